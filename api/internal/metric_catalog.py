@@ -0,0 +1,376 @@
+"""
+Catalog of the metrics and label values available through the Prometheus connector.
+
+The catalog is refreshed periodically with PromQL queries sent through the
+connector. Each refresh lists the series present right now (instant
+selectors, so only Prometheus' lookback of a few minutes is scanned);
+metrics that stop reporting age out after METRIC_CATALOG_TTL_SECONDS.
+Catalog queries have their own limiter and circuit breaker, so a refresh
+never takes connector slots from user requests or opens their breaker.
+With several worker processes, only the worker holding the catalog lease
+queries the connector; it publishes the catalog to the shared store, and
+the other workers load it from there.
+Metric names are split into tokens ("http", "request",
+"duration", ...) and kept in an inverted index. A sorted token list serves
+prefix lookups like a trie, so "request" finds "requests". Label values
+are indexed as well, so "checkout" ranks metrics carrying service="checkout".
+
+For each natural language query only the top-k matching metrics are
+rendered into the user prompt. Memory is bounded by a maximum number of
+metrics (least recently seen are dropped) and of values kept per label.
+"""
+import asyncio
+import heapq
+import logging
+import math
+import re
+import time
+from bisect import bisect_left
+from collections import Counter
+from typing import Optional, Dict, Any, List, Set
+
+from api.internal.query_planner import find_result_container
+from config import Config
+from utils.admission import create_guard
+
+logger = logging.getLogger(__name__)
+
+_NAME_TOKEN = re.compile(r"[a-z0-9]+")
+_QUERY_WORD = re.compile(r"[a-z0-9]+")
+_PERCENTILE_WORD = re.compile(r"p\d{2,3}")
+
+# Query words with no bearing on which metric is meant
+_STOPWORDS = {
+    "show", "me", "what", "is", "are", "the", "a", "an", "of", "for", "in", "on", "over", "by", "per", "and",
+    "or", "to", "from", "last", "past", "with", "graph", "chart", "plot", "get", "all", "my", "our", "how",
+    "many", "much", "each", "minutes", "minute", "hours", "hour", "days", "day", "weeks", "week", "m", "h",
+    "d", "s", "w", "top", "average", "avg", "max", "min", "sum", "total", "current", "now", "trend",
+}
+
+# Words users say that show up differently in metric names
+_SYNONYMS = {
+    "latency": ["latency", "duration", "seconds"],
+    "percentile": ["bucket", "quantile"],
+    "quantile": ["bucket", "quantile"],
+    "response": ["response", "duration"],
+    "memory": ["memory", "mem", "bytes"],
+    "ram": ["memory", "mem"],
+    "disk": ["disk", "filesystem", "fs"],
+    "storage": ["disk", "filesystem", "fs"],
+    "network": ["network", "net"],
+    "errors": ["errors", "error", "failed", "failures"],
+    "error": ["errors", "error", "failed", "failures"],
+    "requests": ["requests", "request", "http"],
+    "request": ["requests", "request", "http"],
+    "traffic": ["requests", "bytes", "network"],
+}
+
+# Prefix expansions considered per query word
+_MAX_PREFIX_EXPANSIONS = 32
+
+
+def infer_metric_type(name: str) -> str:
+    """Guess the metric type from Prometheus naming conventions"""
+    if name.endswith("_bucket"):
+        return "histogram"
+    if name.endswith(("_total", "_count", "_sum", "_created")):
+        return "counter"
+    if name.endswith("_info"):
+        return "info"
+    return "gauge"
+
+
+class MetricCatalog:
+    """
+    In-memory metric/label catalog with incremental refresh and top-k retrieval.
+
+    All methods run on the event loop; search never awaits, so it always sees
+    a consistent index.
+    """
+
+    def __init__(self, prometheus_client, lease=None, shared=None):
+        self.prometheus_client = prometheus_client
+        # SharedLease electing the refreshing worker and SharedStore the catalog is published to
+        # (both None with a single worker process)
+        self.lease = lease
+        self.shared = shared
+        self.enabled = Config.METRIC_CATALOG_ENABLED
+        self.label_keys = [key.strip() for key in Config.METRIC_CATALOG_LABEL_KEYS.split(",") if key.strip()]
+        self.max_metrics = Config.METRIC_CATALOG_MAX_METRICS
+        self.max_label_values = Config.METRIC_CATALOG_MAX_LABEL_VALUES
+        self.guard = create_guard(
+            "metricCatalog", Config.METRIC_CATALOG_MAX_CONCURRENT_QUERIES, Config.METRIC_CATALOG_MAX_CONCURRENT_QUERIES
+        )
+        # name -> {"type": ..., "labels": {key: [values]}, "lastSeen": ...}
+        self._metrics: Dict[str, Dict[str, Any]] = {}
+        self._token_index: Dict[str, Set[str]] = {}
+        self._value_index: Dict[str, Set[str]] = {}
+        self._sorted_tokens: List[str] = []
+        self._last_refresh: Optional[float] = None
+        self._refresh_task = None
+        self.refreshes = 0
+        self.loads = 0
+        self.refresh_failures = 0
+        self.last_refresh_seconds = None
+        self.searches = 0
+
+    def _add_metric(self, name: str, now: float):
+        entry = self._metrics.get(name)
+        if entry is not None:
+            entry["lastSeen"] = now
+            return
+        entry = {"type": infer_metric_type(name), "labels": {}, "lastSeen": now}
+        self._metrics[name] = entry
+        for token in set(_NAME_TOKEN.findall(name.lower())):
+            self._token_index.setdefault(token, set()).add(name)
+
+    def _add_label_value(self, name: str, key: str, value: str, now: float):
+        self._add_metric(name, now)
+        values = self._metrics[name]["labels"].setdefault(key, [])
+        if value in values or len(values) >= self.max_label_values:
+            return
+        values.append(value)
+        self._value_index.setdefault(value.lower(), set()).add(name)
+
+    def _remove_metric(self, name: str):
+        entry = self._metrics.pop(name)
+        for token in set(_NAME_TOKEN.findall(name.lower())):
+            names = self._token_index.get(token)
+            if names is not None:
+                names.discard(name)
+                if not names:
+                    del self._token_index[token]
+        for values in entry["labels"].values():
+            for value in values:
+                names = self._value_index.get(value.lower())
+                if names is not None:
+                    names.discard(name)
+                    if not names:
+                        del self._value_index[value.lower()]
+
+    @staticmethod
+    def _build_index(metrics: Dict[str, Dict[str, Any]]):
+        """Token and label value indexes for a catalog loaded from the shared store"""
+        token_index: Dict[str, Set[str]] = {}
+        value_index: Dict[str, Set[str]] = {}
+        for name, entry in metrics.items():
+            for token in set(_NAME_TOKEN.findall(name.lower())):
+                token_index.setdefault(token, set()).add(name)
+            for values in entry["labels"].values():
+                for value in values:
+                    value_index.setdefault(value.lower(), set()).add(name)
+        return token_index, value_index, sorted(token_index)
+
+    def _prune(self, now: float):
+        """Drop metrics not seen within the TTL, then the least recently seen beyond max_metrics"""
+        expired = [
+            name for name, entry in self._metrics.items()
+            if now - entry["lastSeen"] > Config.METRIC_CATALOG_TTL_SECONDS
+        ]
+        for name in expired:
+            self._remove_metric(name)
+        excess = len(self._metrics) - self.max_metrics
+        if excess > 0:
+            for name in heapq.nsmallest(excess, self._metrics, key=lambda name: self._metrics[name]["lastSeen"]):
+                self._remove_metric(name)
+
+    async def _query(self, query: str, now: float) -> List[Dict[str, Any]]:
+        data = await self.prometheus_client.fetch_prometheus_data({
+            "prometheusQuery": query,
+            "start": int(now),
+            "end": int(now),
+            "step": "60s"
+        }, guard=self.guard)
+        container = find_result_container(data)
+        return (container["result"] or []) if container is not None else []
+
+    async def refresh(self, now: Optional[float] = None):
+        """
+        Pull the metric names and label values of the series present now.
+
+        Raises:
+            RuntimeError: If a connector query fails
+        """
+        now = time.time() if now is None else now
+        start_time = time.time()
+
+        names = await self._query('group by (__name__) ({__name__=~".+"})', now)
+        for series in names:
+            name = series.get("metric", {}).get("__name__")
+            if name:
+                self._add_metric(name, now)
+
+        for key in self.label_keys:
+            values = await self._query(f'group by (__name__, {key}) ({{__name__=~".+", {key}!=""}})', now)
+            for series in values:
+                metric = series.get("metric", {})
+                if metric.get("__name__") and metric.get(key):
+                    self._add_label_value(metric["__name__"], key, metric[key], now)
+
+        self._prune(now)
+        self._sorted_tokens = sorted(self._token_index)
+        self._last_refresh = now
+        self.refreshes += 1
+        self.last_refresh_seconds = time.time() - start_time
+        logger.info("Metric catalog refreshed - %d metrics (%d reporting) in %.2fs",
+                    len(self._metrics), len(names), self.last_refresh_seconds)
+
+    async def publish(self):
+        """Write the catalog to the shared store (off the event loop; refresh() is the only writer of the catalog)"""
+        snapshot = {"metrics": self._metrics, "lastRefresh": self._last_refresh}
+        await asyncio.to_thread(self.shared.set, "catalog", snapshot, self._last_refresh)
+
+    async def load_shared(self) -> bool:
+        """
+        Adopt the catalog another worker published, if it is newer than this one.
+
+        Decoding and indexing run off the event loop; the indexes are swapped in
+        at once, so searches never see a partial catalog.
+
+        Returns:
+            bool: Whether a newer catalog was loaded
+        """
+        snapshot = await self.shared.get_async("catalog", newer_than=self._last_refresh)
+        if snapshot is None:
+            return False
+        token_index, value_index, sorted_tokens = await asyncio.to_thread(self._build_index, snapshot["metrics"])
+        self._metrics = snapshot["metrics"]
+        self._token_index, self._value_index, self._sorted_tokens = token_index, value_index, sorted_tokens
+        self._last_refresh = snapshot["lastRefresh"]
+        self.loads += 1
+        return True
+
+    async def _refresh_loop(self):
+        while True:
+            try:
+                if self.lease is None or await self.lease.acquire():
+                    await self.refresh()
+                    if self.shared is not None:
+                        await self.publish()
+                else:
+                    await self.load_shared()
+            except Exception as e:
+                self.refresh_failures += 1
+                logger.warning("Metric catalog refresh failed: %s", e)
+            await asyncio.sleep(Config.METRIC_CATALOG_REFRESH_INTERVAL_SECONDS)
+
+    def start(self):
+        """Start the periodic background refresh (no-op when disabled or already running)"""
+        if not self.enabled or (self._refresh_task and not self._refresh_task.done()):
+            return
+        self._refresh_task = asyncio.create_task(self._refresh_loop())
+
+    async def stop(self):
+        """Stop the background refresh"""
+        if self._refresh_task is None:
+            return
+        self._refresh_task.cancel()
+        try:
+            await self._refresh_task
+        except asyncio.CancelledError:
+            pass
+        self._refresh_task = None
+        if self.lease is not None:
+            await self.lease.release()
+
+    def _prefix_tokens(self, word: str) -> List[str]:
+        index = bisect_left(self._sorted_tokens, word)
+        tokens = []
+        while index < len(self._sorted_tokens) and len(tokens) < _MAX_PREFIX_EXPANSIONS:
+            token = self._sorted_tokens[index]
+            if not token.startswith(word):
+                break
+            tokens.append(token)
+            index += 1
+        return tokens
+
+    def search(self, natural_language_query: str, k: int) -> List[str]:
+        """
+        Return the names of the k metrics most relevant to a query.
+
+        Metric name tokens are weighted by inverse document frequency; exact
+        token matches count fully, prefix matches half. Metrics carrying a
+        label value named in the query get a boost weighted the same way.
+        """
+        if not self._metrics or k <= 0:
+            return []
+        self.searches += 1
+        metric_count = len(self._metrics)
+        scores: Counter = Counter()
+
+        for word in _QUERY_WORD.findall(natural_language_query.lower()):
+            if word in _STOPWORDS or word.isdigit():
+                continue
+            if _PERCENTILE_WORD.fullmatch(word):
+                word = "percentile"
+            weighted = []
+            for term in _SYNONYMS.get(word, [word]):
+                if term not in self._token_index and term.endswith("s") and term[:-1] in self._token_index:
+                    term = term[:-1]
+                if term in self._token_index:
+                    weighted.append((1.0, term))
+                if len(term) >= 3:
+                    weighted += [(0.5, token) for token in self._prefix_tokens(term) if token != term]
+            weighted = sorted(
+                ((weight * math.log(1 + metric_count / len(self._token_index[token])), token)
+                 for weight, token in weighted),
+                reverse=True
+            )
+            # Each metric gets the best weight among this word's terms, so synonyms do not add up
+            word_scores: Dict[str, float] = {}
+            for score, token in weighted:
+                best = dict.fromkeys(self._token_index[token], score)
+                best.update(word_scores)
+                word_scores = best
+            names = self._value_index.get(word)
+            if names:
+                boost = math.log(1 + metric_count / len(names))
+                word_scores.update({name: word_scores.get(name, 0.0) + boost for name in names})
+            scores.update(word_scores)
+
+        if not scores:
+            return []
+        # Rank by score, shorter (more generic) names first on ties
+        threshold = heapq.nlargest(k, scores.values())[-1]
+        ranked = sorted((name for name, score in scores.items() if score >= threshold),
+                        key=lambda name: (-scores[name], len(name), name))
+        return ranked[:k]
+
+    def prompt_context(self, natural_language_query: str, k: Optional[int] = None) -> str:
+        """
+        Render the top-k relevant metrics for the user prompt.
+
+        Returns:
+            One line per metric with its type and labels, or "" when nothing matched
+        """
+        if not self.enabled:
+            return ""
+        names = self.search(natural_language_query, Config.METRIC_CATALOG_TOP_K if k is None else k)
+        lines = []
+        for name in names:
+            entry = self._metrics[name]
+            labels = []
+            for key, values in entry["labels"].items():
+                shown = values[:Config.METRIC_CATALOG_PROMPT_LABEL_VALUES]
+                more = "|..." if len(values) > len(shown) else ""
+                labels.append(f"{key}={'|'.join(shown)}{more}")
+            label_text = f" {{{', '.join(labels)}}}" if labels else ""
+            lines.append(f"- {name} ({entry['type']}){label_text}")
+        return "\n".join(lines)
+
+    def stats(self) -> Dict[str, Any]:
+        """Return catalog size, index footprint and refresh counters"""
+        return {
+            "enabled": self.enabled,
+            "metrics": len(self._metrics),
+            "maxMetrics": self.max_metrics,
+            "indexedTokens": len(self._token_index),
+            "indexedLabelValues": len(self._value_index),
+            "refreshes": self.refreshes,
+            "loadsFromSharedStore": self.loads,
+            "refreshFailures": self.refresh_failures,
+            "leaseHeld": self.lease.held if self.lease is not None else None,
+            "lastRefresh": self._last_refresh,
+            "lastRefreshSeconds": self.last_refresh_seconds,
+            "searches": self.searches,
+        }
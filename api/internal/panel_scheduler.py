@@ -0,0 +1,470 @@
+"""
+Saved panels refreshed in the background.
+
+A panel is a stored conversation's query (PromQL, range length and step)
+plus its chartConfig and a refresh interval. Instead of each wallboard
+refresh going through the LLM, the connector and a new conversation, the
+PanelScheduler re-runs only the connector query and keeps the latest result,
+which reads return immediately.
+
+- Panels sharing a query, range length and step form one refresh group and
+  are refreshed together, at the shortest of their intervals.
+- Each refresh is scheduled at the interval plus or minus PANEL_REFRESH_JITTER,
+  and the first refreshes of groups loaded on start are spread out, so
+  refreshes do not line up.
+- Due groups are queued for a fixed pool of PANEL_REFRESH_WORKERS workers; a
+  group is never queued twice, so a slow connector delays refreshes instead
+  of piling them up.
+- Refreshes go through the query planner, so with the result cache only the
+  most recent steps are fetched again.
+- Each panel reports how old its result is and whether it is stale (older
+  than PANEL_STALE_AFTER_INTERVALS of its own interval).
+
+Definitions and latest results are kept in MongoDB (panels and panel_results)
+and loaded on start, so results survive restarts.
+
+With several worker processes, only the worker holding the panel lease
+refreshes; it publishes each result to the shared store, where the other
+workers read it when a panel is requested. Every worker re-reads the
+definitions every PANEL_SYNC_INTERVAL_SECONDS, so panels saved or deleted
+through one worker show up in the others.
+"""
+import asyncio
+import heapq
+import json
+import logging
+import random
+import time
+import uuid
+from datetime import datetime
+from typing import Optional, Dict, Any, List
+
+from config import Config
+from utils.promql_parser import parse_step, parse_timestamp
+
+logger = logging.getLogger(__name__)
+
+
+def refresh_key(prometheus_query: str, range_seconds: float, step: str) -> str:
+    """Key shared by panels whose refreshes would fetch the same data"""
+    return json.dumps([prometheus_query, range_seconds, step])
+
+
+class SavedPanel:
+    """A saved panel definition"""
+
+    def __init__(self,
+                 panel_id: str,
+                 conversation_id: str,
+                 natural_language_query: str,
+                 prometheus_query: str,
+                 range_seconds: float,
+                 step: str,
+                 chart_config: Dict[str, Any],
+                 refresh_interval: float,
+                 name: Optional[str] = None,
+                 created_at: Optional[str] = None):
+        self.panel_id = panel_id
+        self.conversation_id = conversation_id
+        self.natural_language_query = natural_language_query
+        self.prometheus_query = prometheus_query
+        self.range_seconds = range_seconds
+        self.step = step
+        self.chart_config = chart_config
+        self.refresh_interval = refresh_interval
+        self.name = name
+        self.created_at = created_at or datetime.utcnow().isoformat()
+        self.key = refresh_key(prometheus_query, range_seconds, step)
+        # (refreshedAt, maxPointsPerSeries) -> chart data built from that result
+        self.chart_data_cache = None
+
+    def to_document(self) -> Dict[str, Any]:
+        return {
+            "panelId": self.panel_id,
+            "conversationId": self.conversation_id,
+            "naturalLanguageQuery": self.natural_language_query,
+            "prometheusQuery": self.prometheus_query,
+            "rangeSeconds": self.range_seconds,
+            "step": self.step,
+            "chartConfig": self.chart_config,
+            "refreshIntervalSeconds": self.refresh_interval,
+            "name": self.name,
+            "createdAt": self.created_at,
+        }
+
+    @classmethod
+    def from_document(cls, document: Dict[str, Any]) -> "SavedPanel":
+        return cls(
+            panel_id=document["panelId"],
+            conversation_id=document.get("conversationId"),
+            natural_language_query=document.get("naturalLanguageQuery", ""),
+            prometheus_query=document["prometheusQuery"],
+            range_seconds=document["rangeSeconds"],
+            step=document["step"],
+            chart_config=document.get("chartConfig", {}),
+            refresh_interval=document["refreshIntervalSeconds"],
+            name=document.get("name"),
+            created_at=document.get("createdAt"),
+        )
+
+
+class RefreshGroup:
+    """Panels sharing one refresh, and the latest result of that refresh"""
+
+    def __init__(self, key: str, prometheus_query: str, range_seconds: float, step: str):
+        self.key = key
+        self.prometheus_query = prometheus_query
+        self.range_seconds = range_seconds
+        self.step = step
+        self.panel_ids = set()
+        self.interval = None
+        self.next_due = 0.0
+        # Whether the group is queued or being refreshed
+        self.scheduled = False
+        self.result = None
+        self.refreshed_at = None
+        self.last_error = None
+        self.last_error_at = None
+        self.last_duration = None
+        self.consecutive_failures = 0
+
+
+class PanelScheduler:
+    """Keeps the latest result of every saved panel, refreshing them on a jittered schedule"""
+
+    def __init__(self, query_planner, mongo_client, lease=None, shared=None):
+        self.query_planner = query_planner
+        self.mongo_client = mongo_client
+        # SharedLease electing the refreshing worker and SharedStore results are published to
+        # (both None with a single worker process, which always refreshes)
+        self.lease = lease
+        self.shared = shared
+        self.enabled = Config.PANEL_SCHEDULER_ENABLED
+        self.panels: Dict[str, SavedPanel] = {}
+        self.groups: Dict[str, RefreshGroup] = {}
+        # (due time, key) entries; outdated entries are skipped when popped
+        self._schedule: List[tuple] = []
+        self._queue: Optional[asyncio.Queue] = None
+        self._wakeup: Optional[asyncio.Event] = None
+        self._tasks: List[asyncio.Task] = []
+        self.refreshes = 0
+        self.refresh_failures = 0
+        self.skipped = 0
+
+    def _jittered(self, interval: float) -> float:
+        jitter = Config.PANEL_REFRESH_JITTER
+        return interval * random.uniform(1 - jitter, 1 + jitter)
+
+    def _schedule_group(self, group: RefreshGroup, due: float):
+        group.next_due = due
+        heapq.heappush(self._schedule, (due, group.key))
+        if self._wakeup is not None:
+            self._wakeup.set()
+
+    def _add(self, panel: SavedPanel, result: Optional[Dict[str, Any]] = None, refresh_now: bool = False):
+        """Add a panel to its refresh group, creating the group if needed, and (re)schedule the group"""
+        self.panels[panel.panel_id] = panel
+        group = self.groups.get(panel.key)
+        created = group is None
+        if created:
+            group = self.groups[panel.key] = RefreshGroup(panel.key, panel.prometheus_query, panel.range_seconds, panel.step)
+            if result is not None:
+                group.result = result
+                group.refreshed_at = result["refreshedAt"]
+        previous_interval = group.interval
+        group.panel_ids.add(panel.panel_id)
+        group.interval = min(self.panels[panel_id].refresh_interval for panel_id in group.panel_ids)
+
+        now = time.time()
+        if refresh_now:
+            self._schedule_group(group, now)
+        elif created:
+            # Spread the first refreshes of loaded groups so they do not all run at once
+            due = now + random.uniform(0, group.interval * Config.PANEL_REFRESH_JITTER)
+            if group.refreshed_at is not None:
+                due = max(due, group.refreshed_at + group.interval)
+            self._schedule_group(group, due)
+        elif group.interval < previous_interval:
+            self._schedule_group(group, min(group.next_due, (group.refreshed_at or now) + group.interval))
+
+    def _remove(self, panel: SavedPanel):
+        group = self.groups.get(panel.key)
+        if group is None:
+            return
+        group.panel_ids.discard(panel.panel_id)
+        if not group.panel_ids:
+            del self.groups[panel.key]
+        else:
+            group.interval = min(self.panels[panel_id].refresh_interval for panel_id in group.panel_ids)
+
+    async def add_panel(self,
+                        conversation: Dict[str, Any],
+                        refresh_interval: Optional[float] = None,
+                        name: Optional[str] = None) -> SavedPanel:
+        """
+        Save a stored conversation's query as a panel and schedule its first refresh right away.
+
+        Args:
+            conversation: Conversation from get_conversation
+            refresh_interval: Seconds between refreshes (PANEL_DEFAULT_REFRESH_SECONDS by default)
+            name: Optional display name
+
+        Returns:
+            The saved panel
+
+        Raises:
+            ValueError: If the conversation has no usable query, the interval is too short,
+                        the panel limit is reached or the panel cannot be stored
+        """
+        payload = conversation.get("generatedPayload") or {}
+        if not payload.get("prometheusQuery") or conversation.get("success") != 200:
+            raise ValueError("Only conversations with a successfully executed query can be saved as panels")
+        if len(self.panels) >= Config.PANEL_MAX_PANELS:
+            raise ValueError(f"At most {Config.PANEL_MAX_PANELS} panels can be saved")
+
+        refresh_interval = refresh_interval or Config.PANEL_DEFAULT_REFRESH_SECONDS
+        if refresh_interval < Config.PANEL_MIN_REFRESH_SECONDS:
+            raise ValueError(f"refreshIntervalSeconds must be at least {Config.PANEL_MIN_REFRESH_SECONDS}")
+        range_seconds = parse_timestamp(payload["end"]) - parse_timestamp(payload["start"])
+        step = payload["step"]
+        parse_step(step)
+
+        panel = SavedPanel(
+            panel_id=str(uuid.uuid4()),
+            conversation_id=conversation.get("conversationId"),
+            natural_language_query=conversation.get("naturalLanguageQuery", ""),
+            prometheus_query=payload["prometheusQuery"],
+            range_seconds=range_seconds,
+            step=step,
+            chart_config=conversation.get("chartConfig", {}),
+            refresh_interval=refresh_interval,
+            name=name,
+        )
+        if not await self.mongo_client.store_panel(panel.to_document()):
+            raise ValueError("The panel could not be stored")
+        group = self.groups.get(panel.key)
+        self._add(panel, refresh_now=group is None or group.result is None)
+        return panel
+
+    async def delete_panel(self, panel_id: str) -> bool:
+        """Delete a panel; returns False if it does not exist"""
+        panel = self.panels.pop(panel_id, None)
+        if panel is None:
+            return False
+        self._remove(panel)
+        await self.mongo_client.delete_panel(panel_id)
+        return True
+
+    def _apply_documents(self, documents: List[Dict[str, Any]], results: Dict[str, Dict[str, Any]]):
+        for document in documents:
+            if document["panelId"] in self.panels:
+                continue
+            panel = SavedPanel.from_document(document)
+            result = results.get(panel.key)
+            if result is not None:
+                result = {field: value for field, value in result.items() if field != "refreshKey"}
+            self._add(panel, result=result)
+
+    async def load(self):
+        """Load the saved panels and their latest stored results, retrying until MongoDB can be read"""
+        while True:
+            documents = await self.mongo_client.list_panels()
+            stored_results = await self.mongo_client.list_panel_results() if documents else []
+            if documents is not None and stored_results is not None:
+                break
+            await asyncio.sleep(Config.DEPENDENCY_RECOVERY_CHECK_INTERVAL_SECONDS)
+
+        self._apply_documents(documents, {result["refreshKey"]: result for result in stored_results})
+        if self.panels:
+            logger.info("Loaded %d panels in %d refresh groups", len(self.panels), len(self.groups))
+
+    async def sync(self):
+        """Pick up the panels other workers saved or deleted since the last sync"""
+        documents = await self.mongo_client.list_panels()
+        if documents is None:
+            return
+        saved = {document["panelId"] for document in documents}
+        for panel_id in [panel_id for panel_id in self.panels if panel_id not in saved]:
+            self._remove(self.panels.pop(panel_id))
+        # Results of new groups are read from the shared store when the panels are requested
+        self._apply_documents(documents, {})
+
+    @property
+    def leading(self) -> bool:
+        """Whether this worker runs the refreshes"""
+        return self.lease is None or self.lease.held
+
+    async def _lease_loop(self):
+        while True:
+            try:
+                # Groups left to another worker are re-checked every interval, so a worker taking
+                # the lease over refreshes each of them within one interval
+                await self.lease.acquire()
+                await self.sync()
+            except Exception as e:
+                logger.warning("Panel sync failed: %s", e)
+            await asyncio.sleep(Config.PANEL_SYNC_INTERVAL_SECONDS)
+
+    async def refresh(self, group: RefreshGroup):
+        """Run a group's query over the range ending now and keep the result"""
+        end = time.time()
+        plan = self.query_planner.plan({
+            "prometheusQuery": group.prometheus_query,
+            "start": end - group.range_seconds,
+            "end": end,
+            "step": group.step
+        })
+        start_time = time.perf_counter()
+        try:
+            prometheus_data = await self.query_planner.execute(plan)
+        except Exception as e:
+            group.last_error = str(e)
+            group.last_error_at = time.time()
+            group.consecutive_failures += 1
+            self.refresh_failures += 1
+            logger.warning("Panel refresh failed for %s: %s", group.prometheus_query, e)
+            return
+        finally:
+            group.last_duration = time.perf_counter() - start_time
+            self.refreshes += 1
+
+        group.result = {
+            "prometheusData": prometheus_data,
+            "start": plan.payload["start"],
+            "end": plan.payload["end"],
+            "step": plan.payload["step"],
+            "refreshedAt": time.time()
+        }
+        group.refreshed_at = group.result["refreshedAt"]
+        group.last_error = None
+        group.consecutive_failures = 0
+        if self.shared is not None:
+            self.shared.set_later(group.key, group.result, now=group.refreshed_at)
+        if Config.PANEL_PERSIST_RESULTS:
+            await self.mongo_client.store_panel_result(group.key, group.result)
+
+    async def _worker(self):
+        while True:
+            key = await self._queue.get()
+            group = self.groups.get(key)
+            try:
+                if group is not None:
+                    await self.refresh(group)
+            except Exception:
+                logger.exception("Panel refresh worker error")
+            finally:
+                if group is not None:
+                    group.scheduled = False
+                    if key in self.groups:
+                        self._schedule_group(group, time.time() + self._jittered(group.interval))
+                self._queue.task_done()
+
+    async def _schedule_loop(self):
+        await self.load()
+        while True:
+            now = time.time()
+            while self._schedule and self._schedule[0][0] <= now:
+                due, key = heapq.heappop(self._schedule)
+                group = self.groups.get(key)
+                if group is None or due != group.next_due:
+                    continue
+                if group.scheduled:
+                    # Still queued or refreshing: the worker reschedules it when done
+                    self.skipped += 1
+                    continue
+                if not self.leading:
+                    # Another worker refreshes it; check again one interval later
+                    self._schedule_group(group, now + group.interval)
+                    continue
+                group.scheduled = True
+                self._queue.put_nowait(key)
+
+            timeout = self._schedule[0][0] - now if self._schedule else None
+            self._wakeup.clear()
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout)
+            except asyncio.TimeoutError:
+                pass
+
+    def start(self):
+        """Load the panels and start refreshing them (no-op when disabled or already running)"""
+        if not self.enabled or self._tasks:
+            return
+        self._queue = asyncio.Queue()
+        self._wakeup = asyncio.Event()
+        self._tasks = [asyncio.create_task(self._schedule_loop())] + [
+            asyncio.create_task(self._worker()) for _ in range(Config.PANEL_REFRESH_WORKERS)
+        ]
+        if self.lease is not None:
+            self._tasks.append(asyncio.create_task(self._lease_loop()))
+
+    async def stop(self):
+        """Stop the scheduler and its workers"""
+        for task in self._tasks:
+            task.cancel()
+        for task in self._tasks:
+            try:
+                await task
+            except asyncio.CancelledError:
+                pass
+        self._tasks = []
+        if self.lease is not None:
+            await self.lease.release()
+
+    def panel_status(self, panel: SavedPanel) -> Dict[str, Any]:
+        """Freshness of a panel's latest result"""
+        group = self.groups[panel.key]
+        age = None if group.refreshed_at is None else max(0.0, time.time() - group.refreshed_at)
+        # Without the lease, this worker only knows when the result it last read was refreshed
+        next_due = group.next_due if self.leading else (group.refreshed_at or time.time()) + group.interval
+        if age is None:
+            status = "pending"
+        elif age > panel.refresh_interval * Config.PANEL_STALE_AFTER_INTERVALS:
+            status = "stale"
+        else:
+            status = "fresh"
+        return {
+            "status": status,
+            "refreshedAt": None if group.refreshed_at is None else datetime.utcfromtimestamp(group.refreshed_at).isoformat(),
+            "ageSeconds": None if age is None else round(age, 3),
+            "nextRefreshInSeconds": round(max(0.0, next_due - time.time()), 3),
+            "lastError": group.last_error,
+            "consecutiveFailures": group.consecutive_failures,
+            "sharedWith": len(group.panel_ids) - 1,
+        }
+
+    def describe(self, panel: SavedPanel) -> Dict[str, Any]:
+        """Panel definition with its freshness"""
+        return {**panel.to_document(), **self.panel_status(panel)}
+
+    async def latest_result(self, panel: SavedPanel) -> Optional[Dict[str, Any]]:
+        """
+        The latest result shared by the panel's group, or None before the first refresh.
+
+        Without the lease, a newer result published by the refreshing worker is read first.
+        """
+        group = self.groups[panel.key]
+        if self.shared is not None and not self.leading:
+            result = await self.shared.get_async(group.key, newer_than=group.refreshed_at)
+            if result is not None:
+                group.result = result
+                group.refreshed_at = result["refreshedAt"]
+        return group.result
+
+    def stats(self) -> Dict[str, Any]:
+        """Return panel, group and refresh counters"""
+        statuses = {"pending": 0, "fresh": 0, "stale": 0}
+        for panel in self.panels.values():
+            statuses[self.panel_status(panel)["status"]] += 1
+        return {
+            "enabled": self.enabled,
+            "leading": self.leading,
+            "panels": len(self.panels),
+            "refreshGroups": len(self.groups),
+            "panelsByStatus": statuses,
+            "queued": self._queue.qsize() if self._queue is not None else 0,
+            "workers": Config.PANEL_REFRESH_WORKERS,
+            "refreshes": self.refreshes,
+            "refreshFailures": self.refresh_failures,
+            "skipped": self.skipped,
+        }
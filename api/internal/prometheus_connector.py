@@ -1,12 +1,210 @@
-import requests 
+import requests
+import httpx
+import asyncio
+import json
+import random
+import threading
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+from requests.adapters import HTTPAdapter
 from config import Config
+from utils.single_flight import SingleFlight
+from utils.admission import create_guard
+from utils.serialization import loads
+from utils.metrics import CONNECTOR_REQUEST_SECONDS, CONNECTOR_RESPONSE_BYTES, should_log_payload
 import time
-from datetime import datetime
+import logging
+
+# Status codes worth retrying: the connector request is a read, so replaying it is safe
+RETRYABLE_STATUS_CODES = {429, 500, 502, 503, 504}
+
+# Per-request detail is logged at DEBUG: latency, sizes and outcomes are already in /metrics and Server-Timing
+logger = logging.getLogger(__name__)
+
+
+class ConnectorStats:
+    """
+    Thread-safe latency and retry accounting for connector calls.
+
+    Keeps a bounded window of per-attempt latencies, which also drives the
+    hedging delay (p95 of recent attempts).
+    """
+
+    def __init__(self, window_size: int = 512):
+        self._latencies = deque(maxlen=window_size)
+        self._lock = threading.Lock()
+        self.requests = 0
+        self.attempts = 0
+        self.retries = 0
+        self.hedges_fired = 0
+        self.hedges_won = 0
+        self.failures = 0
+
+    def record_attempt(self, latency: float):
+        with self._lock:
+            self.attempts += 1
+            self._latencies.append(latency)
+
+    def record_request(self):
+        with self._lock:
+            self.requests += 1
+
+    def record_retry(self):
+        with self._lock:
+            self.retries += 1
+
+    def record_hedge(self, won: bool = False):
+        with self._lock:
+            if won:
+                self.hedges_won += 1
+            else:
+                self.hedges_fired += 1
+
+    def record_failure(self):
+        with self._lock:
+            self.failures += 1
+
+    def percentile(self, percentile: float, min_samples: int = 1):
+        """Return the given latency percentile of recent attempts, or None if too few samples"""
+        with self._lock:
+            samples = sorted(self._latencies)
+        if not samples or len(samples) < min_samples:
+            return None
+        index = min(len(samples) - 1, int(round(percentile / 100 * (len(samples) - 1))))
+        return samples[index]
+
+    def hedge_delay(self) -> float:
+        """Delay before firing a hedged attempt: p95 of recent attempts, with a configured fallback"""
+        p95 = self.percentile(95, min_samples=Config.PROMETHEUS_CONNECTOR_HEDGE_MIN_SAMPLES)
+        if p95 is None:
+            return Config.PROMETHEUS_CONNECTOR_HEDGE_DELAY_SECONDS
+        return max(p95, Config.PROMETHEUS_CONNECTOR_HEDGE_MIN_DELAY_SECONDS)
+
+    def snapshot(self) -> dict:
+        """Return counters and latency percentiles for reporting"""
+        with self._lock:
+            counters = {
+                "requests": self.requests,
+                "attempts": self.attempts,
+                "retries": self.retries,
+                "hedgesFired": self.hedges_fired,
+                "hedgesWon": self.hedges_won,
+                "failures": self.failures,
+            }
+        counters["attemptLatencySeconds"] = {
+            "p50": self.percentile(50),
+            "p95": self.percentile(95),
+            "p99": self.percentile(99),
+        }
+        return counters
+
+
+def is_connector_failure(error: BaseException) -> bool:
+    """Whether an error counts against the connector (4xx answers other than 429 are caused by the request)"""
+    if isinstance(error, httpx.HTTPStatusError):
+        status_code = error.response.status_code
+        return status_code >= 500 or status_code == 429
+    return True
+
+
+def backoff_delay(retry_number: int) -> float:
+    """Full-jitter exponential backoff for the given retry (1-based)"""
+    ceiling = min(
+        Config.PROMETHEUS_CONNECTOR_BACKOFF_MAX_SECONDS,
+        Config.PROMETHEUS_CONNECTOR_BACKOFF_BASE_SECONDS * (2 ** (retry_number - 1))
+    )
+    return random.uniform(0, ceiling)
 
 
 class PrometheusClient:
+    """
+    Client for the internal Prometheus connector API.
+
+    Requests go through a persistent requests.Session with a pooled
+    keep-alive adapter. Transient failures (connection errors, timeouts and
+    retryable 5xx/429 responses) are retried with jittered exponential
+    backoff, and an optional hedged attempt is fired when the first one is
+    slower than the recent p95.
+    """
+
     def __init__(self):
         self.base_url = Config.PROMETHEUS_CONNECTOR_URL
+        self.timeout = (
+            Config.PROMETHEUS_CONNECTOR_CONNECT_TIMEOUT_SECONDS,
+            Config.PROMETHEUS_CONNECTOR_READ_TIMEOUT_SECONDS
+        )
+        self.session = requests.Session()
+        adapter = HTTPAdapter(
+            pool_connections=1,
+            pool_maxsize=Config.PROMETHEUS_CONNECTOR_MAX_CONNECTIONS
+        )
+        self.session.mount("http://", adapter)
+        self.session.mount("https://", adapter)
+        self.stats = ConnectorStats()
+        self._hedge_executor = None
+        if Config.PROMETHEUS_CONNECTOR_HEDGING_ENABLED:
+            self._hedge_executor = ThreadPoolExecutor(
+                max_workers=Config.PROMETHEUS_CONNECTOR_MAX_CONNECTIONS,
+                thread_name_prefix="prometheus-hedge"
+            )
+
+    @staticmethod
+    def _is_retryable(error: Exception) -> bool:
+        if isinstance(error, requests.exceptions.HTTPError):
+            return error.response is not None and error.response.status_code in RETRYABLE_STATUS_CODES
+        return isinstance(error, (requests.exceptions.ConnectionError, requests.exceptions.Timeout))
+
+    def _attempt(self, url: str, payload: dict) -> requests.Response:
+        """Send a single POST and record its latency"""
+        start_time = time.time()
+        try:
+            response = self.session.post(url, json=payload, timeout=self.timeout)
+            response.raise_for_status()
+            return response
+        finally:
+            latency = time.time() - start_time
+            self.stats.record_attempt(latency)
+            logger.debug("Prometheus connector attempt latency: %.3fs", latency)
+
+    def _hedged_attempt(self, url: str, payload: dict) -> requests.Response:
+        """Send a POST and fire a second one if the first is slower than the hedge delay"""
+        if self._hedge_executor is None:
+            return self._attempt(url, payload)
+
+        primary = self._hedge_executor.submit(self._attempt, url, payload)
+        done, _ = wait([primary], timeout=self.stats.hedge_delay())
+        if done:
+            return primary.result()
+
+        self.stats.record_hedge()
+        hedge = self._hedge_executor.submit(self._attempt, url, payload)
+        pending = {primary, hedge}
+        last_error = None
+        while pending:
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                if future.exception() is None:
+                    if future is hedge:
+                        self.stats.record_hedge(won=True)
+                    return future.result()
+                last_error = future.exception()
+        raise last_error
+
+    def _post_with_retries(self, url: str, payload: dict) -> requests.Response:
+        """POST with jittered exponential-backoff retries on transient failures"""
+        self.stats.record_request()
+        max_retries = Config.PROMETHEUS_CONNECTOR_MAX_RETRIES
+        for retry_number in range(max_retries + 1):
+            try:
+                return self._hedged_attempt(url, payload)
+            except requests.exceptions.RequestException as e:
+                if retry_number == max_retries or not self._is_retryable(e):
+                    self.stats.record_failure()
+                    raise
+                delay = backoff_delay(retry_number + 1)
+                self.stats.record_retry()
+                logger.warning("Retrying Prometheus connector API in %.2fs after error: %s", delay, e)
+                time.sleep(delay)
 
     def fetch_prometheus_data(self, payload: dict, conversation_id: str = None):
         """
@@ -32,30 +230,298 @@ class PrometheusClient:
         if conversation_id:
             payload["conversationId"] = conversation_id
 
-        print(f"[{datetime.now().isoformat()}] Prometheus Connector API Request")
-        print(f"URL: {url}")
-        print(f"Conversation ID: {conversation_id}")
-        print(f"Payload: {payload}")
+        logger.debug("Prometheus connector API request - URL: %s, conversation ID: %s", url, conversation_id)
+        if should_log_payload():
+            logger.info("Prometheus connector API payload: %s", payload)
 
+        start_time = time.time()
         try:
-            start_time = time.time()
-            response = requests.post(url, json=payload, timeout=10)
+            response = self._post_with_retries(url, payload)
             response_time = time.time() - start_time
-            
-            response.raise_for_status()
-            response_data = response.json()
-            
-            print(f"[{datetime.now().isoformat()}] Prometheus Connector API Response")
-            print(f"Status Code: {response.status_code}")
-            print(f"Response Time: {response_time:.2f}s")
-            print(f"Response Size: {len(str(response_data))} characters")
-            print(f"Response Data: {response_data}")
-            
-            return response_data
+
+            CONNECTOR_REQUEST_SECONDS.observe(response_time, outcome="success")
+            CONNECTOR_RESPONSE_BYTES.observe(len(response.content))
+
+            logger.debug("Prometheus connector API response - status: %s, time: %.2fs, size: %d bytes",
+                         response.status_code, response_time, len(response.content))
+
+            return response.content
 
         except requests.exceptions.RequestException as e:
-            print(f"[{datetime.now().isoformat()}] Prometheus Connector API Error")
-            print(f"Error: {str(e)}")
-            print(f"URL: {url}")
-            print(f"Payload: {payload}")
+            CONNECTOR_REQUEST_SECONDS.observe(time.time() - start_time, outcome="error")
+            logger.warning("Prometheus connector API error - URL: %s, error: %s", url, e)
+            if should_log_payload():
+                logger.info("Prometheus connector API payload: %s", payload)
             raise RuntimeError(f"Failed to fetch data from Prometheus connector: {e}")
+
+    def close(self):
+        """Close pooled connections to the connector"""
+        self.session.close()
+        if self._hedge_executor is not None:
+            self._hedge_executor.shutdown(wait=False)
+
+
+class AsyncPrometheusClient:
+    """
+    Async counterpart of PrometheusClient.
+
+    Uses a single pooled httpx.AsyncClient so connections to the connector
+    are kept alive and shared across concurrent requests. Retry and hedging
+    behaviour matches PrometheusClient. The httpx client is created on first
+    use, keeping its setup (TLS context) out of import time.
+
+    Requests (including their retries) go through an adaptive concurrency
+    limit and circuit breaker, so a slow or failing connector sheds load
+    instead of accumulating waiting requests.
+    """
+
+    def __init__(self):
+        self.base_url = Config.PROMETHEUS_CONNECTOR_URL
+        self._http_client = None
+        self.stats = ConnectorStats()
+        # Identical payloads already in flight share one connector call
+        self.flights = SingleFlight(enabled=Config.SINGLE_FLIGHT_ENABLED)
+        self.guard = create_guard(
+            "prometheusConnector",
+            Config.CONNECTOR_CONCURRENCY_INITIAL_LIMIT,
+            Config.CONNECTOR_CONCURRENCY_MAX_LIMIT,
+            is_failure=is_connector_failure
+        )
+
+    @property
+    def http_client(self) -> httpx.AsyncClient:
+        """The pooled httpx client, created on first use"""
+        if self._http_client is None:
+            self._http_client = httpx.AsyncClient(
+                timeout=httpx.Timeout(
+                    Config.PROMETHEUS_CONNECTOR_READ_TIMEOUT_SECONDS,
+                    connect=Config.PROMETHEUS_CONNECTOR_CONNECT_TIMEOUT_SECONDS
+                ),
+                limits=httpx.Limits(
+                    max_connections=Config.PROMETHEUS_CONNECTOR_MAX_CONNECTIONS,
+                    max_keepalive_connections=Config.PROMETHEUS_CONNECTOR_MAX_CONNECTIONS
+                )
+            )
+        return self._http_client
+
+    @http_client.setter
+    def http_client(self, http_client: httpx.AsyncClient):
+        self._http_client = http_client
+
+    async def ping(self) -> bool:
+        """
+        Check that the connector accepts connections.
+
+        Any HTTP response counts as reachable; the established connection
+        stays in the pool for the first real request.
+        """
+        await self.http_client.get(self.base_url)
+        return True
+
+    @staticmethod
+    def _is_retryable(error: Exception) -> bool:
+        if isinstance(error, httpx.HTTPStatusError):
+            return error.response.status_code in RETRYABLE_STATUS_CODES
+        return isinstance(error, httpx.TransportError)
+
+    async def _attempt(self, url: str, payload: dict) -> httpx.Response:
+        """Send a single POST and record its latency"""
+        start_time = time.time()
+        try:
+            response = await self.http_client.post(url, json=payload)
+            response.raise_for_status()
+            return response
+        finally:
+            latency = time.time() - start_time
+            self.stats.record_attempt(latency)
+            logger.debug("Prometheus connector attempt latency: %.3fs", latency)
+
+    async def _hedged_attempt(self, url: str, payload: dict) -> httpx.Response:
+        """Send a POST and fire a second one if the first is slower than the hedge delay"""
+        if not Config.PROMETHEUS_CONNECTOR_HEDGING_ENABLED:
+            return await self._attempt(url, payload)
+
+        primary = asyncio.create_task(self._attempt(url, payload))
+        done, _ = await asyncio.wait({primary}, timeout=self.stats.hedge_delay())
+        if done:
+            return primary.result()
+
+        self.stats.record_hedge()
+        hedge = asyncio.create_task(self._attempt(url, payload))
+        pending = {primary, hedge}
+        last_error = None
+        try:
+            while pending:
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    if task.exception() is None:
+                        if task is hedge:
+                            self.stats.record_hedge(won=True)
+                        return task.result()
+                    last_error = task.exception()
+            raise last_error
+        finally:
+            for task in pending:
+                task.cancel()
+
+    async def _open_stream(self, url: str, payload: dict) -> httpx.Response:
+        """Send a single streaming POST; latency recorded is the time to response headers"""
+        start_time = time.time()
+        try:
+            request = self.http_client.build_request("POST", url, json=payload)
+            response = await self.http_client.send(request, stream=True)
+            try:
+                response.raise_for_status()
+            except httpx.HTTPStatusError:
+                await response.aclose()
+                raise
+            return response
+        finally:
+            latency = time.time() - start_time
+            self.stats.record_attempt(latency)
+            logger.debug("Prometheus connector attempt latency (headers): %.3fs", latency)
+
+    async def _post_with_retries(self, url: str, payload: dict, attempt=None) -> httpx.Response:
+        """POST with jittered exponential-backoff retries on transient failures"""
+        attempt = attempt or self._hedged_attempt
+        self.stats.record_request()
+        max_retries = Config.PROMETHEUS_CONNECTOR_MAX_RETRIES
+        for retry_number in range(max_retries + 1):
+            try:
+                return await attempt(url, payload)
+            except httpx.HTTPError as e:
+                if retry_number == max_retries or not self._is_retryable(e):
+                    self.stats.record_failure()
+                    raise
+                delay = backoff_delay(retry_number + 1)
+                self.stats.record_retry()
+                logger.warning("Retrying Prometheus connector API in %.2fs after error: %s", delay, e)
+                await asyncio.sleep(delay)
+
+    async def fetch_prometheus_data(self, payload: dict, conversation_id: str = None, guard=None):
+        """
+        Calls the internal Prometheus connector API with the given payload.
+
+        Concurrent calls with the same payload (ignoring conversationId) share a
+        single connector request; each caller decodes its own copy of the
+        response body, so callers may mutate the returned dict.
+
+        Args:
+            payload (dict): Dictionary containing at least:
+                            - prometheusQuery
+                            - start
+                            - end
+                            - step
+            conversation_id (str): Optional conversation ID to include in the payload
+            guard (UpstreamGuard): Admission control for the call (the client's own by default);
+                                   background work passes its own so it never competes with user requests
+
+        Returns:
+            dict: Response JSON from Prometheus connector API
+
+        Raises:
+            RuntimeError: If request fails or returns non-2xx response
+            OverloadError: If shed by admission control, the circuit is open or the request deadline passes
+        """
+        key = json.dumps(
+            {field: value for field, value in payload.items() if field != "conversationId"},
+            sort_keys=True,
+            default=str
+        )
+
+        # Add conversationId to payload if provided
+        if conversation_id:
+            payload["conversationId"] = conversation_id
+
+        content, shared = await self.flights.do(key, lambda: self._fetch(payload, conversation_id, guard))
+        if shared:
+            logger.debug("Prometheus connector API request coalesced - conversation ID: %s", conversation_id)
+        return loads(content)
+
+    async def _fetch(self, payload: dict, conversation_id: str = None, guard=None) -> bytes:
+        """Send one connector request for fetch_prometheus_data and return the raw response body"""
+        url = f"{self.base_url}/prometheusData"
+
+        logger.debug("Prometheus connector API request - URL: %s, conversation ID: %s", url, conversation_id)
+        if should_log_payload():
+            logger.info("Prometheus connector API payload: %s", payload)
+
+        start_time = time.time()
+        try:
+            response = await (guard or self.guard).call(self._post_with_retries, url, payload)
+            response_time = time.time() - start_time
+
+            CONNECTOR_REQUEST_SECONDS.observe(response_time, outcome="success")
+            CONNECTOR_RESPONSE_BYTES.observe(len(response.content))
+
+            logger.debug("Prometheus connector API response - status: %s, time: %.2fs, size: %d bytes",
+                         response.status_code, response_time, len(response.content))
+
+            return response.content
+
+        except httpx.HTTPError as e:
+            CONNECTOR_REQUEST_SECONDS.observe(time.time() - start_time, outcome="error")
+            logger.warning("Prometheus connector API error - URL: %s, error: %s", url, e)
+            if should_log_payload():
+                logger.info("Prometheus connector API payload: %s", payload)
+            raise RuntimeError(f"Failed to fetch data from Prometheus connector: {e}")
+
+    async def stream_prometheus_data(self, payload: dict, conversation_id: str = None):
+        """
+        Calls the internal Prometheus connector API and yields the response body as it arrives.
+
+        Failures before the response headers are retried like fetch_prometheus_data;
+        once the body has started streaming, errors are not retried.
+
+        Args:
+            payload (dict): Same fields as for fetch_prometheus_data
+            conversation_id (str): Optional conversation ID to include in the payload
+
+        Yields:
+            bytes: Raw chunks of the connector response body
+
+        Raises:
+            RuntimeError: If request fails or returns non-2xx response
+            OverloadError: If shed by admission control, the circuit is open or the request deadline passes
+        """
+        url = f"{self.base_url}/prometheusData"
+
+        # Add conversationId to payload if provided
+        if conversation_id:
+            payload["conversationId"] = conversation_id
+
+        logger.debug("Prometheus connector API streaming request - URL: %s, conversation ID: %s", url, conversation_id)
+        if should_log_payload():
+            logger.info("Prometheus connector API payload: %s", payload)
+
+        start_time = time.time()
+        try:
+            # The slot covers the request up to the response headers, not the body stream
+            response = await self.guard.call(self._post_with_retries, url, payload, attempt=self._open_stream)
+        except httpx.HTTPError as e:
+            CONNECTOR_REQUEST_SECONDS.observe(time.time() - start_time, outcome="error")
+            logger.warning("Prometheus connector API error - URL: %s, error: %s", url, e)
+            raise RuntimeError(f"Failed to fetch data from Prometheus connector: {e}")
+
+        response_size = 0
+        try:
+            async for chunk in response.aiter_bytes():
+                response_size += len(chunk)
+                yield chunk
+        except httpx.HTTPError as e:
+            CONNECTOR_REQUEST_SECONDS.observe(time.time() - start_time, outcome="error")
+            logger.warning("Prometheus connector API stream error - URL: %s, error: %s", url, e)
+            raise RuntimeError(f"Prometheus connector stream failed: {e}")
+        finally:
+            await response.aclose()
+
+        CONNECTOR_REQUEST_SECONDS.observe(time.time() - start_time, outcome="success")
+        CONNECTOR_RESPONSE_BYTES.observe(response_size)
+
+        logger.debug("Prometheus connector API streaming response - status: %s, time: %.2fs, size: %d bytes",
+                     response.status_code, time.time() - start_time, response_size)
+
+    async def close(self):
+        """Close pooled connections to the connector"""
+        if self._http_client is not None:
+            await self._http_client.aclose()
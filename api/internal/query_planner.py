@@ -0,0 +1,280 @@
+"""
+Query planning for range queries sent to the Prometheus connector.
+
+Sits between payload generation and AsyncPrometheusClient:
+- the step is clamped so the range returns at most a target number of points
+  per series, rounded up to a readable step (15s, 1m, 5m, 1h, ...)
+- start and end are aligned to multiples of the step
+- long ranges are split into step-aligned sub-ranges on fixed interval
+  boundaries, fetched concurrently and stitched back into one matrix;
+  coarse steps get longer intervals so each sub-range still carries a
+  useful number of points per request
+"""
+import asyncio
+import copy
+import logging
+import math
+from typing import Optional, Dict, Any, List, Tuple
+
+from config import Config
+from utils.promql_parser import parse_step, parse_timestamp
+
+# Readable steps (seconds) the planner rounds up to
+NICE_STEPS = [1, 2, 5, 10, 15, 30, 60, 120, 300, 600, 900, 1800, 3600, 7200, 10800, 21600, 43200, 86400]
+
+logger = logging.getLogger(__name__)
+
+
+def choose_step(start: float, end: float, requested_step: float, target_points: int) -> float:
+    """
+    Return the step to query with.
+
+    The requested step is kept unless it yields more than target_points per
+    series, in which case the smallest readable step that fits is used.
+    """
+    minimum_step = (end - start) / max(target_points - 1, 1)
+    if requested_step >= minimum_step:
+        return requested_step
+    for step in NICE_STEPS:
+        if step >= minimum_step:
+            return step
+    return math.ceil(minimum_step / NICE_STEPS[-1]) * NICE_STEPS[-1]
+
+
+def split_range(start: float, end: float, step: float, interval: float, max_splits: int) -> List[Tuple[float, float]]:
+    """
+    Split a step-aligned [start, end] range into sub-ranges on interval boundaries.
+
+    Boundaries are multiples of the interval (rounded down to a multiple of the
+    step), so the same absolute sub-ranges are produced for overlapping queries.
+    Sub-ranges do not overlap: each starts one step after the previous one ends.
+
+    Returns:
+        List of inclusive (start, end) pairs
+    """
+    if interval <= 0 or end - start <= interval or max_splits == 1:
+        return [(start, end)]
+
+    base_interval = max(step, math.floor(interval / step) * step)
+    interval = base_interval
+    if max_splits > 0:
+        # Sub-ranges follow the interval boundaries the range crosses, which can be one more than its length suggests
+        multiplier = max(1, math.ceil((end - start) / base_interval / max_splits))
+        while math.floor(end / (base_interval * multiplier)) - math.floor(start / (base_interval * multiplier)) >= max_splits:
+            multiplier += 1
+        interval = base_interval * multiplier
+
+    ranges = []
+    range_start = start
+    while range_start <= end:
+        boundary = (math.floor(range_start / interval) + 1) * interval
+        range_end = min(end, boundary - step)
+        ranges.append((range_start, range_end))
+        range_start = range_end + step
+    return ranges
+
+
+def find_result_container(data: Any) -> Optional[Dict[Any, Any]]:
+    """Locate the dict holding resultType and result (possibly nested under "data")"""
+    for _ in range(3):
+        if not isinstance(data, dict):
+            break
+        if "resultType" in data and "result" in data:
+            return data
+        data = data.get("data")
+    return None
+
+
+def stitch_results(responses: List[Dict[Any, Any]]) -> Dict[Any, Any]:
+    """
+    Stitch connector responses for consecutive sub-ranges into one matrix response.
+
+    Series are matched on their full label set; samples at or before the last
+    timestamp already collected for a series are dropped, so boundaries are
+    never duplicated.
+
+    Raises:
+        ValueError: If a response does not hold a matrix result
+    """
+    if len(responses) == 1:
+        return responses[0]
+
+    merged: Dict[tuple, Dict[str, Any]] = {}
+    for response in responses:
+        container = find_result_container(response)
+        if container is None or container["resultType"] != "matrix":
+            raise ValueError("Cannot stitch connector responses without a matrix result")
+        for series in container["result"]:
+            metric = series.get("metric", {})
+            key = tuple(sorted(metric.items()))
+            stitched = merged.get(key)
+            if stitched is None:
+                merged[key] = {"metric": metric, **{
+                    sample_key: list(series[sample_key]) for sample_key in ("values", "histograms") if sample_key in series
+                }}
+                continue
+            for sample_key in ("values", "histograms"):
+                samples = series.get(sample_key)
+                if not samples:
+                    continue
+                collected = stitched.setdefault(sample_key, [])
+                last_timestamp = collected[-1][0] if collected else None
+                collected.extend(
+                    sample for sample in samples if last_timestamp is None or sample[0] > last_timestamp
+                )
+
+    # Copy the first envelope without its result list
+    container = find_result_container(responses[0])
+    result = container["result"]
+    container["result"] = []
+    try:
+        stitched_response = copy.deepcopy(responses[0])
+    finally:
+        container["result"] = result
+    find_result_container(stitched_response)["result"] = list(merged.values())
+    return stitched_response
+
+
+def _format_seconds(value: float):
+    return int(value) if value == int(value) else value
+
+
+class QueryPlan:
+    """Planned execution of one range query: the adjusted payload and how to split it"""
+
+    def __init__(self,
+                 payload: Dict[str, Any],
+                 start: float,
+                 end: float,
+                 step: float,
+                 split_interval: float = 0,
+                 max_splits: int = 0):
+        self.payload = payload
+        self.start = start
+        self.end = end
+        self.step = step
+        self.split_interval = split_interval
+        self.max_splits = max_splits
+
+    @property
+    def ranges(self) -> List[Tuple[float, float]]:
+        """Sub-ranges covering the whole planned range"""
+        return self.split(self.start, self.end)
+
+    def split(self, start: float, end: float) -> List[Tuple[float, float]]:
+        """Split part of the planned range into sub-ranges on the plan's interval boundaries"""
+        return split_range(start, end, self.step, self.split_interval, self.max_splits)
+
+    def sub_payloads(self, ranges: List[Tuple[float, float]] = None) -> List[Dict[str, Any]]:
+        """Connector payloads for each sub-range (all of the plan's sub-ranges by default)"""
+        return [
+            {**self.payload, "start": _format_seconds(start), "end": _format_seconds(end)}
+            for start, end in (self.ranges if ranges is None else ranges)
+        ]
+
+
+class QueryPlanner:
+    """
+    Plans range queries and fetches them through an AsyncPrometheusClient.
+
+    Sub-range fetches are bounded per query (QUERY_PLANNER_SPLIT_CONCURRENCY)
+    and across all queries in the process (QUERY_PLANNER_MAX_CONCURRENT_FETCHES).
+    With a ResultCache, only the parts of the range missing from the cache are fetched.
+    """
+
+    def __init__(self, prometheus_client, result_cache=None):
+        self.prometheus_client = prometheus_client
+        self.result_cache = result_cache
+        self.target_points = Config.QUERY_PLANNER_TARGET_POINTS
+        self.split_interval = Config.QUERY_PLANNER_SPLIT_INTERVAL_SECONDS
+        self.min_points_per_split = Config.QUERY_PLANNER_MIN_POINTS_PER_SPLIT
+        self.max_splits = Config.QUERY_PLANNER_MAX_SPLITS
+        self.split_concurrency = Config.QUERY_PLANNER_SPLIT_CONCURRENCY
+        self._fetch_slots = asyncio.Semaphore(Config.QUERY_PLANNER_MAX_CONCURRENT_FETCHES)
+
+    def plan(self, payload: Dict[str, Any], split: bool = True) -> QueryPlan:
+        """
+        Choose the step, align the range to it and split it into sub-ranges.
+
+        Args:
+            payload: Validated payload with prometheusQuery, start, end and step
+            split: Whether long ranges may be split into sub-ranges
+
+        Returns:
+            QueryPlan whose payload holds the planned start, end and step
+        """
+        start = parse_timestamp(payload["start"])
+        end = parse_timestamp(payload["end"])
+        step = choose_step(start, end, parse_step(payload["step"]), self.target_points)
+
+        aligned_start = math.floor(start / step) * step
+        aligned_end = max(aligned_start, math.floor(end / step) * step)
+        interval = 0
+        if split and self.split_interval > 0:
+            interval = max(self.split_interval, step * self.min_points_per_split)
+
+        planned_payload = {
+            **payload,
+            "start": _format_seconds(aligned_start),
+            "end": _format_seconds(aligned_end),
+            "step": f"{_format_seconds(step)}s"
+        }
+        return QueryPlan(planned_payload, aligned_start, aligned_end, step, interval, self.max_splits)
+
+    async def _fetch_range(self, payload: Dict[str, Any], conversation_id: str, split_slots: asyncio.Semaphore):
+        async with split_slots, self._fetch_slots:
+            return await self.prometheus_client.fetch_prometheus_data(payload, conversation_id)
+
+    async def execute(self, plan: QueryPlan, conversation_id: str = None) -> Dict[Any, Any]:
+        """
+        Fetch the sub-ranges of a plan concurrently and stitch the results.
+
+        Parts of the range held in the result cache are served from it; only the
+        missing head/tail ranges (and the volatile most recent steps) are fetched.
+
+        Returns:
+            dict: Response JSON in the connector's shape, covering the whole planned range
+
+        Raises:
+            RuntimeError: If any sub-range fetch fails or the responses cannot be stitched
+        """
+        query = plan.payload["prometheusQuery"]
+        cached, missing = None, [(plan.start, plan.end)]
+        if self.result_cache is not None:
+            cached, missing = await self.result_cache.lookup(query, plan.step, plan.start, plan.end)
+
+        ranges = [sub_range for start, end in missing for sub_range in plan.split(start, end)]
+        sub_payloads = plan.sub_payloads(ranges)
+        if len(sub_payloads) > 1 or cached is not None:
+            logger.debug("Query plan: %d sub-ranges at step %s%s", len(sub_payloads), plan.payload["step"],
+                         " (rest served from result cache)" if cached is not None else "")
+
+        split_slots = asyncio.Semaphore(self.split_concurrency)
+        tasks = [
+            asyncio.create_task(self._fetch_range(sub_payload, conversation_id, split_slots))
+            for sub_payload in sub_payloads
+        ]
+        try:
+            responses = await asyncio.gather(*tasks)
+        except BaseException:
+            for task in tasks:
+                task.cancel()
+            raise
+
+        if self.result_cache is not None:
+            self.result_cache.record_fetched(responses)
+
+        # Stitch cached and fetched parts in time order
+        parts = sorted(
+            [(start, response) for (start, _), response in zip(ranges, responses)]
+            + ([(cached[0], cached[1])] if cached is not None else []),
+            key=lambda part: part[0]
+        )
+        try:
+            prometheus_data = stitch_results([response for _, response in parts])
+        except ValueError as e:
+            raise RuntimeError(f"Failed to stitch Prometheus connector responses: {e}")
+
+        if self.result_cache is not None:
+            await self.result_cache.store(query, plan.step, prometheus_data, plan.start, plan.end)
+        return prometheus_data
@@ -0,0 +1,295 @@
+"""
+Step-aligned incremental cache for Prometheus range query results.
+
+Entries are keyed on (query, step) and hold one contiguous extent of
+step-aligned samples per key. A lookup returns the cached part of the
+requested range plus the head/tail ranges that still have to be fetched.
+Samples within the most recent few steps are never cached, since
+Prometheus may still be ingesting data for them (the same approach as
+the Cortex/Thanos query-frontend).
+
+With a shared store (several worker processes), every entry whose extent
+changed is written through to it, and a lookup the local entry does not
+cover picks up a wider extent another worker has stored since. Shared
+reads run on the store's I/O threads and writes are queued there, so the
+event loop never waits on SQLite.
+"""
+import copy
+import math
+import threading
+import time
+from bisect import bisect_left, bisect_right
+from collections import OrderedDict
+from typing import Optional, Dict, Any, List, Tuple
+
+from api.internal.query_planner import find_result_container
+from utils.serialization import dumps
+from utils.shared_store import SharedStore
+
+
+def _sample_time(sample) -> float:
+    return sample[0]
+
+
+def estimate_series_bytes(series_list: List[Dict[str, Any]]) -> int:
+    """
+    Approximate the JSON size of a list of matrix series.
+
+    Sample sizes are extrapolated from the first sample of each series,
+    which keeps the estimate O(series) rather than O(samples).
+    """
+    total = 0
+    for series in series_list:
+        total += 16 + sum(len(key) + len(str(value)) + 6 for key, value in series.get("metric", {}).items())
+        values = series.get("values") or []
+        if values:
+            total += len(values) * (len(str(values[0][0])) + len(str(values[0][1])) + 6)
+    return total
+
+
+def _slice(values: list, start: float, end: float) -> list:
+    return values[bisect_left(values, start, key=_sample_time):bisect_right(values, end, key=_sample_time)]
+
+
+class ResultCache:
+    """
+    Bounded LRU cache of step-aligned range query results with a memory budget.
+
+    Sizes are estimated from the JSON representation of the cached samples;
+    least recently used entries are evicted once the total exceeds max_bytes.
+    """
+
+    def __init__(self, max_bytes: int, volatile_steps: int, shared: Optional[SharedStore] = None):
+        self.max_bytes = max_bytes
+        self.volatile_steps = volatile_steps
+        self.shared = shared
+        self._entries: "OrderedDict[Tuple[str, float], Dict[str, Any]]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.size_bytes = 0
+        self.hits = 0
+        self.partial_hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.bytes_from_cache = 0
+        self.bytes_fetched = 0
+
+    async def lookup(self,
+                     query: str,
+                     step: float,
+                     start: float,
+                     end: float) -> Tuple[Optional[Tuple[float, Dict[Any, Any]]], List[Tuple[float, float]]]:
+        """
+        Look up the cached part of a step-aligned range.
+
+        Args:
+            query: PromQL query
+            step: Query step in seconds
+            start: Step-aligned range start
+            end: Step-aligned range end
+
+        Returns:
+            ((start of the cached part, response holding it) or None, inclusive ranges still to fetch)
+        """
+        if self.max_bytes <= 0:
+            return None, [(start, end)]
+
+        key = (query, step)
+        if self.shared is not None:
+            await self._refresh_from_shared(key, start, end)
+        with self._lock:
+            entry = self._entries.get(key)
+            cached_start = max(start, entry["start"]) if entry else None
+            cached_end = min(end, entry["end"]) if entry else None
+            if entry is None or cached_start > cached_end:
+                self.misses += 1
+                return None, [(start, end)]
+
+            self._entries.move_to_end(key)
+            result = []
+            for series in entry["series"]:
+                values = _slice(series["values"], cached_start, cached_end)
+                if values:
+                    result.append({"metric": series["metric"], "values": values})
+            missing = []
+            if start < entry["start"]:
+                missing.append((start, entry["start"] - step))
+            if end > entry["end"]:
+                missing.append((entry["end"] + step, end))
+            if missing:
+                self.partial_hits += 1
+            else:
+                self.hits += 1
+            self.bytes_from_cache += estimate_series_bytes(result)
+            envelope = entry["envelope"]
+
+        response = copy.deepcopy(envelope)
+        find_result_container(response)["result"] = result
+        return (cached_start, response), missing
+
+    def record_fetched(self, responses: List[Dict[Any, Any]]):
+        """Count the bytes of connector responses fetched for cached queries"""
+        fetched = 0
+        for response in responses:
+            container = find_result_container(response)
+            if container is not None and isinstance(container["result"], list):
+                fetched += estimate_series_bytes(container["result"])
+        with self._lock:
+            self.bytes_fetched += fetched
+
+    async def store(self,
+                    query: str,
+                    step: float,
+                    response: Dict[Any, Any],
+                    start: float,
+                    end: float,
+                    now: Optional[float] = None) -> bool:
+        """
+        Merge the non-volatile part of a complete [start, end] response into the cache.
+
+        Returns:
+            bool: True if anything was cached, False otherwise
+        """
+        if self.max_bytes <= 0:
+            return False
+
+        now = time.time() if now is None else now
+        cacheable_end = min(end, (math.floor(now / step) - self.volatile_steps) * step)
+        container = find_result_container(response)
+        if cacheable_end < start or container is None or container["resultType"] != "matrix":
+            return False
+        if any(set(series) != {"metric", "values"} for series in container["result"]):
+            # Native histograms and other sample shapes are not cached
+            return False
+
+        key = (query, step)
+        if self.shared is not None:
+            # Merge into the newest extent any worker has stored, rather than overwrite it with an older one
+            await self._refresh_from_shared(key, start, cacheable_end)
+
+        fresh = {
+            tuple(sorted(series["metric"].items())): {
+                "metric": series["metric"],
+                "values": _slice(series["values"], start, cacheable_end)
+            }
+            for series in container["result"]
+        }
+
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry["start"] <= cacheable_end + step and entry["end"] >= start - step:
+                # Adjacent or overlapping extent: the fresh samples replace the cached ones in [start, cacheable_end]
+                merged = {}
+                for series in entry["series"]:
+                    label_key = tuple(sorted(series["metric"].items()))
+                    merged[label_key] = {
+                        "metric": series["metric"],
+                        "values": _slice(series["values"], -math.inf, start - step)
+                    }
+                for label_key, series in fresh.items():
+                    merged.setdefault(label_key, {"metric": series["metric"], "values": []})
+                    merged[label_key]["values"] = merged[label_key]["values"] + series["values"]
+                for series in entry["series"]:
+                    label_key = tuple(sorted(series["metric"].items()))
+                    merged[label_key]["values"] = (
+                        merged[label_key]["values"] + _slice(series["values"], cacheable_end + step, math.inf)
+                    )
+                series_list = [series for series in merged.values() if series["values"]]
+                extent = (min(start, entry["start"]), max(cacheable_end, entry["end"]))
+            else:
+                series_list = [series for series in fresh.values() if series["values"]]
+                extent = (start, cacheable_end)
+
+            size = estimate_series_bytes(series_list)
+            if size > self.max_bytes:
+                if entry is not None:
+                    del self._entries[key]
+                    self.size_bytes -= entry["size"]
+                return False
+
+            result = container["result"]
+            container["result"] = []
+            try:
+                envelope = copy.deepcopy(response)
+            finally:
+                container["result"] = result
+
+            extended = entry is None or (entry["start"], entry["end"]) != extent
+            stored = {
+                "start": extent[0],
+                "end": extent[1],
+                "series": series_list,
+                "envelope": envelope,
+                "size": size,
+                "sharedAt": now if self.shared is not None and extended else (entry or {}).get("sharedAt"),
+            }
+            self._install(key, stored)
+
+        if self.shared is not None and extended:
+            # Only a changed extent is written: re-storing the same range (every request) would rewrite MBs
+            self.shared.set_later(self._shared_key(key), stored, now=stored["sharedAt"])
+        return True
+
+    def _install(self, key: Tuple[str, float], entry: Dict[str, Any]):
+        """Insert or replace an entry and evict least recently used ones beyond max_bytes (caller holds the lock)"""
+        previous = self._entries.pop(key, None)
+        if previous is not None:
+            self.size_bytes -= previous["size"]
+        self._entries[key] = entry
+        self.size_bytes += entry["size"]
+        while self.size_bytes > self.max_bytes:
+            _, evicted = self._entries.popitem(last=False)
+            self.size_bytes -= evicted["size"]
+            self.evictions += 1
+
+    @staticmethod
+    def _shared_key(key: Tuple[str, float]) -> str:
+        return dumps(list(key)).decode("utf-8")
+
+    async def _refresh_from_shared(self, key: Tuple[str, float], start: float, end: float):
+        """Adopt the shared entry for key if another worker stored one covering more of [start, end] than ours"""
+        with self._lock:
+            entry = self._entries.get(key)
+        if entry is not None and entry["start"] <= start and entry["end"] >= end:
+            return
+        shared = await self.shared.get_async(
+            self._shared_key(key), newer_than=entry.get("sharedAt") if entry else None
+        )
+        if shared is None:
+            return
+
+        def coverage(candidate: Dict[str, Any]) -> float:
+            return min(end, candidate["end"]) - max(start, candidate["start"])
+
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None or coverage(shared) > coverage(entry):
+                self._install(key, shared)
+
+    def clear(self):
+        """Drop all cached results, including the shared ones (counters are kept)"""
+        with self._lock:
+            self._entries.clear()
+            self.size_bytes = 0
+        if self.shared is not None:
+            self.shared.clear()
+
+    def stats(self) -> Dict[str, Any]:
+        """Return hit/miss counters, bytes served from cache vs. fetched, and memory use"""
+        with self._lock:
+            lookups = self.hits + self.partial_hits + self.misses
+            total_bytes = self.bytes_from_cache + self.bytes_fetched
+            return {
+                "hits": self.hits,
+                "partialHits": self.partial_hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "hitRatio": ((self.hits + self.partial_hits) / lookups) if lookups else 0.0,
+                "bytesFromCache": self.bytes_from_cache,
+                "bytesFetched": self.bytes_fetched,
+                "cachedByteRatio": (self.bytes_from_cache / total_bytes) if total_bytes else 0.0,
+                "entries": len(self._entries),
+                "sizeBytes": self.size_bytes,
+                "maxBytes": self.max_bytes,
+                "volatileSteps": self.volatile_steps,
+                "shared": self.shared.stats() if self.shared is not None else None,
+            }
@@ -0,0 +1,110 @@
+import codecs
+import json
+import re
+from typing import Any, Dict, List
+
+# Opening of the result array in a connector/Prometheus response body
+_RESULT_ARRAY_START = re.compile(r'"result"\s*:\s*\[')
+_WHITESPACE_AND_COMMAS = re.compile(r"[\s,]*")
+# Characters that end a JSON number inside an array
+_NUMBER_END = frozenset(", \t\r\n]")
+# Stand-in for the result array when re-assembling the full response envelope
+_RESULT_PLACEHOLDER = "__incremental_result_placeholder__"
+
+
+def _replace_placeholder(node: Any, result: List[Any]) -> Any:
+    if isinstance(node, str) and node == _RESULT_PLACEHOLDER:
+        return result
+    if isinstance(node, dict):
+        return {key: _replace_placeholder(value, result) for key, value in node.items()}
+    if isinstance(node, list):
+        return [_replace_placeholder(value, result) for value in node]
+    return node
+
+
+class IncrementalResultParser:
+    """
+    Incrementally parses a streamed connector response body.
+
+    Elements of the "result" array (one series each for matrix and vector
+    results) are returned as soon as they are complete, without waiting for
+    the whole body. Everything around the array is kept as text and parsed
+    into the response envelope once the stream ends.
+    """
+
+    def __init__(self):
+        self._decoder = json.JSONDecoder()
+        self._utf8 = codecs.getincrementaldecoder("utf-8")()
+        self._buffer = ""
+        self._state = "head"
+        self._head = ""
+        # Retry parsing an incomplete element only once the buffer has doubled,
+        # keeping total parse work linear in the element size
+        self._retry_at = 0
+        self.series_count = 0
+
+    def feed(self, chunk: bytes) -> List[Any]:
+        """Add a chunk of the response body and return any result elements it completed"""
+        self._buffer += self._utf8.decode(chunk)
+        return self._drain(final=False)
+
+    def close(self) -> List[Any]:
+        """Signal the end of the body and return any remaining result elements"""
+        self._buffer += self._utf8.decode(b"", final=True)
+        return self._drain(final=True)
+
+    def envelope(self, result: List[Any] = None) -> Dict[Any, Any]:
+        """
+        Return the parsed response with the result array replaced by `result` (empty by default).
+
+        Raises:
+            ValueError: If the stream has not been closed or the body is not valid JSON
+        """
+        if self._state == "head":
+            return json.loads(self._head + self._buffer)
+        if self._state != "tail":
+            raise ValueError("Connector response ended inside the result array")
+        if result is None:
+            return json.loads(self._head + "[]" + self._buffer)
+        envelope = json.loads(self._head + json.dumps(_RESULT_PLACEHOLDER) + self._buffer)
+        return _replace_placeholder(envelope, result)
+
+    def _drain(self, final: bool) -> List[Any]:
+        items = []
+        if self._state == "head":
+            match = _RESULT_ARRAY_START.search(self._buffer)
+            if match is None:
+                return items
+            self._head = self._buffer[:match.end() - 1]
+            self._buffer = self._buffer[match.end():]
+            self._state = "items"
+
+        position = 0
+        while self._state == "items":
+            position = _WHITESPACE_AND_COMMAS.match(self._buffer, position).end()
+            if position >= len(self._buffer):
+                break
+            if self._buffer[position] == "]":
+                self._state = "tail"
+                position += 1
+                break
+            if not final and len(self._buffer) < self._retry_at:
+                break
+            try:
+                item, end = self._decoder.raw_decode(self._buffer, position)
+            except json.JSONDecodeError:
+                if final:
+                    raise ValueError("Connector response ended inside a result element")
+                self._retry_at = position + 2 * (len(self._buffer) - position)
+                break
+            if not final and type(item) in (int, float) and self._buffer[end:end + 1] not in _NUMBER_END:
+                # The number may continue in the next chunk ("17" + "00.5"; scalar results)
+                break
+            position = end
+            self._retry_at = 0
+            self.series_count += 1
+            items.append(item)
+
+        self._buffer = self._buffer[position:]
+        self._retry_at = max(0, self._retry_at - position)
+        return items
@@ -1,31 +1,245 @@
-from fastapi import APIRouter, HTTPException
+from fastapi import APIRouter, HTTPException, Request
+from fastapi.responses import StreamingResponse
+from starlette.concurrency import run_in_threadpool
 from pydantic import BaseModel
-from openai import OpenAI
+from typing import Optional, List, Tuple
 from config import Config
 import prompts.promql_query_prompts as query_prompt
-from api.internal.prometheus_connector import PrometheusClient
-from dashboard.mongo_client import mongo_client
+from api.internal.prometheus_connector import AsyncPrometheusClient
+from api.internal.series_stream import IncrementalResultParser
+from api.internal.query_planner import QueryPlanner
+from api.internal.result_cache import ResultCache
+from api.internal.metric_catalog import MetricCatalog
+from api.internal.panel_scheduler import PanelScheduler
+from dashboard.mongo_client import async_mongo_client, build_conversation_document
+from utils.payload_cache import PayloadCache, normalize_query
+from utils.shared_store import SharedLease, SharedStore
+from utils.single_flight import SingleFlight
+from utils.intent_matcher import Refinement, match_intent, match_refinement
+from utils.chart_enums import ChartType, ChartConfig
+from utils.chart_transform import transform_for_chart
+from utils.lazy_client import LazyClient
+from utils.serialization import dumps, json_response, response_content
+from utils.admission import OverloadError, create_guard
+from utils.promql_parser import PromQLValidationError, parse_step, parse_timestamp, validate_payload
+from utils.token_budget import TokenBudget
+from utils.metrics import (
+    registry as metrics_registry, stage, should_log_payload, LLM_REQUEST_SECONDS, LLM_TOKENS,
+    LLM_REQUEST_TOKENS, LLM_PAYLOAD_ERRORS, PAYLOADS_ANSWERED
+)
+import asyncio
+import copy
 import json
 import time
-from datetime import datetime
+import logging
 
-# Initialize router, OpenAI client, and Prometheus client
+def create_openai_client():
+    """Create the async OpenAI client; the SDK is imported here so importing this module stays fast"""
+    from openai import AsyncOpenAI
+    return AsyncOpenAI(api_key=Config.OPENAI_API_KEY)
+
+async def check_openai() -> bool:
+    """Readiness check: create the client off the event loop (the SDK import takes ~0.8s), then list models"""
+    await asyncio.to_thread(client.get)
+    await client.models.list()
+    return True
+
+def is_llm_failure(error: BaseException) -> bool:
+    """Whether an OpenAI error counts against the upstream (4xx answers other than 429 are caused by the request)"""
+    status_code = getattr(error, "status_code", None)
+    return status_code is None or status_code >= 500 or status_code == 429
+
+# Initialize router, async OpenAI client (created on first use) behind its concurrency limit and
+# circuit breaker, async Prometheus client, query planner with its result cache, and LLM payload cache
 router = APIRouter()
-client = OpenAI(api_key=Config.OPENAI_API_KEY)
-prometheus_client = PrometheusClient()
+# Per-request detail is logged at DEBUG: latency, tokens and outcomes are already in /metrics and Server-Timing
+logger = logging.getLogger(__name__)
+client = LazyClient(create_openai_client)
+llm_guard = create_guard(
+    "openai", Config.LLM_CONCURRENCY_INITIAL_LIMIT, Config.LLM_CONCURRENCY_MAX_LIMIT, is_failure=is_llm_failure
+)
+prometheus_client = AsyncPrometheusClient()
+
+def create_shared_store(namespace: str, max_bytes: int, ttl_seconds: Optional[float] = None) -> Optional[SharedStore]:
+    """Store the in-process caches share their entries through across worker processes (None when disabled)"""
+    if not Config.SHARED_CACHE_ENABLED:
+        return None
+    return SharedStore(
+        Config.SHARED_CACHE_PATH, namespace, max_bytes, ttl_seconds=ttl_seconds, mmap_bytes=Config.SHARED_CACHE_MMAP_BYTES,
+        io_threads=Config.SHARED_CACHE_IO_THREADS, max_pending_writes=Config.SHARED_CACHE_MAX_PENDING_WRITES
+    )
+
+def create_lease(name: str, ttl_seconds: float) -> Optional[SharedLease]:
+    """Lease electing the one worker that runs a background job (None when the workers share no store)"""
+    if not Config.SHARED_CACHE_ENABLED:
+        return None
+    return SharedLease(Config.SHARED_CACHE_PATH, name, ttl_seconds)
+
+result_cache = ResultCache(
+    max_bytes=Config.RESULT_CACHE_MAX_BYTES,
+    volatile_steps=Config.RESULT_CACHE_VOLATILE_STEPS,
+    shared=create_shared_store("results", Config.SHARED_CACHE_RESULT_MAX_BYTES)
+)
+query_planner = QueryPlanner(prometheus_client, result_cache)
+# Metric/label catalog used to add the relevant metrics to each prompt (refreshed in the background)
+metric_catalog = MetricCatalog(
+    prometheus_client,
+    lease=create_lease("metric-catalog", 2 * Config.METRIC_CATALOG_REFRESH_INTERVAL_SECONDS),
+    shared=create_shared_store("catalog", Config.SHARED_CACHE_CATALOG_MAX_BYTES)
+)
+# Saved panels whose queries are re-run in the background, serving their latest result on read
+panel_scheduler = PanelScheduler(
+    query_planner,
+    async_mongo_client,
+    lease=create_lease("panel-scheduler", 3 * Config.PANEL_SYNC_INTERVAL_SECONDS),
+    shared=create_shared_store("panels", Config.SHARED_CACHE_PANEL_MAX_BYTES)
+)
+# Concurrent requests for the same normalized query share one OpenAI generation
+payload_flights = SingleFlight(enabled=Config.SINGLE_FLIGHT_ENABLED)
+payload_cache = PayloadCache(
+    max_size=Config.PAYLOAD_CACHE_MAX_SIZE,
+    ttl_seconds=Config.PAYLOAD_CACHE_TTL_SECONDS,
+    shared=create_shared_store("payloads", Config.SHARED_CACHE_PAYLOAD_MAX_BYTES, Config.PAYLOAD_CACHE_TTL_SECONDS)
+)
+
+def get_limits_stats() -> dict:
+    """Limiter and circuit breaker state of every upstream guard"""
+    return {
+        "openai": llm_guard.stats(),
+        "prometheusConnector": prometheus_client.guard.stats(),
+        "metricCatalog": metric_catalog.guard.stats(),
+        "mongodb": async_mongo_client.guard.stats()
+    }
+
+def collect_component_metrics():
+    """Export the counters the caches, single-flight groups, connector, catalog, panel scheduler and upstream guards keep themselves"""
+    payloads = payload_cache.stats()
+    results = result_cache.stats()
+    connector = prometheus_client.stats.snapshot()
+    payload_group = payload_flights.stats()
+    connector_group = prometheus_client.flights.stats()
+    catalog = metric_catalog.stats()
+    guards = get_limits_stats()
+    panels = panel_scheduler.stats()
+    shared_stores = {"payload": payloads["shared"], "result": results["shared"]}
+    shared_stores = {cache: stats for cache, stats in shared_stores.items() if stats is not None}
+    return [
+        ("promql_generator_cache_lookups_total", "counter", "Cache lookups by cache and result", [
+            ({"cache": "payload", "result": "hit"}, payloads["hits"]),
+            ({"cache": "payload", "result": "miss"}, payloads["misses"]),
+            ({"cache": "result", "result": "hit"}, results["hits"]),
+            ({"cache": "result", "result": "partial_hit"}, results["partialHits"]),
+            ({"cache": "result", "result": "miss"}, results["misses"]),
+        ]),
+        ("promql_generator_cache_evictions_total", "counter", "Cache evictions by cache", [
+            ({"cache": "payload"}, payloads["evictions"]),
+            ({"cache": "result"}, results["evictions"]),
+        ]),
+        ("promql_generator_cache_entries", "gauge", "Entries held by each cache", [
+            ({"cache": "payload"}, payloads["size"]),
+            ({"cache": "result"}, results["entries"]),
+        ]),
+        ("promql_generator_result_cache_size_bytes", "gauge", "Estimated size of the cached results", [
+            ({}, results["sizeBytes"]),
+        ]),
+        ("promql_generator_result_bytes_total", "counter", "Result bytes served from the result cache or fetched", [
+            ({"source": "cache"}, results["bytesFromCache"]),
+            ({"source": "connector"}, results["bytesFetched"]),
+        ]),
+        ("promql_generator_single_flight_calls_total", "counter", "Calls executed or coalesced by single-flight group", [
+            ({"group": "payload", "outcome": "executed"}, payload_group["executions"]),
+            ({"group": "payload", "outcome": "coalesced"}, payload_group["coalesced"]),
+            ({"group": "connector", "outcome": "executed"}, connector_group["executions"]),
+            ({"group": "connector", "outcome": "coalesced"}, connector_group["coalesced"]),
+        ]),
+        ("promql_generator_connector_events_total", "counter", "Prometheus connector attempts, retries, hedges and failures", [
+            ({"event": "attempt"}, connector["attempts"]),
+            ({"event": "retry"}, connector["retries"]),
+            ({"event": "hedge_fired"}, connector["hedgesFired"]),
+            ({"event": "hedge_won"}, connector["hedgesWon"]),
+            ({"event": "failure"}, connector["failures"]),
+        ]),
+        ("promql_generator_metric_catalog_metrics", "gauge", "Metric names held by the metric catalog", [
+            ({}, catalog["metrics"]),
+        ]),
+        ("promql_generator_panels", "gauge", "Saved panels by freshness of their latest result", [
+            ({"status": status}, count) for status, count in panels["panelsByStatus"].items()
+        ]),
+        ("promql_generator_panel_refresh_groups", "gauge", "Distinct panel queries refreshed by the scheduler", [
+            ({}, panels["refreshGroups"]),
+        ]),
+        ("promql_generator_panel_refreshes_total", "counter", "Panel refreshes by outcome", [
+            ({"outcome": "success"}, panels["refreshes"] - panels["refreshFailures"]),
+            ({"outcome": "failure"}, panels["refreshFailures"]),
+            ({"outcome": "skipped"}, panels["skipped"]),
+        ]),
+        ("promql_generator_concurrency_limit", "gauge", "Adaptive concurrency limit by upstream", [
+            ({"upstream": upstream}, guard["limiter"]["limit"]) for upstream, guard in guards.items()
+        ]),
+        ("promql_generator_concurrency_in_flight", "gauge", "Calls in flight by upstream", [
+            ({"upstream": upstream}, guard["limiter"]["inFlight"]) for upstream, guard in guards.items()
+        ]),
+        ("promql_generator_concurrency_queued", "gauge", "Calls waiting for a slot by upstream", [
+            ({"upstream": upstream}, guard["limiter"]["queued"]) for upstream, guard in guards.items()
+        ]),
+        ("promql_generator_concurrency_limit_decreases_total", "counter", "Multiplicative limit decreases by upstream", [
+            ({"upstream": upstream}, guard["limiter"]["decreases"]) for upstream, guard in guards.items()
+        ]),
+        ("promql_generator_shed_total", "counter", "Calls rejected by admission control, by upstream and reason", [
+            ({"upstream": upstream, "reason": reason}, count)
+            for upstream, guard in guards.items() for reason, count in guard["limiter"]["shed"].items()
+        ] + [
+            ({"upstream": upstream, "reason": "circuit_open"}, guard["circuitBreaker"]["rejected"])
+            for upstream, guard in guards.items()
+        ]),
+        ("promql_generator_circuit_state", "gauge", "Circuit breaker state by upstream (1 for the current state)", [
+            ({"upstream": upstream, "state": state}, 1 if guard["circuitBreaker"]["state"] == state else 0)
+            for upstream, guard in guards.items() for state in ("closed", "half_open", "open")
+        ]),
+        ("promql_generator_circuit_opened_total", "counter", "Times the circuit breaker opened, by upstream", [
+            ({"upstream": upstream}, guard["circuitBreaker"]["opened"]) for upstream, guard in guards.items()
+        ]),
+        ("promql_generator_shared_cache_lookups_total", "counter", "Lookups in the process-shared cache store after a local miss", [
+            ({"cache": cache, "result": result}, stats[field])
+            for cache, stats in shared_stores.items() for result, field in (("hit", "hits"), ("miss", "misses"))
+        ]),
+        ("promql_generator_shared_cache_size_bytes", "gauge", "Bytes held by the process-shared cache store", [
+            ({"cache": cache}, stats["sizeBytes"]) for cache, stats in shared_stores.items()
+        ]),
+    ]
+
+metrics_registry.register_collector(collect_component_metrics)
 
 # Request body schema
 class PromQLRequest(BaseModel):
     query: str
+    # Optional chart-ready, downsampled data keyed on chartConfig.chartType
+    includeChartData: bool = False
+    maxPointsPerSeries: Optional[int] = None
+    includeRawData: bool = True
+
+# Request schema for the follow-up refinement endpoint
+class RefineRequest(BaseModel):
+    conversationId: str
+    # Follow-up such as "same but last 24h", "group by pod instead" or "show as bar chart"
+    refinement: str
+    includeChartData: bool = False
+    maxPointsPerSeries: Optional[int] = None
+    includeRawData: bool = True
 
 # Request schema for getChartConfig endpoint
 class ChartConfigRequest(BaseModel):
     conversationId: str
+    includeChartData: bool = False
+    maxPointsPerSeries: Optional[int] = None
+    includeRawData: bool = True
 
 # Response schema (optional, but good practice)
 class PromQLResponse(BaseModel):
     query_prompt: str
     explanation: str
+    # Which path produced the payload: "fast_path", "cache" or "llm"
+    answered_by: Optional[str] = None
 
 # New response schema for integrated endpoint
 class PrometheusDataResponse(BaseModel):
@@ -34,6 +248,41 @@ class PrometheusDataResponse(BaseModel):
     prometheus_data: dict
     success: bool
     message: str
+    chart_data: Optional[dict] = None
+    answered_by: Optional[str] = None
+
+# Response of the refinement endpoint: a new conversation linked to the refined one
+class RefineResponse(PrometheusDataResponse):
+    parent_conversation_id: str
+    chart_config: dict = {}
+    # Changes applied without the LLM, e.g. "window=1d", "groupBy=pod", "chartType=barChart"
+    applied_changes: List[str] = []
+
+# Request schema for the batch endpoint (options apply to every query)
+class BatchPromQLRequest(BaseModel):
+    queries: List[str]
+    includeChartData: bool = False
+    maxPointsPerSeries: Optional[int] = None
+    includeRawData: bool = True
+
+# Per-query result of the batch endpoint
+class BatchItemResponse(BaseModel):
+    index: int
+    query: str
+    conversation_id: str
+    status_code: int
+    success: bool
+    message: str
+    generated_payload: dict = {}
+    prometheus_data: dict = {}
+    chart_data: Optional[dict] = None
+    answered_by: Optional[str] = None
+    # Index of the earlier, normalized-equal query whose result this item shares
+    duplicate_of: Optional[int] = None
+
+class BatchPromQLResponse(BaseModel):
+    results: List[BatchItemResponse]
+    unique_queries: int
 
 # Response schema for getChartConfig endpoint
 class ChartConfigResponse(BaseModel):
@@ -42,120 +291,312 @@ class ChartConfigResponse(BaseModel):
     chartConfig: dict
     prometheusData: dict
     timestamp: str
+    chartData: Optional[dict] = None
+
+class PanelRequest(BaseModel):
+    conversationId: str
+    refreshIntervalSeconds: Optional[float] = None
+    name: Optional[str] = None
+
+class PanelResultResponse(BaseModel):
+    panelId: str
+    name: Optional[str] = None
+    naturalLanguageQuery: str
+    status: str
+    refreshedAt: Optional[str] = None
+    ageSeconds: Optional[float] = None
+    lastError: Optional[str] = None
+    generatedPayload: dict
+    chartConfig: dict
+    prometheusData: dict
+    chartData: Optional[dict] = None
+
+def record_llm_call(endpoint: str, response_time: float, usage) -> None:
+    """Record OpenAI latency and token usage for an endpoint"""
+    LLM_REQUEST_SECONDS.observe(response_time, endpoint=endpoint)
+    if usage is not None:
+        LLM_TOKENS.inc(usage.prompt_tokens, endpoint=endpoint, kind="prompt")
+        LLM_TOKENS.inc(usage.completion_tokens, endpoint=endpoint, kind="completion")
+        # Prompt tokens served from the provider's prompt cache (billed and processed at a discount)
+        cached_tokens = getattr(getattr(usage, "prompt_tokens_details", None), "cached_tokens", None)
+        if cached_tokens:
+            LLM_TOKENS.inc(cached_tokens, endpoint=endpoint, kind="cached_prompt")
+
+async def create_chat_completion(messages: List[dict], max_completion_tokens: Optional[int] = None):
+    """
+    Call OpenAI chat completions through the LLM concurrency limit and circuit breaker, asking
+    for a payload in the configured response format with a capped completion.
+
+    Raises:
+        OverloadError: If shed by admission control, the circuit is open or the request deadline passes
+    """
+    options = {"max_completion_tokens": max_completion_tokens or Config.LLM_MAX_COMPLETION_TOKENS}
+    response_format = query_prompt.response_format()
+    if response_format is not None:
+        options["response_format"] = response_format
+    if Config.LLM_PROMPT_CACHE_KEY:
+        options["extra_body"] = {"prompt_cache_key": f"{Config.LLM_PROMPT_CACHE_KEY}-v{query_prompt.PROMPT_VERSION}"}
+    return await llm_guard.call(
+        client.chat.completions.create, model=Config.OPENAI_MODEL_NAME, messages=messages, **options
+    )
+
+def check_generated_payload(openai_response: str) -> Tuple[Optional[dict], Optional[str]]:
+    """
+    Parse and validate a generated payload locally, before anything is sent to the connector.
+
+    Args:
+        openai_response: Raw message content returned by OpenAI
+
+    Returns:
+        (payload or None if it is not a JSON object, error detail or None if the payload is valid)
+    """
+    try:
+        payload = json.loads(openai_response)
+    except json.JSONDecodeError as e:
+        return None, f"OpenAI returned invalid JSON: {str(e)}"
+    if not isinstance(payload, dict):
+        return None, "OpenAI returned invalid JSON: expected a JSON object"
+
+    required_fields = ["prometheusQuery", "start", "end", "step", "chartConfig"]
+    missing_fields = [field for field in required_fields if field not in payload]
+    if missing_fields:
+        return payload, f"Generated payload missing required fields: {missing_fields}"
+
+    # The points-per-series limit is enforced by the query planner, which clamps the step
+    try:
+        validate_payload(payload, max_points=None)
+    except PromQLValidationError as e:
+        return payload, f"Generated payload failed validation: {str(e)}"
+    return payload, None
+
+async def _complete_payload(messages: List[dict],
+                            natural_language_query: str,
+                            conversation_id: str,
+                            endpoint: str) -> Tuple[Optional[dict], Optional[str]]:
+    """
+    Generate a payload with OpenAI, repairing it until it passes local validation.
+
+    The calls of one request share a token budget (LLM_REQUEST_TOKEN_BUDGET): each
+    completion is capped to what is left, and no repair is attempted once too little
+    is. Truncated completions and refusals are not repaired either.
+
+    Returns:
+        (payload, None) for a validated payload, or (last payload or None, error detail)
+    """
+    logger.debug("OpenAI API request - %s endpoint, conversation ID: %s, model: %s, user query: %s",
+                 endpoint, conversation_id, Config.OPENAI_MODEL_NAME, natural_language_query)
+
+    budget = TokenBudget(Config.LLM_REQUEST_TOKEN_BUDGET, Config.LLM_MAX_COMPLETION_TOKENS)
+    max_repairs = Config.PROMQL_REPAIR_MAX_ATTEMPTS
+    payload, error = None, None
+    try:
+        for attempt in range(max_repairs + 1):
+            completion_limit = budget.completion_limit(messages)
+            if completion_limit is None:
+                LLM_PAYLOAD_ERRORS.inc(endpoint=endpoint, reason="budget")
+                if error is None:
+                    return None, f"Prompt exceeds the LLM token budget of {budget.limit} tokens"
+                return payload, f"{error} (not repaired: LLM token budget of {budget.limit} tokens spent)"
+
+            # Step 2: Call OpenAI to generate complete JSON payload
+            start_time = time.time()
+            response = await create_chat_completion(messages, completion_limit)
+            response_time = time.time() - start_time
+            record_llm_call(endpoint, response_time, response.usage)
+            budget.record(response.usage)
+            choice = response.choices[0]
+            openai_response = (choice.message.content or "").strip()
+
+            logger.debug("OpenAI API response - %s endpoint, time: %.2fs, request tokens: %s",
+                         endpoint, response_time, budget.summary())
+            if should_log_payload():
+                logger.info("Raw OpenAI response: %s", openai_response)
+
+            refusal = getattr(choice.message, "refusal", None)
+            if refusal:
+                LLM_PAYLOAD_ERRORS.inc(endpoint=endpoint, reason="refused")
+                return None, f"OpenAI refused to generate a payload: {refusal}"
+            if getattr(choice, "finish_reason", None) == "length":
+                # A repair would be cut off the same way
+                LLM_PAYLOAD_ERRORS.inc(endpoint=endpoint, reason="truncated")
+                return None, f"OpenAI response was cut off at {completion_limit} completion tokens"
+
+            # Steps 3-4: Parse and validate the payload locally
+            payload, error = check_generated_payload(openai_response)
+            if error is None:
+                return payload, None
+            LLM_PAYLOAD_ERRORS.inc(endpoint=endpoint, reason="invalid_json" if payload is None else "invalid_payload")
+            if attempt < max_repairs:
+                # Step 4.5: Send the validation error back to OpenAI for a repaired payload
+                logger.debug("Repairing payload (%d/%d) - %s", attempt + 1, max_repairs, error)
+                messages = messages + [
+                    {"role": "assistant", "content": openai_response},
+                    {"role": "user", "content": query_prompt.repair_template(error)}
+                ]
+        return payload, error
+    finally:
+        LLM_REQUEST_TOKENS.observe(budget.total_tokens, endpoint=endpoint)
+
+async def _generate_payload(natural_language_query: str,
+                            conversation_id: str,
+                            endpoint: str) -> Tuple[Optional[dict], Optional[str]]:
+    """
+    Generate the payload for a natural language query with OpenAI and cache it once validated.
+
+    Returns:
+        (payload, None) for a validated payload, or (last payload or None, error detail)
+    """
+    messages = [
+        {"role": "system", "content": query_prompt.SYSTEM_PROMPT},
+        {"role": "user", "content": query_prompt.query_template(
+            natural_language_query, metric_catalog.prompt_context(natural_language_query)
+        )}
+    ]
+    payload, error = await _complete_payload(messages, natural_language_query, conversation_id, endpoint)
+    if error is None:
+        # Step 5: Cache the validated payload for repeat questions
+        payload_cache.put(
+            natural_language_query, Config.OPENAI_MODEL_NAME, query_prompt.PAYLOAD_CACHE_VERSION, payload
+        )
+    return payload, error
+
+def match_fast_path(natural_language_query: str, endpoint: str) -> Optional[dict]:
+    """
+    Build the payload for a stock question with the rule-based intent matcher.
+
+    Returns:
+        The payload, or None if the fast path is disabled or not confident enough
+    """
+    if not Config.INTENT_FAST_PATH_ENABLED:
+        return None
+    match = match_intent(natural_language_query)
+    if match is None or match.confidence < Config.INTENT_FAST_PATH_MIN_CONFIDENCE:
+        return None
+    logger.debug("Intent fast path - %s endpoint, intent: %s, confidence: %.2f, user query: %s",
+                 endpoint, match.intent, match.confidence, natural_language_query)
+    return match.payload
+
+async def generate_validated_payload(natural_language_query: str,
+                                     conversation_id: str,
+                                     endpoint: str,
+                                     store_failures: bool = True) -> Tuple[dict, str]:
+    """
+    Produce the query payload for a natural language query from the rule-based
+    fast path, the payload cache or OpenAI, in that order.
+
+    Generated payloads are validated locally (JSON, required fields, PromQL syntax and
+    typing, time range); on failure the error is sent back to OpenAI for up to
+    PROMQL_REPAIR_MAX_ATTEMPTS repairs. Payloads that still fail are stored in
+    MongoDB (unless store_failures is False) and surfaced as a 400 HTTPException.
+    Concurrent requests for the same normalized query share one generation; each
+    caller still gets its own copy of the payload and its own failure record.
+
+    Args:
+        natural_language_query: Original user query
+        conversation_id: Conversation ID used for logging and failure records
+        endpoint: Endpoint name used in log lines
+        store_failures: Whether to store failure records (callers batching their writes pass False)
+
+    Returns:
+        (payload with prometheusQuery, start, end, step and chartConfig,
+         path that answered: "fast_path", "cache" or "llm")
+    """
+    # Step 0: Answer stock questions without calling the LLM
+    with stage("fast_path"):
+        payload = match_fast_path(natural_language_query, endpoint)
+    if payload is not None:
+        PAYLOADS_ANSWERED.inc(answered_by="fast_path")
+        return payload, "fast_path"
+
+    # Step 1: Reuse a cached payload (re-anchored to now) when available
+    with stage("payload_cache"):
+        payload = await payload_cache.get(
+            natural_language_query, Config.OPENAI_MODEL_NAME, query_prompt.PAYLOAD_CACHE_VERSION
+        )
+    if payload is not None:
+        PAYLOADS_ANSWERED.inc(answered_by="cache")
+        logger.debug("Payload cache hit - %s endpoint, conversation ID: %s, user query: %s",
+                     endpoint, conversation_id, natural_language_query)
+        return payload, "cache"
+
+    # Steps 2-5: Generate the payload, joining an identical generation already in flight
+    key = payload_cache.make_key(natural_language_query, Config.OPENAI_MODEL_NAME, query_prompt.PAYLOAD_CACHE_VERSION)
+    with stage("llm"):
+        (payload, error), shared = await payload_flights.do(
+            key, lambda: _generate_payload(natural_language_query, conversation_id, endpoint)
+        )
+    if shared:
+        logger.debug("OpenAI API request coalesced - %s endpoint, conversation ID: %s, user query: %s",
+                     endpoint, conversation_id, natural_language_query)
+    payload = copy.deepcopy(payload)
+
+    if error is not None:
+        # Store failed interaction in MongoDB
+        if store_failures:
+            await async_mongo_client.store_conversation(
+                conversation_id=conversation_id,
+                natural_language_query=natural_language_query,
+                generated_payload=payload or {},
+                chart_config={},
+                prometheus_data={},
+                success_status=400
+            )
+        raise HTTPException(status_code=400, detail=error)
+    PAYLOADS_ANSWERED.inc(answered_by="llm")
+    return payload, "llm"
+
+async def build_chart_data(prometheus_data: dict, chart_config: dict, max_points: Optional[int] = None) -> Optional[dict]:
+    """Run the (CPU-bound) chart transformation off the event loop"""
+    return await run_in_threadpool(
+        transform_for_chart,
+        prometheus_data,
+        chart_config,
+        max_points or Config.CHART_MAX_POINTS_PER_SERIES
+    )
 
 @router.post("/generate-promql", response_model=PromQLResponse)
-def generate_promql_endpoint(request: PromQLRequest):
+async def generate_promql_endpoint(request: PromQLRequest):
     """
     Generate a PromQL query from natural language.
     Input: { "query": "95th percentile latency for checkout service in last 1h" }
-    Output: { "query_prompt": "...", "explanation": "..." }
+    Output: { "query_prompt": "...", "explanation": "...", "answered_by": "fast_path" | "cache" | "llm" }
     """
 
     # Step 1: Extract natural language query
     natural_language_query = request.query
-    
-    print(f"[{datetime.now().isoformat()}] OpenAI API Request - generate-promql endpoint")
-    print(f"Model: {Config.OPENAI_MODEL_NAME}")
-    print(f"User Query: {natural_language_query}")
-
-    # Step 2: Call OpenAI with system + user prompts
-    start_time = time.time()
-    response = client.chat.completions.create(
-        model=Config.OPENAI_MODEL_NAME,
-        messages=[
-            {"role": "system", "content": query_prompt.SYSTEM_PROMPT},
-            {"role": "user", "content": query_prompt.query_template(natural_language_query)}
-        ]
-    )
-    response_time = time.time() - start_time
 
-    # Step 3: Extract PromQL string from LLM output
-    promql_query = response.choices[0].message.content.strip()
-    
-    print(f"[{datetime.now().isoformat()}] OpenAI API Response - generate-promql endpoint")
-    print(f"Response Time: {response_time:.2f}s")
-    print(f"Tokens Used - Prompt: {response.usage.prompt_tokens}, Completion: {response.usage.completion_tokens}, Total: {response.usage.total_tokens}")
-    print(f"Generated PromQL: {promql_query}")
+    # Steps 2-3: Fast path, payload cache or OpenAI (with local validation and repairs);
+    # a refused, truncated or still invalid generation is a 400
+    payload, answered_by = await generate_validated_payload(
+        natural_language_query, None, "generate-promql", store_failures=False
+    )
 
     # Step 4: Return structured response
     return PromQLResponse(
-        query_prompt=promql_query,
-        explanation=f"Generated PromQL for request: {natural_language_query}"
+        query_prompt=json.dumps(payload),
+        explanation=f"Generated PromQL for request: {natural_language_query}",
+        answered_by=answered_by
     )
 
 @router.post("/execute-with-data", response_model=PrometheusDataResponse)
-def execute_promql_with_data(request: PromQLRequest):
+async def execute_promql_with_data(request: PromQLRequest):
     """
     Generate a PromQL query from natural language and execute it against Prometheus.
-    Input: { "query": "network packets received rate by instance in last 5 minutes" }
-    Output: { "conversation_id": "uuid", "generated_payload": {...}, "prometheus_data": {...}, "success": true, "message": "..." }
+    Input: { "query": "network packets received rate by instance in last 5 minutes",
+             "includeChartData": false, "maxPointsPerSeries": 500, "includeRawData": true }
+    Output: { "conversation_id": "uuid", "generated_payload": {...}, "prometheus_data": {...}, "success": true, "message": "...",
+              "chart_data": {...} }
     """
     
     # Generate conversation ID
-    conversation_id = mongo_client.generate_conversation_id()
+    conversation_id = async_mongo_client.generate_conversation_id()
     
     try:
         # Step 1: Extract natural language query
         natural_language_query = request.query
-        
-        print(f"[{datetime.now().isoformat()}] OpenAI API Request - execute-with-data endpoint")
-        print(f"Conversation ID: {conversation_id}")
-        print(f"Model: {Config.OPENAI_MODEL_NAME}")
-        print(f"User Query: {natural_language_query}")
-
-        # Step 2: Call OpenAI to generate complete JSON payload
-        start_time = time.time()
-        response = client.chat.completions.create(
-            model=Config.OPENAI_MODEL_NAME,
-            messages=[
-                {"role": "system", "content": query_prompt.SYSTEM_PROMPT},
-                {"role": "user", "content": query_prompt.query_template(natural_language_query)}
-            ]
-        )
-        response_time = time.time() - start_time
 
-        # Step 3: Parse OpenAI response as JSON
-        openai_response = response.choices[0].message.content.strip()
-        
-        print(f"[{datetime.now().isoformat()}] OpenAI API Response - execute-with-data endpoint")
-        print(f"Response Time: {response_time:.2f}s")
-        print(f"Tokens Used - Prompt: {response.usage.prompt_tokens}, Completion: {response.usage.completion_tokens}, Total: {response.usage.total_tokens}")
-        print(f"Raw OpenAI Response: {openai_response}")
-        
-        try:
-            payload = json.loads(openai_response)
-        except json.JSONDecodeError as e:
-            # Store failed interaction in MongoDB
-            mongo_client.store_conversation(
-                conversation_id=conversation_id,
-                natural_language_query=natural_language_query,
-                generated_payload={},
-                prometheus_data={},
-                success_status=400,
-                chart_config={}
-            )
-            raise HTTPException(
-                status_code=400, 
-                detail=f"OpenAI returned invalid JSON: {str(e)}"
-            )
-
-        # Step 4: Validate payload structure
-        required_fields = ["prometheusQuery", "start", "end", "step", "chartConfig"]
-        missing_fields = [field for field in required_fields if field not in payload]
-        if missing_fields:
-            # Store failed interaction in MongoDB
-            mongo_client.store_conversation(
-                conversation_id=conversation_id,
-                natural_language_query=natural_language_query,
-                generated_payload=payload,
-                chart_config={},
-                prometheus_data={},
-                success_status=400
-            )
-            raise HTTPException(
-                status_code=400,
-                detail=f"Generated payload missing required fields: {missing_fields}"
-            )
+        # Steps 2-4: Generate and validate the JSON payload (cached or via OpenAI)
+        payload, answered_by = await generate_validated_payload(natural_language_query, conversation_id, "execute-with-data")
 
         # Step 4.5: Extract chartConfig and prometheus payload
         chart_config = payload.pop("chartConfig", {})
@@ -166,31 +607,53 @@ def execute_promql_with_data(request: PromQLRequest):
             "step": payload["step"]
         }
 
-        # Step 5: Call Prometheus connector with prometheus payload only
-        prometheus_data = prometheus_client.fetch_prometheus_data(prometheus_payload, conversation_id)
+        # Step 4.6: Plan the range query (step clamping, alignment, sub-range splitting)
+        plan = query_planner.plan(prometheus_payload)
+        prometheus_payload = plan.payload
+        payload.update(start=prometheus_payload["start"], end=prometheus_payload["end"], step=prometheus_payload["step"])
+
+        # Step 5: Call Prometheus connector with prometheus payload only (sub-ranges fetched concurrently)
+        with stage("connector"):
+            prometheus_data = await query_planner.execute(plan, conversation_id)
 
         # Step 6: Store successful interaction in MongoDB
-        mongo_client.store_conversation(
-            conversation_id=conversation_id,
-            natural_language_query=natural_language_query,
-            generated_payload=prometheus_payload,
-            chart_config=chart_config,
-            prometheus_data=prometheus_data,
-            success_status=200
-        )
+        with stage("mongo"):
+            await async_mongo_client.store_conversation(
+                conversation_id=conversation_id,
+                natural_language_query=natural_language_query,
+                generated_payload=prometheus_payload,
+                chart_config=chart_config,
+                prometheus_data=prometheus_data,
+                success_status=200
+            )
 
-        # Step 7: Return combined response
-        return PrometheusDataResponse(
+        # Step 7: Build chart-ready data if requested
+        chart_data = None
+        if request.includeChartData:
+            with stage("chart"):
+                chart_data = await build_chart_data(prometheus_data, chart_config, request.maxPointsPerSeries)
+
+        # Step 8: Return combined response (encoded directly, without re-validating the data)
+        return json_response(
+            PrometheusDataResponse,
             conversation_id=conversation_id,
             generated_payload=payload,
-            prometheus_data=prometheus_data,
+            prometheus_data=prometheus_data if request.includeRawData else {},
             success=True,
-            message=f"Successfully executed query for: {natural_language_query}"
+            message=f"Successfully executed query for: {natural_language_query}",
+            chart_data=chart_data,
+            answered_by=answered_by
         )
 
+    except HTTPException:
+        # Payload generation errors, already stored by generate_validated_payload
+        raise
+    except OverloadError:
+        # Shed by admission control: answered with 429/503/504 and Retry-After, nothing stored
+        raise
     except RuntimeError as e:
         # Store failed interaction in MongoDB
-        mongo_client.store_conversation(
+        await async_mongo_client.store_conversation(
             conversation_id=conversation_id,
             natural_language_query=natural_language_query,
             generated_payload=payload if 'payload' in locals() else {},
@@ -202,7 +665,7 @@ def execute_promql_with_data(request: PromQLRequest):
         raise HTTPException(status_code=502, detail=str(e))
     except Exception as e:
         # Store failed interaction in MongoDB
-        mongo_client.store_conversation(
+        await async_mongo_client.store_conversation(
             conversation_id=conversation_id,
             natural_language_query=natural_language_query,
             generated_payload=payload if 'payload' in locals() else {},
@@ -213,12 +676,467 @@ def execute_promql_with_data(request: PromQLRequest):
         # General error
         raise HTTPException(status_code=500, detail=f"Internal server error: {str(e)}")
 
+async def _execute_batch_item(index: int,
+                              natural_language_query: str,
+                              request: BatchPromQLRequest,
+                              llm_slots: asyncio.Semaphore,
+                              connector_slots: asyncio.Semaphore) -> Tuple[dict, dict]:
+    """
+    Run one batch query end to end without storing it.
+
+    Returns:
+        (result item, conversation document to store)
+    """
+    conversation_id = async_mongo_client.generate_conversation_id()
+    payload = {}
+    try:
+        # Steps 1-4: Generate and validate the JSON payload (cached or via OpenAI)
+        async with llm_slots:
+            payload, answered_by = await generate_validated_payload(
+                natural_language_query, conversation_id, "execute-with-data/batch", store_failures=False
+            )
+
+        # Step 5: Plan and fetch the range query
+        chart_config = payload.pop("chartConfig", {})
+        plan = query_planner.plan({
+            "prometheusQuery": payload["prometheusQuery"],
+            "start": payload["start"],
+            "end": payload["end"],
+            "step": payload["step"]
+        })
+        prometheus_payload = plan.payload
+        payload.update(start=prometheus_payload["start"], end=prometheus_payload["end"], step=prometheus_payload["step"])
+        async with connector_slots:
+            prometheus_data = await query_planner.execute(plan, conversation_id)
+
+        # Step 6: Build chart-ready data if requested
+        chart_data = None
+        if request.includeChartData:
+            chart_data = await build_chart_data(prometheus_data, chart_config, request.maxPointsPerSeries)
+
+        item = {
+            "index": index,
+            "query": natural_language_query,
+            "conversation_id": conversation_id,
+            "status_code": 200,
+            "success": True,
+            "message": f"Successfully executed query for: {natural_language_query}",
+            "generated_payload": payload,
+            "prometheus_data": prometheus_data if request.includeRawData else {},
+            "chart_data": chart_data,
+            "answered_by": answered_by
+        }
+        document = build_conversation_document(
+            conversation_id, natural_language_query, prometheus_payload, prometheus_data, 200, chart_config
+        )
+        return item, document
+
+    except HTTPException as e:
+        # Payload generation or validation error
+        status_code, message = e.status_code, str(e.detail)
+    except OverloadError as e:
+        # Shed by admission control
+        status_code, message = e.status_code, str(e)
+    except RuntimeError as e:
+        # Prometheus connector error
+        status_code, message = 502, str(e)
+    except Exception as e:
+        # General error
+        status_code, message = 500, f"Internal server error: {str(e)}"
+
+    item = {
+        "index": index,
+        "query": natural_language_query,
+        "conversation_id": conversation_id,
+        "status_code": status_code,
+        "success": False,
+        "message": message,
+        "generated_payload": payload
+    }
+    document = build_conversation_document(conversation_id, natural_language_query, payload, {}, status_code, {})
+    return item, document
+
+@router.post("/execute-with-data/batch", response_model=BatchPromQLResponse)
+async def execute_promql_with_data_batch(request: BatchPromQLRequest):
+    """
+    Execute several natural language queries at once, e.g. all panels of a dashboard page.
+    Input: { "queries": ["cpu usage by instance in last 1h", "memory usage in last 1h"], "includeChartData": false }
+    Output: { "results": [{ "index": 0, "conversation_id": "uuid", "status_code": 200, "success": true, ... }], "unique_queries": 2 }
+    Normalized-equal queries run once and share a result; a failing query only fails its own item.
+    """
+
+    if not request.queries:
+        raise HTTPException(status_code=400, detail="queries cannot be empty")
+    if len(request.queries) > Config.BATCH_MAX_QUERIES:
+        raise HTTPException(
+            status_code=400,
+            detail=f"At most {Config.BATCH_MAX_QUERIES} queries can be executed in one batch"
+        )
+
+    # Step 1: Deduplicate normalized-equal queries
+    first_index = {}
+    unique_indexes = []
+    for index, natural_language_query in enumerate(request.queries):
+        key = normalize_query(natural_language_query)
+        if key not in first_index:
+            first_index[key] = index
+            unique_indexes.append(index)
+
+    logger.debug("Batch request - %d queries, %d unique", len(request.queries), len(unique_indexes))
+
+    # Step 2: Run unique queries concurrently, capping concurrent LLM and connector calls
+    llm_slots = asyncio.Semaphore(Config.BATCH_LLM_CONCURRENCY)
+    connector_slots = asyncio.Semaphore(Config.BATCH_CONNECTOR_CONCURRENCY)
+    with stage("queries"):
+        outcomes = await asyncio.gather(*[
+            _execute_batch_item(index, request.queries[index], request, llm_slots, connector_slots)
+            for index in unique_indexes
+        ])
+
+    # Step 3: Store every conversation with one bulk insert
+    with stage("mongo"):
+        await async_mongo_client.store_conversations([document for _, document in outcomes])
+
+    # Step 4: Return per-item results, duplicates sharing their first occurrence's result
+    items = {item["index"]: item for item, _ in outcomes}
+    results = []
+    for index, natural_language_query in enumerate(request.queries):
+        original = first_index[normalize_query(natural_language_query)]
+        if original == index:
+            results.append(response_content(BatchItemResponse, **items[index]))
+        else:
+            duplicate = copy.copy(items[original])
+            duplicate.update(index=index, query=natural_language_query, duplicate_of=original)
+            results.append(response_content(BatchItemResponse, **duplicate))
+
+    return json_response(BatchPromQLResponse, results=results, unique_queries=len(unique_indexes))
+
+def _stream_frame(frame_type: str, body: dict, use_sse: bool) -> str:
+    """Serialize one streaming frame as an NDJSON line or a Server-Sent Event"""
+    data = dumps({"type": frame_type, **body}).decode("utf-8")
+    if use_sse:
+        return f"event: {frame_type}\ndata: {data}\n\n"
+    return data + "\n"
+
+async def _stream_execution(conversation_id: str,
+                            natural_language_query: str,
+                            payload: dict,
+                            chart_config: dict,
+                            prometheus_payload: dict,
+                            use_sse: bool,
+                            chart_request: PromQLRequest = None,
+                            answered_by: str = None):
+    """Yield the payload frame, one frame per series as it is parsed, and a final status frame"""
+    yield _stream_frame("payload", {
+        "conversation_id": conversation_id,
+        "generated_payload": payload,
+        "chartConfig": chart_config,
+        "answered_by": answered_by
+    }, use_sse)
+
+    parser = IncrementalResultParser()
+    series = []
+    try:
+        async for chunk in prometheus_client.stream_prometheus_data(prometheus_payload, conversation_id):
+            for item in parser.feed(chunk):
+                yield _stream_frame("series", {"index": len(series), "series": item}, use_sse)
+                series.append(item)
+        for item in parser.close():
+            yield _stream_frame("series", {"index": len(series), "series": item}, use_sse)
+            series.append(item)
+        prometheus_data = parser.envelope(result=series)
+    except (RuntimeError, ValueError, OverloadError) as e:
+        # Prometheus connector error, malformed connector response or shed by admission control
+        status_code = e.status_code if isinstance(e, OverloadError) else 502
+        await async_mongo_client.store_conversation(
+            conversation_id=conversation_id,
+            natural_language_query=natural_language_query,
+            generated_payload=prometheus_payload,
+            prometheus_data={},
+            success_status=status_code,
+            chart_config=chart_config
+        )
+        yield _stream_frame("status", {
+            "success": False,
+            "statusCode": status_code,
+            "message": str(e),
+            "seriesCount": len(series)
+        }, use_sse)
+        return
+
+    await async_mongo_client.store_conversation(
+        conversation_id=conversation_id,
+        natural_language_query=natural_language_query,
+        generated_payload=prometheus_payload,
+        chart_config=chart_config,
+        prometheus_data=prometheus_data,
+        success_status=200
+    )
+    if chart_request is not None and chart_request.includeChartData:
+        chart_data = await build_chart_data(prometheus_data, chart_config, chart_request.maxPointsPerSeries)
+        yield _stream_frame("chart", {"chart_data": chart_data}, use_sse)
+    yield _stream_frame("status", {
+        "success": True,
+        "statusCode": 200,
+        "message": f"Successfully executed query for: {natural_language_query}",
+        "seriesCount": len(series),
+        "envelope": parser.envelope()
+    }, use_sse)
+
+@router.post("/execute-with-data/stream")
+async def execute_promql_with_data_stream(request: PromQLRequest, http_request: Request):
+    """
+    Streaming variant of /execute-with-data.
+    Input: { "query": "network packets received rate by instance in last 5 minutes" }
+    Output: NDJSON lines (or SSE events with Accept: text/event-stream), in order:
+        { "type": "payload", "conversation_id": "uuid", "generated_payload": {...}, "chartConfig": {...}, "answered_by": "llm" }
+        { "type": "series", "index": 0, "series": {...} }  (one per series, as soon as it is parsed)
+        { "type": "chart", "chart_data": {...} }  (only with includeChartData)
+        { "type": "status", "success": true, "statusCode": 200, "message": "...", "seriesCount": N, "envelope": {...} }
+    Payload generation errors are returned as regular HTTP errors before streaming starts.
+    """
+
+    conversation_id = async_mongo_client.generate_conversation_id()
+    natural_language_query = request.query
+
+    try:
+        payload, answered_by = await generate_validated_payload(natural_language_query, conversation_id, "execute-with-data/stream")
+    except (HTTPException, OverloadError):
+        raise
+    except Exception as e:
+        await async_mongo_client.store_conversation(
+            conversation_id=conversation_id,
+            natural_language_query=natural_language_query,
+            generated_payload={},
+            prometheus_data={},
+            success_status=500,
+            chart_config={}
+        )
+        raise HTTPException(status_code=500, detail=f"Internal server error: {str(e)}")
+
+    chart_config = payload.pop("chartConfig", {})
+    prometheus_payload = {
+        "prometheusQuery": payload["prometheusQuery"],
+        "start": payload["start"],
+        "end": payload["end"],
+        "step": payload["step"]
+    }
+
+    # Series are streamed from a single connector response, so the range is planned without splitting
+    prometheus_payload = query_planner.plan(prometheus_payload, split=False).payload
+    payload.update(start=prometheus_payload["start"], end=prometheus_payload["end"], step=prometheus_payload["step"])
+
+    use_sse = "text/event-stream" in http_request.headers.get("accept", "")
+    return StreamingResponse(
+        _stream_execution(
+            conversation_id, natural_language_query, payload, chart_config, prometheus_payload, use_sse, request,
+            answered_by
+        ),
+        media_type="text/event-stream" if use_sse else "application/x-ndjson"
+    )
+
+async def refine_payload(conversation: dict,
+                         refinement: str,
+                         conversation_id: str) -> Tuple[dict, dict, List[str], str]:
+    """
+    Apply a follow-up to a stored conversation's payload.
+
+    Follow-ups made only of time range, step, grouping and chart type changes
+    are applied locally (match_refinement). Anything else sends the whole
+    follow-up to OpenAI with the previous payload as compact context: words
+    such as "compare with last week" change what the recognized parts mean, so
+    the LLM's time range, step and query are kept. Only a locally recognized
+    chart type takes precedence over the LLM's.
+
+    Returns:
+        (payload with prometheusQuery, start, end and step, chartConfig, changes applied locally,
+         path that answered: "refinement" or "llm")
+
+    Raises:
+        HTTPException: 400 for an invalid chart type/library combination or a payload
+                       that still fails validation after repairs (stored as a failure)
+    """
+    previous_payload = {
+        key: conversation["generatedPayload"][key] for key in ("prometheusQuery", "start", "end", "step")
+    }
+    previous_chart_config = conversation.get("chartConfig", {})
+    if Config.REFINEMENT_LOCAL_EDITS_ENABLED:
+        with stage("refinement"):
+            try:
+                refined = match_refinement(refinement, previous_payload, previous_chart_config)
+            except ValueError as e:
+                raise HTTPException(status_code=400, detail=str(e))
+    else:
+        refined = Refinement(previous_payload, previous_chart_config, [], refinement)
+
+    if not refined.remaining:
+        PAYLOADS_ANSWERED.inc(answered_by="refinement")
+        logger.debug("Refinement applied locally - conversation ID: %s, changes: %s",
+                     conversation_id, ", ".join(refined.changes) or "none")
+        return refined.payload, refined.chart_config, refined.changes, "refinement"
+
+    context = json.dumps({**previous_payload, "chartConfig": previous_chart_config}, separators=(",", ":"))
+    messages = [
+        {"role": "system", "content": query_prompt.SYSTEM_PROMPT},
+        {"role": "user", "content": query_prompt.refine_template(
+            context, refinement, metric_catalog.prompt_context(refinement)
+        )}
+    ]
+    with stage("llm"):
+        payload, error = await _complete_payload(messages, refinement, conversation_id, "execute-with-data/refine")
+    if error is not None:
+        await async_mongo_client.store_conversation(
+            conversation_id=conversation_id,
+            natural_language_query=refinement,
+            generated_payload=payload or {},
+            chart_config={},
+            prometheus_data={},
+            success_status=400,
+            parent_conversation_id=conversation["conversationId"]
+        )
+        raise HTTPException(status_code=400, detail=error)
+    PAYLOADS_ANSWERED.inc(answered_by="llm")
+
+    chart_config = payload.get("chartConfig") or {}
+    changes = [change for change in refined.changes if change.startswith("chartType=")]
+    if changes:
+        chart_config = refined.chart_config
+    else:
+        try:
+            chart_config = ChartConfig.get_chart_config(ChartType(chart_config.get("chartType")))
+        except ValueError:
+            chart_config = previous_chart_config
+    refined_payload = {key: payload[key] for key in ("prometheusQuery", "start", "end", "step")}
+    return refined_payload, chart_config, changes, "llm"
+
+async def execute_with_stored_data(plan, conversation: dict, conversation_id: str) -> dict:
+    """
+    Execute a planned refinement, reusing the data stored with the refined conversation.
+
+    The stored data is returned as is when query, step and range are unchanged. When
+    only the range moved, it is merged into the result cache first, so only the parts
+    of the new range it does not cover are fetched (nothing is reused if the cache is
+    disabled).
+    """
+    previous_payload = conversation["generatedPayload"]
+    stored_data = conversation.get("prometheusData")
+    if not stored_data or plan.payload["prometheusQuery"] != previous_payload["prometheusQuery"]:
+        return await query_planner.execute(plan, conversation_id)
+    previous_step = parse_step(previous_payload["step"])
+    if plan.step != previous_step:
+        return await query_planner.execute(plan, conversation_id)
+
+    previous_start = parse_timestamp(previous_payload["start"])
+    previous_end = parse_timestamp(previous_payload["end"])
+    if (plan.start, plan.end) == (previous_start, previous_end):
+        logger.debug("Query plan: range unchanged, reusing stored data of conversation %s", conversation["conversationId"])
+        return stored_data
+    if plan.start <= previous_end and previous_start <= plan.end:
+        await result_cache.store(plan.payload["prometheusQuery"], plan.step, stored_data, previous_start, previous_end)
+    return await query_planner.execute(plan, conversation_id)
+
+@router.post("/execute-with-data/refine", response_model=RefineResponse)
+async def refine_promql_with_data(request: RefineRequest):
+    """
+    Refine a stored conversation's query with a follow-up and execute it as a new conversation.
+    Input: { "conversationId": "uuid", "refinement": "same but last 24h grouped by pod",
+             "includeChartData": false, "maxPointsPerSeries": 500, "includeRawData": true }
+    Output: { "conversation_id": "uuid", "parent_conversation_id": "uuid", "generated_payload": {...},
+              "chart_config": {...}, "prometheus_data": {...}, "success": true, "message": "...", "chart_data": {...},
+              "answered_by": "refinement" | "llm", "applied_changes": ["window=1d", "groupBy=pod"] }
+    """
+    parent_conversation_id = request.conversationId.strip()
+    refinement = request.refinement.strip()
+    if not parent_conversation_id:
+        raise HTTPException(status_code=400, detail="conversationId cannot be empty")
+    if not refinement:
+        raise HTTPException(status_code=400, detail="refinement cannot be empty")
+
+    with stage("mongo"):
+        conversation = await async_mongo_client.get_conversation(parent_conversation_id)
+    if conversation is None:
+        raise HTTPException(status_code=404, detail=f"Conversation with ID {parent_conversation_id} not found")
+    if conversation.get("success") != 200 or not (conversation.get("generatedPayload") or {}).get("prometheusQuery"):
+        raise HTTPException(
+            status_code=400,
+            detail=f"Conversation {parent_conversation_id} has no successfully executed query to refine"
+        )
+
+    conversation_id = async_mongo_client.generate_conversation_id()
+    try:
+        # Steps 1-2: Apply the follow-up locally, sending only what is left to OpenAI
+        payload, chart_config, changes, answered_by = await refine_payload(conversation, refinement, conversation_id)
+
+        # Step 3: Plan the range query and fetch it, reusing the stored data where the ranges overlap
+        plan = query_planner.plan(payload)
+        prometheus_payload = plan.payload
+        with stage("connector"):
+            prometheus_data = await execute_with_stored_data(plan, conversation, conversation_id)
+
+        # Step 4: Store the refined interaction, linked to the conversation it refines
+        with stage("mongo"):
+            await async_mongo_client.store_conversation(
+                conversation_id=conversation_id,
+                natural_language_query=refinement,
+                generated_payload=prometheus_payload,
+                chart_config=chart_config,
+                prometheus_data=prometheus_data,
+                success_status=200,
+                parent_conversation_id=parent_conversation_id
+            )
+
+        # Step 5: Build chart-ready data if requested
+        chart_data = None
+        if request.includeChartData:
+            with stage("chart"):
+                chart_data = await build_chart_data(prometheus_data, chart_config, request.maxPointsPerSeries)
+
+        return json_response(
+            RefineResponse,
+            conversation_id=conversation_id,
+            parent_conversation_id=parent_conversation_id,
+            generated_payload=prometheus_payload,
+            chart_config=chart_config,
+            prometheus_data=prometheus_data if request.includeRawData else {},
+            success=True,
+            message=f"Successfully executed refinement: {refinement}",
+            chart_data=chart_data,
+            answered_by=answered_by,
+            applied_changes=changes
+        )
+
+    except (HTTPException, OverloadError):
+        raise
+    except RuntimeError as e:
+        await async_mongo_client.store_conversation(
+            conversation_id=conversation_id,
+            natural_language_query=refinement,
+            generated_payload=payload if 'payload' in locals() else {},
+            prometheus_data={},
+            success_status=502,
+            chart_config={},
+            parent_conversation_id=parent_conversation_id
+        )
+        # Prometheus connector error
+        raise HTTPException(status_code=502, detail=str(e))
+    except Exception as e:
+        await async_mongo_client.store_conversation(
+            conversation_id=conversation_id,
+            natural_language_query=refinement,
+            generated_payload=payload if 'payload' in locals() else {},
+            prometheus_data={},
+            success_status=500,
+            chart_config={},
+            parent_conversation_id=parent_conversation_id
+        )
+        raise HTTPException(status_code=500, detail=f"Internal server error: {str(e)}")
+
 @router.post("/promQL-query-generator/v1/getChartConfig", response_model=ChartConfigResponse)
-def get_chart_config(request: ChartConfigRequest):
+async def get_chart_config(request: ChartConfigRequest):
     """
     Retrieve stored conversation data by conversation ID.
-    Input: { "conversationId": "uuid-string" }
-    Output: Complete stored conversation data from MongoDB
+    Input: { "conversationId": "uuid-string", "includeChartData": false, "maxPointsPerSeries": 500, "includeRawData": true }
+    Output: Complete stored conversation data from MongoDB, plus chartData when requested
     """
     
     try:
@@ -231,7 +1149,8 @@ def get_chart_config(request: ChartConfigRequest):
             )
         
         # Retrieve conversation data from MongoDB
-        conversation_data = mongo_client.get_conversation(conversation_id)
+        with stage("mongo"):
+            conversation_data = await async_mongo_client.get_conversation(conversation_id)
         
         if conversation_data is None:
             raise HTTPException(
@@ -239,17 +1158,28 @@ def get_chart_config(request: ChartConfigRequest):
                 detail=f"Conversation with ID {conversation_id} not found"
             )
         
+        chart_data = None
+        if request.includeChartData:
+            with stage("chart"):
+                chart_data = await build_chart_data(
+                    conversation_data["prometheusData"],
+                    conversation_data.get("chartConfig", {}),
+                    request.maxPointsPerSeries
+                )
+
         # Return the stored conversation data
-        return ChartConfigResponse(
+        return json_response(
+            ChartConfigResponse,
             conversationId=conversation_data["conversationId"],
             naturalLanguageQuery=conversation_data["naturalLanguageQuery"],
             chartConfig=conversation_data.get("chartConfig", {}),
-            prometheusData=conversation_data["prometheusData"],
-            timestamp=conversation_data["timestamp"]
+            prometheusData=conversation_data["prometheusData"] if request.includeRawData else {},
+            timestamp=conversation_data["timestamp"],
+            chartData=chart_data
         )
         
-    except HTTPException:
-        # Re-raise HTTP exceptions
+    except (HTTPException, OverloadError):
+        # Re-raise HTTP exceptions and admission control rejections
         raise
     except Exception as e:
         # Handle unexpected errors
@@ -257,3 +1187,139 @@ def get_chart_config(request: ChartConfigRequest):
             status_code=500,
             detail=f"Internal server error while retrieving conversation: {str(e)}"
         )
+
+@router.post("/panels")
+async def create_panel(request: PanelRequest):
+    """
+    Save a stored conversation's query as a panel refreshed in the background.
+    Input: { "conversationId": "uuid-string", "refreshIntervalSeconds": 30, "name": "Checkout latency" }
+    Output: { "panelId": "uuid", "prometheusQuery": "...", "rangeSeconds": 3600, "step": "60s", "refreshIntervalSeconds": 30,
+              "status": "pending", "sharedWith": 0, ... }
+    Panels sharing a query, range and step are refreshed once for all of them.
+    """
+    if not panel_scheduler.enabled:
+        raise HTTPException(status_code=503, detail="Saved panels are disabled")
+    conversation_id = request.conversationId.strip()
+    if not conversation_id:
+        raise HTTPException(status_code=400, detail="conversationId cannot be empty")
+
+    with stage("mongo"):
+        conversation_data = await async_mongo_client.get_conversation(conversation_id)
+    if conversation_data is None:
+        raise HTTPException(status_code=404, detail=f"Conversation with ID {conversation_id} not found")
+
+    try:
+        panel = await panel_scheduler.add_panel(conversation_data, request.refreshIntervalSeconds, request.name)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    logger.info("Saved panel %s for conversation %s", panel.panel_id, conversation_id)
+    return panel_scheduler.describe(panel)
+
+@router.get("/panels")
+def list_panels():
+    """
+    List saved panels with the freshness of their latest result, and scheduler counters.
+    Output: { "panels": [{ "panelId": "uuid", "status": "fresh" | "stale" | "pending", "ageSeconds": 3.2, ... }], "scheduler": {...} }
+    """
+    return {
+        "panels": [panel_scheduler.describe(panel) for panel in panel_scheduler.panels.values()],
+        "scheduler": panel_scheduler.stats()
+    }
+
+@router.get("/panels/{panel_id}", response_model=PanelResultResponse)
+async def get_panel(panel_id: str,
+                    includeChartData: bool = False,
+                    maxPointsPerSeries: Optional[int] = None,
+                    includeRawData: bool = True):
+    """
+    Return a panel's latest precomputed result without querying any upstream.
+    Input: GET /panels/{panelId}?includeChartData=true&maxPointsPerSeries=500&includeRawData=false
+    Output: { "panelId": "uuid", "status": "fresh" | "stale" | "pending", "refreshedAt": "...", "ageSeconds": 3.2,
+              "generatedPayload": {...}, "chartConfig": {...}, "prometheusData": {...}, "chartData": {...} }
+    Before the first refresh the status is "pending" and the data is empty.
+    """
+    panel = panel_scheduler.panels.get(panel_id)
+    if panel is None:
+        raise HTTPException(status_code=404, detail=f"Panel with ID {panel_id} not found")
+
+    result = await panel_scheduler.latest_result(panel) or {}
+    status = panel_scheduler.panel_status(panel)
+    prometheus_data = result.get("prometheusData", {})
+
+    # Chart data is built once per refreshed result and point budget
+    chart_data = None
+    if includeChartData and result:
+        cache_key = (result["refreshedAt"], maxPointsPerSeries)
+        if panel.chart_data_cache is not None and panel.chart_data_cache[0] == cache_key:
+            chart_data = panel.chart_data_cache[1]
+        else:
+            with stage("chart"):
+                chart_data = await build_chart_data(prometheus_data, panel.chart_config, maxPointsPerSeries)
+            panel.chart_data_cache = (cache_key, chart_data)
+
+    return json_response(
+        PanelResultResponse,
+        panelId=panel.panel_id,
+        name=panel.name,
+        naturalLanguageQuery=panel.natural_language_query,
+        status=status["status"],
+        refreshedAt=status["refreshedAt"],
+        ageSeconds=status["ageSeconds"],
+        lastError=status["lastError"],
+        generatedPayload={
+            "prometheusQuery": panel.prometheus_query,
+            "start": result.get("start"),
+            "end": result.get("end"),
+            "step": result.get("step", panel.step)
+        },
+        chartConfig=panel.chart_config,
+        prometheusData=prometheus_data if includeRawData else {},
+        chartData=chart_data
+    )
+
+@router.delete("/panels/{panel_id}")
+async def delete_panel(panel_id: str):
+    """
+    Delete a saved panel.
+    Output: { "deleted": true }
+    """
+    if not await panel_scheduler.delete_panel(panel_id):
+        raise HTTPException(status_code=404, detail=f"Panel with ID {panel_id} not found")
+    return {"deleted": True}
+
+@router.get("/cache/stats")
+def get_cache_stats():
+    """
+    Report hit/miss counters for the LLM payload cache and the Prometheus result cache,
+    and how many payload generations were coalesced with one already in flight.
+    Output: { "payloadCache": { "hits": 0, "misses": 0, ... }, "payloadSingleFlight": { "coalesced": 0, ... }, "resultCache": { "bytesFromCache": 0, "bytesFetched": 0, ... } }
+    """
+    return {
+        "payloadCache": payload_cache.stats(),
+        "payloadSingleFlight": payload_flights.stats(),
+        "resultCache": result_cache.stats()
+    }
+
+@router.get("/connector/stats")
+def get_connector_stats():
+    """
+    Report request, retry, hedging and coalescing counters and per-attempt latency for the Prometheus connector.
+    Output: { "prometheusConnector": { "requests": 0, "retries": 0, "attemptLatencySeconds": {...}, "singleFlight": {...}, ... } }
+    """
+    return {"prometheusConnector": {**prometheus_client.stats.snapshot(), "singleFlight": prometheus_client.flights.stats()}}
+
+@router.get("/limits/stats")
+def get_limits_stats_endpoint():
+    """
+    Report the adaptive concurrency limit, queue and shed counters, and circuit breaker state per upstream.
+    Output: { "openai": { "limiter": { "limit": 16, "inFlight": 0, "queued": 0, "shed": {...}, ... }, "circuitBreaker": { "state": "closed", ... } }, "prometheusConnector": {...}, "mongodb": {...} }
+    """
+    return get_limits_stats()
+
+@router.get("/catalog/stats")
+def get_catalog_stats():
+    """
+    Report the size and refresh state of the metric catalog used to build prompts.
+    Output: { "metricCatalog": { "metrics": 0, "indexedTokens": 0, "refreshes": 0, ... } }
+    """
+    return {"metricCatalog": metric_catalog.stats()}
@@ -0,0 +1 @@
+# Offline benchmark harness with local stand-ins for OpenAI, the Prometheus connector and MongoDB
@@ -0,0 +1,352 @@
+"""
+Local stand-ins for the service's dependencies, used by the benchmark harness.
+
+- fake_openai_app: OpenAI-compatible POST /v1/chat/completions with configurable
+  latency, answering with canned query payloads
+- fake_connector_app: POST /prometheusData returning synthetic matrices with a
+  configurable number of series (points follow the requested range and step)
+- InMemoryMongoClient / AsyncInMemoryMongoClient: in-process replacements for
+  pymongo's clients covering the calls dashboard/mongo_client.py makes.
+  Documents are BSON-encoded on insert, so serialization cost is kept.
+
+Both HTTP fakes accept POST /_config to change latency and sizes between
+benchmark cases without restarting them.
+"""
+import asyncio
+import hashlib
+import json
+import logging
+import os
+import random
+import re
+import sys
+import threading
+import time
+from typing import Optional, Dict, Any, List
+
+import uvicorn
+from bson import ObjectId, decode, encode
+from fastapi import FastAPI, Request
+from fastapi.responses import Response
+from pymongo.errors import DuplicateKeyError
+
+from utils.promql_parser import parse_step, parse_timestamp
+
+# Canned (query template, chart type, chart library) answers of the fake OpenAI endpoint;
+# {label} makes the query unique per question so caches only hit for repeated questions
+CANNED_QUERIES = [
+    ('sum by (instance) (rate(http_requests_total{{bench="{label}"}}[5m]))', "lineChart", "recharts"),
+    ('avg by (instance) (rate(node_cpu_seconds_total{{mode!="idle",bench="{label}"}}[5m]))', "areaChart", "recharts"),
+    ('sum by (instance) (container_memory_working_set_bytes{{bench="{label}"}})', "barChart", "recharts"),
+]
+# Prompts carry the current time, which must not make repeated questions look different
+_CURRENT_TIME = re.compile(r"^Current Unix time: \d+$", re.MULTILINE)
+
+
+def fake_openai_app() -> FastAPI:
+    """
+    Build the fake OpenAI endpoint.
+
+    Settings (POST /_config): latency (seconds), jitter (seconds, uniform),
+    rangeSeconds and stepSeconds of the generated payloads.
+    """
+    app = FastAPI()
+    settings = {"latency": 0.05, "jitter": 0.0, "rangeSeconds": 3600, "stepSeconds": 60}
+
+    @app.post("/_config")
+    async def configure(request: Request):
+        settings.update(await request.json())
+        return settings
+
+    @app.get("/_config")
+    async def get_config():
+        return settings
+
+    @app.get("/v1/models")
+    async def models():
+        return {"object": "list", "data": [{"id": "fake", "object": "model", "created": 0, "owned_by": "bench"}]}
+
+    @app.post("/v1/chat/completions")
+    async def chat_completions(request: Request):
+        body = await request.json()
+        question = _CURRENT_TIME.sub("", body["messages"][-1]["content"])
+        delay = settings["latency"] + random.uniform(0, settings["jitter"])
+        if delay > 0:
+            await asyncio.sleep(delay)
+
+        digest = hashlib.sha1(question.encode("utf-8")).hexdigest()
+        query, chart_type, chart_library = CANNED_QUERIES[int(digest, 16) % len(CANNED_QUERIES)]
+        now = int(time.time())
+        content = json.dumps({
+            "prometheusQuery": query.format(label=digest[:12]),
+            "start": now - int(settings["rangeSeconds"]),
+            "end": now,
+            "step": f"{int(settings['stepSeconds'])}s",
+            "chartConfig": {"chartType": chart_type, "chartLibrary": chart_library}
+        })
+        prompt_tokens = sum(len(message.get("content") or "") for message in body["messages"]) // 4
+        completion_tokens = len(content) // 4
+        return {
+            "id": f"chatcmpl-{digest[:24]}",
+            "object": "chat.completion",
+            "created": now,
+            "model": body.get("model", "fake"),
+            "choices": [{
+                "index": 0,
+                "message": {"role": "assistant", "content": content},
+                "finish_reason": "stop"
+            }],
+            "usage": {
+                "prompt_tokens": prompt_tokens,
+                "completion_tokens": completion_tokens,
+                "total_tokens": prompt_tokens + completion_tokens
+            }
+        }
+
+    return app
+
+
+def synthetic_matrix(query: str, start: float, end: float, step: float, series: int) -> Dict[str, Any]:
+    """Build a connector response with the given number of series over [start, end]"""
+    timestamps = []
+    timestamp = start
+    while timestamp <= end:
+        timestamps.append(int(timestamp) if timestamp == int(timestamp) else timestamp)
+        timestamp += step
+    seed = int(hashlib.sha1(query.encode("utf-8")).hexdigest()[:8], 16)
+    result = []
+    for index in range(series):
+        base = (seed + index * 7919) % 1000 / 10
+        result.append({
+            "metric": {"__name__": "bench_metric", "instance": f"host-{index}:9100", "job": "bench"},
+            "values": [[t, str(round(base + (t // step) % 17 * 0.5, 3))] for t in timestamps]
+        })
+    return {"status": "success", "data": {"resultType": "matrix", "result": result}}
+
+
+def fake_connector_app() -> FastAPI:
+    """
+    Build the fake Prometheus connector.
+
+    Settings (POST /_config): latency (seconds), jitter (seconds, uniform) and
+    series per response.
+    """
+    app = FastAPI()
+    settings = {"latency": 0.01, "jitter": 0.0, "series": 10}
+
+    @app.post("/_config")
+    async def configure(request: Request):
+        settings.update(await request.json())
+        return settings
+
+    @app.get("/_config")
+    async def get_config():
+        return settings
+
+    @app.post("/prometheusData")
+    async def prometheus_data(request: Request):
+        payload = await request.json()
+        delay = settings["latency"] + random.uniform(0, settings["jitter"])
+        if delay > 0:
+            await asyncio.sleep(delay)
+        body = synthetic_matrix(
+            payload["prometheusQuery"],
+            parse_timestamp(payload["start"]),
+            parse_timestamp(payload["end"]),
+            parse_step(payload["step"]),
+            int(settings["series"])
+        )
+        return Response(json.dumps(body, separators=(",", ":")), media_type="application/json")
+
+    return app
+
+
+class _InMemoryCollection:
+    """Collection holding BSON-encoded documents, with unique single-field indexes"""
+
+    def __init__(self):
+        self._documents: Dict[Any, bytes] = {}
+        # field -> {value: _id} for unique indexes
+        self._unique: Dict[str, Dict[Any, Any]] = {}
+        self._lock = threading.Lock()
+
+    def create_index(self, keys, name: Optional[str] = None, unique: bool = False, **kwargs) -> str:
+        field = keys[0][0] if isinstance(keys, list) else keys
+        if unique and len(keys) == 1:
+            with self._lock:
+                self._unique.setdefault(field, {})
+        return name or f"{field}_1"
+
+    def insert_one(self, document: Dict[str, Any]):
+        document.setdefault("_id", ObjectId())
+        data = encode(document)
+        with self._lock:
+            for field, values in self._unique.items():
+                if field in document and document[field] in values:
+                    raise DuplicateKeyError(f"E11000 duplicate key error: {field} {document[field]!r}")
+            for field, values in self._unique.items():
+                if field in document:
+                    values[document[field]] = document["_id"]
+            self._documents[document["_id"]] = data
+
+    def insert_many(self, documents: List[Dict[str, Any]], ordered: bool = True):
+        for document in documents:
+            try:
+                self.insert_one(document)
+            except DuplicateKeyError:
+                if ordered:
+                    raise
+
+    def replace_one(self, query: Dict[str, Any], document: Dict[str, Any], upsert: bool = False):
+        existing = self.find_one(query)
+        if existing is not None:
+            self.delete_one(query)
+            document = dict(document, _id=existing["_id"])
+        elif not upsert:
+            return
+        self.insert_one(document)
+
+    def delete_one(self, query: Dict[str, Any]):
+        document = self.find_one(query)
+        if document is None:
+            return
+        with self._lock:
+            del self._documents[document["_id"]]
+            for field, values in self._unique.items():
+                values.pop(document.get(field), None)
+
+    def find(self, query: Optional[Dict[str, Any]] = None, projection: Optional[Dict[str, int]] = None):
+        with self._lock:
+            documents = [decode(data) for data in self._documents.values()]
+        documents = [
+            document for document in documents
+            if all(document.get(field) == value for field, value in (query or {}).items())
+        ]
+        if projection and projection.get("_id") == 0:
+            for document in documents:
+                document.pop("_id", None)
+        return _InMemoryCursor(documents)
+
+    def find_one(self, query: Dict[str, Any], projection: Optional[Dict[str, int]] = None):
+        with self._lock:
+            data = None
+            if len(query) == 1:
+                field, value = next(iter(query.items()))
+                document_id = self._unique.get(field, {}).get(value)
+                if document_id is not None:
+                    data = self._documents.get(document_id)
+                elif field not in self._unique:
+                    for candidate in self._documents.values():
+                        if decode(candidate).get(field) == value:
+                            data = candidate
+                            break
+        if data is None:
+            return None
+        document = decode(data)
+        if projection and projection.get("_id") == 0:
+            document.pop("_id", None)
+        return document
+
+
+class _InMemoryCursor(list):
+    """Result of find(): iterable like a sync cursor, with the async cursor's to_list()"""
+
+    async def to_list(self, length: Optional[int] = None) -> List[Dict[str, Any]]:
+        return list(self[:length] if length else self)
+
+
+class _InMemoryDatabase:
+    def __init__(self):
+        self._collections: Dict[str, _InMemoryCollection] = {}
+
+    def __getitem__(self, name: str) -> _InMemoryCollection:
+        return self._collections.setdefault(name, _InMemoryCollection())
+
+    def command(self, *args, **kwargs):
+        return {"ok": 1}
+
+
+class InMemoryMongoClient:
+    """Drop-in for pymongo.MongoClient keeping data in process memory (shared across clients)"""
+
+    _databases: Dict[str, _InMemoryDatabase] = {}
+
+    def __init__(self, *args, **kwargs):
+        self.admin = _InMemoryDatabase()
+
+    def __getitem__(self, name: str) -> _InMemoryDatabase:
+        return self._databases.setdefault(name, _InMemoryDatabase())
+
+    def close(self):
+        pass
+
+
+class _AsyncWrapper:
+    """Expose the methods of a sync stand-in as coroutines, keeping item access sync"""
+
+    def __init__(self, target):
+        self._target = target
+
+    def __getitem__(self, name: str):
+        return _AsyncWrapper(self._target[name])
+
+    def __getattr__(self, name: str):
+        attribute = getattr(self._target, name)
+        if name == "find":
+            # Like pymongo's async collections, find() returns a cursor synchronously
+            return attribute
+        if not callable(attribute):
+            return _AsyncWrapper(attribute)
+
+        async def call(*args, **kwargs):
+            return attribute(*args, **kwargs)
+        return call
+
+
+class AsyncInMemoryMongoClient(_AsyncWrapper):
+    """Drop-in for pymongo.AsyncMongoClient sharing InMemoryMongoClient's data"""
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(InMemoryMongoClient())
+
+
+def _serve(app, port: int, quiet: bool = True):
+    if quiet:
+        sys.stdout = open(os.devnull, "w")
+    uvicorn.run(app, host="127.0.0.1", port=port, log_level="warning", access_log=False)
+
+
+def serve_fake_openai(port: int):
+    """Process target running the fake OpenAI endpoint"""
+    _serve(fake_openai_app(), port)
+
+
+def serve_fake_connector(port: int):
+    """Process target running the fake Prometheus connector"""
+    _serve(fake_connector_app(), port)
+
+
+def serve_app(port: int, environment: Dict[str, str], quiet: bool = True, workers: int = 1):
+    """
+    Process target running the app from main.py against the fakes.
+
+    The environment must point OPENAI_BASE_URL and PROMETHEUS_CONNECTOR_URL at
+    the fakes; pymongo's clients are replaced by the in-process stand-ins
+    before main (and dashboard.mongo_client) is imported. With several
+    workers the app runs under server.py; each worker then has its own
+    in-memory MongoDB stand-in.
+    """
+    os.environ.update(environment)
+    import pymongo
+    pymongo.MongoClient = InMemoryMongoClient
+    pymongo.AsyncMongoClient = AsyncInMemoryMongoClient
+    if quiet:
+        sys.stdout = open(os.devnull, "w")
+        logging.disable(logging.INFO)
+    if workers > 1:
+        import server
+        server.main(["--host", "127.0.0.1", "--port", str(port), "--workers", str(workers),
+                     "--log-level", "warning", "--no-access-log"])
+        return
+    import main
+    uvicorn.run(main.app, host="127.0.0.1", port=port, log_level="warning", access_log=False)
@@ -0,0 +1,407 @@
+"""
+Offline benchmark harness for the API.
+
+Starts the fake OpenAI endpoint, the fake Prometheus connector and the app
+from main.py (with the in-process MongoDB stand-in) as local processes, then
+drives /generate-promql, /execute-with-data and /getChartConfig with a
+closed-loop load at several concurrency levels and result sizes. Throughput
+and p50/p95/p99 latency are reported per case. Results can be stored as a
+baseline and later runs compared against it.
+
+Usage:
+    python -m benchmarks.run
+    python -m benchmarks.run --concurrency 1,16 --series 10,200 --points 60,1000
+    python -m benchmarks.run --save-baseline default
+    python -m benchmarks.run --compare default   # exit code 1 on regression
+    python -m benchmarks.run --app-env FAST_JSON_RESPONSES_ENABLED=false --accept-encoding gzip
+    python -m benchmarks.run --workers 4 --endpoints generate-promql,execute-with-data
+
+The default matrix (27 cases of 200 requests) takes about 15 minutes; narrow
+it with --endpoints, --concurrency, --series and --points for quick checks.
+Baselines are machine-specific: compare runs made on the same host.
+
+Each request uses a distinct question by default, so the LLM, connector and
+MongoDB paths are exercised; --query-pool N cycles through N questions to
+measure the cache paths instead. Requests ask for uncompressed responses
+unless --accept-encoding is given; the mean response size on the wire is
+reported per case.
+"""
+import argparse
+import asyncio
+import json
+import math
+import multiprocessing
+import os
+import platform
+import socket
+import sys
+import tempfile
+import time
+from datetime import datetime
+from typing import Optional, Dict, Any, List, Tuple
+
+import httpx
+
+from benchmarks.fakes import serve_app, serve_fake_connector, serve_fake_openai
+
+BASELINE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "baselines")
+API_PREFIX = "/api/promql"
+ENDPOINTS = ["generate-promql", "execute-with-data", "getChartConfig"]
+# Metrics compared against a baseline: (field, higher is better)
+COMPARED_FIELDS = [("throughput", True), ("p95", False)]
+
+
+def _free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def _int_list(value: str) -> List[int]:
+    return [int(item) for item in value.split(",") if item.strip()]
+
+
+def percentile(sorted_samples: List[float], percent: float) -> Optional[float]:
+    """Nearest-rank percentile of an already sorted list"""
+    if not sorted_samples:
+        return None
+    index = min(len(sorted_samples) - 1, max(0, math.ceil(percent / 100 * len(sorted_samples)) - 1))
+    return sorted_samples[index]
+
+
+def case_key(result: Dict[str, Any]) -> str:
+    """Identity of a benchmark case, used to match results against a baseline"""
+    return f"{result['endpoint']}|c={result['concurrency']}|series={result['series']}|points={result['points']}"
+
+
+class Environment:
+    """The fake dependencies and the app, each running in its own process"""
+
+    def __init__(self,
+                 verbose: bool = False,
+                 app_environment: Optional[Dict[str, str]] = None,
+                 workers: int = 1):
+        self.openai_port = _free_port()
+        self.connector_port = _free_port()
+        self.app_port = _free_port()
+        self.verbose = verbose
+        self.app_environment = app_environment or {}
+        self.workers = workers
+        self.processes: List[multiprocessing.Process] = []
+
+    @property
+    def openai_url(self) -> str:
+        return f"http://127.0.0.1:{self.openai_port}"
+
+    @property
+    def connector_url(self) -> str:
+        return f"http://127.0.0.1:{self.connector_port}"
+
+    @property
+    def app_url(self) -> str:
+        return f"http://127.0.0.1:{self.app_port}"
+
+    def start(self):
+        context = multiprocessing.get_context("spawn")
+        environment = {
+            "OPEN_AI_KEY": "benchmark",
+            "OPENAI_BASE_URL": f"{self.openai_url}/v1",
+            "PROMETHEUS_CONNECTOR_URL": self.connector_url,
+            "MONGODB_URI": "mongodb://in-process",
+            "MONGODB_DATABASE_NAME": "benchmark",
+            # Keep prompts and connector traffic limited to the measured requests
+            "METRIC_CATALOG_ENABLED": "false",
+            # A fresh shared cache per run, so workers only share what this run computed
+            "SHARED_CACHE_PATH": os.path.join(tempfile.mkdtemp(prefix="promql-bench-"), "cache.sqlite3"),
+            **self.app_environment,
+        }
+        targets = [
+            (serve_fake_openai, (self.openai_port,)),
+            (serve_fake_connector, (self.connector_port,)),
+            (serve_app, (self.app_port, environment, not self.verbose, self.workers)),
+        ]
+        for target, args in targets:
+            process = context.Process(target=target, args=args, daemon=True)
+            process.start()
+            self.processes.append(process)
+        self._wait_ready([f"{self.openai_url}/_config", f"{self.connector_url}/_config", f"{self.app_url}/metrics"])
+
+    @staticmethod
+    def _wait_ready(urls: List[str], timeout: float = 60):
+        deadline = time.time() + timeout
+        for url in urls:
+            while True:
+                try:
+                    if httpx.get(url, timeout=1).status_code == 200:
+                        break
+                except httpx.HTTPError:
+                    pass
+                if time.time() > deadline:
+                    raise RuntimeError(f"Benchmark process did not become ready: {url}")
+                time.sleep(0.1)
+
+    def configure(self, openai: Dict[str, Any], connector: Dict[str, Any]):
+        httpx.post(f"{self.openai_url}/_config", json=openai).raise_for_status()
+        httpx.post(f"{self.connector_url}/_config", json=connector).raise_for_status()
+
+    def stop(self):
+        for process in self.processes:
+            process.terminate()
+        for process in self.processes:
+            process.join(timeout=10)
+
+
+async def _closed_loop(client: httpx.AsyncClient,
+                       concurrency: int,
+                       total: int,
+                       make_request) -> Tuple[List[float], int, float, int]:
+    """
+    Issue total requests from concurrency workers, each sending its next request when the previous one returns.
+
+    Returns:
+        (sorted latencies in seconds, error count, wall time in seconds, response bytes received)
+    """
+    latencies: List[float] = []
+    errors = 0
+    received = 0
+    counter = iter(range(total))
+
+    async def worker():
+        nonlocal errors, received
+        for sequence in counter:
+            method, path, body = make_request(sequence)
+            start_time = time.perf_counter()
+            try:
+                response = await client.request(method, path, json=body)
+                received += response.num_bytes_downloaded
+                if response.status_code != 200:
+                    errors += 1
+            except httpx.HTTPError:
+                errors += 1
+            latencies.append(time.perf_counter() - start_time)
+
+    start_time = time.perf_counter()
+    await asyncio.gather(*[worker() for _ in range(concurrency)])
+    return sorted(latencies), errors, time.perf_counter() - start_time, received
+
+
+def _question(run_id: str, sequence: int, query_pool: int) -> str:
+    number = sequence % query_pool if query_pool > 0 else sequence
+    return f"benchmark traffic overview {run_id} number {number}"
+
+
+async def run_case(environment: Environment,
+                   endpoint: str,
+                   concurrency: int,
+                   series: int,
+                   points: int,
+                   requests: int,
+                   warmup: int,
+                   query_pool: int,
+                   seeded_conversations: int,
+                   accept_encoding: str = "identity") -> Dict[str, Any]:
+    """Run one benchmark case and return its summary"""
+    step_seconds = 60
+    environment.configure(
+        openai={"rangeSeconds": step_seconds * (points - 1), "stepSeconds": step_seconds},
+        connector={"series": series}
+    )
+    run_id = f"{endpoint}-{concurrency}-{series}-{points}-{time.time_ns()}"
+    limits = httpx.Limits(max_connections=concurrency, max_keepalive_connections=concurrency)
+    headers = {"Accept-Encoding": accept_encoding}
+    async with httpx.AsyncClient(base_url=environment.app_url, timeout=120, limits=limits, headers=headers) as client:
+        if endpoint == "getChartConfig":
+            # Seed conversations holding results of the case's size, then read them back
+            conversation_ids = []
+            for sequence in range(seeded_conversations):
+                response = await client.post(
+                    f"{API_PREFIX}/execute-with-data",
+                    json={"query": _question(run_id, sequence, 0)}
+                )
+                response.raise_for_status()
+                conversation_ids.append(response.json()["conversation_id"])
+
+            def make_request(sequence):
+                conversation_id = conversation_ids[sequence % len(conversation_ids)]
+                return "POST", f"{API_PREFIX}/promQL-query-generator/v1/getChartConfig", {
+                    "conversationId": conversation_id
+                }
+        else:
+            def make_request(sequence):
+                return "POST", f"{API_PREFIX}/{endpoint}", {"query": _question(run_id, sequence, query_pool)}
+
+        if warmup > 0:
+            await _closed_loop(client, min(concurrency, warmup), warmup, lambda sequence: make_request(requests + sequence))
+        latencies, errors, wall_time, received = await _closed_loop(client, concurrency, requests, make_request)
+
+    return {
+        "endpoint": endpoint,
+        "concurrency": concurrency,
+        "series": series,
+        "points": points,
+        "requests": requests,
+        "errors": errors,
+        "throughput": round(requests / wall_time, 2),
+        "p50": round(percentile(latencies, 50) * 1000, 2),
+        "p95": round(percentile(latencies, 95) * 1000, 2),
+        "p99": round(percentile(latencies, 99) * 1000, 2),
+        "responseKiB": round(received / requests / 1024, 1),
+    }
+
+
+def compare(results: List[Dict[str, Any]], baseline: Dict[str, Any], tolerance: float) -> List[str]:
+    """
+    Compare results with a baseline.
+
+    Returns:
+        One line per regressed metric (throughput lower or p95 higher than the tolerance allows)
+    """
+    baseline_cases = {case_key(result): result for result in baseline["results"]}
+    regressions = []
+    for result in results:
+        reference = baseline_cases.get(case_key(result))
+        if reference is None:
+            continue
+        for field, higher_is_better in COMPARED_FIELDS:
+            current, previous = result[field], reference[field]
+            if not previous:
+                continue
+            change = (current - previous) / previous
+            if (higher_is_better and change < -tolerance) or (not higher_is_better and change > tolerance):
+                regressions.append(f"{case_key(result)}: {field} {previous} -> {current} ({change:+.0%})")
+    return regressions
+
+
+def print_report(results: List[Dict[str, Any]], baseline: Optional[Dict[str, Any]] = None):
+    baseline_cases = {case_key(result): result for result in (baseline or {}).get("results", [])}
+    header = (f"{'endpoint':<20}{'conc':>6}{'series':>8}{'points':>8}{'req':>6}{'err':>5}{'rps':>10}"
+              f"{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}{'KiB/resp':>10}")
+    if baseline_cases:
+        header += f"{'base rps':>10}{'base p95':>10}"
+    print(header)
+    for result in results:
+        line = (f"{result['endpoint']:<20}{result['concurrency']:>6}{result['series']:>8}{result['points']:>8}"
+                f"{result['requests']:>6}{result['errors']:>5}{result['throughput']:>10}"
+                f"{result['p50']:>10}{result['p95']:>10}{result['p99']:>10}{result.get('responseKiB', ''):>10}")
+        reference = baseline_cases.get(case_key(result))
+        if reference is not None:
+            line += f"{reference['throughput']:>10}{reference['p95']:>10}"
+        print(line)
+
+
+async def run_benchmarks(args) -> List[Dict[str, Any]]:
+    environment = Environment(verbose=args.verbose, app_environment=args.app_env, workers=args.workers)
+    environment.start()
+    try:
+        environment.configure(
+            openai={"latency": args.llm_latency, "jitter": args.llm_jitter},
+            connector={"latency": args.connector_latency, "jitter": args.connector_jitter}
+        )
+        results = []
+        for endpoint in args.endpoints:
+            if endpoint == "getChartConfig" and args.workers > 1:
+                # Conversations are stored in the in-memory MongoDB stand-in of the worker that answered
+                print("Skipping getChartConfig: workers do not share the in-memory MongoDB stand-in", file=sys.stderr)
+                continue
+            # Payload generation does not depend on the result size
+            sizes = [(args.series[0], args.points[0])] if endpoint == "generate-promql" else [
+                (series, points) for series in args.series for points in args.points
+            ]
+            for series, points in sizes:
+                for concurrency in args.concurrency:
+                    result = await run_case(
+                        environment, endpoint, concurrency, series, points, args.requests, args.warmup,
+                        args.query_pool, args.seed_conversations, args.accept_encoding
+                    )
+                    print(f"[{datetime.now().isoformat()}] {case_key(result)} - {result['throughput']} req/s, "
+                          f"p95 {result['p95']} ms, {result['errors']} errors", file=sys.stderr)
+                    results.append(result)
+        return results
+    finally:
+        environment.stop()
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description="Benchmark the API against local fakes of its dependencies")
+    parser.add_argument("--endpoints", type=lambda value: value.split(","), default=ENDPOINTS,
+                        help=f"Comma-separated endpoints to run (default: {','.join(ENDPOINTS)})")
+    parser.add_argument("--concurrency", type=_int_list, default=[1, 8, 32])
+    parser.add_argument("--series", type=_int_list, default=[10, 100], help="Series per connector response")
+    parser.add_argument("--points", type=_int_list, default=[60, 1000], help="Points per series")
+    parser.add_argument("--requests", type=int, default=200, help="Measured requests per case")
+    parser.add_argument("--warmup", type=int, default=10, help="Unmeasured requests before each case")
+    parser.add_argument("--query-pool", type=int, default=0,
+                        help="Cycle through this many questions (0: every request asks a new one)")
+    parser.add_argument("--seed-conversations", type=int, default=50,
+                        help="Conversations stored before a getChartConfig case")
+    parser.add_argument("--llm-latency", type=float, default=0.05, help="Fake OpenAI latency in seconds")
+    parser.add_argument("--llm-jitter", type=float, default=0.0)
+    parser.add_argument("--connector-latency", type=float, default=0.01, help="Fake connector latency in seconds")
+    parser.add_argument("--connector-jitter", type=float, default=0.0)
+    parser.add_argument("--workers", type=int, default=1,
+                        help="Run the app under server.py with this many worker processes")
+    parser.add_argument("--app-env", metavar="NAME=VALUE", action="append", default=[],
+                        help="Environment variable for the app process (repeatable), e.g. RESPONSE_COMPRESSION_ENABLED=false")
+    parser.add_argument("--accept-encoding", default="identity",
+                        help="Accept-Encoding header sent with every request (e.g. gzip, zstd)")
+    parser.add_argument("--save-baseline", metavar="NAME", help="Store the results as baselines/NAME.json")
+    parser.add_argument("--compare", metavar="NAME", help="Compare with baselines/NAME.json")
+    parser.add_argument("--tolerance", type=float, default=0.2,
+                        help="Allowed relative throughput drop / p95 increase before a regression is reported")
+    parser.add_argument("--output", help="Also write the results as JSON to this file")
+    parser.add_argument("--verbose", action="store_true", help="Keep the app's stdout")
+    args = parser.parse_args(argv)
+    args.app_env = dict(item.split("=", 1) for item in args.app_env)
+
+    baseline = None
+    if args.compare:
+        with open(os.path.join(BASELINE_DIR, f"{args.compare}.json")) as baseline_file:
+            baseline = json.load(baseline_file)
+
+    results = asyncio.run(run_benchmarks(args))
+    report = {
+        "created": datetime.now().isoformat(),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "cpus": os.cpu_count(),
+        "settings": {
+            "requests": args.requests,
+            "queryPool": args.query_pool,
+            "llmLatency": args.llm_latency,
+            "connectorLatency": args.connector_latency,
+        },
+        "results": results,
+    }
+    # Only recorded when set, so runs with the defaults stay comparable with older baselines
+    if args.app_env:
+        report["settings"]["appEnvironment"] = args.app_env
+    if args.accept_encoding != "identity":
+        report["settings"]["acceptEncoding"] = args.accept_encoding
+    if args.workers > 1:
+        report["settings"]["workers"] = args.workers
+    print_report(results, baseline)
+
+    if args.output:
+        with open(args.output, "w") as output_file:
+            json.dump(report, output_file, indent=2)
+    if args.save_baseline:
+        os.makedirs(BASELINE_DIR, exist_ok=True)
+        with open(os.path.join(BASELINE_DIR, f"{args.save_baseline}.json"), "w") as baseline_file:
+            json.dump(report, baseline_file, indent=2)
+            baseline_file.write("\n")
+
+    if baseline is not None:
+        if baseline.get("settings") != report["settings"]:
+            print(f"Warning: baseline settings {baseline.get('settings')} differ from this run's", file=sys.stderr)
+        regressions = compare(results, baseline, args.tolerance)
+        if regressions:
+            print(f"\n{len(regressions)} regression(s) against baseline '{args.compare}':")
+            for regression in regressions:
+                print(f"  {regression}")
+            return 1
+        print(f"\nNo regressions against baseline '{args.compare}' (tolerance {args.tolerance:.0%})")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,4 +1,5 @@
 import os
+import tempfile
 from dotenv import load_dotenv
 
 #Loads env vars from .env
@@ -8,7 +9,186 @@ class Config:
     OPENAI_API_KEY = os.getenv("OPEN_AI_KEY")
     OPENAI_MODEL_NAME = os.getenv("OPEN_AI_MODEL_NAME","gpt-4.1-mini")
     PROMETHEUS_CONNECTOR_URL = os.getenv("PROMETHEUS_CONNECTOR_URL")
+
+    # Prometheus connector pool, timeout, retry and hedging configuration
+    PROMETHEUS_CONNECTOR_MAX_CONNECTIONS = int(os.getenv("PROMETHEUS_CONNECTOR_MAX_CONNECTIONS", "100"))
+    PROMETHEUS_CONNECTOR_CONNECT_TIMEOUT_SECONDS = float(os.getenv("PROMETHEUS_CONNECTOR_CONNECT_TIMEOUT_SECONDS", "3"))
+    PROMETHEUS_CONNECTOR_READ_TIMEOUT_SECONDS = float(os.getenv("PROMETHEUS_CONNECTOR_READ_TIMEOUT_SECONDS", "10"))
+    PROMETHEUS_CONNECTOR_MAX_RETRIES = int(os.getenv("PROMETHEUS_CONNECTOR_MAX_RETRIES", "2"))
+    PROMETHEUS_CONNECTOR_BACKOFF_BASE_SECONDS = float(os.getenv("PROMETHEUS_CONNECTOR_BACKOFF_BASE_SECONDS", "0.2"))
+    PROMETHEUS_CONNECTOR_BACKOFF_MAX_SECONDS = float(os.getenv("PROMETHEUS_CONNECTOR_BACKOFF_MAX_SECONDS", "2"))
+    PROMETHEUS_CONNECTOR_HEDGING_ENABLED = os.getenv("PROMETHEUS_CONNECTOR_HEDGING_ENABLED", "false").lower() == "true"
+    # Used as the hedge delay until enough attempts have been observed to compute a p95
+    PROMETHEUS_CONNECTOR_HEDGE_DELAY_SECONDS = float(os.getenv("PROMETHEUS_CONNECTOR_HEDGE_DELAY_SECONDS", "1"))
+    PROMETHEUS_CONNECTOR_HEDGE_MIN_DELAY_SECONDS = float(os.getenv("PROMETHEUS_CONNECTOR_HEDGE_MIN_DELAY_SECONDS", "0.05"))
+    PROMETHEUS_CONNECTOR_HEDGE_MIN_SAMPLES = int(os.getenv("PROMETHEUS_CONNECTOR_HEDGE_MIN_SAMPLES", "20"))
     
     # MongoDB Configuration
     MONGODB_URI = os.getenv("MONGODB_URI")
     MONGODB_DATABASE_NAME = os.getenv("MONGODB_DATABASE_NAME")
+    # Store range-query results in the compact columnar format (reads handle both formats). It stores and
+    # transfers ~4x fewer bytes but decodes slower in-process than raw BSON, so it pays off with a remote or
+    # storage-bound MongoDB
+    MONGODB_COMPACT_PROMETHEUS_DATA = os.getenv("MONGODB_COMPACT_PROMETHEUS_DATA", "false").lower() == "true"
+    # Write-behind mode queues conversations and persists them in batches off the request path
+    # (single process only: server.py turns it off with more than one worker)
+    MONGODB_WRITE_BEHIND_ENABLED = os.getenv("MONGODB_WRITE_BEHIND_ENABLED", "false").lower() == "true"
+    MONGODB_WRITE_QUEUE_SIZE = int(os.getenv("MONGODB_WRITE_QUEUE_SIZE", "10000"))
+    MONGODB_WRITE_BATCH_SIZE = int(os.getenv("MONGODB_WRITE_BATCH_SIZE", "100"))
+    MONGODB_WRITE_FLUSH_INTERVAL_SECONDS = float(os.getenv("MONGODB_WRITE_FLUSH_INTERVAL_SECONDS", "0.5"))
+    MONGODB_WRITE_MAX_ATTEMPTS = int(os.getenv("MONGODB_WRITE_MAX_ATTEMPTS", "3"))
+    # How long a request waits for room in a full write queue before inserting its conversation directly
+    MONGODB_WRITE_QUEUE_TIMEOUT_SECONDS = float(os.getenv("MONGODB_WRITE_QUEUE_TIMEOUT_SECONDS", "1.0"))
+    # How long a MongoDB operation waits for a reachable server before failing
+    MONGODB_SERVER_SELECTION_TIMEOUT_MS = int(os.getenv("MONGODB_SERVER_SELECTION_TIMEOUT_MS", "5000"))
+
+    # LLM payload cache configuration
+    PAYLOAD_CACHE_MAX_SIZE = int(os.getenv("PAYLOAD_CACHE_MAX_SIZE", "1024"))
+    PAYLOAD_CACHE_TTL_SECONDS = int(os.getenv("PAYLOAD_CACHE_TTL_SECONDS", "3600"))
+
+    # Range query planning: step clamping and splitting of long ranges into concurrent sub-range fetches
+    QUERY_PLANNER_TARGET_POINTS = int(os.getenv("QUERY_PLANNER_TARGET_POINTS", "1000"))
+    QUERY_PLANNER_SPLIT_INTERVAL_SECONDS = int(os.getenv("QUERY_PLANNER_SPLIT_INTERVAL_SECONDS", "86400"))
+    QUERY_PLANNER_MIN_POINTS_PER_SPLIT = int(os.getenv("QUERY_PLANNER_MIN_POINTS_PER_SPLIT", "120"))
+    QUERY_PLANNER_MAX_SPLITS = int(os.getenv("QUERY_PLANNER_MAX_SPLITS", "32"))
+    QUERY_PLANNER_SPLIT_CONCURRENCY = int(os.getenv("QUERY_PLANNER_SPLIT_CONCURRENCY", "4"))
+    QUERY_PLANNER_MAX_CONCURRENT_FETCHES = int(os.getenv("QUERY_PLANNER_MAX_CONCURRENT_FETCHES", "16"))
+
+    # Prometheus range query result cache (0 bytes disables it); the most recent steps are always refetched
+    RESULT_CACHE_MAX_BYTES = int(os.getenv("RESULT_CACHE_MAX_BYTES", str(64 * 1024 * 1024)))
+    RESULT_CACHE_VOLATILE_STEPS = int(os.getenv("RESULT_CACHE_VOLATILE_STEPS", "2"))
+
+    # Batch endpoint: maximum queries per request and per-batch caps on concurrent LLM and connector calls
+    BATCH_MAX_QUERIES = int(os.getenv("BATCH_MAX_QUERIES", "50"))
+    BATCH_LLM_CONCURRENCY = int(os.getenv("BATCH_LLM_CONCURRENCY", "8"))
+    BATCH_CONNECTOR_CONCURRENCY = int(os.getenv("BATCH_CONNECTOR_CONCURRENCY", "8"))
+
+    # Share one upstream call between concurrent identical requests (LLM payloads and connector fetches)
+    SINGLE_FLIGHT_ENABLED = os.getenv("SINGLE_FLIGHT_ENABLED", "true").lower() == "true"
+
+    # Rule-based fast path for stock questions; less confident matches fall back to the LLM. The default
+    # only answers questions the matcher explains completely: a single word it skips can change the query
+    INTENT_FAST_PATH_ENABLED = os.getenv("INTENT_FAST_PATH_ENABLED", "true").lower() == "true"
+    INTENT_FAST_PATH_MIN_CONFIDENCE = float(os.getenv("INTENT_FAST_PATH_MIN_CONFIDENCE", "1.0"))
+    # Follow-up refinements: apply time range, step, grouping and chart type changes locally
+    # (when disabled every follow-up is sent to the LLM)
+    REFINEMENT_LOCAL_EDITS_ENABLED = os.getenv("REFINEMENT_LOCAL_EDITS_ENABLED", "true").lower() == "true"
+
+    # Metric catalog: periodically refreshed metric/label index used to add relevant metrics to prompts
+    METRIC_CATALOG_ENABLED = os.getenv("METRIC_CATALOG_ENABLED", "true").lower() == "true"
+    METRIC_CATALOG_REFRESH_INTERVAL_SECONDS = int(os.getenv("METRIC_CATALOG_REFRESH_INTERVAL_SECONDS", "300"))
+    # Catalog queries get their own limiter and circuit breaker, apart from user traffic to the connector
+    METRIC_CATALOG_MAX_CONCURRENT_QUERIES = int(os.getenv("METRIC_CATALOG_MAX_CONCURRENT_QUERIES", "1"))
+    METRIC_CATALOG_TTL_SECONDS = int(os.getenv("METRIC_CATALOG_TTL_SECONDS", str(7 * 86400)))
+    METRIC_CATALOG_LABEL_KEYS = os.getenv("METRIC_CATALOG_LABEL_KEYS", "job,service,namespace")
+    METRIC_CATALOG_MAX_METRICS = int(os.getenv("METRIC_CATALOG_MAX_METRICS", "200000"))
+    METRIC_CATALOG_MAX_LABEL_VALUES = int(os.getenv("METRIC_CATALOG_MAX_LABEL_VALUES", "32"))
+    METRIC_CATALOG_TOP_K = int(os.getenv("METRIC_CATALOG_TOP_K", "8"))
+    METRIC_CATALOG_PROMPT_LABEL_VALUES = int(os.getenv("METRIC_CATALOG_PROMPT_LABEL_VALUES", "5"))
+
+    # Instrumentation: fraction of calls whose full payloads/responses are logged (0 disables)
+    DEBUG_PAYLOAD_LOG_SAMPLE_RATE = float(os.getenv("DEBUG_PAYLOAD_LOG_SAMPLE_RATE", "0"))
+    # Log level; per-request detail (connector calls, OpenAI calls, cache hits, query plans) is logged at DEBUG
+    LOG_LEVEL = os.getenv("LOG_LEVEL", "INFO").upper()
+
+    # Admission control per upstream (OpenAI, Prometheus connector, MongoDB): AIMD concurrency
+    # limits with bounded wait queues, and failure-rate circuit breakers
+    ADAPTIVE_CONCURRENCY_ENABLED = os.getenv("ADAPTIVE_CONCURRENCY_ENABLED", "true").lower() == "true"
+    LLM_CONCURRENCY_INITIAL_LIMIT = int(os.getenv("LLM_CONCURRENCY_INITIAL_LIMIT", "16"))
+    LLM_CONCURRENCY_MAX_LIMIT = int(os.getenv("LLM_CONCURRENCY_MAX_LIMIT", "64"))
+    CONNECTOR_CONCURRENCY_INITIAL_LIMIT = int(os.getenv("CONNECTOR_CONCURRENCY_INITIAL_LIMIT", "32"))
+    CONNECTOR_CONCURRENCY_MAX_LIMIT = int(os.getenv("CONNECTOR_CONCURRENCY_MAX_LIMIT", "100"))
+    MONGODB_CONCURRENCY_INITIAL_LIMIT = int(os.getenv("MONGODB_CONCURRENCY_INITIAL_LIMIT", "50"))
+    MONGODB_CONCURRENCY_MAX_LIMIT = int(os.getenv("MONGODB_CONCURRENCY_MAX_LIMIT", "100"))
+    CONCURRENCY_MIN_LIMIT = int(os.getenv("CONCURRENCY_MIN_LIMIT", "2"))
+    # The limit is cut by CONCURRENCY_BACKOFF_RATIO on failures, or when recent latency exceeds
+    # CONCURRENCY_LATENCY_TOLERANCE times the long-term average
+    CONCURRENCY_LATENCY_TOLERANCE = float(os.getenv("CONCURRENCY_LATENCY_TOLERANCE", "2.0"))
+    CONCURRENCY_BACKOFF_RATIO = float(os.getenv("CONCURRENCY_BACKOFF_RATIO", "0.9"))
+    CONCURRENCY_QUEUE_SIZE = int(os.getenv("CONCURRENCY_QUEUE_SIZE", "200"))
+    CONCURRENCY_QUEUE_TIMEOUT_SECONDS = float(os.getenv("CONCURRENCY_QUEUE_TIMEOUT_SECONDS", "10"))
+    # Requests get this long (or less with an X-Request-Timeout header); 0 disables deadlines
+    REQUEST_DEADLINE_SECONDS = float(os.getenv("REQUEST_DEADLINE_SECONDS", "60"))
+    CIRCUIT_BREAKER_ENABLED = os.getenv("CIRCUIT_BREAKER_ENABLED", "true").lower() == "true"
+    CIRCUIT_BREAKER_FAILURE_RATE = float(os.getenv("CIRCUIT_BREAKER_FAILURE_RATE", "0.5"))
+    CIRCUIT_BREAKER_MIN_CALLS = int(os.getenv("CIRCUIT_BREAKER_MIN_CALLS", "20"))
+    CIRCUIT_BREAKER_WINDOW_SECONDS = float(os.getenv("CIRCUIT_BREAKER_WINDOW_SECONDS", "30"))
+    CIRCUIT_BREAKER_OPEN_SECONDS = float(os.getenv("CIRCUIT_BREAKER_OPEN_SECONDS", "15"))
+    CIRCUIT_BREAKER_HALF_OPEN_PROBES = int(os.getenv("CIRCUIT_BREAKER_HALF_OPEN_PROBES", "3"))
+
+    # Saved panels: connector-only refreshes of stored conversations' queries by a background scheduler
+    PANEL_SCHEDULER_ENABLED = os.getenv("PANEL_SCHEDULER_ENABLED", "true").lower() == "true"
+    PANEL_DEFAULT_REFRESH_SECONDS = float(os.getenv("PANEL_DEFAULT_REFRESH_SECONDS", "30"))
+    PANEL_MIN_REFRESH_SECONDS = float(os.getenv("PANEL_MIN_REFRESH_SECONDS", "5"))
+    # Refreshes run at the interval +/- this fraction of it
+    PANEL_REFRESH_JITTER = float(os.getenv("PANEL_REFRESH_JITTER", "0.1"))
+    PANEL_REFRESH_WORKERS = int(os.getenv("PANEL_REFRESH_WORKERS", "4"))
+    # A panel's result is stale once older than this many of its refresh intervals
+    PANEL_STALE_AFTER_INTERVALS = float(os.getenv("PANEL_STALE_AFTER_INTERVALS", "3"))
+    PANEL_MAX_PANELS = int(os.getenv("PANEL_MAX_PANELS", "1000"))
+    # Store each refreshed result in MongoDB so it is served right after a restart
+    PANEL_PERSIST_RESULTS = os.getenv("PANEL_PERSIST_RESULTS", "true").lower() == "true"
+    # With several workers (shared cache enabled): how often each worker re-reads the panel definitions
+    # and renews or checks the lease deciding which one refreshes
+    PANEL_SYNC_INTERVAL_SECONDS = float(os.getenv("PANEL_SYNC_INTERVAL_SECONDS", "10"))
+
+    # Background dependency checks (OpenAI, Prometheus connector, MongoDB) backing /readyz;
+    # failing dependencies are re-checked every DEPENDENCY_RECOVERY_CHECK_INTERVAL_SECONDS
+    DEPENDENCY_CHECK_INTERVAL_SECONDS = float(os.getenv("DEPENDENCY_CHECK_INTERVAL_SECONDS", "30"))
+    DEPENDENCY_RECOVERY_CHECK_INTERVAL_SECONDS = float(os.getenv("DEPENDENCY_RECOVERY_CHECK_INTERVAL_SECONDS", "2"))
+    DEPENDENCY_CHECK_TIMEOUT_SECONDS = float(os.getenv("DEPENDENCY_CHECK_TIMEOUT_SECONDS", "3"))
+    # Comma-separated dependencies (openai, prometheusConnector, mongodb) that must be up for /readyz to pass;
+    # others are reported but tolerated, so cached and fast-path requests keep being served
+    READINESS_REQUIRED_DEPENDENCIES = os.getenv("READINESS_REQUIRED_DEPENDENCIES", "")
+
+    # Local PromQL validation: LLM repair attempts after a payload fails validation
+    PROMQL_REPAIR_MAX_ATTEMPTS = int(os.getenv("PROMQL_REPAIR_MAX_ATTEMPTS", "2"))
+
+    # Prompt pipeline: template version (see prompts/promql_query_prompts.py) and response format,
+    # "json_schema" (structured outputs), "json_object" or "text" for endpoints supporting neither
+    PROMPT_VERSION = os.getenv("PROMPT_VERSION", "2")
+    LLM_RESPONSE_FORMAT = os.getenv("LLM_RESPONSE_FORMAT", "json_schema")
+    # Sent as prompt_cache_key so requests sharing the prompt prefix hit the same provider-side cache ("" to omit)
+    LLM_PROMPT_CACHE_KEY = os.getenv("LLM_PROMPT_CACHE_KEY", "promql-generator")
+    # Completion cap per LLM call (a payload is about 100 tokens; reasoning models need more)
+    LLM_MAX_COMPLETION_TOKENS = int(os.getenv("LLM_MAX_COMPLETION_TOKENS", "400"))
+    # Prompt plus completion tokens one request may spend across generation and repairs (0: unlimited)
+    LLM_REQUEST_TOKEN_BUDGET = int(os.getenv("LLM_REQUEST_TOKEN_BUDGET", "6000"))
+    # Relevant metrics added to a prompt are cut to this many estimated tokens
+    PROMPT_CONTEXT_MAX_TOKENS = int(os.getenv("PROMPT_CONTEXT_MAX_TOKENS", "600"))
+
+    # Chart data transformation
+    CHART_MAX_POINTS_PER_SERIES = int(os.getenv("CHART_MAX_POINTS_PER_SERIES", "500"))
+
+    # Responses carrying query results are encoded directly (with orjson when installed) instead of
+    # being validated and re-serialized through their pydantic response models
+    FAST_JSON_RESPONSES_ENABLED = os.getenv("FAST_JSON_RESPONSES_ENABLED", "true").lower() == "true"
+    # Compress responses of at least RESPONSE_COMPRESSION_MIN_BYTES with zstd (when the zstandard
+    # package is installed) or gzip, as accepted by the client's Accept-Encoding
+    RESPONSE_COMPRESSION_ENABLED = os.getenv("RESPONSE_COMPRESSION_ENABLED", "true").lower() == "true"
+    RESPONSE_COMPRESSION_MIN_BYTES = int(os.getenv("RESPONSE_COMPRESSION_MIN_BYTES", "4096"))
+    RESPONSE_COMPRESSION_GZIP_LEVEL = int(os.getenv("RESPONSE_COMPRESSION_GZIP_LEVEL", "1"))
+    RESPONSE_COMPRESSION_ZSTD_LEVEL = int(os.getenv("RESPONSE_COMPRESSION_ZSTD_LEVEL", "3"))
+
+    # Production server (server.py): listen address, worker processes and graceful shutdown
+    SERVER_HOST = os.getenv("SERVER_HOST", "0.0.0.0")
+    SERVER_PORT = int(os.getenv("SERVER_PORT", "8000"))
+    # 0: one worker per CPU core
+    SERVER_WORKERS = int(os.getenv("SERVER_WORKERS", "0"))
+    SERVER_BACKLOG = int(os.getenv("SERVER_BACKLOG", "2048"))
+    # After SIGTERM/SIGINT, in-flight requests get this long to finish before pending writes are flushed
+    SERVER_GRACEFUL_SHUTDOWN_SECONDS = float(os.getenv("SERVER_GRACEFUL_SHUTDOWN_SECONDS", "30"))
+    # Payload and result caches shared by the worker processes through a SQLite file (defaults to
+    # enabled when server.py runs more than one worker)
+    SHARED_CACHE_ENABLED = os.getenv("SHARED_CACHE_ENABLED", "false").lower() == "true"
+    SHARED_CACHE_PATH = os.getenv("SHARED_CACHE_PATH", os.path.join(tempfile.gettempdir(), "promql-generator-cache.sqlite3"))
+    SHARED_CACHE_MMAP_BYTES = int(os.getenv("SHARED_CACHE_MMAP_BYTES", str(256 * 1024 * 1024)))
+    SHARED_CACHE_PAYLOAD_MAX_BYTES = int(os.getenv("SHARED_CACHE_PAYLOAD_MAX_BYTES", str(16 * 1024 * 1024)))
+    SHARED_CACHE_RESULT_MAX_BYTES = int(os.getenv("SHARED_CACHE_RESULT_MAX_BYTES", str(256 * 1024 * 1024)))
+    # The metric catalog and saved panel results published by the worker that refreshes them
+    SHARED_CACHE_CATALOG_MAX_BYTES = int(os.getenv("SHARED_CACHE_CATALOG_MAX_BYTES", str(64 * 1024 * 1024)))
+    SHARED_CACHE_PANEL_MAX_BYTES = int(os.getenv("SHARED_CACHE_PANEL_MAX_BYTES", str(256 * 1024 * 1024)))
+    # Threads per shared store running its SQLite calls off the event loop, and writes queued there
+    # before further ones are dropped
+    SHARED_CACHE_IO_THREADS = int(os.getenv("SHARED_CACHE_IO_THREADS", "2"))
+    SHARED_CACHE_MAX_PENDING_WRITES = int(os.getenv("SHARED_CACHE_MAX_PENDING_WRITES", "64"))
@@ -1,36 +1,108 @@
-from pymongo import MongoClient
-from pymongo.errors import ConnectionFailure, PyMongoError
+from pymongo import MongoClient, AsyncMongoClient, ASCENDING
+from pymongo.errors import BulkWriteError, ConnectionFailure, DuplicateKeyError, PyMongoError
 from config import Config
+from dashboard.prometheus_codec import encode_prometheus_data, decode_prometheus_data
+from utils.metrics import MONGO_WRITE_SECONDS
+from utils.admission import OverloadError, create_guard
+import asyncio
 import uuid
 from datetime import datetime
-from typing import Optional, Dict, Any
+from typing import Optional, Dict, Any, List
 import logging
 import time
 
 # Configure logging
-logging.basicConfig(level=logging.INFO)
+logging.basicConfig(level=Config.LOG_LEVEL)
 logger = logging.getLogger(__name__)
 
+def build_conversation_document(conversation_id: str,
+                                natural_language_query: str,
+                                generated_payload: Dict[Any, Any],
+                                prometheus_data: Dict[Any, Any],
+                                success_status: int,
+                                chart_config: Dict[Any, Any] = None,
+                                parent_conversation_id: Optional[str] = None) -> Dict[Any, Any]:
+    """Build the conversation document stored in the conversations collection"""
+    if Config.MONGODB_COMPACT_PROMETHEUS_DATA:
+        prometheus_data = encode_prometheus_data(prometheus_data)
+    document = {
+        "conversationId": conversation_id,
+        "naturalLanguageQuery": natural_language_query,
+        "generatedPayload": generated_payload,
+        "chartConfig": chart_config or {},
+        "prometheusData": prometheus_data,
+        "timestamp": datetime.utcnow().isoformat(),
+        "success": success_status
+    }
+    if parent_conversation_id:
+        # Follow-up refinements link to the conversation they refine
+        document["parentConversationId"] = parent_conversation_id
+    return document
+
+def decode_conversation_document(document: Dict[Any, Any]) -> Dict[Any, Any]:
+    """Return a copy of a stored conversation with prometheusData decoded to the connector shape"""
+    document = dict(document)
+    document.pop("_id", None)
+    if "prometheusData" in document:
+        document["prometheusData"] = decode_prometheus_data(document["prometheusData"])
+    return document
+
+# Server error code of a unique index violation
+DUPLICATE_KEY_ERROR = 11000
+
+# Indexes backing conversation lookups and time-ordered scans
+CONVERSATION_INDEXES = [
+    {"keys": [("conversationId", ASCENDING)], "unique": True, "name": "conversationId_unique"},
+    {"keys": [("timestamp", ASCENDING)], "name": "timestamp"},
+]
+
+# Indexes of the saved panel definitions and their latest refreshed results
+PANEL_INDEXES = [
+    {"keys": [("panelId", ASCENDING)], "unique": True, "name": "panelId_unique"},
+]
+PANEL_RESULT_INDEXES = [
+    {"keys": [("refreshKey", ASCENDING)], "unique": True, "name": "refreshKey_unique"},
+]
+
 class MongoDBClient:
+    """
+    Synchronous MongoDB client for scripts.
+
+    Connects on first use rather than on construction, so importing this
+    module never waits on MongoDB.
+    """
+
     def __init__(self):
         self.client = None
         self.db = None
         self.collection = None
-        self._connect()
-    
+
+    def _ensure_connected(self):
+        """Connect on first use"""
+        if self.collection is None:
+            self._connect()
+
     def _connect(self):
         """Establish connection to MongoDB"""
         try:
-            self.client = MongoClient(Config.MONGODB_URI)
+            self.client = MongoClient(
+                Config.MONGODB_URI, serverSelectionTimeoutMS=Config.MONGODB_SERVER_SELECTION_TIMEOUT_MS
+            )
             # Test the connection
             self.client.admin.command('ping')
             self.db = self.client[Config.MONGODB_DATABASE_NAME]
             self.collection = self.db['conversations']
+            for index in CONVERSATION_INDEXES:
+                self.collection.create_index(
+                    index["keys"], name=index["name"], unique=index.get("unique", False)
+                )
             logger.info(f"Successfully connected to MongoDB database: {Config.MONGODB_DATABASE_NAME}")
         except ConnectionFailure as e:
+            self.client = self.db = self.collection = None
             logger.error(f"Failed to connect to MongoDB: {e}")
             raise
         except Exception as e:
+            self.client = self.db = self.collection = None
             logger.error(f"Unexpected error connecting to MongoDB: {e}")
             raise
     
@@ -60,17 +132,18 @@ class MongoDBClient:
             bool: True if successful, False otherwise
         """
         try:
-            document = {
-                "conversationId": conversation_id,
-                "naturalLanguageQuery": natural_language_query,
-                "generatedPayload": generated_payload,
-                "chartConfig": chart_config or {},
-                "prometheusData": prometheus_data,
-                "timestamp": datetime.utcnow().isoformat(),
-                "success": success_status
-            }
+            self._ensure_connected()
+            document = build_conversation_document(
+                conversation_id,
+                natural_language_query,
+                generated_payload,
+                prometheus_data,
+                success_status,
+                chart_config
+            )
             
-            result = self.collection.insert_one(document)
+            with MONGO_WRITE_SECONDS.time(operation="insert_one"):
+                result = self.collection.insert_one(document)
             logger.info(f"Successfully stored conversation {conversation_id}")
             return True
             
@@ -92,6 +165,7 @@ class MongoDBClient:
             Dict containing conversation data or None if not found
         """
         try:
+            self._ensure_connected()
             document = self.collection.find_one(
                 {"conversationId": conversation_id},
                 {"_id": 0}  # Exclude MongoDB's internal _id field
@@ -99,7 +173,7 @@ class MongoDBClient:
             
             if document:
                 logger.info(f"Successfully retrieved conversation {conversation_id}")
-                return document
+                return decode_conversation_document(document)
             else:
                 logger.warning(f"Conversation {conversation_id} not found")
                 return None
@@ -117,5 +191,465 @@ class MongoDBClient:
             self.client.close()
             logger.info("MongoDB connection closed")
 
-# Global MongoDB client instance
+class AsyncMongoDBClient:
+    """
+    Async counterpart of MongoDBClient built on PyMongo's native asyncio driver.
+
+    The underlying AsyncMongoClient is created on first use and connects
+    lazily, so neither import nor startup waits on MongoDB; warm_up() checks
+    connectivity and creates the indexes once MongoDB is reachable.
+
+    While the last ping failed, direct writes and reads fail fast instead of
+    waiting for server selection to time out; in write-behind mode documents
+    are still queued and the flusher retries them.
+
+    Direct reads and writes go through an adaptive concurrency limit and
+    circuit breaker; shed writes are reported as failed stores, shed reads
+    raise OverloadError.
+    """
+
+    def __init__(self):
+        self._client = None
+        self._db = None
+        self._collection = None
+        # Set by ping(); stays True until a ping fails so scripts not running checks behave as before
+        self.available = True
+        self._indexes_created = False
+        self.guard = create_guard(
+            "mongodb",
+            Config.MONGODB_CONCURRENCY_INITIAL_LIMIT,
+            Config.MONGODB_CONCURRENCY_MAX_LIMIT,
+            # Duplicate keys are caused by the document, not by MongoDB being in trouble
+            is_failure=lambda error: not isinstance(error, DuplicateKeyError)
+        )
+
+        # Write-behind state: queued documents are also indexed by conversationId
+        # until flushed, so reads issued right after a write still find them
+        self.write_behind = Config.MONGODB_WRITE_BEHIND_ENABLED
+        self._write_queue = None
+        self._pending_documents: Dict[str, Dict[Any, Any]] = {}
+        self._flusher_task = None
+        self._stopping = False
+
+    @property
+    def client(self) -> AsyncMongoClient:
+        """The AsyncMongoClient, created on first use"""
+        if self._client is None:
+            self._client = AsyncMongoClient(
+                Config.MONGODB_URI, serverSelectionTimeoutMS=Config.MONGODB_SERVER_SELECTION_TIMEOUT_MS
+            )
+            self._db = self._client[Config.MONGODB_DATABASE_NAME]
+            self._collection = self._db['conversations']
+        return self._client
+
+    @property
+    def panels(self):
+        return self.db['panels']
+
+    @property
+    def panel_results(self):
+        return self.db['panel_results']
+
+    @property
+    def db(self):
+        if self._db is None:
+            self.client
+        return self._db
+
+    @property
+    def collection(self):
+        if self._collection is None:
+            self.client
+        return self._collection
+
+    def start_write_behind(self):
+        """Start the background flusher (no-op when write-behind is disabled or already running)"""
+        if not self.write_behind or (self._flusher_task and not self._flusher_task.done()):
+            return
+        if self._write_queue is None:
+            self._write_queue = asyncio.Queue(maxsize=Config.MONGODB_WRITE_QUEUE_SIZE)
+        self._stopping = False
+        self._flusher_task = asyncio.create_task(self._flush_loop())
+        logger.info("Started MongoDB write-behind flusher")
+
+    async def stop_write_behind(self):
+        """Stop the background flusher after writing every queued conversation"""
+        if self._flusher_task is None:
+            return
+        self._stopping = True
+        await self._flusher_task
+        self._flusher_task = None
+        logger.info("Stopped MongoDB write-behind flusher")
+
+    async def _flush_loop(self):
+        """Collect queued documents into size- or time-bounded batches and insert them"""
+        batch_size = Config.MONGODB_WRITE_BATCH_SIZE
+        interval = Config.MONGODB_WRITE_FLUSH_INTERVAL_SECONDS
+        loop = asyncio.get_running_loop()
+
+        while not (self._stopping and self._write_queue.empty()):
+            try:
+                first = await asyncio.wait_for(self._write_queue.get(), timeout=interval)
+            except asyncio.TimeoutError:
+                continue
+
+            batch = [first]
+            deadline = loop.time() + interval
+            while len(batch) < batch_size:
+                remaining = deadline - loop.time()
+                if remaining <= 0 or self._stopping:
+                    break
+                try:
+                    batch.append(await asyncio.wait_for(self._write_queue.get(), timeout=remaining))
+                except asyncio.TimeoutError:
+                    break
+            # Drain whatever is already queued without waiting, up to the batch size
+            while len(batch) < batch_size and not self._write_queue.empty():
+                batch.append(self._write_queue.get_nowait())
+
+            await self._insert_batch(batch)
+            for _ in batch:
+                self._write_queue.task_done()
+
+    async def _insert_batch(self, batch):
+        """
+        Insert a batch with insert_many, retrying transient failures before giving up.
+
+        After a partial write only the documents MongoDB reported as not written
+        are retried; duplicate keys mean the document is already stored.
+        """
+        attempts = Config.MONGODB_WRITE_MAX_ATTEMPTS
+        remaining = batch
+        for attempt in range(1, attempts + 1):
+            try:
+                # Copies keep the pending documents free of the _id field insert_many adds
+                with MONGO_WRITE_SECONDS.time(operation="insert_many"):
+                    await self.collection.insert_many([dict(document) for document in remaining], ordered=False)
+                logger.info(f"Flushed {len(remaining)} conversations to MongoDB")
+                remaining = []
+            except BulkWriteError as e:
+                failed = sorted({
+                    error["index"] for error in e.details.get("writeErrors", [])
+                    if error.get("code") != DUPLICATE_KEY_ERROR
+                })
+                logger.info(f"Flushed {len(remaining) - len(failed)} of {len(remaining)} conversations to MongoDB")
+                remaining = [remaining[index] for index in failed]
+                if remaining:
+                    self._retry_or_drop(remaining, attempt, attempts, e)
+            except PyMongoError as e:
+                self._retry_or_drop(remaining, attempt, attempts, e)
+            except Exception as e:
+                logger.error(f"Unexpected error flushing {len(remaining)} conversations: {e}")
+                break
+            if not remaining or attempt == attempts:
+                break
+            await asyncio.sleep(Config.MONGODB_WRITE_FLUSH_INTERVAL_SECONDS * attempt)
+
+        for document in batch:
+            conversation_id = document["conversationId"]
+            if self._pending_documents.get(conversation_id) is document:
+                del self._pending_documents[conversation_id]
+
+    @staticmethod
+    def _retry_or_drop(documents, attempt: int, attempts: int, error: Exception):
+        if attempt == attempts:
+            logger.error(f"Dropping {len(documents)} conversations after {attempts} failed flushes: {error}")
+        else:
+            logger.warning(f"Failed to flush {len(documents)} conversations (attempt {attempt}): {error}")
+
+    async def _enqueue(self, documents: List[Dict[Any, Any]]) -> List[Dict[Any, Any]]:
+        """
+        Queue documents for the flusher, waiting at most MONGODB_WRITE_QUEUE_TIMEOUT_SECONDS
+        for room in a full queue.
+
+        Returns:
+            The documents that could not be queued in time, to be inserted directly
+        """
+        self.start_write_behind()
+        for position, document in enumerate(documents):
+            self._pending_documents[document["conversationId"]] = document
+            try:
+                await asyncio.wait_for(
+                    self._write_queue.put(document), timeout=Config.MONGODB_WRITE_QUEUE_TIMEOUT_SECONDS
+                )
+            except asyncio.TimeoutError:
+                overflow = documents[position:]
+                for pending in overflow:
+                    if self._pending_documents.get(pending["conversationId"]) is pending:
+                        del self._pending_documents[pending["conversationId"]]
+                logger.warning(f"Write-behind queue full, inserting {len(overflow)} conversations directly")
+                return overflow
+        return []
+
+    async def flush(self):
+        """Wait until every conversation queued so far has been written"""
+        if self._write_queue is not None and self._flusher_task is not None:
+            await self._write_queue.join()
+
+    async def ping(self) -> bool:
+        """Check that MongoDB is reachable"""
+        try:
+            await self.client.admin.command('ping')
+            self.available = True
+            return True
+        except PyMongoError as e:
+            logger.error(f"Failed to ping MongoDB: {e}")
+            self.available = False
+            return False
+        except asyncio.CancelledError:
+            # Timed out by the caller: treat MongoDB as unavailable until a ping succeeds
+            self.available = False
+            raise
+
+    async def warm_up(self) -> bool:
+        """Ping MongoDB, creating the indexes on the first successful ping"""
+        if not await self.ping():
+            return False
+        if not self._indexes_created:
+            self._indexes_created = await self.ensure_indexes()
+        return self._indexes_created
+
+    async def ensure_indexes(self) -> bool:
+        """Create the conversation, panel and panel result indexes if they do not exist"""
+        try:
+            for collection, indexes in ((self.collection, CONVERSATION_INDEXES),
+                                        (self.panels, PANEL_INDEXES),
+                                        (self.panel_results, PANEL_RESULT_INDEXES)):
+                for index in indexes:
+                    await collection.create_index(
+                        index["keys"], name=index["name"], unique=index.get("unique", False)
+                    )
+            return True
+        except PyMongoError as e:
+            logger.error(f"Failed to create MongoDB indexes: {e}")
+            return False
+
+    def generate_conversation_id(self) -> str:
+        """Generate a new UUID for conversation ID"""
+        return str(uuid.uuid4())
+
+    async def store_conversation(self,
+                                 conversation_id: str,
+                                 natural_language_query: str,
+                                 generated_payload: Dict[Any, Any],
+                                 prometheus_data: Dict[Any, Any],
+                                 success_status: int,
+                                 chart_config: Dict[Any, Any] = None,
+                                 parent_conversation_id: Optional[str] = None) -> bool:
+        """
+        Store conversation data in MongoDB without blocking the event loop.
+
+        In write-behind mode the document is queued and written later in a
+        batch; it stays readable through get_conversation in the meantime.
+        If the queue stays full for MONGODB_WRITE_QUEUE_TIMEOUT_SECONDS, the
+        document is inserted directly instead.
+
+        Args:
+            conversation_id: UUID string for the conversation
+            natural_language_query: Original user query
+            generated_payload: OpenAI generated payload
+            prometheus_data: Prometheus response data
+            success_status: HTTP status code (200, 404, 500, etc.)
+            chart_config: Chart configuration data (optional)
+            parent_conversation_id: Conversation this one refines (optional)
+
+        Returns:
+            bool: True if successful, False otherwise
+        """
+        try:
+            document = build_conversation_document(
+                conversation_id,
+                natural_language_query,
+                generated_payload,
+                prometheus_data,
+                success_status,
+                chart_config,
+                parent_conversation_id
+            )
+
+            # A full queue applies backpressure for a bounded time, then the document is inserted directly
+            if self.write_behind and not await self._enqueue([document]):
+                return True
+
+            if not self.available:
+                logger.error(f"Failed to store conversation {conversation_id}: MongoDB unavailable")
+                return False
+
+            async with self.guard.slot():
+                with MONGO_WRITE_SECONDS.time(operation="insert_one"):
+                    await self.collection.insert_one(document)
+            logger.info(f"Successfully stored conversation {conversation_id}")
+            return True
+
+        except OverloadError as e:
+            logger.error(f"Failed to store conversation {conversation_id}: {e}")
+            return False
+        except PyMongoError as e:
+            logger.error(f"Failed to store conversation {conversation_id}: {e}")
+            return False
+        except Exception as e:
+            logger.error(f"Unexpected error storing conversation {conversation_id}: {e}")
+            return False
+
+    async def store_conversations(self, documents: List[Dict[Any, Any]]) -> bool:
+        """
+        Store several conversations at once with a single bulk insert.
+
+        Args:
+            documents: Conversation documents built with build_conversation_document
+
+        Returns:
+            bool: True if every document was stored (or queued in write-behind mode), False otherwise
+        """
+        if not documents:
+            return True
+        try:
+            if self.write_behind:
+                documents = await self._enqueue(documents)
+                if not documents:
+                    return True
+
+            if not self.available:
+                logger.error(f"Failed to store {len(documents)} conversations: MongoDB unavailable")
+                return False
+
+            async with self.guard.slot():
+                with MONGO_WRITE_SECONDS.time(operation="insert_many"):
+                    await self.collection.insert_many(documents, ordered=False)
+            logger.info(f"Successfully stored {len(documents)} conversations")
+            return True
+
+        except OverloadError as e:
+            logger.error(f"Failed to store {len(documents)} conversations: {e}")
+            return False
+        except PyMongoError as e:
+            logger.error(f"Failed to store {len(documents)} conversations: {e}")
+            return False
+        except Exception as e:
+            logger.error(f"Unexpected error storing {len(documents)} conversations: {e}")
+            return False
+
+    async def get_conversation(self, conversation_id: str) -> Optional[Dict[Any, Any]]:
+        """
+        Retrieve conversation data by conversation ID
+
+        Args:
+            conversation_id: UUID string for the conversation
+
+        Returns:
+            Dict containing conversation data or None if not found
+
+        Raises:
+            OverloadError: If the read is shed by admission control or the circuit is open
+        """
+        pending = self._pending_documents.get(conversation_id)
+        if pending is not None:
+            logger.info(f"Retrieved pending conversation {conversation_id} from write-behind queue")
+            return decode_conversation_document(pending)
+
+        if not self.available:
+            logger.error(f"Failed to retrieve conversation {conversation_id}: MongoDB unavailable")
+            return None
+
+        try:
+            async with self.guard.slot():
+                document = await self.collection.find_one(
+                    {"conversationId": conversation_id},
+                    {"_id": 0}  # Exclude MongoDB's internal _id field
+                )
+
+            if document:
+                logger.info(f"Successfully retrieved conversation {conversation_id}")
+                return decode_conversation_document(document)
+            else:
+                logger.warning(f"Conversation {conversation_id} not found")
+                return None
+
+        except OverloadError:
+            raise
+        except PyMongoError as e:
+            logger.error(f"Failed to retrieve conversation {conversation_id}: {e}")
+            return None
+        except Exception as e:
+            logger.error(f"Unexpected error retrieving conversation {conversation_id}: {e}")
+            return None
+
+    async def store_panel(self, panel: Dict[Any, Any]) -> bool:
+        """
+        Store a saved panel definition
+
+        Args:
+            panel: Panel document with a unique panelId
+
+        Returns:
+            bool: True if successful, False otherwise
+        """
+        try:
+            async with self.guard.slot():
+                await self.panels.insert_one(dict(panel))
+            logger.info(f"Successfully stored panel {panel['panelId']}")
+            return True
+        except (OverloadError, PyMongoError) as e:
+            logger.error(f"Failed to store panel {panel['panelId']}: {e}")
+            return False
+
+    async def delete_panel(self, panel_id: str) -> bool:
+        """Delete a saved panel definition, returning whether the delete succeeded"""
+        try:
+            async with self.guard.slot():
+                await self.panels.delete_one({"panelId": panel_id})
+            return True
+        except (OverloadError, PyMongoError) as e:
+            logger.error(f"Failed to delete panel {panel_id}: {e}")
+            return False
+
+    async def list_panels(self) -> Optional[List[Dict[Any, Any]]]:
+        """Return every saved panel definition, or None if MongoDB cannot be read"""
+        try:
+            return await self.panels.find({}, {"_id": 0}).to_list(None)
+        except PyMongoError as e:
+            logger.error(f"Failed to list panels: {e}")
+            return None
+
+    async def store_panel_result(self, refresh_key: str, result: Dict[Any, Any]) -> bool:
+        """
+        Replace the latest refreshed result shared by the panels with this refresh key
+
+        Args:
+            refresh_key: Key of the panels' shared query (query, range and step)
+            result: Result with prometheusData, start, end and refreshedAt
+
+        Returns:
+            bool: True if successful, False otherwise
+        """
+        document = dict(result, refreshKey=refresh_key)
+        if Config.MONGODB_COMPACT_PROMETHEUS_DATA:
+            document["prometheusData"] = encode_prometheus_data(document["prometheusData"])
+        try:
+            async with self.guard.slot():
+                with MONGO_WRITE_SECONDS.time(operation="replace_one"):
+                    await self.panel_results.replace_one({"refreshKey": refresh_key}, document, upsert=True)
+            return True
+        except (OverloadError, PyMongoError) as e:
+            logger.error(f"Failed to store panel result {refresh_key}: {e}")
+            return False
+
+    async def list_panel_results(self) -> Optional[List[Dict[Any, Any]]]:
+        """Return the latest stored panel results with prometheusData decoded, or None if MongoDB cannot be read"""
+        try:
+            documents = await self.panel_results.find({}, {"_id": 0}).to_list(None)
+        except PyMongoError as e:
+            logger.error(f"Failed to list panel results: {e}")
+            return None
+        return [decode_conversation_document(document) for document in documents]
+
+    async def close_connection(self):
+        """Flush queued writes and close MongoDB connection"""
+        await self.stop_write_behind()
+        if self._client:
+            await self._client.close()
+            logger.info("Async MongoDB connection closed")
+
+# Global MongoDB client instances (sync for scripts, async for the API)
 mongo_client = MongoDBClient()
+async_mongo_client = AsyncMongoDBClient()
@@ -0,0 +1,273 @@
+"""
+Compact columnar encoding for Prometheus range-query results stored in MongoDB.
+
+A matrix result is normally a list of series, each holding a list of
+[timestamp, "string value"] pairs. The encoded form stores, per series:
+
+- the label set once, as indexes into a document-wide string table
+- the first timestamp in milliseconds plus either a constant step or
+  delta-encoded int64 offsets packed in BSON binary
+- the sample values as packed float64 in BSON binary
+
+Prometheus formats sample values as the shortest decimal that round-trips
+the float64, without an exponent. Within 1e-4 <= |value| < 1e16 that is
+what the JSON encoders print too, once a trailing ".0" is dropped, so the
+value strings are rebuilt by encoding the whole column as one JSON array
+and splitting it rather than formatting every float in Python. Series
+whose values would not come back identical (NaN, Inf, values outside that
+range, strings not in Prometheus' format) keep their value strings as one
+newline-joined UTF-8 column instead.
+
+Series that cannot be reproduced exactly (non-millisecond timestamps,
+native histograms, unexpected sample shapes) are kept in their raw form,
+so decoding always yields the original document.
+"""
+import copy
+import json
+import sys
+from array import array
+from typing import Optional, Dict, Any, List
+
+import numpy as np
+from bson.binary import Binary
+
+try:
+    import orjson
+except ImportError:  # Optional: value columns are formatted with the stdlib encoder without it
+    orjson = None
+
+ENCODING_VERSION = "columnar-v2"
+# Documents in these encodings are decoded (v1 stored every value column as strings)
+DECODABLE_VERSIONS = ("columnar-v1", ENCODING_VERSION)
+
+# Magnitudes whose shortest round-trip form is printed without an exponent by every JSON encoder used here
+_MIN_PLAIN_MAGNITUDE = 1e-4
+_MAX_PLAIN_MAGNITUDE = 1e16
+
+# How deep to look for the {"resultType": ..., "result": [...]} container
+_MAX_CONTAINER_DEPTH = 3
+
+
+def _find_result_path(data: Any, depth: int = 0) -> Optional[List[str]]:
+    """Return the key path to the dict holding resultType/result, or None"""
+    if not isinstance(data, dict) or depth > _MAX_CONTAINER_DEPTH:
+        return None
+    if data.get("resultType") == "matrix" and isinstance(data.get("result"), list):
+        return []
+    nested = data.get("data")
+    if isinstance(nested, dict):
+        path = _find_result_path(nested, depth + 1)
+        if path is not None:
+            return ["data"] + path
+    return None
+
+
+def _resolve(data: Dict[Any, Any], path: List[str]) -> Dict[Any, Any]:
+    for key in path:
+        data = data[key]
+    return data
+
+
+def _pack(typecode: str, values) -> Binary:
+    packed = array(typecode, values)
+    if sys.byteorder != "little":
+        packed.byteswap()
+    return Binary(packed.tobytes())
+
+
+def _unpack(typecode: str, blob: bytes) -> array:
+    unpacked = array(typecode)
+    unpacked.frombytes(bytes(blob))
+    if sys.byteorder != "little":
+        unpacked.byteswap()
+    return unpacked
+
+
+def _encode_timestamps(timestamps) -> Optional[Dict[str, Any]]:
+    """Encode sample timestamps as milliseconds: a start plus a constant step or packed deltas"""
+    types = set(map(type, timestamps))
+    if types == {int}:
+        timestamps_ms = [timestamp * 1000 for timestamp in timestamps]
+        integer_timestamps = True
+    elif types <= {int, float}:
+        timestamps_ms = [round(timestamp * 1000) for timestamp in timestamps]
+        if [timestamp_ms / 1000 for timestamp_ms in timestamps_ms] != list(timestamps):
+            return None
+        integer_timestamps = False
+    else:
+        return None
+
+    encoded = {"t0": timestamps_ms[0], "intTimestamps": integer_timestamps}
+    if len(types) > 1:
+        # Integer and float timestamps in one series: record which ones were integers
+        encoded["intMask"] = Binary(bytes(type(timestamp) is int for timestamp in timestamps))
+    if len(timestamps_ms) > 1:
+        step = timestamps_ms[1] - timestamps_ms[0]
+        if step > 0 and list(range(timestamps_ms[0], timestamps_ms[0] + step * len(timestamps_ms), step)) == timestamps_ms:
+            encoded["step"] = step
+        else:
+            encoded["deltas"] = _pack("q", [b - a for a, b in zip(timestamps_ms, timestamps_ms[1:])])
+    return encoded
+
+
+def _decode_timestamps(encoded: Dict[str, Any], count: int) -> list:
+    t0 = encoded["t0"]
+    if "step" in encoded or count == 1:
+        step = encoded.get("step", 1)
+        timestamps_ms = range(t0, t0 + step * count, step)
+        if encoded["intTimestamps"] and t0 % 1000 == 0 and step % 1000 == 0:
+            return list(range(t0 // 1000, (t0 + step * count) // 1000, step // 1000))
+    else:
+        timestamps_ms = [t0]
+        for delta in _unpack("q", encoded["deltas"]):
+            timestamps_ms.append(timestamps_ms[-1] + delta)
+
+    if encoded["intTimestamps"]:
+        return [timestamp_ms // 1000 for timestamp_ms in timestamps_ms]
+    if "intMask" in encoded:
+        return [
+            timestamp_ms // 1000 if is_int else timestamp_ms / 1000
+            for timestamp_ms, is_int in zip(timestamps_ms, bytes(encoded["intMask"]))
+        ]
+    return [timestamp_ms / 1000 for timestamp_ms in timestamps_ms]
+
+
+def _format_values(floats: np.ndarray) -> List[str]:
+    """Format float64 sample values the way Prometheus does (see the module docstring for the range this holds in)"""
+    integral = floats == np.trunc(floats)
+    if integral.all():
+        # Gauges and counts: format as integers, which needs no ".0" clean-up
+        floats = floats.astype(np.int64)
+    if orjson is not None:
+        text = orjson.dumps(floats, option=orjson.OPT_SERIALIZE_NUMPY).decode("ascii")[1:-1]
+    else:
+        text = json.dumps(floats.tolist(), separators=(",", ":"))[1:-1]
+    if integral.any() and not integral.all():
+        text = (text + ",").replace(".0,", ",")[:-1]
+    return text.split(",") if text else []
+
+
+def _encode_values(texts) -> Optional[Dict[str, Binary]]:
+    """Pack sample value strings as float64 if they format back identically, else as a string column"""
+    try:
+        floats = np.array(texts, dtype="<f8")
+    except ValueError:
+        floats = None
+    if floats is not None:
+        magnitudes = np.abs(floats)
+        plain = (floats == 0) | ((magnitudes >= _MIN_PLAIN_MAGNITUDE) & (magnitudes < _MAX_PLAIN_MAGNITUDE))
+        if plain.all() and _format_values(floats) == list(texts):
+            return {"floats": Binary(floats.tobytes())}
+    values = "\n".join(texts)
+    if values.count("\n") != len(texts) - 1:
+        return None
+    return {"values": Binary(values.encode("utf-8"))}
+
+
+def _decode_values(encoded: Dict[str, Any]) -> List[str]:
+    if "floats" in encoded:
+        return _format_values(np.frombuffer(encoded["floats"], dtype="<f8"))
+    return bytes(encoded["values"]).decode("utf-8").split("\n")
+
+
+def _encode_series(series: Dict[Any, Any], strings: Dict[str, int]) -> Optional[Dict[str, Any]]:
+    """Encode one matrix series, or return None if it cannot be encoded losslessly"""
+    if set(series) != {"metric", "values"} or not isinstance(series["metric"], dict):
+        return None
+
+    labels = []
+    for key, label_value in series["metric"].items():
+        for text in (key, label_value):
+            if not isinstance(text, str):
+                return None
+            labels.append(strings.setdefault(text, len(strings)))
+
+    samples = series["values"]
+    encoded = {"labels": labels, "count": len(samples)}
+    if not samples:
+        return encoded
+
+    try:
+        timestamps, texts = zip(*samples)
+    except (TypeError, ValueError):
+        return None
+    if len(samples[0]) != 2 or set(map(type, texts)) != {str}:
+        return None
+    value_encoding = _encode_values(texts)
+    if value_encoding is None:
+        return None
+
+    timestamp_encoding = _encode_timestamps(timestamps)
+    if timestamp_encoding is None:
+        return None
+    encoded.update(timestamp_encoding)
+    encoded.update(value_encoding)
+    return encoded
+
+
+def _decode_series(encoded: Dict[str, Any], strings: List[str]) -> Dict[Any, Any]:
+    labels = encoded["labels"]
+    metric = {strings[labels[i]]: strings[labels[i + 1]] for i in range(0, len(labels), 2)}
+
+    count = encoded["count"]
+    if count == 0:
+        return {"metric": metric, "values": []}
+
+    timestamps = _decode_timestamps(encoded, count)
+    return {"metric": metric, "values": list(map(list, zip(timestamps, _decode_values(encoded))))}
+
+
+def encode_prometheus_data(prometheus_data: Dict[Any, Any]) -> Dict[Any, Any]:
+    """
+    Encode a connector response into the compact columnar storage format.
+
+    Args:
+        prometheus_data: Response JSON from the Prometheus connector
+
+    Returns:
+        The encoded document, or the input unchanged if it holds no matrix result
+    """
+    path = _find_result_path(prometheus_data)
+    if path is None:
+        return prometheus_data
+
+    strings: Dict[str, int] = {}
+    series_list = []
+    for series in _resolve(prometheus_data, path)["result"]:
+        encoded = _encode_series(series, strings) if isinstance(series, dict) else None
+        series_list.append(encoded if encoded is not None else {"raw": series})
+
+    # Copy the envelope without the (potentially large) result list
+    container = _resolve(prometheus_data, path)
+    result = container["result"]
+    container["result"] = []
+    try:
+        envelope = copy.deepcopy(prometheus_data)
+    finally:
+        container["result"] = result
+
+    return {
+        "encoding": ENCODING_VERSION,
+        "envelope": envelope,
+        "path": path,
+        "strings": list(strings),
+        "series": series_list
+    }
+
+
+def decode_prometheus_data(stored: Dict[Any, Any]) -> Dict[Any, Any]:
+    """
+    Decode a stored prometheusData field back into the connector response shape.
+
+    Documents that were not encoded (older records, non-matrix results) are returned unchanged.
+    """
+    if not isinstance(stored, dict) or stored.get("encoding") not in DECODABLE_VERSIONS:
+        return stored
+
+    strings = stored["strings"]
+    decoded = copy.deepcopy(stored["envelope"])
+    _resolve(decoded, stored["path"])["result"] = [
+        series["raw"] if "raw" in series else _decode_series(series, strings)
+        for series in stored["series"]
+    ]
+    return decoded
@@ -1,17 +1,133 @@
+import time
+
+# Start of the app import, the reference point of the startup timings
+IMPORT_STARTED = time.perf_counter()
+
+import asyncio
 import uvicorn
+from contextlib import asynccontextmanager
 from fastapi import FastAPI
-from api.promql_api import router as promql_router
+from fastapi.responses import JSONResponse, PlainTextResponse
+from config import Config
+from api.promql_api import (
+    router as promql_router, client as openai_client, check_openai, prometheus_client, metric_catalog, panel_scheduler
+)
+from dashboard.mongo_client import async_mongo_client
+from utils.metrics import MetricsMiddleware, registry as metrics_registry
+from utils.admission import DeadlineMiddleware, OverloadError
+from utils.compression import CompressionMiddleware
+from utils.readiness import DependencyMonitor, StartupTimer
+
+startup_timer = StartupTimer(IMPORT_STARTED)
+
+# Background checks warming the lazily created clients; none of them blocks startup
+dependency_monitor = DependencyMonitor(
+    interval_seconds=Config.DEPENDENCY_CHECK_INTERVAL_SECONDS,
+    recovery_interval_seconds=Config.DEPENDENCY_RECOVERY_CHECK_INTERVAL_SECONDS,
+    timeout_seconds=Config.DEPENDENCY_CHECK_TIMEOUT_SECONDS,
+    required=[name.strip() for name in Config.READINESS_REQUIRED_DEPENDENCIES.split(",") if name.strip()]
+)
+dependency_monitor.register("openai", check_openai)
+dependency_monitor.register("prometheusConnector", prometheus_client.ping)
+dependency_monitor.register("mongodb", async_mongo_client.warm_up)
+
+
+async def warm_up():
+    """Run the first round of dependency checks, then keep checking in the background"""
+    await dependency_monitor.check_all()
+    startup_timer.mark_warmed_up()
+    dependency_monitor.start()
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    """
+    Start background work (dependency warm-up, write-behind flusher, metric catalog
+    refresh, saved panel refreshes) without waiting on any dependency, and close the
+    clients created on shutdown
+    """
+    warm_up_task = asyncio.create_task(warm_up())
+    async_mongo_client.start_write_behind()
+    metric_catalog.start()
+    panel_scheduler.start()
+    yield
+    warm_up_task.cancel()
+    await dependency_monitor.stop()
+    await panel_scheduler.stop()
+    await metric_catalog.stop()
+    await prometheus_client.close()
+    if openai_client.created:
+        await openai_client.close()
+    await async_mongo_client.close_connection()
 
 # Initialize FastAPI app
 app = FastAPI(
     title="PromQL Query Generator API",
     version="0.1.0",
-    description="Generate PromQL queries from natural language using OpenAI"
+    description="Generate PromQL queries from natural language using OpenAI",
+    lifespan=lifespan
 )
 
+# Give each request a deadline used to shed upstream calls that could not finish in time
+app.add_middleware(DeadlineMiddleware)
+
+# Compress large responses with zstd or gzip as negotiated by Accept-Encoding (inside the metrics
+# middleware, so compression time shows up in Server-Timing)
+app.add_middleware(CompressionMiddleware)
+
+# Count responses per endpoint and return per-request stage timings in a Server-Timing header
+app.add_middleware(MetricsMiddleware, on_first_response=startup_timer.mark_first_response)
+
 # Register routers
 app.include_router(promql_router, prefix="/api/promql", tags=["PromQL"])
 
+@app.exception_handler(OverloadError)
+async def overload_error_handler(request, exc: OverloadError):
+    """Answer calls rejected by admission control with their status (429/503/504) and Retry-After"""
+    return JSONResponse({"detail": str(exc)}, status_code=exc.status_code, headers=exc.headers())
+
+@app.get("/metrics", include_in_schema=False)
+def metrics():
+    """Expose request, LLM, connector, MongoDB and cache metrics in the Prometheus text format"""
+    return PlainTextResponse(metrics_registry.render(), media_type="text/plain; version=0.0.4")
+
+@app.get("/healthz", include_in_schema=False)
+def healthz():
+    """Liveness: the process is up and serving, whatever the state of its dependencies"""
+    return {"status": "ok"}
+
+@app.get("/readyz", include_in_schema=False)
+def readyz():
+    """
+    Readiness with the last check of each dependency.
+
+    503 until the first round of checks has finished, or while a dependency
+    listed in READINESS_REQUIRED_DEPENDENCIES is failing.
+    """
+    status = dependency_monitor.status()
+    status["startup"] = startup_timer.stats()
+    return JSONResponse(status, status_code=200 if status["ready"] else 503)
+
+def collect_readiness_metrics():
+    """Export dependency readiness and startup timings"""
+    startup = startup_timer.stats()
+    return [
+        ("promql_generator_dependency_up", "gauge", "Whether the last check of a dependency passed", [
+            ({"dependency": name}, 1 if dependency["ready"] else 0)
+            for name, dependency in dependency_monitor.status()["dependencies"].items()
+        ]),
+        ("promql_generator_startup_seconds", "gauge", "Time from the start of the app import to each startup phase", [
+            ({"phase": "import"}, startup["importSeconds"]),
+            ({"phase": "warm_up"}, startup["warmUpSeconds"]),
+            ({"phase": "first_response"}, startup["firstResponseSeconds"]),
+        ]),
+    ]
+
+metrics_registry.register_collector(collect_readiness_metrics)
+
+startup_timer.mark_imported()
+
 # Run the server
 if __name__ == "__main__":
+    # Development server with auto-reload; production runs server.py (several workers, graceful shutdown)
     uvicorn.run("main:app", host="0.0.0.0", port=8000, reload=True)
@@ -1,4 +1,31 @@
-SYSTEM_PROMPT = """
+"""
+Prompt templates for payload generation, by version.
+
+Every version defines the system prompt and the user templates; the one in
+use is selected with PROMPT_VERSION and, together with LLM_RESPONSE_FORMAT,
+is part of the payload cache key, so payloads generated from another version
+or response format are not reused. Add a version rather than editing one
+that may have been deployed.
+
+Requests are laid out for provider-side prompt caching: the system prompt
+is identical for every request of a deployment and always comes first,
+while everything that varies (relevant metrics, current time, the question)
+follows in the user message.
+
+With LLM_RESPONSE_FORMAT=json_schema the model's output is constrained by
+payload_json_schema(), derived from the payload fields and the chart type
+to library mapping, so the system prompt only describes what to choose,
+not the JSON layout.
+"""
+import time
+from typing import Optional, Dict, Any, Callable
+
+from config import Config
+from utils.chart_enums import ChartConfig, ChartLibrary, ChartType
+from utils.token_budget import truncate_lines
+
+# Version 1: free-form JSON described in the prompt (its example object is not valid JSON)
+SYSTEM_PROMPT_V1 = """
 You are an expert in Prometheus and PromQL.
 - Always follow PromQL best practices.
 - For counters, use rate().
@@ -31,10 +58,164 @@ You are an expert in Prometheus and PromQL.
 - Ensure that start and end are **actual numeric Unix timestamps**, not placeholder strings.
 """
 
+# What each chart type is for (version 2 lists them with the library they require)
+CHART_TYPE_USES = {
+    ChartType.LINE_CHART: "time series trends such as CPU, memory or request rates",
+    ChartType.BAR_CHART: "discrete values such as top N or counts by label",
+    ChartType.AREA_CHART: "stacked values or proportions such as a traffic split",
+    ChartType.GAUGE: "a single current value such as availability",
+    ChartType.HEATMAP: "latency histograms or other bucketed data",
+}
+
+_RULES_V2 = """You are an expert in Prometheus and PromQL. Turn the request into a Prometheus range query payload.
+- Follow PromQL best practices: rate() for counters, histogram_quantile() over rate() of _bucket series for latency percentiles.
+- start and end are Unix timestamps in seconds, based on the current time given with the request; default to the last 1 hour.
+- step is a duration such as "60s" for ranges of a few hours or "5m" and more for longer ones.
+- chartType, with the chartLibrary it requires:
+{chart_types}"""
+
+_FORMAT_V2 = """
+- Reply with only a JSON object like this one, without any other text:
+{"prometheusQuery": "sum by (instance) (rate(http_requests_total[5m]))", "start": 1700000000, "end": 1700003600, "step": "60s", "chartConfig": {"chartType": "lineChart", "chartLibrary": "recharts"}}"""
+
+_METRICS_INTRO = "Metrics that exist in this Prometheus and may be relevant (name, type, label values); prefer these names:\n"
+
+
+def _system_prompt_v2(structured: bool) -> str:
+    chart_types = "\n".join(
+        f"  - {chart_type.value} ({ChartConfig.get_library_for_chart_type(chart_type).value}): {use}"
+        for chart_type, use in CHART_TYPE_USES.items()
+    )
+    prompt = _RULES_V2.format(chart_types=chart_types)
+    # The response schema already fixes the layout; describing it again would only add prompt tokens
+    return prompt if structured else prompt + _FORMAT_V2
+
+
+def _metrics_block(metrics_context: str) -> str:
+    metrics_context = truncate_lines(metrics_context, Config.PROMPT_CONTEXT_MAX_TOKENS)
+    return f"{_METRICS_INTRO}{metrics_context}\n" if metrics_context else ""
+
+
+def _query_template_v1(description: str, metrics_context: str, now: float) -> str:
+    if not metrics_context:
+        return f"Generate a complete Prometheus query payload for: {description}"
+    return (
+        f"Generate a complete Prometheus query payload for: {description}\n"
+        f"{_METRICS_INTRO}{metrics_context}"
+    )
+
+
+def _refine_template_v1(previous_payload: str, change: str, metrics_context: str, now: float) -> str:
+    prompt = (
+        f"Current Prometheus query payload:\n{previous_payload}\n"
+        f"Change it as follows, keeping everything else, and return the complete payload: {change}"
+    )
+    if not metrics_context:
+        return prompt
+    return f"{prompt}\n{_METRICS_INTRO}{metrics_context}"
+
+
+def _query_template_v2(description: str, metrics_context: str, now: float) -> str:
+    return f"{_metrics_block(metrics_context)}Current Unix time: {int(now)}\nRequest: {description}"
+
+
+def _refine_template_v2(previous_payload: str, change: str, metrics_context: str, now: float) -> str:
+    return (
+        f"{_metrics_block(metrics_context)}Current Unix time: {int(now)}\n"
+        f"Current payload: {previous_payload}\n"
+        f"Change it as follows, keeping everything else: {change}"
+    )
+
+
+class PromptVersion:
+    """System prompt and user templates of one prompt version"""
+
+    def __init__(self,
+                 system_prompt: Callable[[bool], str],
+                 query_template: Callable[[str, str, float], str],
+                 refine_template: Callable[[str, str, str, float], str]):
+        self.system_prompt = system_prompt
+        self.query_template = query_template
+        self.refine_template = refine_template
+
+
+PROMPT_VERSIONS: Dict[str, PromptVersion] = {
+    "1": PromptVersion(lambda structured: SYSTEM_PROMPT_V1, _query_template_v1, _refine_template_v1),
+    "2": PromptVersion(_system_prompt_v2, _query_template_v2, _refine_template_v2),
+}
+
+if Config.PROMPT_VERSION not in PROMPT_VERSIONS:
+    raise ValueError(f"Unknown PROMPT_VERSION {Config.PROMPT_VERSION!r}; available: {', '.join(PROMPT_VERSIONS)}")
+
+PROMPT_VERSION = Config.PROMPT_VERSION
+_prompts = PROMPT_VERSIONS[PROMPT_VERSION]
+
+# Part of the payload cache key: the system prompt differs with the response
+# format, so payloads from other prompt versions or formats are not reused
+PAYLOAD_CACHE_VERSION = f"{PROMPT_VERSION}-{Config.LLM_RESPONSE_FORMAT}"
+
+SYSTEM_PROMPT = _prompts.system_prompt(Config.LLM_RESPONSE_FORMAT == "json_schema")
+
+
+def payload_json_schema() -> Dict[str, Any]:
+    """
+    JSON schema of a generated payload, for structured outputs in strict mode.
+
+    chartConfig is one of the chart types of a library together with that
+    library, so a mismatched pair cannot be generated.
+    """
+    chart_configs = []
+    for library in ChartLibrary:
+        chart_types = [
+            chart_type.value for chart_type, chart_library in ChartConfig.CHART_TYPE_TO_LIBRARY.items()
+            if chart_library == library
+        ]
+        chart_configs.append({
+            "type": "object",
+            "properties": {
+                "chartType": {"type": "string", "enum": chart_types},
+                "chartLibrary": {"type": "string", "enum": [library.value]},
+            },
+            "required": ["chartType", "chartLibrary"],
+            "additionalProperties": False,
+        })
+    return {
+        "type": "object",
+        "properties": {
+            "prometheusQuery": {"type": "string"},
+            "start": {"type": "integer"},
+            "end": {"type": "integer"},
+            "step": {"type": "string"},
+            "chartConfig": {"anyOf": chart_configs},
+        },
+        "required": ["prometheusQuery", "start", "end", "step", "chartConfig"],
+        "additionalProperties": False,
+    }
+
+
+def response_format() -> Optional[Dict[str, Any]]:
+    """The response_format of payload generation requests for LLM_RESPONSE_FORMAT (None for plain text)"""
+    if Config.LLM_RESPONSE_FORMAT == "json_schema":
+        return {
+            "type": "json_schema",
+            "json_schema": {"name": "prometheus_query_payload", "strict": True, "schema": payload_json_schema()},
+        }
+    if Config.LLM_RESPONSE_FORMAT == "json_object":
+        return {"type": "json_object"}
+    return None
+
+
+def query_template(description: str, metrics_context: str = "", now: Optional[float] = None) -> str:
+    return _prompts.query_template(description, metrics_context, time.time() if now is None else now)
 
+def refine_template(previous_payload: str, change: str, metrics_context: str = "", now: Optional[float] = None) -> str:
+    return _prompts.refine_template(previous_payload, change, metrics_context, time.time() if now is None else now)
 
-def query_template(description: str) -> str:
-    return f"Generate a complete Prometheus query payload for: {description}"
+def repair_template(error: str) -> str:
+    return (
+        f"The payload you returned is invalid: {error}\n"
+        "Fix the problem and return ONLY the corrected JSON object with the same structure."
+    )
 
 def explain_template(query: str) -> str:
     return f"Explain this PromQL query in simple terms: {query}"
@@ -0,0 +1,189 @@
+"""
+Production entry point.
+
+    python server.py [--workers N] [--host HOST] [--port PORT]
+
+main.py's __main__ runs one auto-reloading process for development. This
+server imports the app once in the parent process (preload), binds the
+listening socket and forks the workers, which share the socket and each
+serve the app on their own event loop and CPU core. With more than one
+worker, the payload and result caches share their entries through a SQLite
+file (SHARED_CACHE_ENABLED defaults to true), so an answer computed by one
+worker is reused by the others.
+
+On SIGTERM or SIGINT the parent asks every worker to shut down. Each stops
+accepting connections, gives in-flight requests up to
+SERVER_GRACEFUL_SHUTDOWN_SECONDS to finish, then runs the app's shutdown,
+which stops the background refreshes and flushes queued MongoDB writes.
+Workers that exit unexpectedly are replaced.
+
+Background refreshes of the metric catalog and saved panels run in one
+worker at a time, elected through a lease in the same SQLite file; it
+publishes the results there for the others. MongoDB write-behind is turned
+off with more than one worker: a conversation still queued in one worker
+could not be read through another. Other per-process state remains per
+worker: /metrics reports the worker that answered the scrape.
+"""
+import argparse
+import os
+import signal
+import socket
+import sys
+import time
+from datetime import datetime
+from typing import Any, Dict
+
+import uvicorn
+
+from config import Config
+
+# Grace period for the app's shutdown (flushing writes) once the connections are drained
+SHUTDOWN_FLUSH_SECONDS = 15
+# A worker exiting sooner than this after its start is restarted after a pause, not in a tight loop
+MIN_WORKER_UPTIME_SECONDS = 1
+
+
+def log(message: str):
+    print(f"[{datetime.now().isoformat()}] {message}", flush=True)
+
+
+def bind_socket(host: str, port: int, backlog: int) -> socket.socket:
+    """Bind the listening socket the workers inherit"""
+    family = socket.AF_INET6 if ":" in host else socket.AF_INET
+    sock = socket.socket(family, socket.SOCK_STREAM)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    sock.bind((host, port))
+    sock.listen(backlog)
+    sock.set_inheritable(True)
+    return sock
+
+
+def create_server(app, backlog: int, log_level: str = "info", access_log: bool = True) -> uvicorn.Server:
+    config = uvicorn.Config(
+        app,
+        lifespan="on",
+        backlog=backlog,
+        log_level=log_level,
+        access_log=access_log,
+        timeout_graceful_shutdown=Config.SERVER_GRACEFUL_SHUTDOWN_SECONDS
+    )
+    return uvicorn.Server(config)
+
+
+class WorkerSupervisor:
+    """
+    Pre-forking process manager: forks the workers, replaces the ones that
+    exit unexpectedly and stops them all gracefully on SIGTERM/SIGINT.
+    """
+
+    def __init__(self, app, sock: socket.socket, workers: int, server_options: Dict[str, Any]):
+        self.app = app
+        self.sock = sock
+        self.workers = workers
+        self.server_options = server_options
+        # pid -> (worker index, start time)
+        self.children: Dict[int, tuple] = {}
+        self.stopping = False
+        self.stop_deadline = None
+
+    def spawn(self, index: int):
+        pid = os.fork()
+        if pid:
+            self.children[pid] = (index, time.monotonic())
+            return
+        # Worker: uvicorn handles SIGTERM/SIGINT itself while serving and re-raises them when done,
+        # which is ignored here so the worker exits normally after its graceful shutdown
+        signal.signal(signal.SIGTERM, signal.SIG_IGN)
+        signal.signal(signal.SIGINT, signal.SIG_IGN)
+        exit_code = 0
+        try:
+            create_server(self.app, **self.server_options).run(sockets=[self.sock])
+        except BaseException as e:
+            log(f"Worker {index} (pid {os.getpid()}) failed: {e!r}")
+            exit_code = 1
+        finally:
+            sys.stdout.flush()
+            os._exit(exit_code)
+
+    def stop(self, signum, frame):
+        """Signal handler: forward SIGTERM to every worker (once) and stop replacing them"""
+        if self.stopping:
+            return
+        self.stopping = True
+        self.stop_deadline = time.monotonic() + Config.SERVER_GRACEFUL_SHUTDOWN_SECONDS + SHUTDOWN_FLUSH_SECONDS
+        log(f"Received {signal.Signals(signum).name}, stopping {len(self.children)} workers")
+        for pid in list(self.children):
+            try:
+                os.kill(pid, signal.SIGTERM)
+            except ProcessLookupError:
+                pass
+
+    def run(self):
+        signal.signal(signal.SIGTERM, self.stop)
+        signal.signal(signal.SIGINT, self.stop)
+        for index in range(self.workers):
+            self.spawn(index)
+        log(f"Started {self.workers} workers: {', '.join(str(pid) for pid in self.children)}")
+
+        while self.children:
+            pid, status = os.waitpid(-1, os.WNOHANG)
+            if pid == 0:
+                if self.stopping and time.monotonic() > self.stop_deadline:
+                    log(f"Killing {len(self.children)} workers that did not stop in time")
+                    for child in self.children:
+                        os.kill(child, signal.SIGKILL)
+                    self.stop_deadline = float("inf")
+                time.sleep(0.1)
+                continue
+            if pid not in self.children:
+                continue
+            index, started = self.children.pop(pid)
+            if self.stopping:
+                continue
+            log(f"Worker {index} (pid {pid}) exited with status {os.waitstatus_to_exitcode(status)}, restarting it")
+            if time.monotonic() - started < MIN_WORKER_UPTIME_SECONDS:
+                time.sleep(MIN_WORKER_UPTIME_SECONDS)
+            self.spawn(index)
+        self.sock.close()
+        log("All workers stopped")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Run the API with several worker processes")
+    parser.add_argument("--host", default=Config.SERVER_HOST)
+    parser.add_argument("--port", type=int, default=Config.SERVER_PORT)
+    parser.add_argument("--workers", type=int, default=Config.SERVER_WORKERS,
+                        help="Worker processes (0: one per CPU core)")
+    parser.add_argument("--backlog", type=int, default=Config.SERVER_BACKLOG)
+    parser.add_argument("--log-level", default="info")
+    parser.add_argument("--no-access-log", action="store_true")
+    args = parser.parse_args(argv)
+
+    workers = args.workers or os.cpu_count() or 1
+    if workers > 1 and not hasattr(os, "fork"):
+        log("Forking workers is not supported on this platform, running a single process")
+        workers = 1
+    if "SHARED_CACHE_ENABLED" not in os.environ:
+        # Must be decided before the app (and its caches) is imported
+        Config.SHARED_CACHE_ENABLED = workers > 1
+    if workers > 1 and Config.MONGODB_WRITE_BEHIND_ENABLED:
+        # Queued conversations are only visible to the worker holding them (read-your-writes is per process)
+        log("MONGODB_WRITE_BEHIND_ENABLED is ignored with more than one worker")
+        Config.MONGODB_WRITE_BEHIND_ENABLED = False
+
+    # Preload: import the app once, so workers start without importing it again and share its pages
+    from main import app
+
+    sock = bind_socket(args.host, args.port, args.backlog)
+    log(f"Listening on {args.host}:{args.port} with {workers} workers")
+    if Config.SHARED_CACHE_ENABLED:
+        log(f"Caches shared through {Config.SHARED_CACHE_PATH}")
+    server_options = {"backlog": args.backlog, "log_level": args.log_level, "access_log": not args.no_access_log}
+    if workers == 1:
+        create_server(app, **server_options).run(sockets=[sock])
+        return
+    WorkerSupervisor(app, sock, workers, server_options).run()
+
+
+if __name__ == "__main__":
+    main()
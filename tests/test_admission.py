@@ -0,0 +1,159 @@
+import asyncio
+import logging
+import time
+
+import pytest
+
+from utils.admission import AdaptiveLimiter, CircuitBreaker, OverloadError, UpstreamGuard, _deadline
+
+
+def make_limiter(limit=1, max_queue=1, queue_timeout=1.0, **kwargs):
+    return AdaptiveLimiter("test", initial_limit=limit, min_limit=1, max_limit=kwargs.pop("max_limit", 10),
+                           max_queue=max_queue, queue_timeout=queue_timeout, latency_tolerance=2.0,
+                           backoff_ratio=0.5, **kwargs)
+
+
+def make_breaker(open_seconds=0.01, probes=2):
+    return CircuitBreaker("test", failure_rate=0.5, min_calls=4, window_seconds=60,
+                          open_seconds=open_seconds, half_open_probes=probes)
+
+
+def test_limiter_sheds_when_the_queue_is_full():
+    async def scenario():
+        limiter = make_limiter()
+        await limiter.acquire()
+        waiting = asyncio.create_task(limiter.acquire())
+        await asyncio.sleep(0)
+        with pytest.raises(OverloadError) as error:
+            await limiter.acquire()
+        assert (error.value.reason, error.value.status_code) == ("queue_full", 429)
+
+        # Releasing the slot hands it to the queued call
+        limiter.release(0.01, failed=False)
+        await waiting
+        assert (limiter.in_flight, limiter.stats()["queued"]) == (1, 0)
+        return limiter
+
+    assert asyncio.run(scenario()).shed["queue_full"] == 1
+
+
+def test_limiter_sheds_on_queue_timeout():
+    async def scenario():
+        limiter = make_limiter(queue_timeout=0.01)
+        await limiter.acquire()
+        with pytest.raises(OverloadError) as error:
+            await limiter.acquire()
+        assert error.value.reason == "queue_timeout"
+        assert limiter.stats()["queued"] == 0
+
+    asyncio.run(scenario())
+
+
+def test_limiter_sheds_calls_that_cannot_start_before_the_deadline():
+    async def scenario():
+        limiter = make_limiter()
+        limiter.short_latency = 5.0
+        await limiter.acquire()
+        token = _deadline.set(time.monotonic() + 1.0)
+        try:
+            with pytest.raises(OverloadError) as error:
+                await limiter.acquire()
+        finally:
+            _deadline.reset(token)
+        assert error.value.reason == "deadline"
+        assert error.value.headers()["Retry-After"] == "5"
+
+    asyncio.run(scenario())
+
+
+def test_limiter_grows_while_saturated_and_backs_off_on_failure():
+    async def scenario():
+        limiter = make_limiter(limit=2)
+        for _ in range(2):
+            await limiter.acquire()
+        limiter.release(0.01, failed=False)
+        assert limiter.limit == pytest.approx(2.5)
+        limiter.release(0.01, failed=True)
+        assert limiter.limit == pytest.approx(1.25)
+        assert limiter.decreases == 1
+
+    asyncio.run(scenario())
+
+
+def test_disabled_limiter_admits_everything():
+    async def scenario():
+        limiter = make_limiter(max_queue=0, enabled=False)
+        for _ in range(5):
+            await limiter.acquire()
+        assert limiter.in_flight == 5
+
+    asyncio.run(scenario())
+
+
+def test_breaker_opens_on_failure_rate_and_closes_after_probes(caplog):
+    caplog.set_level(logging.INFO, logger="utils.admission")
+    breaker = make_breaker()
+    for failed in (False, False, True):
+        breaker.before_call()
+        breaker.record(failed)
+    assert breaker.state == CircuitBreaker.CLOSED  # below min_calls
+
+    breaker.before_call()
+    breaker.record(True)
+    assert breaker.state == CircuitBreaker.OPEN
+    with pytest.raises(OverloadError) as error:
+        breaker.before_call()
+    assert (error.value.reason, error.value.status_code) == ("circuit_open", 503)
+
+    time.sleep(0.02)
+    assert breaker.before_call() is True
+    assert breaker.state == CircuitBreaker.HALF_OPEN
+    assert breaker.before_call() is True
+    with pytest.raises(OverloadError):
+        breaker.before_call()  # both probes are in flight
+
+    breaker.record(False, probe=True)
+    breaker.record(False, probe=True)
+    assert breaker.state == CircuitBreaker.CLOSED
+    assert breaker.stats()["windowCalls"] == 0
+    assert [(record.levelno, record.getMessage()) for record in caplog.records] == [
+        (logging.WARNING, f"Circuit breaker for {breaker.name} opened"),
+        (logging.INFO, f"Circuit breaker for {breaker.name} closed"),
+    ]
+
+
+def test_breaker_reopens_when_a_probe_fails():
+    breaker = make_breaker()
+    for _ in range(4):
+        breaker.record(True)
+    time.sleep(0.02)
+    probe = breaker.before_call()
+    breaker.record(True, probe=probe)
+    assert breaker.state == CircuitBreaker.OPEN
+    assert breaker.opened == 2
+
+
+def test_guard_counts_only_upstream_failures():
+    class ClientError(Exception):
+        pass
+
+    guard = UpstreamGuard("test", make_limiter(limit=4), make_breaker(open_seconds=60),
+                          is_failure=lambda error: not isinstance(error, ClientError))
+
+    async def fail(error):
+        raise error
+
+    async def scenario():
+        for _ in range(4):
+            with pytest.raises(ClientError):
+                await guard.call(fail, ClientError())
+        assert guard.breaker.state == CircuitBreaker.CLOSED
+        for _ in range(4):
+            with pytest.raises(RuntimeError):
+                await guard.call(fail, RuntimeError())
+        with pytest.raises(OverloadError) as error:
+            await guard.call(fail, RuntimeError())
+        assert error.value.status_code == 503
+        assert guard.limiter.in_flight == 0
+
+    asyncio.run(scenario())
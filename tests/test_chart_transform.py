@@ -0,0 +1,59 @@
+import math
+
+import numpy as np
+
+from utils.chart_transform import lttb_indices, transform_for_chart
+
+
+def _matrix(series):
+    return {"status": "success", "data": {"resultType": "matrix", "result": series}}
+
+
+def _series(index, points, offset=0, step=15):
+    return {
+        "metric": {"__name__": "up", "instance": str(index)},
+        "values": [[1700000000 + offset + i * step, str(math.sin(i / 50 + index))] for i in range(points)],
+    }
+
+
+def test_line_chart_rows_are_capped_at_max_points_for_misaligned_series():
+    data = _matrix([_series(index, 2000, offset=index, step=60) for index in range(20)])
+    chart = transform_for_chart(data, {"chartType": "lineChart"}, 500)
+    assert len(chart["data"]) <= 500
+    assert chart["downsampled"] and chart["originalPoints"] == 40000
+    # Every row carries every series (None where it has no sample)
+    assert all(len(row) == 21 for row in chart["data"])
+
+
+def test_line_chart_keeps_first_and_last_points_and_every_series():
+    data = _matrix([_series(index, 1000) for index in range(5)])
+    chart = transform_for_chart(data, {"chartType": "lineChart"}, 100)
+    assert len(chart["data"]) == 100
+    assert chart["data"][0]["timestamp"] == 1700000000
+    assert chart["data"][-1]["timestamp"] == 1700000000 + 999 * 15
+    assert all(row[f"s{index}"] is not None for row in chart["data"] for index in range(5))
+
+
+def test_small_results_are_not_downsampled():
+    data = _matrix([_series(0, 50)])
+    chart = transform_for_chart(data, {"chartType": "areaChart"}, 100)
+    assert len(chart["data"]) == 50 and not chart["downsampled"]
+
+
+def test_shared_lttb_picks_the_spike_of_any_series():
+    x = np.arange(100, dtype=np.float64)
+    y = np.zeros((2, 100))
+    y[1, 37] = 1000.0
+    indices = lttb_indices(x, y, 10, shared=True)
+    assert indices.shape == (1, 10)
+    assert 37 in indices[0]
+
+
+def test_gauge_uses_the_latest_finite_value():
+    data = _matrix([
+        {"metric": {"job": "a"}, "values": [[1, "1"], [2, "5"], [3, "NaN"]]},
+        {"metric": {"job": "b"}, "values": []},
+    ])
+    chart = transform_for_chart(data, {"chartType": "gauge"}, 100)
+    assert chart["value"] == 5.0
+    assert [series["value"] for series in chart["series"]] == [5.0, None]
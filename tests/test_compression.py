@@ -0,0 +1,116 @@
+import gzip
+import json
+
+import pytest
+from fastapi import FastAPI
+from fastapi.responses import StreamingResponse
+from fastapi.testclient import TestClient
+
+import utils.compression as compression
+from api.promql_api import PrometheusDataResponse
+from config import Config
+from utils.compression import CompressionMiddleware, negotiate_encoding
+from utils.serialization import FastJSONResponse, dumps, json_response
+
+MIN_BYTES = 1024
+
+# Shaped like the results the API serves: repeated label sets, string sample values, nested chart data
+PROMETHEUS_DATA = {"status": "success", "data": {"resultType": "matrix", "result": [
+    {"metric": {"__name__": "http_requests_total", "job": "api", "path": "/café"},
+     "values": [[1700000000 + 60 * index, str(index * 0.1)] for index in range(200)]}
+]}}
+RESPONSE_FIELDS = {
+    "conversation_id": "c1",
+    "generated_payload": {"prometheusQuery": 'sum(rate(http_requests_total{job="api"}[5m]))',
+                          "start": 1700000000, "end": 1700012000, "step": "60s"},
+    "prometheus_data": PROMETHEUS_DATA,
+    "success": True,
+    "message": "Successfully executed query",
+    "chart_data": {"series": [{"name": "api", "points": [[1700000000, 0.1], [1700000060, 1e-7]]}]},
+    "answered_by": "llm",
+}
+
+
+def make_client():
+    app = FastAPI()
+    app.add_middleware(CompressionMiddleware, minimum_size=MIN_BYTES)
+
+    @app.get("/data")
+    def data(size: int):
+        return FastJSONResponse({"padding": "x" * size})
+
+    @app.get("/stream")
+    def stream():
+        return StreamingResponse((line for line in [b'{"a":1}\n' * 200, b'{"b":2}\n' * 200]),
+                                 media_type="application/x-ndjson")
+
+    return TestClient(app)
+
+
+@pytest.mark.parametrize("accept_encoding,encoding", [
+    ("gzip, deflate, br, zstd", "zstd"),
+    ("gzip;q=1.0, zstd;q=0.5", "gzip"),
+    ("zstd;q=0, gzip", "gzip"),
+    ("*", "zstd"),
+    ("br, identity", None),
+    ("gzip;q=0", None),
+])
+def test_negotiation_prefers_zstd_unless_gzip_is_weighted_higher(monkeypatch, accept_encoding, encoding):
+    monkeypatch.setattr(compression, "supported_encodings", lambda: ["zstd", "gzip"])
+    assert negotiate_encoding(accept_encoding) == encoding
+
+
+def test_zstd_is_not_offered_without_zstandard(monkeypatch):
+    monkeypatch.setattr(compression, "zstandard", None)
+    assert negotiate_encoding("zstd, gzip;q=0.5") == "gzip"
+    assert negotiate_encoding("zstd") is None
+
+
+def test_responses_at_the_minimum_size_are_gzipped():
+    client = make_client()
+    response = client.get("/data", params={"size": MIN_BYTES}, headers={"Accept-Encoding": "gzip"})
+    assert response.headers["content-encoding"] == "gzip"
+    assert response.headers["vary"] == "Accept-Encoding"
+    assert int(response.headers["content-length"]) < MIN_BYTES
+    assert response.json() == {"padding": "x" * MIN_BYTES}
+
+
+def test_small_responses_and_clients_without_gzip_get_identity():
+    client = make_client()
+    small = client.get("/data", params={"size": MIN_BYTES // 2}, headers={"Accept-Encoding": "gzip"})
+    assert "content-encoding" not in small.headers
+    identity = client.get("/data", params={"size": MIN_BYTES}, headers={"Accept-Encoding": "identity"})
+    assert "content-encoding" not in identity.headers
+
+
+def test_streamed_responses_pass_through_uncompressed():
+    client = make_client()
+    response = client.get("/stream", headers={"Accept-Encoding": "gzip"})
+    assert "content-encoding" not in response.headers
+    assert response.content == b'{"a":1}\n' * 200 + b'{"b":2}\n' * 200
+
+
+def test_zstd_round_trip():
+    zstandard = pytest.importorskip("zstandard")
+    body = dumps(PROMETHEUS_DATA)
+    assert zstandard.ZstdDecompressor().decompress(compression.compress(body, "zstd")) == body
+    assert gzip.decompress(compression.compress(body, "gzip")) == body
+
+
+def _stdlib_dumps(value):
+    return json.dumps(value, separators=(",", ":"), ensure_ascii=False).encode("utf-8")
+
+
+def test_fast_encoding_matches_the_stdlib_encoding():
+    # Connector data (string sample values, unicode labels) encodes to the same bytes
+    assert dumps(PROMETHEUS_DATA) == _stdlib_dumps(PROMETHEUS_DATA)
+    # Floats may be spelled differently (1e-7 vs 1e-07) but decode to the same values
+    assert json.loads(dumps(RESPONSE_FIELDS)) == json.loads(_stdlib_dumps(RESPONSE_FIELDS)) == RESPONSE_FIELDS
+
+
+def test_json_response_matches_the_response_model(monkeypatch):
+    response = json_response(PrometheusDataResponse, **RESPONSE_FIELDS)
+    assert json.loads(response.body) == PrometheusDataResponse(**RESPONSE_FIELDS).model_dump()
+
+    monkeypatch.setattr(Config, "FAST_JSON_RESPONSES_ENABLED", False)
+    assert isinstance(json_response(PrometheusDataResponse, **RESPONSE_FIELDS), PrometheusDataResponse)
@@ -0,0 +1,70 @@
+import pytest
+
+from api.promql_api import match_fast_path
+from utils.intent_matcher import match_intent, match_refinement, regroup_query, widen_range_selectors
+
+NOW = 1700000000
+
+
+@pytest.mark.parametrize("question,query", [
+    ("show cpu usage by instance over the last 6 hours",
+     '100 * (1 - avg by (instance) (rate(node_cpu_seconds_total{mode="idle"}[5m])))'),
+    ("p99 latency for the checkout service",
+     'histogram_quantile(0.99, sum by (le) (rate(http_request_duration_seconds_bucket{service="checkout"}[5m])))'),
+    ("top 5 pods by request rate", "topk(5, sum by (pod) (rate(http_requests_total[5m])))"),
+    ("error ratio of http requests by service",
+     'sum by (service) (rate(http_requests_total{status=~"5.."}[5m])) / sum by (service) (rate(http_requests_total[5m]))'),
+])
+def test_stock_questions_are_fully_explained(question, query):
+    match = match_intent(question, now=NOW)
+    assert match.confidence == 1.0
+    assert match.payload["prometheusQuery"] == query
+    assert match_fast_path(question, "test")["prometheusQuery"] == query
+
+
+def test_window_and_step_follow_the_question():
+    payload = match_intent("request rate per pod last 24h", now=NOW).payload
+    assert (payload["start"], payload["end"], payload["step"]) == (NOW - 86400, NOW, "300s")
+
+
+@pytest.mark.parametrize("question", [
+    "error rate for 4xx",
+    "how many requests failed",
+    "latency of checkout service except p50",
+    "requests that are not 200",
+    "errors excluding the health endpoint",
+    "cpu usage on node 10.0.0.1",
+    "successful requests per second",
+    "requests slower than 2 seconds",
+    "error rate by status",
+    "error ratio per status code",
+])
+def test_near_misses_fall_through_to_the_llm(question):
+    match = match_intent(question, now=NOW)
+    assert match is None or match.confidence < 1.0
+    assert match_fast_path(question, "test") is None
+
+
+def test_two_intents_are_left_to_the_llm():
+    assert match_intent("cpu and memory usage", now=NOW) is None
+
+
+def test_refinement_changes_window_grouping_and_chart():
+    payload = {"prometheusQuery": "sum(rate(http_requests_total[5m]))", "start": 0, "end": 3600, "step": "60s"}
+    refinement = match_refinement("same but last 24h grouped by pod as a bar chart", payload, {}, now=NOW)
+    assert refinement.payload["prometheusQuery"] == "sum by (pod) (rate(http_requests_total[5m]))"
+    assert (refinement.payload["start"], refinement.payload["end"], refinement.payload["step"]) == (NOW - 86400, NOW, "300s")
+    assert refinement.chart_config["chartType"] == "barChart"
+    assert refinement.remaining == ""
+
+
+def test_regroup_keeps_le_and_refuses_label_matching():
+    query = "histogram_quantile(0.9, sum by (le, pod) (rate(x_bucket[5m])))"
+    assert regroup_query(query, "service") == "histogram_quantile(0.9, sum by (le, service) (rate(x_bucket[5m])))"
+    assert regroup_query("a / on (job) b", "pod") is None
+
+
+def test_only_range_selectors_shorter_than_the_step_are_widened():
+    query = 'sum(rate(x{path="[5m]"}[5m])) / sum(rate(y[2h])) + max_over_time(z[1h:5m])'
+    assert widen_range_selectors(query, 3600) == \
+        'sum(rate(x{path="[5m]"}[1h])) / sum(rate(y[2h])) + max_over_time(z[1h:5m])'
@@ -0,0 +1,79 @@
+import asyncio
+
+from api.internal.metric_catalog import MetricCatalog, infer_metric_type
+from utils.shared_store import SharedStore
+
+NOW = 1700000000
+
+
+class FakeConnector:
+    """Answers the catalog's instant queries from a fixed set of series"""
+
+    def __init__(self, series):
+        self.series = series
+        self.calls = []
+
+    async def fetch_prometheus_data(self, payload, conversation_id=None, guard=None):
+        self.calls.append((payload, guard))
+        query = payload["prometheusQuery"]
+        key = query.split("(__name__, ")[1].split(")")[0] if "(__name__, " in query else None
+        result = [
+            {"metric": {"__name__": labels["__name__"], **({key: labels[key]} if key else {})}, "values": []}
+            for labels in self.series if key is None or labels.get(key)
+        ]
+        return {"status": "success", "data": {"resultType": "matrix", "result": result}}
+
+
+def refreshed_catalog(series):
+    connector = FakeConnector(series)
+    catalog = MetricCatalog(connector)
+    catalog.label_keys = ["service"]
+    asyncio.run(catalog.refresh(now=NOW))
+    return catalog, connector
+
+
+def test_refresh_uses_instant_selectors_and_its_own_guard():
+    catalog, connector = refreshed_catalog([{"__name__": "http_requests_total", "service": "checkout"}])
+    queries = [payload["prometheusQuery"] for payload, _ in connector.calls]
+    assert queries == ['group by (__name__) ({__name__=~".+"})',
+                       'group by (__name__, service) ({__name__=~".+", service!=""})']
+    assert all(payload["start"] == payload["end"] == NOW for payload, _ in connector.calls)
+    assert all(guard is catalog.guard for _, guard in connector.calls)
+
+
+def test_search_ranks_names_and_label_values():
+    catalog, _ = refreshed_catalog([
+        {"__name__": "http_requests_total", "service": "checkout"},
+        {"__name__": "http_request_duration_seconds_bucket", "service": "cart"},
+        {"__name__": "node_memory_MemAvailable_bytes"},
+    ])
+    assert catalog.search("latency of requests", 1) == ["http_request_duration_seconds_bucket"]
+    assert catalog.search("checkout requests", 1) == ["http_requests_total"]
+    assert "service=checkout" in catalog.prompt_context("checkout requests", k=1)
+
+
+def test_infer_metric_type_from_suffix():
+    assert infer_metric_type("x_bucket") == "histogram"
+    assert infer_metric_type("x_total") == "counter"
+    assert infer_metric_type("build_info") == "info"
+    assert infer_metric_type("x_bytes") == "gauge"
+
+
+def test_follower_loads_the_catalog_the_leader_published(tmp_path):
+    path = str(tmp_path / "cache.sqlite")
+    leader = MetricCatalog(FakeConnector([{"__name__": "http_requests_total", "service": "checkout"}]),
+                           shared=SharedStore(path, "catalog", 1_000_000))
+    follower_connector = FakeConnector([])
+    follower = MetricCatalog(follower_connector, shared=SharedStore(path, "catalog", 1_000_000))
+    leader.label_keys = ["service"]
+
+    async def scenario():
+        await leader.refresh(now=NOW)
+        await leader.publish()
+        assert await follower.load_shared()
+        assert not await follower.load_shared()  # nothing newer
+
+    asyncio.run(scenario())
+    assert follower_connector.calls == []
+    assert follower.search("checkout requests", 1) == ["http_requests_total"]
+    assert follower.stats()["loadsFromSharedStore"] == 1
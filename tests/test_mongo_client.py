@@ -0,0 +1,144 @@
+import asyncio
+import logging
+
+import pytest
+from pymongo.errors import BulkWriteError, DuplicateKeyError
+
+from config import Config
+from dashboard.mongo_client import AsyncMongoDBClient, build_conversation_document
+
+
+class FakeCollection:
+    """Conversations collection with a unique conversationId and scripted write failures"""
+
+    def __init__(self):
+        self.documents = {}
+        self.insert_many_calls = []
+        # conversationIds whose next insert fails with a transient write error
+        self.fail_once = set()
+        # Cleared to hold insert_many until the test sets it again
+        self.gate = asyncio.Event()
+        self.gate.set()
+
+    async def insert_many(self, documents, ordered=True):
+        await self.gate.wait()
+        self.insert_many_calls.append([document["conversationId"] for document in documents])
+        errors = []
+        for index, document in enumerate(documents):
+            conversation_id = document["conversationId"]
+            if conversation_id in self.fail_once:
+                self.fail_once.discard(conversation_id)
+                errors.append({"index": index, "code": 91, "errmsg": "shutdown in progress"})
+            elif conversation_id in self.documents:
+                errors.append({"index": index, "code": 11000, "errmsg": "duplicate key"})
+            else:
+                self.documents[conversation_id] = document
+        if errors:
+            raise BulkWriteError({"writeErrors": errors, "nInserted": len(documents) - len(errors)})
+
+    async def insert_one(self, document):
+        if document["conversationId"] in self.documents:
+            raise DuplicateKeyError("duplicate key")
+        self.documents[document["conversationId"]] = document
+
+    async def find_one(self, query, projection=None):
+        document = self.documents.get(query["conversationId"])
+        return {key: value for key, value in document.items() if key != "_id"} if document else None
+
+
+def _document(conversation_id):
+    return build_conversation_document(conversation_id, "cpu usage", {"prometheusQuery": "up"}, {}, 200)
+
+
+@pytest.fixture
+def client(monkeypatch):
+    monkeypatch.setattr(Config, "MONGODB_WRITE_FLUSH_INTERVAL_SECONDS", 0.01)
+    monkeypatch.setattr(Config, "MONGODB_WRITE_MAX_ATTEMPTS", 3)
+    client = AsyncMongoDBClient()
+    client.write_behind = True
+    client._collection = FakeCollection()
+    return client
+
+
+def store(client, conversation_id):
+    return client.store_conversation(conversation_id, "cpu usage", {"prometheusQuery": "up"}, {}, 200)
+
+
+def test_partial_flush_retries_only_unwritten_documents(client, caplog):
+    collection = client._collection
+    collection.documents["b"] = _document("b")
+    collection.fail_once.add("c")
+
+    with caplog.at_level(logging.INFO, logger="dashboard.mongo_client"):
+        asyncio.run(client._insert_batch([_document("a"), _document("b"), _document("c")]))
+
+    # The duplicate counts as stored; only the transient failure is retried
+    assert collection.insert_many_calls == [["a", "b", "c"], ["c"]]
+    assert set(collection.documents) == {"a", "b", "c"}
+    assert "Dropping" not in caplog.text
+
+
+def test_flush_gives_up_after_the_configured_attempts(client, caplog):
+    collection = client._collection
+
+    async def always_fail(documents, ordered=True):
+        collection.insert_many_calls.append([document["conversationId"] for document in documents])
+        # The last document never gets written
+        raise BulkWriteError({"writeErrors": [
+            {"index": len(documents) - 1, "code": 91, "errmsg": "shutdown in progress"}
+        ]})
+
+    collection.insert_many = always_fail
+    asyncio.run(client._insert_batch([_document("a"), _document("b")]))
+    assert collection.insert_many_calls == [["a", "b"], ["b"], ["b"]]
+    assert "Dropping 1 conversations after 3 failed flushes" in caplog.text
+
+
+def test_queued_conversation_is_readable_before_it_is_flushed(client):
+    async def scenario():
+        client._collection.gate.clear()
+        assert await store(client, "a")
+        pending = await client.get_conversation("a")
+        assert pending["conversationId"] == "a" and "a" not in client._collection.documents
+
+        client._collection.gate.set()
+        await client.flush()
+        assert "a" not in client._pending_documents
+        assert (await client.get_conversation("a"))["conversationId"] == "a"
+        await client.stop_write_behind()
+
+    asyncio.run(scenario())
+
+
+def test_stopping_flushes_every_queued_conversation(client):
+    async def scenario():
+        for conversation_id in ("a", "b", "c"):
+            assert await store(client, conversation_id)
+        await client.stop_write_behind()
+
+    asyncio.run(scenario())
+    assert set(client._collection.documents) == {"a", "b", "c"}
+    assert client._pending_documents == {}
+
+
+def test_full_queue_falls_back_to_a_direct_insert(client, monkeypatch):
+    monkeypatch.setattr(Config, "MONGODB_WRITE_QUEUE_SIZE", 1)
+    monkeypatch.setattr(Config, "MONGODB_WRITE_QUEUE_TIMEOUT_SECONDS", 0.05)
+    collection = client._collection
+
+    async def scenario():
+        collection.gate.clear()
+        # The flusher takes the first conversation and waits on MongoDB, the second fills the queue
+        assert await store(client, "a")
+        await asyncio.sleep(0.05)
+        assert await store(client, "b")
+
+        # The third cannot be queued in time and is inserted directly instead of blocking
+        assert await asyncio.wait_for(store(client, "c"), timeout=1)
+        assert list(collection.documents) == ["c"]
+
+        collection.gate.set()
+        await client.stop_write_behind()
+
+    asyncio.run(scenario())
+    assert set(collection.documents) == {"a", "b", "c"}
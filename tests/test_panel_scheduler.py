@@ -0,0 +1,184 @@
+import asyncio
+import logging
+import time
+from types import SimpleNamespace
+
+from api.internal.panel_scheduler import PanelScheduler, SavedPanel
+from config import Config
+from utils.shared_store import SharedLease, SharedStore
+
+
+class FakeMongo:
+    """Panel definitions shared by every scheduler, as in MongoDB"""
+
+    def __init__(self):
+        self.panels = {}
+
+    async def store_panel(self, panel):
+        self.panels[panel["panelId"]] = panel
+        return True
+
+    async def delete_panel(self, panel_id):
+        self.panels.pop(panel_id, None)
+        return True
+
+    async def list_panels(self):
+        return list(self.panels.values())
+
+    async def list_panel_results(self):
+        return []
+
+    async def store_panel_result(self, refresh_key, result):
+        return True
+
+
+class FakePlanner:
+    def __init__(self):
+        self.executed = 0
+
+    def plan(self, payload):
+        return SimpleNamespace(payload=payload)
+
+    async def execute(self, plan, conversation_id=None):
+        self.executed += 1
+        return {"data": {"resultType": "matrix", "result": []}}
+
+
+CONVERSATION = {
+    "conversationId": "c1",
+    "naturalLanguageQuery": "up",
+    "success": 200,
+    "generatedPayload": {"prometheusQuery": "up", "start": 0, "end": 3600, "step": "60s"},
+    "chartConfig": {"chartType": "lineChart"},
+}
+
+
+def test_only_the_lease_holder_refreshes_and_the_others_read_its_results(tmp_path):
+    path = str(tmp_path / "cache.sqlite")
+    mongo = FakeMongo()
+    planners = [FakePlanner(), FakePlanner()]
+    leader, follower = [
+        PanelScheduler(planner, mongo, lease=SharedLease(path, "panels", 30, owner=owner),
+                       shared=SharedStore(path, "panels", 1_000_000))
+        for planner, owner in zip(planners, ("leader", "follower"))
+    ]
+
+    async def scenario():
+        assert await leader.lease.acquire()
+        assert not await follower.lease.acquire()
+
+        # Saved through the follower, picked up by the leader on its next sync
+        panel = await follower.add_panel(CONVERSATION, refresh_interval=30)
+        await leader.sync()
+        await leader.refresh(leader.groups[panel.key])
+        leader.shared.flush()
+
+        result = await follower.latest_result(follower.panels[panel.panel_id])
+        assert result["refreshedAt"] == leader.groups[panel.key].refreshed_at
+        assert follower.panel_status(follower.panels[panel.panel_id])["status"] == "fresh"
+
+        # Deleted through the leader, dropped by the follower on its next sync
+        await leader.delete_panel(panel.panel_id)
+        await follower.sync()
+        assert follower.panels == {} and follower.groups == {}
+
+    asyncio.run(scenario())
+    assert (planners[0].executed, planners[1].executed) == (1, 0)
+    assert leader.stats()["leading"] and not follower.stats()["leading"]
+
+
+def test_saved_panel_round_trips_through_its_document():
+    panel = SavedPanel("p1", "c1", "up", "up", 3600, "60s", {"chartType": "lineChart"}, 30, name="Up")
+    assert SavedPanel.from_document(panel.to_document()).to_document() == panel.to_document()
+
+
+def _conversation(step="60s", query="up"):
+    payload = {**CONVERSATION["generatedPayload"], "prometheusQuery": query, "step": step}
+    return {**CONVERSATION, "generatedPayload": payload}
+
+
+def test_panels_with_the_same_query_range_and_step_share_a_refresh_group():
+    scheduler = PanelScheduler(FakePlanner(), FakeMongo())
+
+    async def scenario():
+        slow = await scheduler.add_panel(_conversation(), refresh_interval=60)
+        fast = await scheduler.add_panel(_conversation(), refresh_interval=20)
+        other_step = await scheduler.add_panel(_conversation(step="5m"), refresh_interval=60)
+        return slow, fast, other_step
+
+    slow, fast, other_step = asyncio.run(scenario())
+    assert slow.key == fast.key != other_step.key
+    group = scheduler.groups[slow.key]
+    assert group.panel_ids == {slow.panel_id, fast.panel_id}
+    assert group.interval == 20
+    assert scheduler.panel_status(slow)["sharedWith"] == 1
+
+
+def test_shorter_interval_brings_the_next_refresh_forward_and_deleting_restores_it():
+    scheduler = PanelScheduler(FakePlanner(), FakeMongo())
+
+    async def scenario():
+        slow = await scheduler.add_panel(_conversation(), refresh_interval=60)
+        group = scheduler.groups[slow.key]
+        await scheduler.refresh(group)
+        scheduler._schedule_group(group, group.refreshed_at + 60)
+
+        fast = await scheduler.add_panel(_conversation(), refresh_interval=10)
+        assert group.interval == 10
+        assert group.next_due == group.refreshed_at + 10
+
+        await scheduler.delete_panel(fast.panel_id)
+        assert group.interval == 60 and group.panel_ids == {slow.panel_id}
+
+    asyncio.run(scenario())
+    # Joining a group that already has a result does not refresh it again
+    assert scheduler.query_planner.executed == 1
+
+
+def test_staleness_follows_each_panels_own_interval(monkeypatch):
+    monkeypatch.setattr(Config, "PANEL_STALE_AFTER_INTERVALS", 3)
+    scheduler = PanelScheduler(FakePlanner(), FakeMongo())
+
+    async def scenario():
+        return (await scheduler.add_panel(_conversation(), refresh_interval=30),
+                await scheduler.add_panel(_conversation(), refresh_interval=60))
+
+    fast, slow = asyncio.run(scenario())
+    assert scheduler.panel_status(fast)["status"] == "pending"
+
+    group = scheduler.groups[fast.key]
+    group.refreshed_at = time.time() - 60
+    assert scheduler.panel_status(fast)["status"] == "fresh"
+
+    # 100s is more than three 30s intervals but less than three 60s intervals
+    group.refreshed_at = time.time() - 100
+    assert scheduler.panel_status(fast)["status"] == "stale"
+    assert scheduler.panel_status(slow)["status"] == "fresh"
+    assert scheduler.stats()["panelsByStatus"] == {"pending": 0, "fresh": 1, "stale": 1}
+
+
+def test_failed_refresh_keeps_the_last_result_and_logs_a_warning(caplog):
+    planner = FakePlanner()
+    scheduler = PanelScheduler(planner, FakeMongo())
+
+    async def failing_execute(plan, conversation_id=None):
+        raise RuntimeError("connector unavailable")
+
+    async def scenario():
+        panel = await scheduler.add_panel(_conversation(), refresh_interval=30)
+        group = scheduler.groups[panel.key]
+        await scheduler.refresh(group)
+        result = group.result
+
+        planner.execute = failing_execute
+        await scheduler.refresh(group)
+        await scheduler.refresh(group)
+        return panel, group, result
+
+    with caplog.at_level(logging.WARNING, logger="api.internal.panel_scheduler"):
+        panel, group, result = asyncio.run(scenario())
+    assert group.result is result
+    status = scheduler.panel_status(panel)
+    assert status["lastError"] == "connector unavailable" and status["consecutiveFailures"] == 2
+    assert scheduler.stats()["refreshFailures"] == 2
+    assert [record.levelno for record in caplog.records] == [logging.WARNING, logging.WARNING]
@@ -0,0 +1,45 @@
+import asyncio
+
+import prompts.promql_query_prompts as query_prompt
+from config import Config
+from utils.payload_cache import PayloadCache, normalize_query
+
+
+def test_normalize_folds_case_whitespace_and_durations():
+    assert normalize_query("CPU usage   last 1 hour.") == "cpu usage last 1h"
+    assert normalize_query("p99 latency over 5 min?") == "p99 latency over 5m"
+    assert normalize_query("Rate of errors!") == "rate of errors"
+
+
+def test_normalize_spacing_around_operators_is_irrelevant():
+    assert normalize_query("status!=200 last 1h") == normalize_query("status != 200, last 1 hour")
+
+
+def test_negated_and_compared_queries_get_different_keys():
+    pairs = [
+        ("requests with status != 200 last 1h", "requests with status = 200 last 1h"),
+        ("cpu > 80% by instance", "cpu < 80% by instance"),
+        ("cpu >= 80 by instance", "cpu > 80 by instance"),
+        ('jobs =~ "api.*"', 'jobs !~ "api.*"'),
+        ("errors above 5%", "errors above 5"),
+    ]
+    for first, second in pairs:
+        assert normalize_query(first) != normalize_query(second), (first, second)
+        assert PayloadCache.make_key(first, "model", "2") != PayloadCache.make_key(second, "model", "2")
+
+
+def test_cache_version_includes_the_response_format():
+    assert query_prompt.PAYLOAD_CACHE_VERSION == f"{Config.PROMPT_VERSION}-{Config.LLM_RESPONSE_FORMAT}"
+    assert PayloadCache.make_key("cpu usage", "model", "2-json_schema") != \
+        PayloadCache.make_key("cpu usage", "model", "2-json_object")
+
+
+def test_cached_payload_is_reanchored_to_now():
+    cache = PayloadCache(max_size=10, ttl_seconds=60)
+    payload = {"prometheusQuery": "up", "start": 1000, "end": 4600, "step": "60s"}
+    assert cache.put("Up last hour", "model", "2", payload, now=5000)
+
+    hit = asyncio.run(cache.get("up last hour", "model", "2", now=5030))
+    assert hit == {"prometheusQuery": "up", "start": 5030 - 3600, "end": 5030, "step": "60s"}
+    assert asyncio.run(cache.get("down last hour", "model", "2", now=5030)) is None
+    assert asyncio.run(cache.get("up last hour", "model", "2", now=5061)) is None
@@ -0,0 +1,65 @@
+import bson
+
+from dashboard.prometheus_codec import ENCODING_VERSION, decode_prometheus_data, encode_prometheus_data
+
+
+def _matrix(*series):
+    return {"status": "success", "data": {"resultType": "matrix", "result": list(series)}}
+
+
+def _round_trip(data):
+    stored = bson.decode(bson.encode({"prometheusData": encode_prometheus_data(data)}))["prometheusData"]
+    return stored, decode_prometheus_data(stored)
+
+
+def test_values_are_packed_as_float64_and_decode_exactly():
+    data = _matrix(
+        {"metric": {"job": "api"}, "values": [[1700000000, "0.016666666666666666"], [1700000060, "12.5"], [1700000120, "3"]]},
+        {"metric": {"job": "db"}, "values": [[1700000000, "0"], [1700000060, "42"], [1700000120, "123456789012"]]},
+    )
+    stored, decoded = _round_trip(data)
+    assert stored["encoding"] == ENCODING_VERSION
+    assert all("floats" in series and "values" not in series for series in stored["series"])
+    assert decoded == data
+
+
+def test_values_that_do_not_format_back_keep_their_strings():
+    data = _matrix(
+        {"metric": {}, "values": [[1700000000, "NaN"], [1700000060, "+Inf"]]},
+        {"metric": {}, "values": [[1700000000, "0.00001"], [1700000060, "1"]]},
+        {"metric": {}, "values": [[1700000000, "1.50"], [1700000060, "1e3"]]},
+    )
+    stored, decoded = _round_trip(data)
+    assert all("values" in series for series in stored["series"])
+    assert decoded == data
+
+
+def test_mixed_integer_and_float_timestamps_keep_their_types():
+    data = _matrix({"metric": {"job": "api"}, "values": [[1700000000, "1"], [1700000000.5, "2"], [1700000001, "3"]]})
+    _, decoded = _round_trip(data)
+    assert decoded == data
+    assert [type(timestamp) for timestamp, _ in decoded["data"]["result"][0]["values"]] == [int, float, int]
+
+
+def test_irregular_timestamps_and_unencodable_series_round_trip():
+    data = _matrix(
+        {"metric": {"job": "api"}, "values": [[1700000000.25, "1"], [1700000015.5, "2"], [1700000100, "3"]]},
+        {"metric": {"job": "api"}, "histograms": [[1700000000, {"count": "1"}]]},
+        {"metric": {"job": "api"}, "values": []},
+    )
+    stored, decoded = _round_trip(data)
+    assert "raw" in stored["series"][1]
+    assert decoded == data
+
+
+def test_unencoded_and_non_matrix_documents_are_returned_unchanged():
+    vector = {"status": "success", "data": {"resultType": "vector", "result": []}}
+    assert encode_prometheus_data(vector) is vector
+    assert decode_prometheus_data(vector) is vector
+
+
+def test_columnar_v1_documents_still_decode():
+    data = _matrix({"metric": {"job": "api"}, "values": [[1700000000, "NaN"], [1700000060, "2"]]})
+    stored, _ = _round_trip(data)
+    stored["encoding"] = "columnar-v1"
+    assert decode_prometheus_data(stored) == data
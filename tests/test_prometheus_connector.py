@@ -0,0 +1,176 @@
+import asyncio
+import json
+
+import httpx
+import pytest
+
+from api.internal.prometheus_connector import AsyncPrometheusClient
+from config import Config
+
+PAYLOAD = {"prometheusQuery": "up", "start": 0, "end": 600, "step": "60s"}
+MATRIX = {"status": "success", "data": {"resultType": "matrix", "result": [
+    {"metric": {"job": "api"}, "values": [[0, "1"], [60, "1"]]}
+]}}
+
+
+class Connector:
+    """Mocked connector: answers each request with the next scripted response, after an optional delay"""
+
+    def __init__(self, *responses, delay=0.0):
+        self.responses = list(responses)
+        self.delay = delay
+        self.requests = []
+        self.cancelled = 0
+
+    async def handler(self, request):
+        self.requests.append(json.loads(request.content))
+        response = self.responses.pop(0) if len(self.responses) > 1 else self.responses[0]
+        try:
+            await asyncio.sleep(response[2] if len(response) > 2 else self.delay)
+        except asyncio.CancelledError:
+            self.cancelled += 1
+            raise
+        status_code, body = response[:2]
+        return httpx.Response(status_code, json=body)
+
+
+@pytest.fixture(autouse=True)
+def fast_retries(monkeypatch):
+    monkeypatch.setattr(Config, "PROMETHEUS_CONNECTOR_HEDGING_ENABLED", False)
+    monkeypatch.setattr(Config, "PROMETHEUS_CONNECTOR_MAX_RETRIES", 2)
+    monkeypatch.setattr(Config, "PROMETHEUS_CONNECTOR_BACKOFF_BASE_SECONDS", 0.001)
+    monkeypatch.setattr(Config, "PROMETHEUS_CONNECTOR_BACKOFF_MAX_SECONDS", 0.001)
+
+
+def make_client(connector):
+    client = AsyncPrometheusClient()
+    client.base_url = "http://connector"
+    client.http_client = httpx.AsyncClient(transport=httpx.MockTransport(connector.handler))
+    return client
+
+
+def test_concurrent_identical_fetches_share_one_request_and_get_their_own_copy():
+    connector = Connector((200, MATRIX), delay=0.05)
+
+    async def scenario():
+        client = make_client(connector)
+        results = await asyncio.gather(*[
+            client.fetch_prometheus_data(dict(PAYLOAD), conversation_id) for conversation_id in ("a", "b", "c")
+        ])
+        await client.close()
+        return client, results
+
+    client, results = asyncio.run(scenario())
+    assert len(connector.requests) == 1
+    assert client.flights.stats()["coalesced"] == 2
+    assert all(result == MATRIX for result in results)
+
+    results[0]["data"]["result"].clear()
+    assert results[1] == MATRIX and results[2] == MATRIX
+
+
+def test_error_of_a_shared_request_reaches_every_waiter():
+    connector = Connector((400, {"error": "bad query"}), delay=0.05)
+
+    async def scenario():
+        client = make_client(connector)
+        outcomes = await asyncio.gather(
+            *[client.fetch_prometheus_data(dict(PAYLOAD)) for _ in range(3)], return_exceptions=True
+        )
+        await client.close()
+        return outcomes
+
+    outcomes = asyncio.run(scenario())
+    assert len(connector.requests) == 1
+    assert all(isinstance(outcome, RuntimeError) and "400" in str(outcome) for outcome in outcomes)
+
+
+def fetch(connector):
+    async def scenario():
+        client = make_client(connector)
+        try:
+            return client, await client.fetch_prometheus_data(dict(PAYLOAD))
+        except RuntimeError as e:
+            return client, e
+        finally:
+            await client.close()
+
+    return asyncio.run(scenario())
+
+
+def test_retries_stop_at_the_configured_attempt_count():
+    connector = Connector((503, {"error": "unavailable"}))
+    client, outcome = fetch(connector)
+    assert isinstance(outcome, RuntimeError)
+    assert len(connector.requests) == Config.PROMETHEUS_CONNECTOR_MAX_RETRIES + 1
+    assert client.stats.snapshot()["retries"] == 2 and client.stats.snapshot()["failures"] == 1
+
+
+def test_transient_failure_is_retried_until_it_succeeds():
+    connector = Connector((502, {"error": "bad gateway"}), (429, {"error": "slow down"}), (200, MATRIX))
+    client, outcome = fetch(connector)
+    assert outcome == MATRIX and len(connector.requests) == 3
+
+
+@pytest.mark.parametrize("status_code", [400, 404, 422])
+def test_client_errors_are_not_retried(status_code):
+    connector = Connector((status_code, {"error": "bad request"}))
+    client, outcome = fetch(connector)
+    assert isinstance(outcome, RuntimeError) and str(status_code) in str(outcome)
+    assert len(connector.requests) == 1 and client.stats.snapshot()["retries"] == 0
+
+
+def test_slow_attempt_is_hedged_and_the_losing_attempt_cancelled(monkeypatch):
+    monkeypatch.setattr(Config, "PROMETHEUS_CONNECTOR_HEDGING_ENABLED", True)
+    monkeypatch.setattr(Config, "PROMETHEUS_CONNECTOR_HEDGE_DELAY_SECONDS", 0.02)
+    connector = Connector((200, {"slow": True}, 5), (200, MATRIX, 0))
+
+    async def scenario():
+        client = make_client(connector)
+        outcome = await client.fetch_prometheus_data(dict(PAYLOAD))
+        await asyncio.sleep(0.01)
+        # Cancelled by the hedging code, not by the event loop shutting down
+        cancelled = connector.cancelled
+        await client.close()
+        return client, outcome, cancelled
+
+    client, outcome, cancelled = asyncio.run(scenario())
+    assert outcome == MATRIX and len(connector.requests) == 2
+    assert cancelled == 1
+    stats = client.stats.snapshot()
+    assert (stats["hedgesFired"], stats["hedgesWon"]) == (1, 1)
+
+
+def test_fast_attempt_is_not_hedged(monkeypatch):
+    monkeypatch.setattr(Config, "PROMETHEUS_CONNECTOR_HEDGING_ENABLED", True)
+    monkeypatch.setattr(Config, "PROMETHEUS_CONNECTOR_HEDGE_DELAY_SECONDS", 1)
+    connector = Connector((200, MATRIX))
+    client, outcome = fetch(connector)
+    assert outcome == MATRIX and len(connector.requests) == 1
+    assert client.stats.snapshot()["hedgesFired"] == 0
+
+
+def test_one_pooled_http_client_is_reused_and_closed(monkeypatch):
+    connector = Connector((200, MATRIX))
+    created = []
+    real_async_client = httpx.AsyncClient
+
+    def async_client(**options):
+        created.append(real_async_client(transport=httpx.MockTransport(connector.handler), **options))
+        return created[-1]
+
+    monkeypatch.setattr(httpx, "AsyncClient", async_client)
+
+    async def scenario():
+        client = AsyncPrometheusClient()
+        client.base_url = "http://connector"
+        assert created == []  # created on first use, not on construction
+        for start in (0, 600, 1200):
+            await client.fetch_prometheus_data({**PAYLOAD, "start": start})
+        assert len(created) == 1 and client.http_client is created[0]
+        assert not created[0].is_closed
+        await client.close()
+
+    asyncio.run(scenario())
+    assert len(connector.requests) == 3
+    assert created[0].is_closed
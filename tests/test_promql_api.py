@@ -0,0 +1,234 @@
+import asyncio
+import json
+import time
+from types import SimpleNamespace
+
+import pytest
+from fastapi import HTTPException
+
+import api.promql_api as promql_api
+from api.promql_api import (
+    BatchPromQLRequest, PromQLRequest, RefineRequest, execute_promql_with_data_batch, generate_promql_endpoint,
+    refine_promql_with_data
+)
+from utils.chart_enums import ChartConfig, ChartType
+
+QUESTION = "memory used by the billing workers"
+NOW = int(time.time())
+MATRIX = {"status": "success", "data": {"resultType": "matrix", "result": []}}
+
+
+def _completion(content, refusal=None, finish_reason="stop"):
+    usage = SimpleNamespace(prompt_tokens=100, completion_tokens=20, total_tokens=120)
+    message = SimpleNamespace(content=content, refusal=refusal)
+    return SimpleNamespace(choices=[SimpleNamespace(message=message, finish_reason=finish_reason)], usage=usage)
+
+
+def _valid_content(**fields):
+    return json.dumps({
+        "prometheusQuery": 'sum(container_memory_working_set_bytes{app="billing"})',
+        "start": NOW - 3600,
+        "end": NOW,
+        "step": "60s",
+        "chartConfig": ChartConfig.get_chart_config(ChartType.LINE_CHART),
+        **fields,
+    })
+
+
+class FakeMongo:
+    """Conversations kept in memory, in place of the MongoDB client"""
+
+    def __init__(self):
+        self.conversations = {}
+        self.bulk_writes = []
+        self._next_id = 0
+
+    def generate_conversation_id(self):
+        self._next_id += 1
+        return f"conversation-{self._next_id}"
+
+    async def get_conversation(self, conversation_id):
+        return self.conversations.get(conversation_id)
+
+    async def store_conversation(self, conversation_id, natural_language_query, generated_payload, prometheus_data,
+                                 success_status, chart_config=None, parent_conversation_id=None):
+        self.conversations[conversation_id] = {
+            "conversationId": conversation_id,
+            "naturalLanguageQuery": natural_language_query,
+            "generatedPayload": generated_payload,
+            "chartConfig": chart_config or {},
+            "success": success_status,
+            "parentConversationId": parent_conversation_id,
+        }
+        return True
+
+    async def store_conversations(self, documents):
+        self.bulk_writes.append(documents)
+        for document in documents:
+            self.conversations[document["conversationId"]] = document
+        return True
+
+
+class QueuedCompletions(list):
+    """Completions returned in order, and the messages of every request"""
+
+    def __init__(self):
+        super().__init__()
+        self.requests = []
+
+
+@pytest.fixture
+def mongo(monkeypatch):
+    mongo = FakeMongo()
+    monkeypatch.setattr(promql_api, "async_mongo_client", mongo)
+    return mongo
+
+
+@pytest.fixture
+def executed(monkeypatch):
+    """Replace connector fetches with an empty matrix, recording the planned payloads"""
+    payloads = []
+
+    async def execute(plan, conversation_id=None):
+        payloads.append(plan.payload)
+        return MATRIX
+
+    monkeypatch.setattr(promql_api.query_planner, "execute", execute)
+    return payloads
+
+
+@pytest.fixture
+def completions(monkeypatch):
+    """Replace the OpenAI call with queued completions and clear the payload cache"""
+    queued = QueuedCompletions()
+
+    async def create_chat_completion(messages, max_completion_tokens=None):
+        queued.requests.append(messages)
+        return queued.pop(0)
+
+    monkeypatch.setattr(promql_api, "create_chat_completion", create_chat_completion)
+    monkeypatch.setattr(promql_api.Config, "INTENT_FAST_PATH_ENABLED", False)
+    promql_api.payload_cache.clear()
+    yield queued
+    promql_api.payload_cache.clear()
+
+
+def generate(question=QUESTION):
+    return asyncio.run(generate_promql_endpoint(PromQLRequest(query=question)))
+
+
+@pytest.mark.parametrize("completion,detail", [
+    (_completion(None, refusal="I can't help with that"), "refused"),
+    (_completion('{"prometheusQuery": "sum(', finish_reason="length"), "cut off"),
+])
+def test_refused_or_truncated_generation_is_a_400(completions, completion, detail):
+    completions.append(completion)
+    with pytest.raises(HTTPException) as error:
+        generate()
+    assert error.value.status_code == 400 and detail in error.value.detail
+
+
+def test_empty_content_is_repaired(completions):
+    completions.extend([_completion(None), _completion(_valid_content())])
+    response = generate()
+    assert response.answered_by == "llm"
+    assert json.loads(response.query_prompt)["step"] == "60s"
+    assert completions == []
+
+    # The validated payload is cached for repeat questions
+    assert generate().answered_by == "cache"
+
+
+PARENT = {
+    "conversationId": "parent",
+    "naturalLanguageQuery": "request rate",
+    "generatedPayload": {"prometheusQuery": "sum(rate(http_requests_total[5m]))",
+                         "start": NOW - 3600, "end": NOW, "step": "60s"},
+    "chartConfig": ChartConfig.get_chart_config(ChartType.LINE_CHART),
+    "success": 200,
+}
+
+
+def refine(refinement):
+    response = asyncio.run(refine_promql_with_data(RefineRequest(conversationId="parent", refinement=refinement)))
+    return json.loads(response.body)
+
+
+def test_local_refinement_widens_range_selectors_to_a_coarser_step(mongo, executed, completions):
+    mongo.conversations["parent"] = PARENT
+    body = refine("same but over the last 7d at 1h resolution")
+
+    assert body["answered_by"] == "refinement" and completions.requests == []
+    assert body["applied_changes"] == ["window=7d", "step=1h"]
+    assert body["generated_payload"]["prometheusQuery"] == "sum(rate(http_requests_total[1h]))"
+    assert body["generated_payload"]["step"] == "3600s"
+    assert mongo.conversations[body["conversation_id"]]["parentConversationId"] == "parent"
+
+
+def test_llm_refinement_keeps_the_llms_time_range_and_query(mongo, executed, completions):
+    mongo.conversations["parent"] = PARENT
+    query = "sum(rate(http_requests_total[5m])) / sum(rate(http_requests_total[5m] offset 1w))"
+    completions.append(_completion(_valid_content(prometheusQuery=query)))
+    body = refine("compare with last week")
+
+    # The whole follow-up and the unedited previous payload are sent to the LLM
+    prompt = completions.requests[0][-1]["content"]
+    assert "compare with last week" in prompt and f'"start":{NOW - 3600}' in prompt
+    assert body["answered_by"] == "llm" and body["applied_changes"] == []
+    payload = body["generated_payload"]
+    assert payload["prometheusQuery"] == query
+    assert payload["end"] - payload["start"] <= 3600 and payload["step"] == "60s"
+
+
+def test_locally_recognized_chart_type_takes_precedence_over_the_llm(mongo, executed, completions):
+    mongo.conversations["parent"] = PARENT
+    completions.append(_completion(_valid_content(prometheusQuery="sum(rate(http_requests_total[5m] offset 1w))")))
+    body = refine("as a bar chart and compare with last week")
+
+    assert body["answered_by"] == "llm" and body["applied_changes"] == ["chartType=barChart"]
+    assert body["chart_config"]["chartType"] == "barChart"
+
+
+def test_refining_an_unknown_conversation_is_a_404(mongo):
+    with pytest.raises(HTTPException) as error:
+        refine("same but last 24h")
+    assert error.value.status_code == 404
+
+
+def batch(queries):
+    response = asyncio.run(execute_promql_with_data_batch(BatchPromQLRequest(queries=queries)))
+    return json.loads(response.body)
+
+
+def test_batch_runs_normalized_duplicates_once_and_stores_with_one_bulk_write(mongo, executed, completions):
+    completions.extend([_completion(_valid_content()), _completion(_valid_content(step="300s"))])
+    body = batch([QUESTION, "  Memory used by the BILLING workers? ", "disk used by the billing workers"])
+
+    assert body["unique_queries"] == 2 and len(completions.requests) == 2 and len(executed) == 2
+    first, duplicate, other = body["results"]
+    assert duplicate["duplicate_of"] == 0 and duplicate["index"] == 1
+    assert duplicate["query"] == "  Memory used by the BILLING workers? "
+    assert duplicate["conversation_id"] == first["conversation_id"]
+    assert duplicate["generated_payload"] == first["generated_payload"]
+    assert first["duplicate_of"] is None and other["duplicate_of"] is None
+
+    # One bulk write holding one conversation per unique query
+    assert [len(documents) for documents in mongo.bulk_writes] == [2]
+    stored = {document["conversationId"] for document in mongo.bulk_writes[0]}
+    assert stored == {first["conversation_id"], other["conversation_id"]}
+
+
+def test_batch_item_failure_only_fails_that_item(mongo, monkeypatch, completions):
+    async def execute(plan, conversation_id=None):
+        if plan.payload["step"] == "300s":
+            raise RuntimeError("connector unavailable")
+        return MATRIX
+
+    monkeypatch.setattr(promql_api.query_planner, "execute", execute)
+    completions.extend([_completion(_valid_content()), _completion(_valid_content(step="300s"))])
+    body = batch([QUESTION, "disk used by the billing workers"])
+
+    succeeded, failed = sorted(body["results"], key=lambda item: item["status_code"])
+    assert succeeded["success"] and succeeded["status_code"] == 200
+    assert not failed["success"] and failed["status_code"] == 502 and failed["message"] == "connector unavailable"
+    assert sorted(document["success"] for document in mongo.bulk_writes[0]) == [200, 502]
@@ -0,0 +1,95 @@
+import re
+
+import pytest
+
+from utils.promql_parser import (
+    MATRIX, SCALAR, VECTOR, PromQLValidationError, parse_duration, parse_promql, validate_payload
+)
+
+
+@pytest.mark.parametrize("query,value_type", [
+    ("up", VECTOR),
+    ('http_requests_total{job="api", code=~"5.."}', VECTOR),
+    ("rate(http_requests_total[5m])", VECTOR),
+    ('sum by (job) (rate(http_requests_total{code!="200"}[5m]))', VECTOR),
+    ("sum(rate(http_requests_total[5m])) without (instance)", VECTOR),
+    ("histogram_quantile(0.99, sum by (le) (rate(http_request_duration_seconds_bucket[5m])))", VECTOR),
+    ("topk(5, sum by (path) (rate(http_requests_total[1h])))", VECTOR),
+    ('count_values("version", build_info)', VECTOR),
+    ("rate(errors_total[5m]) / ignoring (code) group_left rate(requests_total[5m])", VECTOR),
+    ("up == bool 1", VECTOR),
+    ("1 > bool 2", SCALAR),
+    ("-up ^ 2 ^ 3", VECTOR),
+    ("max_over_time(rate(x_total[5m])[1h:1m])", VECTOR),
+    ("max_over_time(rate(x_total[5m])[1h:])", VECTOR),
+    ("rate(x_total[5m] offset 1d @ end())", VECTOR),
+    ("x_total @ 1700000000 offset -5m", VECTOR),
+    ("x_total[1h30m]", MATRIX),
+    ('label_join(up, "dst", ",", "a", "b", "c")', VECTOR),
+    ("round(up)", VECTOR),
+    ("time() - 3600", SCALAR),
+    ("rate(x_total[5m])[1h:1m]", MATRIX),
+    ("info(rate(http_server_requests_total[5m]))", VECTOR),
+    ('info(rate(http_server_requests_total[5m]), {k8s_cluster_name=~".+"})', VECTOR),
+    ("up and on (job) absent(down)", VECTOR),
+    ("# comment\nup", VECTOR),
+])
+def test_valid_queries(query, value_type):
+    assert parse_promql(query) == value_type
+
+
+@pytest.mark.parametrize("query,message", [
+    ("rate(http_requests_total)", "expected type range vector"),
+    ("sum(rate(x[5m]))[5m]", "ranges only allowed for vector selectors"),
+    ("x[5m][1h:1m]", "unexpected token after expression"),
+    ('"text"[1h:1m]', "subquery is only allowed on instant vector"),
+    ("ratee(x[5m])", "unknown function"),
+    ("sum(rate(x[5m])", "expected ')'"),
+    ("{}", "at least one non-empty matcher"),
+    ('{job=~".*"}', "at least one non-empty matcher"),
+    ("1 > 2", "must use BOOL modifier"),
+    ("1 and up", "set operator"),
+    ("up + on (job) 1", "vector matching only allowed between instant vectors"),
+    ("up or on (job) group_left down", "no grouping allowed for set operations"),
+    ("histogram_quantile(up)", "argument(s)"),
+    ("clamp(up, 1)", "argument(s)"),
+    ("info(up, down, other)", "argument(s)"),
+    ("x[0s]", "range must be positive"),
+    ("x[5x]", "expected duration for range"),
+    ("x offset 5m offset 1m", "may not be set multiple times"),
+    ("topk(up, 5)", "expected type scalar"),
+    ("up up", "unexpected token after expression"),
+    ("up $", "unexpected character"),
+    ("   ", "non-empty string"),
+])
+def test_invalid_queries(query, message):
+    with pytest.raises(PromQLValidationError, match=re.escape(message)):
+        parse_promql(query)
+
+
+def test_durations():
+    assert parse_duration("1h30m") == 5400
+    assert parse_duration("500ms") == 0.5
+    with pytest.raises(PromQLValidationError):
+        parse_duration("5 m")
+
+
+def test_validate_payload_parses_the_time_range():
+    parsed = validate_payload({"prometheusQuery": "up", "start": "1700000000", "end": 1700003600, "step": "1m"})
+    assert parsed == {"start": 1700000000.0, "end": 1700003600.0, "step": 60.0}
+
+
+def test_validate_payload_reports_every_problem():
+    with pytest.raises(PromQLValidationError) as error:
+        validate_payload({"prometheusQuery": "x[5m]", "start": 10, "end": 5, "step": "soon"})
+    message = str(error.value)
+    assert "invalid expression type 'range vector'" in message
+    assert "step:" in message
+    assert "end must be greater than start" in message
+
+
+def test_validate_payload_limits_points_per_series():
+    payload = {"prometheusQuery": "up", "start": 0, "end": 86400 * 7, "step": "15s"}
+    with pytest.raises(PromQLValidationError, match="increase step"):
+        validate_payload(payload)
+    assert validate_payload(payload, max_points=None)["step"] == 15.0
@@ -0,0 +1,89 @@
+import asyncio
+
+import pytest
+
+from api.internal.query_planner import QueryPlanner, choose_step, split_range, stitch_results
+
+DAY = 86400
+
+
+def _matrix(series):
+    return {"status": "success", "data": {"resultType": "matrix", "result": series}}
+
+
+class FakeConnector:
+    """Answers range queries with one sample per step of a single series, recording the requested ranges"""
+
+    def __init__(self):
+        self.requests = []
+
+    async def fetch_prometheus_data(self, payload, conversation_id=None):
+        self.requests.append((payload["start"], payload["end"]))
+        step = int(payload["step"][:-1])
+        values = [[timestamp, "1"] for timestamp in range(payload["start"], payload["end"] + 1, step)]
+        return _matrix([{"metric": {"job": "api"}, "values": values}])
+
+
+def test_choose_step_keeps_fine_enough_steps_and_rounds_up_to_readable_ones():
+    assert choose_step(0, 3600, 15, 1000) == 15
+    assert choose_step(0, 7 * DAY, 15, 1000) == 900
+    assert choose_step(0, 400 * DAY, 60, 1000) == 43200
+    assert choose_step(0, 4000 * DAY, 60, 1000) == 5 * DAY
+
+
+def test_split_range_covers_the_range_without_gaps_or_overlap():
+    start, end, step = 1000 * 60, 1000 * 60 + 3 * DAY + 3600, 60
+    ranges = split_range(start, end, step, DAY, 0)
+    assert ranges[0][0] == start and ranges[-1][1] == end
+    for (_, previous_end), (next_start, _) in zip(ranges, ranges[1:]):
+        assert next_start == previous_end + step
+    # Inner boundaries sit on interval multiples, so overlapping queries share sub-ranges
+    assert all(range_start % DAY == 0 for range_start, _ in ranges[1:])
+    assert len(ranges) == 4
+
+
+def test_split_range_respects_max_splits_and_short_ranges():
+    assert split_range(0, 3600, 60, DAY, 0) == [(0, 3600)]
+    for start, end in ((0, 100 * DAY), (DAY // 2, 100 * DAY + DAY // 2), (3600, 40 * DAY)):
+        ranges = split_range(start, end, 3600, DAY, 10)
+        assert len(ranges) <= 10
+        assert ranges[0][0] == start and ranges[-1][1] == end
+    assert split_range(0, 10 * DAY, 3600, DAY, 1) == [(0, 10 * DAY)]
+
+
+def test_stitch_drops_duplicated_boundary_samples_and_matches_series_by_labels():
+    first = _matrix([
+        {"metric": {"job": "a", "instance": "1"}, "values": [[0, "1"], [60, "2"]]},
+        {"metric": {"job": "b"}, "values": [[0, "5"]]},
+    ])
+    second = _matrix([
+        {"metric": {"instance": "1", "job": "a"}, "values": [[60, "2"], [120, "3"]]},
+        {"metric": {"job": "c"}, "values": [[120, "7"]]},
+    ])
+    stitched = stitch_results([first, second])["data"]["result"]
+    assert stitched == [
+        {"metric": {"job": "a", "instance": "1"}, "values": [[0, "1"], [60, "2"], [120, "3"]]},
+        {"metric": {"job": "b"}, "values": [[0, "5"]]},
+        {"metric": {"job": "c"}, "values": [[120, "7"]]},
+    ]
+    # The inputs are not modified
+    assert first["data"]["result"][0]["values"] == [[0, "1"], [60, "2"]]
+
+
+def test_stitch_rejects_non_matrix_results():
+    vector = {"status": "success", "data": {"resultType": "vector", "result": []}}
+    with pytest.raises(ValueError):
+        stitch_results([vector, vector])
+
+
+def test_planner_aligns_splits_and_stitches_a_long_range():
+    connector = FakeConnector()
+    planner = QueryPlanner(connector)
+    plan = planner.plan({"prometheusQuery": "up", "start": 1000 * 60 + 17, "end": 1000 * 60 + 3 * DAY + 29, "step": "1m"})
+    assert plan.payload["step"] == "300s"
+    assert plan.start % 300 == 0 and plan.end % 300 == 0
+
+    data = asyncio.run(planner.execute(plan))
+    assert len(connector.requests) == len(plan.ranges) > 1
+    timestamps = [timestamp for timestamp, _ in data["data"]["result"][0]["values"]]
+    assert timestamps == list(range(int(plan.start), int(plan.end) + 1, 300))
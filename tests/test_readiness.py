@@ -0,0 +1,109 @@
+import asyncio
+import logging
+import threading
+
+from fastapi.testclient import TestClient
+
+import main
+from utils.lazy_client import LazyClient
+from utils.readiness import DependencyMonitor
+
+
+class Dependency:
+    """Check whose result the test switches"""
+
+    def __init__(self, ready=True):
+        self.ready = ready
+        self.checks = 0
+
+    async def check(self):
+        self.checks += 1
+        if isinstance(self.ready, Exception):
+            raise self.ready
+        return self.ready
+
+
+def make_monitor(required=("mongodb",), timeout_seconds=1.0):
+    return DependencyMonitor(interval_seconds=60, recovery_interval_seconds=1,
+                             timeout_seconds=timeout_seconds, required=required)
+
+
+def test_lazy_client_is_created_once_on_first_use():
+    created = []
+
+    def factory():
+        created.append(threading.get_ident())
+        return type("Client", (), {"name": "openai"})()
+
+    client = LazyClient(factory)
+    assert not client.created and created == []
+
+    threads = [threading.Thread(target=lambda: client.name) for _ in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert client.created and len(created) == 1
+    assert client.get() is client.get() and client.name == "openai"
+
+
+def test_monitor_reports_transitions_of_each_dependency(caplog):
+    caplog.set_level(logging.INFO, logger="utils.readiness")
+    mongodb, openai = Dependency(), Dependency(ready=False)
+    monitor = make_monitor()
+    monitor.register("mongodb", mongodb.check)
+    monitor.register("openai", openai.check)
+    assert not monitor.ready
+
+    asyncio.run(monitor.check_all())
+    # openai is not required, so it does not fail readiness
+    assert monitor.ready and not monitor.is_ready("openai")
+    assert caplog.records == []  # first results are not transitions
+
+    mongodb.ready = ConnectionError("connection refused")
+    asyncio.run(monitor.check_all())
+    asyncio.run(monitor.check_all())
+    status = monitor.status()["dependencies"]["mongodb"]
+    assert not monitor.ready
+    assert (status["lastError"], status["consecutiveFailures"]) == ("connection refused", 2)
+
+    mongodb.ready = True
+    asyncio.run(monitor.check_all())
+    assert monitor.ready and monitor.status()["dependencies"]["mongodb"]["consecutiveFailures"] == 0
+    assert [(record.levelno, record.getMessage()) for record in caplog.records] == [
+        (logging.WARNING, "Dependency mongodb is not ready: connection refused"),
+        (logging.INFO, "Dependency mongodb is ready"),
+    ]
+
+
+def test_slow_check_counts_as_failed():
+    async def hang():
+        await asyncio.sleep(1)
+        return True
+
+    monitor = make_monitor(timeout_seconds=0.01)
+    monitor.register("mongodb", hang)
+    asyncio.run(monitor.check_all())
+    assert not monitor.ready
+    assert monitor.status()["dependencies"]["mongodb"]["lastError"] == "timed out after 0.01s"
+
+
+def test_readyz_is_503_while_a_required_dependency_is_down(monkeypatch):
+    mongodb = Dependency()
+    monitor = make_monitor()
+    monitor.register("mongodb", mongodb.check)
+    monkeypatch.setattr(main, "dependency_monitor", monitor)
+    client = TestClient(main.app)
+
+    # Not ready before the first round of checks
+    assert client.get("/readyz").status_code == 503
+
+    asyncio.run(monitor.check_all())
+    response = client.get("/readyz")
+    assert response.status_code == 200 and response.json()["dependencies"]["mongodb"]["ready"]
+
+    mongodb.ready = False
+    asyncio.run(monitor.check_all())
+    response = client.get("/readyz")
+    assert response.status_code == 503 and response.json()["dependencies"]["mongodb"]["lastError"] == "check failed"
+    assert client.get("/healthz").status_code == 200
@@ -0,0 +1,104 @@
+import asyncio
+
+from api.internal.result_cache import ResultCache
+from utils.shared_store import SharedStore
+
+STEP = 60
+NOW = 1700100000
+
+
+def _response(start, end, jobs=("api",)):
+    return {"status": "success", "data": {"resultType": "matrix", "result": [
+        {"metric": {"job": job}, "values": [[timestamp, str(timestamp)] for timestamp in range(start, end + 1, STEP)]}
+        for job in jobs
+    ]}}
+
+
+def lookup(cache, *args):
+    return asyncio.run(cache.lookup(*args))
+
+
+def store(cache, *args, **kwargs):
+    return asyncio.run(cache.store(*args, **kwargs))
+
+
+def _timestamps(response, index=0):
+    return [timestamp for timestamp, _ in response["data"]["result"][index]["values"]]
+
+
+def test_miss_then_full_hit():
+    cache = ResultCache(max_bytes=10_000_000, volatile_steps=2)
+    assert lookup(cache, "up", STEP, 0, 600) == (None, [(0, 600)])
+
+    assert store(cache, "up", STEP, _response(0, 600), 0, 600, now=NOW)
+    cached, missing = lookup(cache, "up", STEP, 120, 480)
+    assert missing == []
+    assert cached[0] == 120
+    assert _timestamps(cached[1]) == list(range(120, 481, STEP))
+    assert cache.stats()["hits"] == 1 and cache.stats()["misses"] == 1
+
+
+def test_partial_hit_returns_the_missing_head_and_tail():
+    cache = ResultCache(max_bytes=10_000_000, volatile_steps=2)
+    store(cache, "up", STEP, _response(600, 1200), 600, 1200, now=NOW)
+
+    cached, missing = lookup(cache, "up", STEP, 0, 1800)
+    assert missing == [(0, 540), (1260, 1800)]
+    assert cached[0] == 600 and _timestamps(cached[1]) == list(range(600, 1201, STEP))
+    assert cache.stats()["partialHits"] == 1
+
+
+def test_volatile_tail_is_never_cached():
+    cache = ResultCache(max_bytes=10_000_000, volatile_steps=2)
+    end = NOW - NOW % STEP
+    store(cache, "up", STEP, _response(end - 600, end), end - 600, end, now=NOW)
+
+    cached, missing = lookup(cache, "up", STEP, end - 600, end)
+    # Samples newer than volatile_steps steps before now are fetched again
+    assert missing == [(end - STEP, end)]
+    assert _timestamps(cached[1])[-1] == end - 2 * STEP
+    assert not store(cache, "up", STEP, _response(end - STEP, end), end - STEP, end, now=NOW)
+
+
+def test_adjacent_extents_are_merged_and_fresh_samples_win():
+    cache = ResultCache(max_bytes=10_000_000, volatile_steps=0)
+    store(cache, "up", STEP, _response(0, 600), 0, 600, now=NOW)
+    newer = _response(540, 1200, jobs=("api", "db"))
+    newer["data"]["result"][0]["values"][0][1] = "fresh"
+    store(cache, "up", STEP, newer, 540, 1200, now=NOW)
+
+    cached, missing = lookup(cache, "up", STEP, 0, 1200)
+    assert missing == []
+    api, db = cached[1]["data"]["result"]
+    assert [timestamp for timestamp, _ in api["values"]] == list(range(0, 1201, STEP))
+    assert dict(api["values"])[540] == "fresh"
+    assert db["metric"] == {"job": "db"} and db["values"][0][0] == 540
+
+
+def test_disjoint_extent_replaces_the_old_one():
+    cache = ResultCache(max_bytes=10_000_000, volatile_steps=0)
+    store(cache, "up", STEP, _response(0, 600), 0, 600, now=NOW)
+    store(cache, "up", STEP, _response(6000, 6600), 6000, 6600, now=NOW)
+    assert lookup(cache, "up", STEP, 0, 600)[1] == [(0, 600)]
+    assert lookup(cache, "up", STEP, 6000, 6600)[1] == []
+
+
+def test_entries_are_keyed_on_query_and_step_and_evicted_by_size():
+    cache = ResultCache(max_bytes=600, volatile_steps=0)
+    store(cache, "up", STEP, _response(0, 3000), 0, 3000, now=NOW)
+    assert lookup(cache, "up", 2 * STEP, 0, 3000)[0] is None
+    store(cache, "down", STEP, _response(0, 3000), 0, 3000, now=NOW)
+    assert cache.stats()["evictions"] == 1
+    assert lookup(cache, "up", STEP, 0, 3000)[0] is None
+    assert lookup(cache, "down", STEP, 0, 3000)[1] == []
+
+
+def test_extents_are_shared_between_processes(tmp_path):
+    path = str(tmp_path / "cache.sqlite")
+    writer = ResultCache(10_000_000, 0, shared=SharedStore(path, "results", 10_000_000))
+    reader = ResultCache(10_000_000, 0, shared=SharedStore(path, "results", 10_000_000))
+    store(writer, "up", STEP, _response(0, 600), 0, 600, now=NOW)
+    writer.shared.flush()
+
+    cached, missing = lookup(reader, "up", STEP, 0, 600)
+    assert missing == [] and _timestamps(cached[1]) == list(range(0, 601, STEP))
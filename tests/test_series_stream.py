@@ -0,0 +1,73 @@
+import json
+import random
+
+import pytest
+
+from api.internal.series_stream import IncrementalResultParser
+
+
+def _body(result_type, result):
+    return json.dumps({"status": "success", "data": {"resultType": result_type, "result": result}, "stats": {"µs": 1}})
+
+
+MATRIX = [
+    {"metric": {"job": "api", "path": "/ü/[x]"}, "values": [[1700000000, "1"], [1700000015, "2.5"]]},
+    {"metric": {"job": "db"}, "values": [[1700000000, "NaN"]]},
+    {"metric": {}, "values": []},
+]
+
+
+def _parse(body, chunk_sizes):
+    data = body.encode("utf-8")
+    parser = IncrementalResultParser()
+    items, position = [], 0
+    for size in chunk_sizes:
+        items += parser.feed(data[position:position + size])
+        position += size
+    items += parser.feed(data[position:])
+    items += parser.close()
+    return items, parser
+
+
+@pytest.mark.parametrize("result_type,result", [
+    ("matrix", MATRIX),
+    ("vector", [{"metric": {"job": "api"}, "value": [1700000000.123, "12345"]}]),
+    ("scalar", [1700000000.123, "12345"]),
+    ("matrix", []),
+])
+def test_every_chunk_boundary_yields_the_same_result(result_type, result):
+    body = _body(result_type, result)
+    for split in range(1, len(body.encode("utf-8"))):
+        items, parser = _parse(body, [split])
+        assert items == result, split
+        assert parser.envelope(items) == json.loads(body)
+
+
+def test_random_chunking_of_a_large_matrix():
+    result = [
+        {"metric": {"instance": str(index)}, "values": [[1700000000 + i, str(i * 0.5)] for i in range(200)]}
+        for index in range(50)
+    ]
+    body = _body("matrix", result)
+    rng = random.Random(7)
+    items, parser = _parse(body, [rng.randint(1, 700) for _ in range(500)])
+    assert items == result
+    assert parser.series_count == 50
+    assert parser.envelope() == json.loads(_body("matrix", []))
+
+
+def test_series_are_returned_before_the_body_ends():
+    body = _body("matrix", MATRIX).encode("utf-8")
+    parser = IncrementalResultParser()
+    first_end = body.index(b"]]}") + 3
+    assert parser.feed(body[:first_end + 1]) == MATRIX[:1]
+
+
+def test_truncated_bodies_raise():
+    body = _body("matrix", MATRIX).encode("utf-8")
+    parser = IncrementalResultParser()
+    parser.feed(body[:len(body) // 2])
+    with pytest.raises(ValueError):
+        parser.close()
+    with pytest.raises(ValueError):
+        parser.envelope()
@@ -0,0 +1,54 @@
+import asyncio
+import logging
+
+from utils.payload_cache import PayloadCache
+from utils.shared_store import SharedLease, SharedStore
+
+
+def test_queued_write_is_read_back_off_the_loop(tmp_path):
+    store = SharedStore(str(tmp_path / "cache.sqlite"), "payloads", 1_000_000)
+    assert store.set_later("key", {"value": [1, 2]}, now=100)
+    store.flush()
+    assert asyncio.run(store.get_async("key", now=100)) == {"value": [1, 2]}
+    assert asyncio.run(store.get_async("key", newer_than=100, now=100)) is None
+    assert store.stats()["pendingWrites"] == 0
+
+
+def test_writes_beyond_the_queue_are_dropped(tmp_path):
+    store = SharedStore(str(tmp_path / "cache.sqlite"), "payloads", 1_000_000, max_pending_writes=0)
+    assert not store.set_later("key", {"value": 1})
+    assert store.stats()["droppedWrites"] == 1
+    assert asyncio.run(store.get_async("key")) is None
+
+
+def test_payload_generated_by_one_worker_is_reused_by_another(tmp_path):
+    path = str(tmp_path / "cache.sqlite")
+    first = PayloadCache(10, 60, shared=SharedStore(path, "payloads", 1_000_000))
+    second = PayloadCache(10, 60, shared=SharedStore(path, "payloads", 1_000_000))
+    first.put("up last hour", "model", "2", {"prometheusQuery": "up", "start": 1000, "end": 4600}, now=5000)
+    first.shared.flush()
+    assert asyncio.run(second.get("up last hour", "model", "2", now=5010)) == {
+        "prometheusQuery": "up", "start": 5010 - 3600, "end": 5010
+    }
+
+
+
+def test_lease_is_held_by_one_owner_until_released_or_expired(tmp_path, caplog):
+    caplog.set_level(logging.INFO, logger="utils.shared_store")
+    path = str(tmp_path / "cache.sqlite")
+    first = SharedLease(path, "job", ttl_seconds=30, owner="first")
+    second = SharedLease(path, "job", ttl_seconds=30, owner="second")
+
+    assert asyncio.run(first.acquire(now=100))
+    assert not asyncio.run(second.acquire(now=110))
+    assert asyncio.run(first.acquire(now=120))  # renewed until 150
+    assert not asyncio.run(second.acquire(now=140))
+    assert asyncio.run(second.acquire(now=151))  # expired
+    assert not asyncio.run(first.acquire(now=152))
+
+    asyncio.run(second.release())
+    assert asyncio.run(first.acquire(now=153))
+    assert {record.levelno for record in caplog.records} == {logging.INFO}
+    assert [record.getMessage().split(" ", 2)[2] for record in caplog.records] == [
+        "took lease job", "took lease job", "lost lease job", "released lease job", "took lease job"
+    ]
@@ -0,0 +1,449 @@
+"""
+Admission control for calls to upstreams (OpenAI, Prometheus connector, MongoDB).
+
+Each upstream gets an UpstreamGuard combining:
+- AdaptiveLimiter: AIMD concurrency limit. The limit grows by 1/limit per
+  completed call while it is in use, and is cut by CONCURRENCY_BACKOFF_RATIO
+  when a call fails or the short-term latency average exceeds
+  CONCURRENCY_LATENCY_TOLERANCE times the long-term one. Calls over the limit
+  wait in a bounded queue; calls that cannot start within the queue timeout
+  or the request deadline are shed right away instead of piling up.
+- CircuitBreaker: opens when the failure rate over a sliding window crosses
+  CIRCUIT_BREAKER_FAILURE_RATE, rejects calls while open, then lets a few
+  half-open probe calls through to decide whether to close again.
+
+Rejections raise OverloadError carrying the HTTP status (429 when shed by the
+limiter, 503 while the circuit is open, 504 when the deadline passes) and a
+Retry-After hint; main.py turns it into a response.
+
+Request deadlines are kept in a context variable set by DeadlineMiddleware
+from REQUEST_DEADLINE_SECONDS or a shorter X-Request-Timeout header.
+"""
+import asyncio
+import contextvars
+import logging
+import math
+import time
+from collections import deque
+from contextlib import asynccontextmanager
+from typing import Optional, Dict, Any, Callable
+
+from config import Config
+
+logger = logging.getLogger(__name__)
+
+# Absolute (time.monotonic) deadline of the request being handled; None outside requests
+_deadline: contextvars.ContextVar = contextvars.ContextVar("request_deadline", default=None)
+
+
+class OverloadError(Exception):
+    """
+    A call rejected by admission control.
+
+    Attributes:
+        upstream: Upstream the call was for
+        reason: "queue_full", "deadline", "queue_timeout" or "circuit_open"
+        status_code: HTTP status to answer with (429, 503 or 504)
+        retry_after: Seconds the client should wait before retrying, if known
+    """
+
+    def __init__(self, upstream: str, reason: str, status_code: int, retry_after: Optional[float] = None):
+        self.upstream = upstream
+        self.reason = reason
+        self.status_code = status_code
+        self.retry_after = retry_after
+        super().__init__(f"{upstream} is overloaded ({reason.replace('_', ' ')}), retry later")
+
+    def headers(self) -> Dict[str, str]:
+        """Retry-After header (whole seconds, at least 1) when a hint is known"""
+        if self.retry_after is None:
+            return {}
+        return {"Retry-After": str(max(1, math.ceil(self.retry_after)))}
+
+
+def remaining_time() -> Optional[float]:
+    """Seconds left before the current request's deadline, or None without a deadline"""
+    deadline = _deadline.get()
+    if deadline is None:
+        return None
+    return deadline - time.monotonic()
+
+
+class AdaptiveLimiter:
+    """AIMD concurrency limit with a bounded, deadline-aware wait queue"""
+
+    def __init__(self,
+                 name: str,
+                 initial_limit: int,
+                 min_limit: int,
+                 max_limit: int,
+                 max_queue: int,
+                 queue_timeout: float,
+                 latency_tolerance: float,
+                 backoff_ratio: float,
+                 enabled: bool = True):
+        self.name = name
+        self.limit = float(min(max(initial_limit, min_limit), max_limit))
+        self.min_limit = min_limit
+        self.max_limit = max_limit
+        self.max_queue = max_queue
+        self.queue_timeout = queue_timeout
+        self.latency_tolerance = latency_tolerance
+        self.backoff_ratio = backoff_ratio
+        self.enabled = enabled
+        self.in_flight = 0
+        self._waiters = deque()
+        # Short-term and long-term latency averages; the short one reacts to congestion first
+        self.short_latency = None
+        self.long_latency = None
+        self._last_decrease = 0.0
+        self.admitted = 0
+        self.shed: Dict[str, int] = {"queue_full": 0, "deadline": 0, "queue_timeout": 0}
+        self.decreases = 0
+
+    def _expected_wait(self, position: int) -> float:
+        """Estimated time until the call at this queue position gets a slot"""
+        return position * (self.short_latency or 0.0) / max(self.limit, 1.0)
+
+    def _shed(self, reason: str, retry_after: Optional[float]) -> OverloadError:
+        self.shed[reason] += 1
+        return OverloadError(self.name, reason, 429, retry_after)
+
+    async def acquire(self):
+        """
+        Take a slot, waiting in the queue if the limit is reached.
+
+        Raises:
+            OverloadError: (429) if the queue is full, the call cannot start before the
+                           request deadline, or the queue timeout passes
+        """
+        if not self.enabled or (self.in_flight < int(self.limit) and not self._waiters):
+            self.in_flight += 1
+            self.admitted += 1
+            return
+
+        if len(self._waiters) >= self.max_queue:
+            raise self._shed("queue_full", self._expected_wait(len(self._waiters)))
+
+        # Only wait as long as leaves time to serve the call before the deadline
+        expected_wait = self._expected_wait(len(self._waiters) + 1)
+        budget = self.queue_timeout
+        remaining = remaining_time()
+        if remaining is not None:
+            budget = min(budget, remaining - (self.short_latency or 0.0))
+            if budget <= 0 or expected_wait > budget:
+                raise self._shed("deadline", expected_wait)
+
+        waiter = asyncio.get_running_loop().create_future()
+        self._waiters.append(waiter)
+        try:
+            await asyncio.wait_for(waiter, budget)
+        except asyncio.TimeoutError:
+            if waiter in self._waiters:
+                self._waiters.remove(waiter)
+            raise self._shed("queue_timeout", self._expected_wait(len(self._waiters)))
+        except asyncio.CancelledError:
+            if waiter.done() and not waiter.cancelled():
+                # The slot was handed over as the caller went away: pass it on
+                self.in_flight -= 1
+                self._wake_waiters()
+            elif waiter in self._waiters:
+                self._waiters.remove(waiter)
+            raise
+        self.admitted += 1
+
+    def _wake_waiters(self):
+        while self._waiters and self.in_flight < int(self.limit):
+            waiter = self._waiters.popleft()
+            if not waiter.done():
+                self.in_flight += 1
+                waiter.set_result(None)
+
+    def release(self, latency: float, failed: bool):
+        """
+        Return a slot and adjust the limit from the call's outcome.
+
+        Args:
+            latency: Duration of the call in seconds
+            failed: Whether the call failed in a way that signals upstream trouble
+        """
+        saturated = self.in_flight >= int(self.limit) or bool(self._waiters)
+        self.in_flight -= 1
+        if self.enabled:
+            now = time.monotonic()
+            if not failed:
+                self.short_latency = latency if self.short_latency is None else 0.8 * self.short_latency + 0.2 * latency
+                self.long_latency = latency if self.long_latency is None else 0.98 * self.long_latency + 0.02 * latency
+            congested = failed or self.short_latency > self.latency_tolerance * self.long_latency
+            # Signals from calls started before the last cut belong to the same episode
+            if congested and now - latency > self._last_decrease:
+                self.limit = max(float(self.min_limit), self.limit * self.backoff_ratio)
+                self._last_decrease = now
+                self.decreases += 1
+            elif not congested and saturated:
+                self.limit = min(float(self.max_limit), self.limit + 1.0 / self.limit)
+        self._wake_waiters()
+
+    def stats(self) -> Dict[str, Any]:
+        """Return the current limit, usage and shed counters"""
+        return {
+            "enabled": self.enabled,
+            "limit": int(self.limit),
+            "minLimit": self.min_limit,
+            "maxLimit": self.max_limit,
+            "inFlight": self.in_flight,
+            "queued": len(self._waiters),
+            "maxQueue": self.max_queue,
+            "admitted": self.admitted,
+            "shed": dict(self.shed),
+            "decreases": self.decreases,
+            "shortLatencySeconds": self.short_latency,
+            "longLatencySeconds": self.long_latency,
+        }
+
+
+class CircuitBreaker:
+    """Failure-rate circuit breaker with half-open probing"""
+
+    CLOSED, HALF_OPEN, OPEN = "closed", "half_open", "open"
+
+    def __init__(self,
+                 name: str,
+                 failure_rate: float,
+                 min_calls: int,
+                 window_seconds: float,
+                 open_seconds: float,
+                 half_open_probes: int,
+                 enabled: bool = True):
+        self.name = name
+        self.failure_rate = failure_rate
+        self.min_calls = min_calls
+        self.window_seconds = window_seconds
+        self.open_seconds = open_seconds
+        self.half_open_probes = half_open_probes
+        self.enabled = enabled
+        self.state = self.CLOSED
+        # Per-second [second, calls, failures] buckets of the sliding window
+        self._buckets = deque()
+        self._calls = 0
+        self._failures = 0
+        self._opened_at = 0.0
+        self._probes_in_flight = 0
+        self._probe_successes = 0
+        self.opened = 0
+        self.rejected = 0
+
+    def _trim(self, now: float):
+        while self._buckets and self._buckets[0][0] <= now - self.window_seconds:
+            _, calls, failures = self._buckets.popleft()
+            self._calls -= calls
+            self._failures -= failures
+
+    def _open(self, now: float):
+        self.state = self.OPEN
+        self._opened_at = now
+        self.opened += 1
+        logger.warning("Circuit breaker for %s opened", self.name)
+
+    def before_call(self) -> bool:
+        """
+        Admit a call or reject it.
+
+        Returns:
+            bool: Whether the call is a half-open probe
+
+        Raises:
+            OverloadError: (503) while the circuit is open or its probes are in flight
+        """
+        if not self.enabled:
+            return False
+        now = time.monotonic()
+        if self.state == self.OPEN:
+            remaining = self._opened_at + self.open_seconds - now
+            if remaining > 0:
+                self.rejected += 1
+                raise OverloadError(self.name, "circuit_open", 503, remaining)
+            self.state = self.HALF_OPEN
+            self._probes_in_flight = 0
+            self._probe_successes = 0
+        if self.state == self.HALF_OPEN:
+            if self._probes_in_flight >= self.half_open_probes:
+                self.rejected += 1
+                raise OverloadError(self.name, "circuit_open", 503, 1)
+            self._probes_in_flight += 1
+            return True
+        return False
+
+    def record(self, failed: Optional[bool], probe: bool = False):
+        """
+        Record a call's outcome.
+
+        Args:
+            failed: True/False for a failed/successful call, None for one that ended
+                    without telling anything about the upstream (e.g. cancelled)
+            probe: Whether the call was admitted as a half-open probe
+        """
+        if not self.enabled:
+            return
+        now = time.monotonic()
+        if probe:
+            if self.state != self.HALF_OPEN:
+                return
+            self._probes_in_flight -= 1
+            if failed:
+                self._open(now)
+            elif failed is False:
+                self._probe_successes += 1
+                if self._probe_successes >= self.half_open_probes:
+                    self.state = self.CLOSED
+                    self._buckets.clear()
+                    self._calls = self._failures = 0
+                    logger.info("Circuit breaker for %s closed", self.name)
+            return
+        if self.state != self.CLOSED or failed is None:
+            return
+
+        second = int(now)
+        if self._buckets and self._buckets[-1][0] == second:
+            bucket = self._buckets[-1]
+        else:
+            bucket = [second, 0, 0]
+            self._buckets.append(bucket)
+        bucket[1] += 1
+        self._calls += 1
+        if failed:
+            bucket[2] += 1
+            self._failures += 1
+        self._trim(now)
+        if failed and self._calls >= self.min_calls and self._failures / self._calls >= self.failure_rate:
+            self._open(now)
+
+    def stats(self) -> Dict[str, Any]:
+        """Return the state, window counters and how often the circuit opened"""
+        self._trim(time.monotonic())
+        return {
+            "enabled": self.enabled,
+            "state": self.state,
+            "windowCalls": self._calls,
+            "windowFailures": self._failures,
+            "opened": self.opened,
+            "rejected": self.rejected,
+        }
+
+
+class UpstreamGuard:
+    """
+    Circuit breaker and adaptive limiter in front of one upstream.
+
+    Usage:
+        async with guard.slot():
+            ...call the upstream...
+
+    is_failure decides which exceptions count against the upstream (by default all);
+    exceptions such as client errors caused by the request itself should not.
+    """
+
+    def __init__(self, name: str, limiter: AdaptiveLimiter, breaker: CircuitBreaker,
+                 is_failure: Callable[[BaseException], bool] = None):
+        self.name = name
+        self.limiter = limiter
+        self.breaker = breaker
+        self.is_failure = is_failure or (lambda error: True)
+
+    @asynccontextmanager
+    async def slot(self):
+        probe = self.breaker.before_call()
+        try:
+            await self.limiter.acquire()
+        except BaseException:
+            self.breaker.record(None, probe)
+            raise
+        start_time = time.perf_counter()
+        failed = False
+        try:
+            yield
+        except asyncio.CancelledError:
+            failed = None
+            raise
+        except Exception as e:
+            failed = self.is_failure(e)
+            raise
+        finally:
+            self.limiter.release(time.perf_counter() - start_time, bool(failed))
+            self.breaker.record(failed, probe)
+
+    async def call(self, function: Callable, *args, **kwargs):
+        """
+        Await function(*args, **kwargs) in a slot, bounded by the request deadline.
+
+        Raises:
+            OverloadError: (504) if the request deadline passes during the call
+        """
+        async with self.slot():
+            remaining = remaining_time()
+            if remaining is None:
+                return await function(*args, **kwargs)
+            try:
+                return await asyncio.wait_for(function(*args, **kwargs), max(remaining, 0))
+            except asyncio.TimeoutError:
+                raise OverloadError(self.name, "deadline", 504)
+
+    def stats(self) -> Dict[str, Any]:
+        return {"limiter": self.limiter.stats(), "circuitBreaker": self.breaker.stats()}
+
+
+def create_guard(name: str,
+                 initial_limit: int,
+                 max_limit: int,
+                 is_failure: Callable[[BaseException], bool] = None) -> UpstreamGuard:
+    """Build an upstream guard with the limiter and breaker settings from Config"""
+    limiter = AdaptiveLimiter(
+        name,
+        initial_limit=initial_limit,
+        min_limit=Config.CONCURRENCY_MIN_LIMIT,
+        max_limit=max_limit,
+        max_queue=Config.CONCURRENCY_QUEUE_SIZE,
+        queue_timeout=Config.CONCURRENCY_QUEUE_TIMEOUT_SECONDS,
+        latency_tolerance=Config.CONCURRENCY_LATENCY_TOLERANCE,
+        backoff_ratio=Config.CONCURRENCY_BACKOFF_RATIO,
+        enabled=Config.ADAPTIVE_CONCURRENCY_ENABLED
+    )
+    breaker = CircuitBreaker(
+        name,
+        failure_rate=Config.CIRCUIT_BREAKER_FAILURE_RATE,
+        min_calls=Config.CIRCUIT_BREAKER_MIN_CALLS,
+        window_seconds=Config.CIRCUIT_BREAKER_WINDOW_SECONDS,
+        open_seconds=Config.CIRCUIT_BREAKER_OPEN_SECONDS,
+        half_open_probes=Config.CIRCUIT_BREAKER_HALF_OPEN_PROBES,
+        enabled=Config.CIRCUIT_BREAKER_ENABLED
+    )
+    return UpstreamGuard(name, limiter, breaker, is_failure)
+
+
+class DeadlineMiddleware:
+    """
+    ASGI middleware setting the request deadline used for deadline-aware shedding:
+    REQUEST_DEADLINE_SECONDS, or the client's X-Request-Timeout (seconds) when shorter.
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        timeout = Config.REQUEST_DEADLINE_SECONDS
+        for name, value in scope.get("headers", []):
+            if name == b"x-request-timeout":
+                try:
+                    timeout = min(timeout, float(value.decode("latin-1")))
+                except ValueError:
+                    pass
+                break
+        token = _deadline.set(time.monotonic() + timeout if timeout > 0 else None)
+        try:
+            await self.app(scope, receive, send)
+        finally:
+            _deadline.reset(token)
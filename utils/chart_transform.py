@@ -0,0 +1,280 @@
+"""
+Server-side transformation of Prometheus results into chart-ready data.
+
+The output shape is chosen from chartConfig.chartType via ChartConfig:
+- recharts (lineChart, barChart, areaChart): rows of {"timestamp": t, "s0": v, ...}
+- plotly heatmap: {"x": timestamps, "y": bucket labels, "z": matrix}
+- plotly gauge: a single scalar value
+
+Range results are downsampled to a maximum number of rows with
+Largest-Triangle-Three-Buckets (LTTB). Every row carries every series, so
+the rows are selected once for all of them: line charts on the summed
+triangle areas of the (range-normalized) series, bar and area charts on
+the stacked total.
+"""
+from operator import itemgetter
+from typing import Optional, Dict, Any, List, Tuple
+
+import numpy as np
+
+from utils.chart_enums import ChartType, ChartLibrary, ChartConfig
+
+
+def series_name(metric: Dict[str, str]) -> str:
+    """Build a readable legend name from a series label set"""
+    labels = {key: value for key, value in metric.items() if key != "__name__"}
+    name = metric.get("__name__", "")
+    if not labels:
+        return name or "value"
+    label_text = ",".join(f'{key}="{value}"' for key, value in sorted(labels.items()))
+    return f"{name}{{{label_text}}}"
+
+
+def _find_result(prometheus_data: Dict[Any, Any]) -> Tuple[Optional[str], Any]:
+    """Locate resultType and result in a connector response (possibly nested under "data")"""
+    node = prometheus_data
+    for _ in range(3):
+        if not isinstance(node, dict):
+            break
+        if "resultType" in node and "result" in node:
+            return node["resultType"], node["result"]
+        node = node.get("data")
+    return None, None
+
+
+_TIMESTAMP = itemgetter(0)
+_VALUE = itemgetter(1)
+
+
+def _samples(series: Dict[Any, Any]) -> list:
+    return series.get("values") or ([series["value"]] if "value" in series else [])
+
+
+def _to_matrix(result: List[Dict[Any, Any]]) -> Tuple[np.ndarray, np.ndarray, List[Dict[str, str]]]:
+    """
+    Pivot matrix series onto a shared timestamp grid.
+
+    Returns:
+        (timestamps of shape (T,), values of shape (S, T) with NaN for missing samples, label sets)
+    """
+    metrics = [series.get("metric", {}) for series in result]
+    per_series = []
+    for series in result:
+        samples = _samples(series)
+        # fromiter over float() is several times faster than letting numpy convert the value strings
+        per_series.append((
+            np.fromiter(map(_TIMESTAMP, samples), np.float64, len(samples)),
+            np.fromiter(map(float, map(_VALUE, samples)), np.float64, len(samples)),
+        ))
+
+    grid = np.unique(np.concatenate([timestamps for timestamps, _ in per_series])) if per_series else np.empty(0)
+    matrix = np.full((len(per_series), len(grid)), np.nan)
+    for row, (timestamps, values) in enumerate(per_series):
+        matrix[row, np.searchsorted(grid, timestamps)] = values
+    return grid, matrix, metrics
+
+
+def lttb_indices(x: np.ndarray, y: np.ndarray, threshold: int, shared: bool = False) -> np.ndarray:
+    """
+    Select up to `threshold` points per series with Largest-Triangle-Three-Buckets.
+
+    Args:
+        x: Shared x values of shape (T,), ascending
+        y: Series values of shape (S, T); NaN samples are never selected over real ones
+        threshold: Number of points to keep per series
+        shared: Select the same points for every series, maximizing the sum of their
+            triangle areas (each series scaled to its value range so none dominates)
+
+    Returns:
+        Selected indices of shape (S, threshold) ((1, threshold) when shared),
+        or all T indices when no downsampling is needed
+    """
+    series_count, length = y.shape
+    if threshold >= length or threshold < 3:
+        return np.tile(np.arange(length), (1 if shared else series_count, 1))
+    if shared:
+        finite = np.isfinite(y)
+        low = np.min(y, axis=1, initial=np.inf, where=finite)
+        high = np.max(y, axis=1, initial=-np.inf, where=finite)
+        spread = np.where(high > low, high - low, 1.0)
+        y = (y - np.where(np.isfinite(low), low, 0.0)[:, None]) / spread[:, None]
+
+    # threshold - 2 buckets between the fixed first and last points
+    edges = np.floor(np.linspace(1, length - 1, threshold - 1)).astype(np.int64)
+    valid = ~np.isnan(y[:, :length - 1])
+    sums = np.add.reduceat(np.where(valid, y[:, :length - 1], 0.0), edges[:-1], axis=1)
+    counts = np.add.reduceat(valid, edges[:-1], axis=1)
+    with np.errstate(invalid="ignore", divide="ignore"):
+        bucket_avg_y = sums / counts
+    bucket_avg_x = np.add.reduceat(x[:length - 1], edges[:-1]) / np.diff(edges)
+
+    # The triangle's third vertex is the average of the following bucket (or the last point)
+    next_avg_x = np.concatenate([bucket_avg_x[1:], x[-1:]])
+    next_avg_y = np.concatenate([bucket_avg_y[:, 1:], y[:, -1:]], axis=1)
+
+    selected = np.empty((series_count, threshold), dtype=np.int64)
+    selected[:, 0] = 0
+    selected[:, -1] = length - 1
+    rows = np.arange(series_count)
+    anchor = np.zeros(series_count, dtype=np.int64)
+    for bucket in range(threshold - 2):
+        start, end = edges[bucket], edges[bucket + 1]
+        anchor_x = x[anchor][:, None]
+        anchor_y = y[rows, anchor][:, None]
+        area = np.abs(
+            (anchor_x - next_avg_x[bucket]) * (y[:, start:end] - anchor_y)
+            - (anchor_x - x[start:end]) * (next_avg_y[:, bucket:bucket + 1] - anchor_y)
+        )
+        area = np.where(np.isnan(area), -1.0, area)
+        if shared:
+            area = np.where(area < 0, 0.0, area).sum(axis=0, keepdims=True)
+        anchor = start + area.argmax(axis=1)
+        if shared:
+            anchor = np.repeat(anchor, series_count)
+        selected[:, bucket + 1] = anchor
+    return selected[:1] if shared else selected
+
+
+def _json_values(values: np.ndarray) -> list:
+    """Convert an array to a JSON-safe (nested) list, with NaN/Inf as None"""
+    return np.where(np.isfinite(values), values, None).tolist()
+
+
+def _latest_values(result: list) -> list:
+    """Latest finite value of each series, or None (only the newest samples are parsed)"""
+    latest = []
+    for series in result:
+        value = None
+        for sample in reversed(_samples(series)):
+            number = float(sample[1])
+            if np.isfinite(number):
+                value = number
+                break
+        latest.append(value)
+    return latest
+
+
+def _json_timestamps(timestamps: np.ndarray) -> list:
+    if np.all(timestamps == np.floor(timestamps)):
+        return timestamps.astype(np.int64).tolist()
+    return timestamps.tolist()
+
+
+def _recharts_rows(chart_type: ChartType, result_type: str, result: list, max_points: int) -> Dict[str, Any]:
+    metrics = [series.get("metric", {}) for series in result]
+    keys = [f"s{index}" for index in range(len(metrics))]
+    legend = [{"key": key, "name": series_name(metric), "labels": metric} for key, metric in zip(keys, metrics)]
+
+    if result_type == "vector":
+        rows = [{"name": entry["name"], "value": value} for entry, value in zip(legend, _latest_values(result))]
+        return {"series": legend, "data": rows, "downsampled": False}
+
+    grid, matrix, _ = _to_matrix(result)
+    if not len(metrics):
+        indices = np.arange(0)
+    elif chart_type == ChartType.LINE_CHART:
+        # One set of rows for all lines, chosen where the lines change shape the most
+        indices = lttb_indices(grid, matrix, max_points, shared=True)[0]
+    else:
+        # Bars and stacked areas: select on the stacked total
+        total = np.nansum(matrix, axis=0)[None, :]
+        indices = lttb_indices(grid, total, max_points)[0]
+
+    timestamps = _json_timestamps(grid[indices])
+    columns = _json_values(matrix[:, indices].T)
+    rows = [{"timestamp": timestamp, **dict(zip(keys, values))} for timestamp, values in zip(timestamps, columns)]
+    return {
+        "series": legend,
+        "data": rows,
+        "downsampled": len(indices) < len(grid),
+        "originalPoints": int(len(grid))
+    }
+
+
+def _bucket_bound(value: str) -> float:
+    return float("inf") if value in ("+Inf", "Inf") else float(value)
+
+
+def _heatmap(result: list, max_points: int) -> Dict[str, Any]:
+    grid, matrix, metrics = _to_matrix(result)
+
+    if metrics and all("le" in metric for metric in metrics):
+        # Histogram buckets: sum series sharing a bound, then de-accumulate across bounds
+        bounds = sorted({metric["le"] for metric in metrics}, key=_bucket_bound)
+        bound_index = {bound: index for index, bound in enumerate(bounds)}
+        cumulative = np.zeros((len(bounds), len(grid)))
+        np.add.at(cumulative, [bound_index[metric["le"]] for metric in metrics], np.nan_to_num(matrix))
+        z = np.clip(np.diff(cumulative, axis=0, prepend=0.0), 0.0, None)
+        y_labels = bounds
+    else:
+        z = matrix
+        y_labels = [series_name(metric) for metric in metrics]
+
+    downsampled = False
+    if len(grid) > max_points > 0:
+        # Average fixed-size time bins; LTTB has no 2D equivalent for heatmap cells
+        bin_size = int(np.ceil(len(grid) / max_points))
+        starts = np.arange(0, len(grid), bin_size)
+        valid = ~np.isnan(z)
+        with np.errstate(invalid="ignore", divide="ignore"):
+            z = np.add.reduceat(np.where(valid, z, 0.0), starts, axis=1) / np.add.reduceat(valid, starts, axis=1)
+        grid = grid[starts]
+        downsampled = True
+
+    return {
+        "x": _json_timestamps(grid),
+        "y": y_labels,
+        "z": _json_values(z),
+        "downsampled": downsampled
+    }
+
+
+def _gauge(result_type: str, result: Any) -> Dict[str, Any]:
+    if result_type == "scalar":
+        value = float(result[1])
+        return {"value": value if np.isfinite(value) else None, "series": []}
+
+    metrics = [series.get("metric", {}) for series in result]
+    latest = _latest_values(result)
+    return {
+        "value": latest[0] if latest else None,
+        "series": [{"name": series_name(metric), "value": value} for metric, value in zip(metrics, latest)]
+    }
+
+
+def transform_for_chart(prometheus_data: Dict[Any, Any],
+                        chart_config: Dict[str, Any],
+                        max_points: int) -> Optional[Dict[str, Any]]:
+    """
+    Transform a connector response into the data shape expected by the chart in chart_config.
+
+    Args:
+        prometheus_data: Response JSON from the Prometheus connector
+        chart_config: {"chartType": ..., "chartLibrary": ...} as generated for the query
+        max_points: Maximum points kept per series (heatmaps: time bins)
+
+    Returns:
+        Chart data with chartType/chartLibrary, or None if the chart type or result is not supported
+    """
+    try:
+        chart_type = ChartType(chart_config.get("chartType"))
+    except ValueError:
+        return None
+    library = ChartConfig.get_library_for_chart_type(chart_type)
+
+    result_type, result = _find_result(prometheus_data)
+    if result_type not in ("matrix", "vector", "scalar") or result is None:
+        return None
+
+    if chart_type == ChartType.GAUGE:
+        chart_data = _gauge(result_type, result)
+    elif result_type == "scalar":
+        return None
+    elif chart_type == ChartType.HEATMAP:
+        chart_data = _heatmap(result, max_points)
+    elif library == ChartLibrary.RECHARTS:
+        chart_data = _recharts_rows(chart_type, result_type, result, max_points)
+    else:
+        return None
+
+    return {**ChartConfig.get_chart_config(chart_type), **chart_data}
@@ -0,0 +1,150 @@
+"""
+Response compression negotiated by Accept-Encoding.
+
+Large query results are highly repetitive JSON (label sets and timestamps
+repeat for every sample), so they compress 10-20x. CompressionMiddleware
+compresses complete responses of at least RESPONSE_COMPRESSION_MIN_BYTES
+with zstd, when the optional zstandard package is installed, or gzip,
+whichever the client accepts with the higher q-value (zstd on ties).
+Streamed responses (NDJSON/SSE) are passed through unchanged, so their
+frames are not held back. Bodies above a few hundred KiB are compressed in
+the thread pool: zlib and zstandard release the GIL, so other requests keep
+being served meanwhile.
+"""
+import gzip
+from typing import Optional, List, Tuple
+
+from starlette.concurrency import run_in_threadpool
+
+from config import Config
+from utils.metrics import RESPONSE_COMPRESSION_BYTES, stage
+
+try:
+    import zstandard
+except ImportError:  # Optional: only gzip is offered without it
+    zstandard = None
+
+# Bodies at least this large are compressed off the event loop
+THREADPOOL_MIN_BYTES = 256 * 1024
+COMPRESSIBLE_TYPES = (b"application/json", b"application/x-ndjson", b"text/")
+
+
+def supported_encodings() -> List[str]:
+    """Encodings this process can produce, in order of preference"""
+    return ["zstd", "gzip"] if zstandard is not None else ["gzip"]
+
+
+def negotiate_encoding(accept_encoding: str) -> Optional[str]:
+    """
+    Choose the response encoding from an Accept-Encoding header value.
+
+    Returns:
+        "zstd" or "gzip", or None if the client accepts neither
+    """
+    weights = {}
+    for part in accept_encoding.split(","):
+        coding, _, parameters = part.partition(";")
+        coding = coding.strip().lower()
+        if not coding:
+            continue
+        weight = 1.0
+        for parameter in parameters.split(";"):
+            name, _, value = parameter.partition("=")
+            if name.strip().lower() == "q":
+                try:
+                    weight = float(value)
+                except ValueError:
+                    weight = 0.0
+        weights[coding] = weight
+
+    chosen, chosen_weight = None, 0.0
+    for coding in supported_encodings():
+        weight = weights.get(coding, weights.get("*", 0.0))
+        if weight > chosen_weight:
+            chosen, chosen_weight = coding, weight
+    return chosen
+
+
+def compress(body: bytes, encoding: str) -> bytes:
+    """Compress a response body with the given encoding"""
+    if encoding == "zstd":
+        return zstandard.ZstdCompressor(level=Config.RESPONSE_COMPRESSION_ZSTD_LEVEL).compress(body)
+    return gzip.compress(body, compresslevel=Config.RESPONSE_COMPRESSION_GZIP_LEVEL, mtime=0)
+
+
+def _header(headers: List[Tuple[bytes, bytes]], name: bytes) -> Optional[bytes]:
+    for key, value in headers:
+        if key.lower() == name:
+            return value
+    return None
+
+
+class CompressionMiddleware:
+    """
+    ASGI middleware compressing complete responses as negotiated by Accept-Encoding.
+
+    The response start is held until the first body message: a body sent in one
+    message (more_body false) of a compressible type and at least minimum_size
+    bytes is compressed; anything else is forwarded as is.
+    """
+
+    def __init__(self, app, minimum_size: Optional[int] = None):
+        self.app = app
+        self.minimum_size = Config.RESPONSE_COMPRESSION_MIN_BYTES if minimum_size is None else minimum_size
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or not Config.RESPONSE_COMPRESSION_ENABLED:
+            await self.app(scope, receive, send)
+            return
+        accept_encoding = _header(scope.get("headers", []), b"accept-encoding")
+        encoding = negotiate_encoding(accept_encoding.decode("latin-1")) if accept_encoding else None
+        if encoding is None:
+            await self.app(scope, receive, send)
+            return
+
+        start_message = None
+        decided = False
+
+        async def send_compressed(message):
+            nonlocal start_message, decided
+            if decided:
+                await send(message)
+                return
+            if message["type"] == "http.response.start":
+                start_message = message
+                return
+            if message["type"] != "http.response.body" or start_message is None:
+                await send(message)
+                return
+
+            decided = True
+            headers = list(start_message.get("headers", []))
+            body = message.get("body", b"")
+            content_type = _header(headers, b"content-type") or b""
+            if (message.get("more_body", False)
+                    or len(body) < self.minimum_size
+                    or _header(headers, b"content-encoding") is not None
+                    or not content_type.startswith(COMPRESSIBLE_TYPES)):
+                await send(start_message)
+                await send(message)
+                return
+
+            with stage("compress"):
+                if len(body) >= THREADPOOL_MIN_BYTES:
+                    compressed = await run_in_threadpool(compress, body, encoding)
+                else:
+                    compressed = compress(body, encoding)
+            RESPONSE_COMPRESSION_BYTES.inc(len(body), encoding=encoding, kind="identity")
+            RESPONSE_COMPRESSION_BYTES.inc(len(compressed), encoding=encoding, kind="compressed")
+
+            vary = _header(headers, b"vary")
+            headers = [(key, value) for key, value in headers if key.lower() not in (b"content-length", b"vary")]
+            headers += [
+                (b"content-encoding", encoding.encode("latin-1")),
+                (b"content-length", str(len(compressed)).encode("latin-1")),
+                (b"vary", vary + b", Accept-Encoding" if vary else b"Accept-Encoding"),
+            ]
+            await send({**start_message, "headers": headers})
+            await send({**message, "body": compressed})
+
+        await self.app(scope, receive, send_compressed)
@@ -0,0 +1,534 @@
+"""
+Deterministic fast path for common natural language queries.
+
+Recognizes a few stock questions (CPU/memory/disk usage, request rate,
+latency percentiles, error ratio) and builds the same payload the LLM
+would, following the conventions in SYSTEM_PROMPT: rate() for counters,
+histogram_quantile() over _bucket series for latency, and its chartType
+rules. Metric names follow node_exporter and the common HTTP
+instrumentation names (http_requests_total, http_request_duration_seconds).
+
+Every part of the query that the matcher understands (intent, window,
+grouping, aggregation, percentile, service) is removed from the text;
+the share of remaining words that are not filler sets the confidence.
+Queries below the configured confidence go to the LLM. Left-over words
+that change what is asked (numbers, status classes, negations, outcomes
+such as "failed") reject the match whatever the configured confidence:
+"error rate for 4xx" must not be answered with the 5xx ratio.
+
+Follow-ups to a previous query ("same but last 24h", "group by pod
+instead", "show as bar chart") are handled by match_refinement, which
+edits the previous payload with the same vocabulary and leaves only the
+words it cannot explain to the LLM.
+"""
+import re
+import time
+from typing import Optional, Dict, Any, List, Tuple
+
+from utils.chart_enums import ChartType, ChartConfig
+from utils.promql_parser import PromQLValidationError, parse_duration, parse_promql, parse_step
+
+NODE_CPU_METRIC = "node_cpu_seconds_total"
+NODE_MEMORY_AVAILABLE_METRIC = "node_memory_MemAvailable_bytes"
+NODE_MEMORY_TOTAL_METRIC = "node_memory_MemTotal_bytes"
+NODE_FILESYSTEM_AVAILABLE_METRIC = "node_filesystem_avail_bytes"
+NODE_FILESYSTEM_SIZE_METRIC = "node_filesystem_size_bytes"
+HTTP_REQUESTS_METRIC = "http_requests_total"
+HTTP_DURATION_BUCKET_METRIC = "http_request_duration_seconds_bucket"
+
+DEFAULT_WINDOW_SECONDS = 3600
+DEFAULT_PERCENTILE = 0.95
+
+_UNIT_SECONDS = {
+    "s": 1, "sec": 1, "secs": 1, "second": 1, "seconds": 1,
+    "m": 60, "min": 60, "mins": 60, "minute": 60, "minutes": 60,
+    "h": 3600, "hr": 3600, "hrs": 3600, "hour": 3600, "hours": 3600,
+    "d": 86400, "day": 86400, "days": 86400,
+    "w": 604800, "week": 604800, "weeks": 604800,
+}
+_STEPS = [60, 300, 900, 1800, 3600, 7200, 21600, 86400]
+
+# Grouping words mapped to the label they group by
+_GROUP_LABELS = {
+    "instance": "instance", "node": "instance", "host": "instance", "server": "instance", "machine": "instance",
+    "pod": "pod", "service": "service", "job": "job", "namespace": "namespace", "container": "container",
+    "method": "method", "status": "status", "code": "status", "handler": "handler", "route": "handler",
+    "endpoint": "handler", "path": "handler",
+}
+_AGGREGATIONS = {
+    "average": "avg", "avg": "avg", "mean": "avg", "overall": "avg",
+    "max": "max", "maximum": "max", "peak": "max", "highest": "max",
+    "min": "min", "minimum": "min", "lowest": "min",
+    "total": "sum", "sum": "sum",
+}
+
+_WINDOW = re.compile(
+    r"\b(?:(?:in|over|for|during|from)\s+)?(?:the\s+)?(?:last|past|previous)\s+"
+    r"(?:(\d+)\s*(" + "|".join(sorted(_UNIT_SECONDS, key=len, reverse=True)) + r")|("
+    r"minute|hour|day|week))\b"
+)
+_PERCENTILE = re.compile(r"\bp(50|75|90|95|99|999)\b|\b(\d{1,2}(?:\.\d+)?)(?:th|st|nd|rd)?\s+percentile\b|\bmedian\b")
+_GROUPING = re.compile(
+    r"\b(?:grouped\s+by|broken\s+down\s+by|split\s+by|by|per|for\s+each|for\s+every|across)\s+(?:each\s+|every\s+)?("
+    + "|".join(_GROUP_LABELS) + r")(?:e?s)?\b"
+)
+_SERVICE = re.compile(
+    r"\b(?:(?:for|of|on|in)\s+(?:the\s+)?)?([a-z0-9][a-z0-9_-]*)\s+service\b"
+    r"|\bservice\s*(?:[=:]\s*|\s(?:named|called)\s+)\"?([a-z0-9][a-z0-9_-]*)\"?"
+)
+_AGGREGATION = re.compile(r"\b(" + "|".join(_AGGREGATIONS) + r")\b")
+_TOP_N = re.compile(r"\b(?:top|most\s+active)\s+(\d+)(?:\s+(" + "|".join(_GROUP_LABELS) + r")(?:e?s)?)?\b")
+_CURRENT = re.compile(r"\b(?:current(?:ly)?|right\s+now|now|latest)\b")
+_DISTRIBUTION = re.compile(r"\b(?:distribution|heatmap|histogram)\b")
+
+# Intents in precedence order: the first pattern found wins, so "error rate of requests"
+# is an error ratio and "request latency" a latency query
+_INTENTS = [
+    ("error_ratio", re.compile(
+        r"\b(?:http\s+)?(?:5xx\s+)?errors?(?:\s+(?:rate|ratio|percentage|percent|fraction))?\b"
+        r"(?:\s+(?:of|for|in)\s+(?:http\s+)?requests?)?"
+    )),
+    ("latency", re.compile(
+        r"\b(?:(?:http\s+)?(?:request|response)\s+)?(?:latency|latencies|response\s+times?|durations?)\b"
+    )),
+    ("request_rate", re.compile(
+        r"\b(?:(?:http\s+)?requests?(?:\s+(?:rate|per\s+second|throughput|count|volume))?|rps|qps|throughput|traffic)\b"
+    )),
+    ("cpu", re.compile(r"\bcpu(?:\s+(?:usage|utili[sz]ation|load|percent(?:age)?|busy))?\b")),
+    ("memory", re.compile(r"\b(?:memory|mem|ram)(?:\s+(?:usage|utili[sz]ation|used|consumption|percent(?:age)?))?\b")),
+    ("disk", re.compile(r"\b(?:disk|filesystem|storage)(?:\s+(?:space\s+)?(?:usage|utili[sz]ation|used|space))?\b")),
+]
+
+# Words that carry no meaning for the query
+_FILLER = {
+    "show", "me", "what", "whats", "is", "are", "was", "the", "a", "an", "of", "for", "in", "on", "over", "at",
+    "graph", "chart", "plot", "display", "get", "give", "list", "all", "my", "our", "and", "usage", "rate",
+    "each", "with", "to", "from", "time", "trend", "trends", "please", "how", "much", "many", "value",
+    "values", "level", "levels", "metric", "metrics", "percent", "percentage", "utilization", "utilisation",
+    "across", "cluster", "fleet", "about", "view", "see", "monitor", "track", "can", "you", "i", "want",
+    "need", "there", "this", "that", "it", "its", "s", "by", "per",
+}
+_WORD = re.compile(r"[a-z0-9_.]+")
+# Left-over words that change the meaning of the question; any of them sends it to the LLM
+_DECISIVE = re.compile(
+    r"\d.*|[1-5]xx|not|no|non|never|except|excluding|exclude|excludes|without|other|than|only|but"
+    r"|fail(?:ed|ing|s|ures?)?|unsuccessful|success(?:ful)?|ok|good|bad|healthy|unhealthy"
+    r"|above|below|under|more|less|fewer|greater|higher|lower"
+)
+
+_NODE_INTENTS = {"cpu", "memory", "disk"}
+
+
+class IntentMatch:
+    """A payload built by the fast path, with the intent it matched and its confidence"""
+
+    def __init__(self, intent: str, payload: Dict[str, Any], confidence: float):
+        self.intent = intent
+        self.payload = payload
+        self.confidence = confidence
+
+
+def _format_duration(seconds: int) -> str:
+    for unit, size in (("d", 86400), ("h", 3600), ("m", 60)):
+        if seconds % size == 0:
+            return f"{seconds // size}{unit}"
+    return f"{seconds}s"
+
+
+def _choose_step(window: int) -> int:
+    """Step giving a few hundred points at most: 60s for short ranges, 5m and up for longer ones"""
+    for step in _STEPS:
+        if window / step <= 360:
+            return step
+    return _STEPS[-1]
+
+
+def _consume(pattern: re.Pattern, text: str) -> Tuple[Optional[re.Match], str]:
+    """Find the first match of pattern and blank it out of the text"""
+    match = pattern.search(text)
+    if match is None:
+        return None, text
+    return match, text[:match.start()] + " " * (match.end() - match.start()) + text[match.end():]
+
+
+def _selector(matchers: List[str]) -> str:
+    return "{" + ",".join(matchers) + "}" if matchers else ""
+
+
+def _sum(expression: str, labels: List[str]) -> str:
+    return f"sum by ({', '.join(labels)}) ({expression})" if labels else f"sum({expression})"
+
+
+def _build_query(intent: str,
+                 group: Optional[str],
+                 aggregation: Optional[str],
+                 percentile: Optional[float],
+                 service: Optional[str],
+                 distribution: bool,
+                 rate_window: str) -> Optional[Tuple[str, ChartType]]:
+    """Build the PromQL query and default chart type for an intent, or None if unsupported"""
+    if intent in _NODE_INTENTS:
+        if service or percentile is not None or (group and group != "instance"):
+            return None
+        if intent == "cpu":
+            # Per-instance busy percentage: 100 - idle share of CPU time
+            query = f'100 * (1 - avg by (instance) (rate({NODE_CPU_METRIC}{{mode="idle"}}[{rate_window}])))'
+        elif intent == "memory":
+            query = f"100 * (1 - {NODE_MEMORY_AVAILABLE_METRIC} / {NODE_MEMORY_TOTAL_METRIC})"
+        else:
+            filesystems = '{fstype!~"tmpfs|overlay|squashfs"}'
+            query = (
+                f"max by (instance) (100 * (1 - {NODE_FILESYSTEM_AVAILABLE_METRIC}{filesystems}"
+                f" / {NODE_FILESYSTEM_SIZE_METRIC}{filesystems}))"
+            )
+        if aggregation and not group:
+            # Percentages do not add up across instances: "total" means the fleet average
+            query = f"{'avg' if aggregation == 'sum' else aggregation}({query})"
+        return query, ChartType.LINE_CHART
+
+    matchers = [f'service="{service}"'] if service else []
+    group_labels = [group] if group else []
+    if intent == "request_rate":
+        if percentile is not None:
+            return None
+        query = _sum(f"rate({HTTP_REQUESTS_METRIC}{_selector(matchers)}[{rate_window}])", group_labels)
+        return query, ChartType.LINE_CHART
+
+    if intent == "error_ratio":
+        # Grouped by status, the 5xx ratio is 1 for every 5xx status and missing for the rest
+        if percentile is not None or group == "status":
+            return None
+        errors = _selector(matchers + ['status=~"5.."'])
+        query = (
+            _sum(f"rate({HTTP_REQUESTS_METRIC}{errors}[{rate_window}])", group_labels)
+            + " / "
+            + _sum(f"rate({HTTP_REQUESTS_METRIC}{_selector(matchers)}[{rate_window}])", group_labels)
+        )
+        return query, ChartType.LINE_CHART
+
+    # Latency from histogram buckets
+    buckets = f"rate({HTTP_DURATION_BUCKET_METRIC}{_selector(matchers)}[{rate_window}])"
+    if distribution:
+        if group:
+            return None
+        return f"sum by (le) ({buckets})", ChartType.HEATMAP
+    quantile = DEFAULT_PERCENTILE if percentile is None else percentile
+    return f"histogram_quantile({quantile:g}, sum by ({', '.join(['le'] + group_labels)}) ({buckets}))", ChartType.LINE_CHART
+
+
+def match_intent(natural_language_query: str, now: Optional[float] = None) -> Optional[IntentMatch]:
+    """
+    Match a natural language query against the stock intents.
+
+    Args:
+        natural_language_query: Original user query
+        now: Unix timestamp the time window ends at (defaults to current time)
+
+    Returns:
+        IntentMatch with a payload shaped like the LLM's (prometheusQuery, start,
+        end, step, chartConfig), or None if no intent matched
+    """
+    text = " " + natural_language_query.lower() + " "
+    words = _WORD.findall(text)
+    if not words:
+        return None
+
+    intent = None
+    for name, pattern in _INTENTS:
+        match, text = _consume(pattern, text)
+        if match is None:
+            continue
+        if intent is None:
+            intent = name
+        elif not (intent in ("error_ratio", "latency") and name == "request_rate"):
+            # Two unrelated intents in one question ("cpu and memory"): leave it to the LLM
+            return None
+    if intent is None:
+        return None
+
+    match, text = _consume(_WINDOW, text)
+    window = DEFAULT_WINDOW_SECONDS
+    if match is not None:
+        if match.group(3):
+            window = _UNIT_SECONDS[match.group(3)]
+        else:
+            window = int(match.group(1)) * _UNIT_SECONDS[match.group(2)]
+    if window <= 0:
+        return None
+
+    match, text = _consume(_PERCENTILE, text)
+    percentile = None
+    if match is not None:
+        if match.group(1):
+            percentile = float("0." + match.group(1))
+        elif match.group(2):
+            percentile = float(match.group(2)) / 100
+        else:
+            percentile = 0.5
+
+    top_match, text = _consume(_TOP_N, text)
+    match, text = _consume(_GROUPING, text)
+    group = _GROUP_LABELS[match.group(1)] if match else None
+    if top_match is not None and top_match.group(2):
+        # "top 5 services by request rate": the ranked label is the grouping
+        if group is not None and group != _GROUP_LABELS[top_match.group(2)]:
+            return None
+        group = _GROUP_LABELS[top_match.group(2)]
+
+    match, text = _consume(_SERVICE, text)
+    service = (match.group(1) or match.group(2)) if match else None
+
+    match, text = _consume(_AGGREGATION, text)
+    aggregation = _AGGREGATIONS[match.group(1)] if match else None
+
+    current_match, text = _consume(_CURRENT, text)
+    distribution_match, text = _consume(_DISTRIBUTION, text)
+    if distribution_match is not None and intent != "latency":
+        return None
+
+    unexplained = [word for word in _WORD.findall(text) if word not in _FILLER]
+    if any(_DECISIVE.fullmatch(word) for word in unexplained):
+        return None
+    confidence = 1.0 - len(unexplained) / len(words)
+
+    step = _choose_step(window)
+    built = _build_query(
+        intent, group, aggregation, percentile, service, distribution_match is not None, _format_duration(max(300, step))
+    )
+    if built is None:
+        return None
+    query, chart_type = built
+
+    if top_match is not None and chart_type == ChartType.LINE_CHART:
+        query = f"topk({int(top_match.group(1))}, {query})"
+        chart_type = ChartType.BAR_CHART
+    elif current_match is not None and chart_type == ChartType.LINE_CHART and not group:
+        chart_type = ChartType.GAUGE
+
+    end = int(time.time() if now is None else now)
+    payload = {
+        "prometheusQuery": query,
+        "start": end - window,
+        "end": end,
+        "step": f"{step}s",
+        "chartConfig": ChartConfig.get_chart_config(chart_type),
+    }
+    return IntentMatch(intent, payload, confidence)
+
+
+# Follow-up refinements of a previous payload ("same but last 24h", "group by pod instead", "as a bar chart")
+_REFINE_WINDOW = re.compile(
+    r"\b(?:(?:over|for|across|to)\s+(?:the\s+)?)(\d+)\s*(" + "|".join(sorted(_UNIT_SECONDS, key=len, reverse=True)) + r")\b"
+)
+_REFINE_STEP = re.compile(
+    r"\b(?:(?:at|with|using)\s+(?:an?\s+)?)?(\d+)\s*(" + "|".join(sorted(_UNIT_SECONDS, key=len, reverse=True))
+    + r")\s+(?:steps?|resolution|granularity|intervals?)\b"
+    r"|\b(?:steps?|resolution|granularity)\s*(?:of\s+|to\s+|=\s*|:\s*)?(\d+)\s*("
+    + "|".join(sorted(_UNIT_SECONDS, key=len, reverse=True)) + r")\b"
+    r"|\bevery\s+(\d+)\s*(" + "|".join(sorted(_UNIT_SECONDS, key=len, reverse=True)) + r")\b"
+)
+_UNGROUP = re.compile(
+    r"\b(?:without|no)\s+grouping\b|\b(?:un|not\s+)grouped\b|\bin\s+total\b|\boverall\b|\bcombined\b"
+    r"|\baggregated\b|\b(?:as\s+)?(?:a\s+)?single\s+(?:series|line)\b"
+)
+_CHART_TYPES = {
+    "line": ChartType.LINE_CHART, "bar": ChartType.BAR_CHART, "area": ChartType.AREA_CHART,
+    "stacked": ChartType.AREA_CHART, "stacked area": ChartType.AREA_CHART, "gauge": ChartType.GAUGE,
+    "single stat": ChartType.GAUGE, "heatmap": ChartType.HEATMAP, "heat map": ChartType.HEATMAP,
+}
+_CHART_TYPE = re.compile(
+    r"\b(?:(?:as|to|into|in)\s+(?:an?\s+)?)?(" + "|".join(sorted(_CHART_TYPES, key=len, reverse=True)).replace(" ", r"\s+") + r")(?:\s+(?:chart|graph|plot))?s?\b"
+)
+_CHART_LIBRARY = re.compile(r"\b(?:(?:in|with|using)\s+)?(recharts|plotly)\b")
+_REFINE_FILLER = _FILLER | {
+    "same", "but", "instead", "now", "make", "change", "switch", "use", "using", "as", "again", "also", "then",
+    "do", "one", "query", "rather", "than", "like", "before", "previous", "window", "range", "timeframe",
+    "period", "shown", "render", "draw", "visualize", "could", "would", "let", "lets", "set", "go", "back",
+    "type", "group", "grouped", "grouping", "chart", "graph", "just", "ok", "okay", "thanks", "thank", "form",
+    "style", "visualization",
+}
+
+# Masks string literals so label values cannot be mistaken for grouping clauses
+_PROMQL_STRING = re.compile(r'"(?:[^"\\]|\\.)*"|\'(?:[^\'\\]|\\.)*\'|`[^`]*`')
+_BY_CLAUSE = re.compile(r"\bby\s*\(([^()]*)\)\s*")
+_PLAIN_AGGREGATION = re.compile(r"\b(sum|avg|min|max|count|stddev|stdvar|group)\s*\(")
+# Label-sensitive constructs a grouping change could silently break
+_LABEL_MATCHING = re.compile(r"\b(?:on|ignoring|group_left|group_right|without)\s*\(")
+# Range selectors such as [5m]; subqueries ([1h:5m]) do not match
+_RANGE_SELECTOR = re.compile(r"\[((?:\d+(?:ms|[smhdwy]))+)\]")
+
+
+class Refinement:
+    """A follow-up applied to a previous payload: the edited payload, what changed and what is left for the LLM"""
+
+    def __init__(self, payload: Dict[str, Any], chart_config: Dict[str, Any], changes: List[str], remaining: str):
+        self.payload = payload
+        self.chart_config = chart_config
+        self.changes = changes
+        self.remaining = remaining
+
+
+def regroup_query(query: str, label: Optional[str]) -> Optional[str]:
+    """
+    Change the grouping labels of every aggregation in a query.
+
+    Existing "by (...)" clauses get the new label (keeping "le" for
+    histogram_quantile); without such clauses, plain aggregations such as
+    sum(...) get one. A label of None removes the grouping.
+
+    Returns:
+        The rewritten query, or None if the grouping cannot be changed safely
+        (no aggregation, "without", or vector matching on labels)
+    """
+    masked = _PROMQL_STRING.sub(lambda match: "_" * len(match.group(0)), query)
+    if _LABEL_MATCHING.search(masked):
+        return None
+
+    edits = []
+    clauses = list(_BY_CLAUSE.finditer(masked))
+    if clauses:
+        for clause in clauses:
+            labels = [name.strip() for name in clause.group(1).split(",") if name.strip()]
+            grouping = [name for name in labels if name == "le"] + ([label] if label else [])
+            replacement = f"by ({', '.join(grouping)}) " if grouping else ""
+            edits.append((clause.start(), clause.end(), replacement))
+    else:
+        aggregations = list(_PLAIN_AGGREGATION.finditer(masked))
+        if not aggregations:
+            return None
+        if label:
+            for aggregation in aggregations:
+                edits.append((aggregation.start(), aggregation.end(), f"{aggregation.group(1)} by ({label}) ("))
+
+    for start, end, replacement in reversed(edits):
+        query = query[:start] + replacement + query[end:]
+    query = query.strip()
+    try:
+        parse_promql(query)
+    except PromQLValidationError:
+        return None
+    return query
+
+
+def widen_range_selectors(query: str, step: float) -> str:
+    """
+    Widen the range selectors of a query that are shorter than the step to the step.
+
+    rate(x[5m]) evaluated every hour only looks at five minutes of each hour;
+    with the selector at least as wide as the step no samples are skipped.
+    Subqueries and label values are left as they are.
+    """
+    masked = _PROMQL_STRING.sub(lambda match: "_" * len(match.group(0)), query)
+    width = _format_duration(int(step))
+    for match in reversed(list(_RANGE_SELECTOR.finditer(masked))):
+        if parse_duration(match.group(1)) < step:
+            query = query[:match.start(1)] + width + query[match.end(1):]
+    return query
+
+
+def _duration_seconds(amount: str, unit: str) -> int:
+    return int(amount) * _UNIT_SECONDS[unit]
+
+
+def match_refinement(refinement: str,
+                     payload: Dict[str, Any],
+                     chart_config: Dict[str, Any],
+                     now: Optional[float] = None) -> Refinement:
+    """
+    Apply the time range, step, grouping and chart type changes of a follow-up locally.
+
+    A new time range ends now; unless a step is given, the previous step is kept
+    while it still fits the range (so overlapping data can be reused) and a step
+    is chosen as for new queries otherwise. A coarser step widens range selectors
+    shorter than it. Grouping changes rewrite the query's
+    "by" clauses. Chart types and libraries are checked against
+    ChartConfig.CHART_TYPE_TO_LIBRARY. Words that none of these explain are
+    returned as the remaining change for the LLM, which also gets any grouping
+    change that cannot be applied safely.
+
+    Args:
+        refinement: Follow-up text, e.g. "same but last 24h grouped by pod"
+        payload: Previous payload (prometheusQuery, start, end, step)
+        chart_config: Previous chartConfig
+        now: Unix timestamp a new time range ends at (defaults to current time)
+
+    Returns:
+        Refinement with the edited payload and chartConfig
+
+    Raises:
+        ValueError: If the requested chart type and library do not go together
+    """
+    text = " " + refinement.lower() + " "
+    payload = dict(payload)
+    chart_config = dict(chart_config or {})
+    changes = []
+
+    # Step before window: "1h resolution over 7d" must not read "1h" as the window
+    match, text = _consume(_REFINE_STEP, text)
+    step = None
+    if match is not None:
+        amount, unit = next((match.group(index), match.group(index + 1)) for index in (1, 3, 5) if match.group(index))
+        step = _duration_seconds(amount, unit)
+
+    match, text = _consume(_WINDOW, text)
+    if match is None:
+        match, text = _consume(_REFINE_WINDOW, text)
+        window = _duration_seconds(match.group(1), match.group(2)) if match is not None else None
+    elif match.group(3):
+        window = _UNIT_SECONDS[match.group(3)]
+    else:
+        window = _duration_seconds(match.group(1), match.group(2))
+
+    previous_step = parse_step(payload["step"])
+    if window:
+        chosen_step = _choose_step(window)
+        end = int(time.time() if now is None else now)
+        payload.update(start=end - window, end=end)
+        if step is None:
+            step = previous_step if previous_step <= chosen_step and window / previous_step <= 360 else chosen_step
+        changes.append(f"window={_format_duration(window)}")
+    if step is not None and step != previous_step:
+        payload["step"] = f"{step}s"
+        changes.append(f"step={_format_duration(step)}")
+        if step > previous_step:
+            payload["prometheusQuery"] = widen_range_selectors(payload["prometheusQuery"], step)
+
+    ungroup_match, text = _consume(_UNGROUP, text)
+    group_match, text = _consume(_GROUPING, text)
+    label = _GROUP_LABELS[group_match.group(1)] if group_match else None
+    if group_match is not None or ungroup_match is not None:
+        query = regroup_query(payload["prometheusQuery"], label)
+        if query is None:
+            # Leave the grouping to the LLM
+            consumed = group_match if group_match is not None else ungroup_match
+            text = text + " " + consumed.group(0)
+        else:
+            payload["prometheusQuery"] = query
+            changes.append(f"groupBy={label}" if label else "groupBy=none")
+
+    chart_match, text = _consume(_CHART_TYPE, text)
+    library_match, text = _consume(_CHART_LIBRARY, text)
+    chart_type = None
+    if chart_match is not None:
+        chart_type = _CHART_TYPES[re.sub(r"\s+", " ", chart_match.group(1))]
+    elif library_match is not None:
+        try:
+            chart_type = ChartType(chart_config.get("chartType"))
+        except ValueError:
+            chart_type = None
+    if library_match is not None and chart_type is not None:
+        library = ChartConfig.get_library_for_chart_type(chart_type).value
+        if library != library_match.group(1):
+            supported = [
+                value.value for value, chart_library in ChartConfig.CHART_TYPE_TO_LIBRARY.items()
+                if chart_library.value == library_match.group(1)
+            ]
+            raise ValueError(
+                f"{chart_type.value} is rendered with {library}; {library_match.group(1)} supports {', '.join(supported)}"
+            )
+    if chart_type is not None and chart_type.value != chart_config.get("chartType"):
+        chart_config = ChartConfig.get_chart_config(chart_type)
+        changes.append(f"chartType={chart_type.value}")
+
+    remaining = [word for word in _WORD.findall(text) if word not in _REFINE_FILLER]
+    return Refinement(payload, chart_config, changes, " ".join(text.split()) if remaining else "")
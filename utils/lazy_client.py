@@ -0,0 +1,33 @@
+import threading
+from typing import Any, Callable
+
+
+class LazyClient:
+    """
+    Proxy creating the wrapped client on first attribute access.
+
+    Keeps client construction (and the import of heavy SDKs done by the
+    factory) out of module import time; attribute access is forwarded to
+    the client once created.
+    """
+
+    def __init__(self, factory: Callable[[], Any]):
+        self._factory = factory
+        self._client = None
+        self._lock = threading.Lock()
+
+    def get(self) -> Any:
+        """Return the client, creating it if needed"""
+        if self._client is None:
+            with self._lock:
+                if self._client is None:
+                    self._client = self._factory()
+        return self._client
+
+    @property
+    def created(self) -> bool:
+        """Whether the client has been created"""
+        return self._client is not None
+
+    def __getattr__(self, name: str) -> Any:
+        return getattr(self.get(), name)
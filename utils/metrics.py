@@ -0,0 +1,316 @@
+"""
+Process-local instrumentation exposed in the Prometheus text format.
+
+Counters and histograms are plain in-memory structures updated under a lock
+(no per-observation allocation beyond the label tuple), so recording them on
+the hot path costs a few microseconds. Components that already keep
+their own counters (caches, connector, single-flight) are exported through
+collector callbacks evaluated only when /metrics is scraped.
+
+Per-request stage timings are collected in a context variable set up by
+MetricsMiddleware and returned in the Server-Timing response header.
+"""
+import contextvars
+import random
+import threading
+import time
+from bisect import bisect_left
+from contextlib import contextmanager
+from typing import Optional, Dict, Any, List, Tuple, Callable, Iterable
+
+from config import Config
+
+# Latency buckets (seconds) covering cache hits up to slow LLM calls
+LATENCY_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+# Response size buckets (bytes), 1KiB to 64MiB
+SIZE_BUCKETS = tuple(1024 * 4 ** power for power in range(9))
+# Token count buckets, 64 to 32768
+TOKEN_BUCKETS = tuple(64 * 2 ** power for power in range(10))
+
+# A collector returns (name, type, help, [(labels, value), ...]) tuples
+CollectorSamples = Iterable[Tuple[str, str, str, List[Tuple[Dict[str, str], float]]]]
+
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_labels(label_names: Tuple[str, ...], label_values: Tuple[str, ...], extra: str = "") -> str:
+    pairs = [f'{name}="{_escape(str(value))}"' for name, value in zip(label_names, label_values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+def _format_value(value: float) -> str:
+    if value == int(value) and abs(value) < 1e15:
+        return str(int(value))
+    return repr(float(value))
+
+
+class Counter:
+    """Monotonic counter with optional labels"""
+
+    def __init__(self, name: str, documentation: str, label_names: Tuple[str, ...] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.label_names = tuple(label_names)
+        self._values: Dict[Tuple[str, ...], float] = {}
+        self._lock = threading.Lock()
+
+    def inc(self, amount: float = 1, **labels):
+        key = tuple(str(labels[name]) for name in self.label_names)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def value(self, **labels) -> float:
+        key = tuple(str(labels[name]) for name in self.label_names)
+        with self._lock:
+            return self._values.get(key, 0)
+
+    def collect(self) -> List[str]:
+        with self._lock:
+            values = list(self._values.items())
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} counter"]
+        for key, value in sorted(values):
+            lines.append(f"{self.name}{_format_labels(self.label_names, key)} {_format_value(value)}")
+        return lines
+
+
+class Histogram:
+    """Fixed-bucket histogram with optional labels"""
+
+    def __init__(self,
+                 name: str,
+                 documentation: str,
+                 label_names: Tuple[str, ...] = (),
+                 buckets: Tuple[float, ...] = LATENCY_BUCKETS):
+        self.name = name
+        self.documentation = documentation
+        self.label_names = tuple(label_names)
+        self.buckets = tuple(sorted(buckets))
+        # label values -> [per-bucket counts (last one is +Inf), sum, count]
+        self._series: Dict[Tuple[str, ...], list] = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value: float, **labels):
+        key = tuple(str(labels[name]) for name in self.label_names)
+        index = bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._series.get(key)
+            if series is None:
+                series = self._series[key] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+            series[0][index] += 1
+            series[1] += value
+            series[2] += 1
+
+    @contextmanager
+    def time(self, **labels):
+        """Observe the duration of the with-block"""
+        start_time = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - start_time, **labels)
+
+    def count(self, **labels) -> int:
+        key = tuple(str(labels[name]) for name in self.label_names)
+        with self._lock:
+            series = self._series.get(key)
+            return series[2] if series else 0
+
+    def collect(self) -> List[str]:
+        with self._lock:
+            snapshot = [(key, list(series[0]), series[1], series[2]) for key, series in self._series.items()]
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} histogram"]
+        for key, bucket_counts, total, count in sorted(snapshot):
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets + (float("inf"),), bucket_counts):
+                cumulative += bucket_count
+                le = "+Inf" if bound == float("inf") else _format_value(bound)
+                bucket_labels = _format_labels(self.label_names, key, f'le="{le}"')
+                lines.append(f"{self.name}_bucket{bucket_labels} {cumulative}")
+            labels = _format_labels(self.label_names, key)
+            lines.append(f"{self.name}_sum{labels} {_format_value(total)}")
+            lines.append(f"{self.name}_count{labels} {count}")
+        return lines
+
+
+class MetricsRegistry:
+    """Holds the process's counters, histograms and scrape-time collectors"""
+
+    def __init__(self):
+        self._metrics: List[Any] = []
+        self._collectors: List[Callable[[], CollectorSamples]] = []
+
+    def counter(self, name: str, documentation: str, label_names: Tuple[str, ...] = ()) -> Counter:
+        metric = Counter(name, documentation, label_names)
+        self._metrics.append(metric)
+        return metric
+
+    def histogram(self,
+                  name: str,
+                  documentation: str,
+                  label_names: Tuple[str, ...] = (),
+                  buckets: Tuple[float, ...] = LATENCY_BUCKETS) -> Histogram:
+        metric = Histogram(name, documentation, label_names, buckets)
+        self._metrics.append(metric)
+        return metric
+
+    def register_collector(self, collector: Callable[[], CollectorSamples]):
+        """Register a callback producing samples from existing component stats at scrape time"""
+        self._collectors.append(collector)
+
+    def render(self) -> str:
+        """Render every metric in the Prometheus text exposition format"""
+        lines = []
+        for metric in self._metrics:
+            lines.extend(metric.collect())
+        for collector in self._collectors:
+            for name, metric_type, documentation, samples in collector():
+                lines.append(f"# HELP {name} {documentation}")
+                lines.append(f"# TYPE {name} {metric_type}")
+                for labels, value in samples:
+                    if value is None:
+                        continue
+                    label_names = tuple(labels)
+                    label_text = _format_labels(label_names, tuple(labels[key] for key in label_names))
+                    lines.append(f"{name}{label_text} {_format_value(value)}")
+        return "\n".join(lines) + "\n"
+
+
+registry = MetricsRegistry()
+
+HTTP_RESPONSES = registry.counter(
+    "promql_generator_http_responses_total", "HTTP responses by endpoint and status code", ("endpoint", "code")
+)
+HTTP_REQUEST_SECONDS = registry.histogram(
+    "promql_generator_http_request_duration_seconds", "HTTP request latency by endpoint", ("endpoint",)
+)
+STAGE_SECONDS = registry.histogram(
+    "promql_generator_stage_duration_seconds", "Latency of request stages (llm, connector, mongo, chart, ...)",
+    ("stage",)
+)
+PAYLOADS_ANSWERED = registry.counter(
+    "promql_generator_payloads_total", "Query payloads produced, by the path that answered", ("answered_by",)
+)
+LLM_REQUEST_SECONDS = registry.histogram(
+    "promql_generator_llm_request_duration_seconds", "OpenAI chat completion latency by endpoint", ("endpoint",)
+)
+LLM_TOKENS = registry.counter(
+    "promql_generator_llm_tokens_total",
+    "OpenAI tokens used by endpoint and kind (prompt, cached_prompt, completion); cached_prompt is part of prompt",
+    ("endpoint", "kind")
+)
+LLM_REQUEST_TOKENS = registry.histogram(
+    "promql_generator_llm_request_tokens", "OpenAI tokens spent per request across its LLM calls, by endpoint",
+    ("endpoint",), buckets=TOKEN_BUCKETS
+)
+LLM_PAYLOAD_ERRORS = registry.counter(
+    "promql_generator_llm_payload_errors_total",
+    "Unusable OpenAI payload responses by reason (invalid_json, invalid_payload, truncated, refused, budget)",
+    ("endpoint", "reason")
+)
+CONNECTOR_REQUEST_SECONDS = registry.histogram(
+    "promql_generator_connector_request_duration_seconds",
+    "Prometheus connector request latency including retries, by outcome", ("outcome",)
+)
+CONNECTOR_RESPONSE_BYTES = registry.histogram(
+    "promql_generator_connector_response_bytes", "Prometheus connector response body size", buckets=SIZE_BUCKETS
+)
+MONGO_WRITE_SECONDS = registry.histogram(
+    "promql_generator_mongo_write_duration_seconds", "MongoDB write latency by operation", ("operation",)
+)
+RESPONSE_COMPRESSION_BYTES = registry.counter(
+    "promql_generator_response_compression_bytes_total",
+    "Body bytes of compressed responses before (identity) and after compression, by encoding", ("encoding", "kind")
+)
+
+# Stage timings of the request being handled; None outside MetricsMiddleware
+_stage_timings: contextvars.ContextVar = contextvars.ContextVar("stage_timings", default=None)
+
+
+def record_stage(name: str, seconds: float):
+    """Record a stage duration for the current request and the stage histogram"""
+    STAGE_SECONDS.observe(seconds, stage=name)
+    timings = _stage_timings.get()
+    if timings is not None:
+        timings.append((name, seconds))
+
+
+@contextmanager
+def stage(name: str):
+    """Time the with-block as a request stage"""
+    start_time = time.perf_counter()
+    try:
+        yield
+    finally:
+        record_stage(name, time.perf_counter() - start_time)
+
+
+def format_server_timing(timings: List[Tuple[str, float]], total: Optional[float] = None) -> str:
+    """
+    Format stage timings as a Server-Timing header value (durations in milliseconds).
+
+    Repeated stages are summed.
+    """
+    merged: Dict[str, float] = {}
+    for name, seconds in timings:
+        merged[name] = merged.get(name, 0.0) + seconds
+    if total is not None:
+        merged["total"] = total
+    return ", ".join(f"{name};dur={seconds * 1000:.1f}" for name, seconds in merged.items())
+
+
+def should_log_payload() -> bool:
+    """Whether to log full payloads for this call (sampled by DEBUG_PAYLOAD_LOG_SAMPLE_RATE)"""
+    rate = Config.DEBUG_PAYLOAD_LOG_SAMPLE_RATE
+    return rate > 0 and (rate >= 1 or random.random() < rate)
+
+
+class MetricsMiddleware:
+    """
+    ASGI middleware counting responses per endpoint and status code, timing
+    requests, and returning the request's stage timings in a Server-Timing header.
+
+    Endpoints are labelled with the route path template, so label cardinality
+    stays bounded. For streaming responses the header holds the stages finished
+    before the response started. on_first_response, if given, is called once
+    when the first response starts (used for startup timing).
+    """
+
+    def __init__(self, app, on_first_response: Optional[Callable[[], None]] = None):
+        self.app = app
+        self.on_first_response = on_first_response
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        timings: List[Tuple[str, float]] = []
+        token = _stage_timings.set(timings)
+        start_time = time.perf_counter()
+        status_code = 500
+
+        async def send_with_timings(message):
+            nonlocal status_code
+            if message["type"] == "http.response.start":
+                status_code = message["status"]
+                header = format_server_timing(timings, time.perf_counter() - start_time)
+                message["headers"] = list(message.get("headers", [])) + [
+                    (b"server-timing", header.encode("latin-1"))
+                ]
+                if self.on_first_response is not None:
+                    self.on_first_response()
+                    self.on_first_response = None
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_with_timings)
+        finally:
+            _stage_timings.reset(token)
+            route = scope.get("route")
+            endpoint = getattr(route, "path", None) or "unmatched"
+            HTTP_REQUEST_SECONDS.observe(time.perf_counter() - start_time, endpoint=endpoint)
+            HTTP_RESPONSES.inc(endpoint=endpoint, code=status_code)
@@ -0,0 +1,204 @@
+import copy
+import re
+import threading
+import time
+from collections import OrderedDict
+from typing import Optional, Dict, Any, Tuple
+
+from utils.serialization import dumps
+from utils.shared_store import SharedStore
+
+# Duration phrases folded into PromQL-style units so "last 1 hour" and
+# "last 1h" share a cache entry
+_DURATION_UNITS = [
+    (r"(?:seconds?|secs?|s)", "s"),
+    (r"(?:minutes?|mins?|m)", "m"),
+    (r"(?:hours?|hrs?|h)", "h"),
+    (r"(?:days?|d)", "d"),
+    (r"(?:weeks?|wks?|w)", "w"),
+]
+_DURATION_PATTERNS = [
+    (re.compile(rf"\b(\d+)\s*{unit}\b"), rf"\g<1>{short}") for unit, short in _DURATION_UNITS
+]
+# Punctuation that does not change what is asked; everything else is kept
+_NEUTRAL_PUNCTUATION = re.compile(r"[?,;\"'`]+")
+# Comparison, matcher and unit characters change the meaning ("!= 200" vs "= 200",
+# "> 80%" vs "< 80%"), so they are kept as tokens of their own
+_OPERATOR = re.compile(r"[!=<>]=|[=!]~|[=!<>~%]")
+_WHITESPACE = re.compile(r"\s+")
+_TRAILING = re.compile(r"[\s.!]+$")
+
+
+def normalize_query(natural_language_query: str) -> str:
+    """
+    Normalize a natural language query for use as a cache key.
+
+    Only case, whitespace, neutral punctuation and duration spellings are
+    folded: operators are spaced out but kept, so "status!=200" and
+    "status != 200" share a key while "status = 200" does not.
+    """
+    text = natural_language_query.lower()
+    text = _NEUTRAL_PUNCTUATION.sub(" ", text)
+    text = _OPERATOR.sub(lambda match: f" {match.group(0)} ", text)
+    for pattern, replacement in _DURATION_PATTERNS:
+        text = pattern.sub(replacement, text)
+    text = _WHITESPACE.sub(" ", text).strip()
+    return _TRAILING.sub("", text)
+
+
+class PayloadCache:
+    """
+    Bounded LRU cache with TTL for LLM-generated query payloads.
+
+    Payloads are stored with a relative time window (duration of the
+    start/end range) instead of the absolute timestamps the LLM produced.
+    On a hit the window is re-anchored so that it ends at the current time.
+
+    With a shared store, entries are written through to it and local misses
+    are looked up there, so a payload generated by one worker process is
+    reused by the others. The store is only used off the event loop: get()
+    awaits the shared lookup and put() queues the write without waiting.
+    """
+
+    def __init__(self, max_size: int, ttl_seconds: float, shared: Optional[SharedStore] = None):
+        self.max_size = max_size
+        self.ttl_seconds = ttl_seconds
+        self.shared = shared
+        self._entries: "OrderedDict[Tuple[str, str, str], Dict[str, Any]]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    @staticmethod
+    def make_key(natural_language_query: str, model_name: str, prompt_version: str) -> Tuple[str, str, str]:
+        """Build the cache key from the normalized query, model and prompt version (including the response format)"""
+        return (normalize_query(natural_language_query), model_name, prompt_version)
+
+    @staticmethod
+    def _shared_key(key: Tuple[str, str, str]) -> str:
+        return dumps(list(key)).decode("utf-8")
+
+    async def get(self,
+                  natural_language_query: str,
+                  model_name: str,
+                  prompt_version: str,
+                  now: Optional[float] = None) -> Optional[Dict[Any, Any]]:
+        """
+        Look up a cached payload and re-anchor its time window.
+
+        Args:
+            natural_language_query: Original user query
+            model_name: LLM model that produced the payload
+            prompt_version: Version of the system prompt used
+            now: Unix timestamp to anchor the window to (defaults to current time)
+
+        Returns:
+            A fresh copy of the payload with start/end ending at `now`, or None on a miss
+        """
+        if self.max_size <= 0:
+            return None
+
+        key = self.make_key(natural_language_query, model_name, prompt_version)
+        now = time.time() if now is None else now
+
+        with self._lock:
+            entry = self._entries.get(key)
+        if entry is None and self.shared is not None:
+            entry = await self.shared.get_async(self._shared_key(key), now=now)
+            if entry is not None:
+                self._insert(key, entry)
+
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            if now - entry["storedAt"] > self.ttl_seconds:
+                del self._entries[key]
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            payload = copy.deepcopy(entry["payload"])
+            window = entry["window"]
+            as_string = entry["timestampsAsString"]
+
+        end = int(now)
+        start = end - window
+        payload["start"] = str(start) if as_string else start
+        payload["end"] = str(end) if as_string else end
+        return payload
+
+    def put(self,
+            natural_language_query: str,
+            model_name: str,
+            prompt_version: str,
+            payload: Dict[Any, Any],
+            now: Optional[float] = None) -> bool:
+        """
+        Store a payload under its normalized query.
+
+        Payloads whose start/end are not numeric or do not describe a positive
+        window are not cached, since they cannot be re-anchored.
+
+        Returns:
+            bool: True if the payload was cached, False otherwise
+        """
+        if self.max_size <= 0:
+            return False
+
+        try:
+            start = float(payload["start"])
+            end = float(payload["end"])
+        except (KeyError, TypeError, ValueError):
+            return False
+        window = int(end - start)
+        if window <= 0:
+            return False
+
+        key = self.make_key(natural_language_query, model_name, prompt_version)
+        template = copy.deepcopy(payload)
+        template.pop("start", None)
+        template.pop("end", None)
+        entry = {
+            "payload": template,
+            "window": window,
+            "timestampsAsString": isinstance(payload["start"], str),
+            "storedAt": time.time() if now is None else now,
+        }
+
+        self._insert(key, entry)
+        if self.shared is not None:
+            self.shared.set_later(self._shared_key(key), entry, now=entry["storedAt"])
+        return True
+
+    def _insert(self, key: Tuple[str, str, str], entry: Dict[str, Any]):
+        with self._lock:
+            self._entries[key] = entry
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+    def clear(self):
+        """Drop all cached payloads, including the shared ones (counters are kept)"""
+        with self._lock:
+            self._entries.clear()
+        if self.shared is not None:
+            self.shared.clear()
+
+    def stats(self) -> Dict[str, Any]:
+        """Return hit/miss counters and current occupancy"""
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "hitRatio": (self.hits / lookups) if lookups else 0.0,
+                "size": len(self._entries),
+                "maxSize": self.max_size,
+                "ttlSeconds": self.ttl_seconds,
+                "shared": self.shared.stats() if self.shared is not None else None,
+            }
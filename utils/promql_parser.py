@@ -0,0 +1,533 @@
+"""
+In-process PromQL parser and validator.
+
+Parses a PromQL expression far enough to check syntax, function arity and
+argument types, and range-vector vs instant-vector typing, without building
+a full AST. Also validates the start/end/step fields of a generated query
+payload so that malformed requests are rejected before they reach the
+Prometheus connector.
+"""
+import re
+from datetime import datetime
+from typing import Dict, List, Optional, Tuple, Any
+
+# Value types, named as in Prometheus error messages
+SCALAR = "scalar"
+VECTOR = "instant vector"
+MATRIX = "range vector"
+STRING = "string"
+
+# Prometheus rejects range queries returning more points than this per series
+MAX_POINTS_PER_SERIES = 11000
+
+_DURATION_UNITS = {"ms": 0.001, "s": 1, "m": 60, "h": 3600, "d": 86400, "w": 604800, "y": 31536000}
+_DURATION_PART = re.compile(r"(\d+)(ms|s|m|h|d|w|y)")
+_DURATION = re.compile(r"(?:\d+(?:ms|s|m|h|d|w|y))+")
+
+_TOKEN = re.compile(r"""
+    (?P<ws>\s+|\#[^\n]*)
+  | (?P<duration>(?:\d+(?:ms|s|m|h|d|w|y))+)(?![\w.])
+  | (?P<number>0[xX][0-9a-fA-F]+|(?:\d+\.?\d*|\.\d+)(?:[eE][+-]?\d+)?)
+  | (?P<ident>[a-zA-Z_][a-zA-Z0-9_:]*)
+  | (?P<string>"(?:[^"\\]|\\.)*"|'(?:[^'\\]|\\.)*'|`[^`]*`)
+  | (?P<op>=~|!~|==|!=|>=|<=|[-+*/%^=<>(){}\[\],:@])
+""", re.VERBOSE)
+
+AGGREGATIONS = {
+    "sum": None, "min": None, "max": None, "avg": None, "group": None,
+    "stddev": None, "stdvar": None, "count": None,
+    "count_values": STRING, "topk": SCALAR, "bottomk": SCALAR, "quantile": SCALAR,
+    "limitk": SCALAR, "limit_ratio": SCALAR,
+}
+
+# name: (argument types, number of trailing optional arguments, variadic last argument, return type)
+FUNCTIONS: Dict[str, Tuple[Tuple[str, ...], int, bool, str]] = {
+    "abs": ((VECTOR,), 0, False, VECTOR),
+    "absent": ((VECTOR,), 0, False, VECTOR),
+    "absent_over_time": ((MATRIX,), 0, False, VECTOR),
+    "acos": ((VECTOR,), 0, False, VECTOR),
+    "acosh": ((VECTOR,), 0, False, VECTOR),
+    "asin": ((VECTOR,), 0, False, VECTOR),
+    "asinh": ((VECTOR,), 0, False, VECTOR),
+    "atan": ((VECTOR,), 0, False, VECTOR),
+    "atanh": ((VECTOR,), 0, False, VECTOR),
+    "avg_over_time": ((MATRIX,), 0, False, VECTOR),
+    "ceil": ((VECTOR,), 0, False, VECTOR),
+    "changes": ((MATRIX,), 0, False, VECTOR),
+    "clamp": ((VECTOR, SCALAR, SCALAR), 0, False, VECTOR),
+    "clamp_max": ((VECTOR, SCALAR), 0, False, VECTOR),
+    "clamp_min": ((VECTOR, SCALAR), 0, False, VECTOR),
+    "cos": ((VECTOR,), 0, False, VECTOR),
+    "cosh": ((VECTOR,), 0, False, VECTOR),
+    "count_over_time": ((MATRIX,), 0, False, VECTOR),
+    "day_of_month": ((VECTOR,), 1, False, VECTOR),
+    "day_of_week": ((VECTOR,), 1, False, VECTOR),
+    "day_of_year": ((VECTOR,), 1, False, VECTOR),
+    "days_in_month": ((VECTOR,), 1, False, VECTOR),
+    "deg": ((VECTOR,), 0, False, VECTOR),
+    "delta": ((MATRIX,), 0, False, VECTOR),
+    "deriv": ((MATRIX,), 0, False, VECTOR),
+    "double_exponential_smoothing": ((MATRIX, SCALAR, SCALAR), 0, False, VECTOR),
+    "exp": ((VECTOR,), 0, False, VECTOR),
+    "floor": ((VECTOR,), 0, False, VECTOR),
+    "histogram_avg": ((VECTOR,), 0, False, VECTOR),
+    "histogram_count": ((VECTOR,), 0, False, VECTOR),
+    "histogram_fraction": ((SCALAR, SCALAR, VECTOR), 0, False, VECTOR),
+    "histogram_quantile": ((SCALAR, VECTOR), 0, False, VECTOR),
+    "histogram_stddev": ((VECTOR,), 0, False, VECTOR),
+    "histogram_stdvar": ((VECTOR,), 0, False, VECTOR),
+    "histogram_sum": ((VECTOR,), 0, False, VECTOR),
+    "holt_winters": ((MATRIX, SCALAR, SCALAR), 0, False, VECTOR),
+    "hour": ((VECTOR,), 1, False, VECTOR),
+    "idelta": ((MATRIX,), 0, False, VECTOR),
+    "increase": ((MATRIX,), 0, False, VECTOR),
+    "info": ((VECTOR, VECTOR), 1, False, VECTOR),
+    "irate": ((MATRIX,), 0, False, VECTOR),
+    "label_join": ((VECTOR, STRING, STRING, STRING), 0, True, VECTOR),
+    "label_replace": ((VECTOR, STRING, STRING, STRING, STRING), 0, False, VECTOR),
+    "last_over_time": ((MATRIX,), 0, False, VECTOR),
+    "ln": ((VECTOR,), 0, False, VECTOR),
+    "log10": ((VECTOR,), 0, False, VECTOR),
+    "log2": ((VECTOR,), 0, False, VECTOR),
+    "mad_over_time": ((MATRIX,), 0, False, VECTOR),
+    "max_over_time": ((MATRIX,), 0, False, VECTOR),
+    "min_over_time": ((MATRIX,), 0, False, VECTOR),
+    "minute": ((VECTOR,), 1, False, VECTOR),
+    "month": ((VECTOR,), 1, False, VECTOR),
+    "pi": ((), 0, False, SCALAR),
+    "predict_linear": ((MATRIX, SCALAR), 0, False, VECTOR),
+    "present_over_time": ((MATRIX,), 0, False, VECTOR),
+    "quantile_over_time": ((SCALAR, MATRIX), 0, False, VECTOR),
+    "rad": ((VECTOR,), 0, False, VECTOR),
+    "rate": ((MATRIX,), 0, False, VECTOR),
+    "resets": ((MATRIX,), 0, False, VECTOR),
+    "round": ((VECTOR, SCALAR), 1, False, VECTOR),
+    "scalar": ((VECTOR,), 0, False, SCALAR),
+    "sgn": ((VECTOR,), 0, False, VECTOR),
+    "sin": ((VECTOR,), 0, False, VECTOR),
+    "sinh": ((VECTOR,), 0, False, VECTOR),
+    "sort": ((VECTOR,), 0, False, VECTOR),
+    "sort_by_label": ((VECTOR, STRING), 1, True, VECTOR),
+    "sort_by_label_desc": ((VECTOR, STRING), 1, True, VECTOR),
+    "sort_desc": ((VECTOR,), 0, False, VECTOR),
+    "sqrt": ((VECTOR,), 0, False, VECTOR),
+    "stddev_over_time": ((MATRIX,), 0, False, VECTOR),
+    "stdvar_over_time": ((MATRIX,), 0, False, VECTOR),
+    "sum_over_time": ((MATRIX,), 0, False, VECTOR),
+    "tan": ((VECTOR,), 0, False, VECTOR),
+    "tanh": ((VECTOR,), 0, False, VECTOR),
+    "time": ((), 0, False, SCALAR),
+    "timestamp": ((VECTOR,), 0, False, VECTOR),
+    "vector": ((SCALAR,), 0, False, VECTOR),
+    "year": ((VECTOR,), 1, False, VECTOR),
+}
+
+# Binary operator precedence, lowest first; "^" is right-associative
+_PRECEDENCE = {
+    "or": 1,
+    "and": 2, "unless": 2,
+    "==": 3, "!=": 3, "<=": 3, "<": 3, ">=": 3, ">": 3,
+    "+": 4, "-": 4,
+    "*": 5, "/": 5, "%": 5, "atan2": 5,
+    "^": 6,
+}
+_COMPARISONS = {"==", "!=", "<=", "<", ">=", ">"}
+_SET_OPERATORS = {"and", "or", "unless"}
+_UNARY_PRECEDENCE = 6
+
+
+class PromQLValidationError(ValueError):
+    """Raised when a PromQL expression or query payload is invalid"""
+
+
+def parse_duration(text: str) -> float:
+    """
+    Parse a Prometheus duration ("90s", "1h30m", "500ms") into seconds.
+
+    Raises:
+        PromQLValidationError: If the text is not a valid duration
+    """
+    if not isinstance(text, str) or not _DURATION.fullmatch(text):
+        raise PromQLValidationError(f"invalid duration {text!r}")
+    return sum(int(amount) * _DURATION_UNITS[unit] for amount, unit in _DURATION_PART.findall(text))
+
+
+def parse_step(step: Any) -> float:
+    """Parse a query step given as a duration string or a number of seconds"""
+    if isinstance(step, bool):
+        raise PromQLValidationError(f"invalid step {step!r}")
+    if isinstance(step, (int, float)):
+        seconds = float(step)
+    else:
+        try:
+            seconds = float(step)
+        except (TypeError, ValueError):
+            seconds = parse_duration(step)
+    if not seconds > 0:
+        raise PromQLValidationError(f"step must be positive, got {step!r}")
+    return seconds
+
+
+def parse_timestamp(value: Any) -> float:
+    """Parse a Unix timestamp (number or numeric string) or RFC 3339 string into seconds"""
+    if isinstance(value, bool):
+        raise PromQLValidationError(f"invalid timestamp {value!r}")
+    if isinstance(value, (int, float)):
+        return float(value)
+    if isinstance(value, str):
+        try:
+            return float(value)
+        except ValueError:
+            pass
+        try:
+            return datetime.fromisoformat(value.replace("Z", "+00:00")).timestamp()
+        except ValueError:
+            pass
+    raise PromQLValidationError(f"invalid timestamp {value!r}")
+
+
+def _tokenize(query: str) -> List[Tuple[str, str, int]]:
+    tokens = []
+    position = 0
+    length = len(query)
+    while position < length:
+        match = _TOKEN.match(query, position)
+        if match is None:
+            raise PromQLValidationError(f"unexpected character {query[position]!r} at position {position}")
+        kind = match.lastgroup
+        if kind != "ws":
+            text = match.group(kind)
+            if kind == "ident":
+                lowered = text.lower()
+                if lowered in ("inf", "nan"):
+                    kind = "number"
+                elif lowered in ("and", "or", "unless", "atan2"):
+                    kind, text = "op", lowered
+            tokens.append((kind, text, position))
+        position = match.end()
+    tokens.append(("eof", "", length))
+    return tokens
+
+
+class _Parser:
+    """Recursive-descent PromQL parser that returns the value type of each expression"""
+
+    def __init__(self, query: str):
+        self.tokens = _tokenize(query)
+        self.index = 0
+
+    # Token helpers
+    def peek(self, offset: int = 0) -> Tuple[str, str, int]:
+        if offset:
+            return self.tokens[min(self.index + offset, len(self.tokens) - 1)]
+        return self.tokens[self.index]
+
+    def advance(self) -> Tuple[str, str, int]:
+        token = self.tokens[self.index]
+        self.index += 1
+        return token
+
+    def at(self, text: str, kind: str = None) -> bool:
+        token_kind, token_text, _ = self.tokens[self.index]
+        return token_text == text and (kind is None or token_kind == kind)
+
+    def expect(self, text: str) -> Tuple[str, str, int]:
+        if not self.at(text):
+            self.fail(f"expected {text!r}")
+        return self.advance()
+
+    def fail(self, message: str):
+        kind, text, position = self.peek()
+        found = "end of input" if kind == "eof" else repr(text)
+        raise PromQLValidationError(f"{message}, found {found} at position {position}")
+
+    # Grammar
+    def parse(self) -> str:
+        value_type = self.expression(0)
+        if self.peek()[0] != "eof":
+            self.fail("unexpected token after expression")
+        return value_type
+
+    def expression(self, min_precedence: int) -> str:
+        left = self.unary()
+        while True:
+            kind, operator, _ = self.peek()
+            precedence = _PRECEDENCE.get(operator) if kind == "op" else None
+            if precedence is None or precedence < min_precedence:
+                return left
+            self.advance()
+            is_bool, vector_matching = self.binary_modifiers(operator)
+            next_precedence = precedence if operator == "^" else precedence + 1
+            right = self.expression(next_precedence)
+            left = self.binary_type(operator, left, right, is_bool, vector_matching)
+
+    def binary_modifiers(self, operator: str) -> Tuple[bool, bool]:
+        """Consume bool / on / ignoring / group_left / group_right after a binary operator"""
+        is_bool = False
+        if self.at("bool", "ident"):
+            if operator not in _COMPARISONS:
+                self.fail("bool modifier can only be used on comparison operators")
+            self.advance()
+            is_bool = True
+        vector_matching = False
+        if self.at("on", "ident") or self.at("ignoring", "ident"):
+            self.advance()
+            self.label_list()
+            vector_matching = True
+            if self.at("group_left", "ident") or self.at("group_right", "ident"):
+                if operator in _SET_OPERATORS:
+                    self.fail("no grouping allowed for set operations")
+                self.advance()
+                if self.at("("):
+                    self.label_list()
+        return is_bool, vector_matching
+
+    def binary_type(self, operator: str, left: str, right: str, is_bool: bool, vector_matching: bool) -> str:
+        for operand in (left, right):
+            if operand not in (SCALAR, VECTOR):
+                raise PromQLValidationError(
+                    f"binary expression must contain only scalar and instant vector types, got {operand}"
+                )
+        if operator in _SET_OPERATORS and (left != VECTOR or right != VECTOR):
+            raise PromQLValidationError(f"set operator {operator!r} not allowed in binary scalar expression")
+        if vector_matching and (left != VECTOR or right != VECTOR):
+            raise PromQLValidationError("vector matching only allowed between instant vectors")
+        if operator in _COMPARISONS and left == SCALAR and right == SCALAR and not is_bool:
+            raise PromQLValidationError("comparisons between scalars must use BOOL modifier")
+        return SCALAR if left == SCALAR and right == SCALAR else VECTOR
+
+    def unary(self) -> str:
+        if self.at("-", "op") or self.at("+", "op"):
+            self.advance()
+            operand = self.expression(_UNARY_PRECEDENCE)
+            if operand not in (SCALAR, VECTOR):
+                raise PromQLValidationError(f"unary expression only allowed on expressions of type scalar or instant vector, got {operand}")
+            return operand
+        return self.postfix(*self.primary())
+
+    def primary(self) -> Tuple[str, bool]:
+        """Parse an operand; returns its value type and whether it is a vector selector"""
+        kind, text, _ = self.peek()
+        if kind == "number":
+            self.advance()
+            return SCALAR, False
+        if kind == "string":
+            self.advance()
+            return STRING, False
+        if text == "(" and kind == "op":
+            self.advance()
+            value_type = self.expression(0)
+            self.expect(")")
+            return value_type, False
+        if text == "{" and kind == "op":
+            self.selector(has_name=False)
+            return VECTOR, True
+        if kind == "ident":
+            next_text = self.peek(1)[1]
+            if text in AGGREGATIONS and next_text in ("(", "by", "without"):
+                return self.aggregation(), False
+            if next_text == "(":
+                return self.function_call(), False
+            self.advance()
+            self.selector(has_name=True)
+            return VECTOR, True
+        self.fail("unexpected token")
+
+    def postfix(self, value_type: str, is_selector: bool) -> str:
+        """Parse range, subquery, offset and @ suffixes"""
+        if self.at("["):
+            self.advance()
+            self.duration_token("range")
+            if self.at(":"):
+                self.advance()
+                if not self.at("]"):
+                    self.duration_token("subquery step")
+                self.expect("]")
+                if value_type != VECTOR:
+                    raise PromQLValidationError(f"subquery is only allowed on instant vector, got {value_type}")
+                value_type = MATRIX
+            else:
+                self.expect("]")
+                if not is_selector:
+                    raise PromQLValidationError("ranges only allowed for vector selectors")
+                value_type = MATRIX
+            is_selector = True
+        seen = set()
+        while self.at("offset", "ident") or self.at("@"):
+            modifier = self.advance()[1]
+            if not is_selector:
+                raise PromQLValidationError(f"{modifier} modifier must be preceded by a vector selector or subquery")
+            if modifier in seen:
+                raise PromQLValidationError(f"{modifier} may not be set multiple times")
+            seen.add(modifier)
+            if modifier == "offset":
+                if self.at("-", "op"):
+                    self.advance()
+                self.duration_token("offset")
+            elif self.at("start", "ident") or self.at("end", "ident"):
+                self.advance()
+                self.expect("(")
+                self.expect(")")
+            elif self.peek()[0] == "number" or self.at("-", "op"):
+                if self.at("-", "op"):
+                    self.advance()
+                if self.peek()[0] != "number":
+                    self.fail("expected timestamp for @ modifier")
+                self.advance()
+            else:
+                self.fail("expected timestamp, start() or end() for @ modifier")
+        return value_type
+
+    def duration_token(self, what: str):
+        kind, text, _ = self.peek()
+        if kind != "duration":
+            self.fail(f"expected duration for {what}")
+        if parse_duration(text) <= 0:
+            self.fail(f"{what} must be positive")
+        self.advance()
+
+    def selector(self, has_name: bool):
+        has_matcher = has_name
+        if self.at("{"):
+            self.advance()
+            while not self.at("}"):
+                kind, _, _ = self.peek()
+                if kind not in ("ident", "string"):
+                    self.fail("expected label name in selector")
+                self.advance()
+                if self.peek()[1] not in ("=", "!=", "=~", "!~"):
+                    self.fail("expected label matching operator")
+                operator = self.advance()[1]
+                kind, value, _ = self.peek()
+                if kind != "string":
+                    self.fail("expected string label value")
+                self.advance()
+                if not (operator in ("=", "=~") and value[1:-1] in ("", ".*")):
+                    has_matcher = True
+                if not self.at("}"):
+                    self.expect(",")
+            self.expect("}")
+        if not has_matcher:
+            raise PromQLValidationError("vector selector must contain at least one non-empty matcher")
+
+    def label_list(self):
+        self.expect("(")
+        while not self.at(")"):
+            kind, _, _ = self.peek()
+            if kind not in ("ident", "string"):
+                self.fail("expected label name in grouping")
+            self.advance()
+            if not self.at(")"):
+                self.expect(",")
+        self.expect(")")
+
+    def aggregation(self) -> str:
+        name = self.advance()[1]
+        if self.at("by", "ident") or self.at("without", "ident"):
+            self.advance()
+            self.label_list()
+        self.expect("(")
+        parameter_type = AGGREGATIONS[name]
+        if parameter_type is not None:
+            parameter = self.expression(0)
+            if parameter != parameter_type:
+                raise PromQLValidationError(f"expected type {parameter_type} in aggregation parameter of {name}, got {parameter}")
+            self.expect(",")
+        argument = self.expression(0)
+        if argument != VECTOR:
+            raise PromQLValidationError(f"expected type instant vector in aggregation expression of {name}, got {argument}")
+        self.expect(")")
+        if self.at("by", "ident") or self.at("without", "ident"):
+            self.advance()
+            self.label_list()
+        return VECTOR
+
+    def function_call(self) -> str:
+        _, name, position = self.advance()
+        if name not in FUNCTIONS:
+            raise PromQLValidationError(f"unknown function with name {name!r} at position {position}")
+        argument_types, optional, variadic, return_type = FUNCTIONS[name]
+        self.expect("(")
+        arguments = []
+        while not self.at(")"):
+            arguments.append(self.expression(0))
+            if not self.at(")"):
+                self.expect(",")
+        self.expect(")")
+
+        minimum = len(argument_types) - optional
+        if len(arguments) < minimum or (not variadic and len(arguments) > len(argument_types)):
+            expected = f"{minimum}" if optional == 0 else f"{minimum} to {len(argument_types)}"
+            raise PromQLValidationError(
+                f"expected {expected} argument(s) in call to {name!r}, got {len(arguments)}"
+            )
+        for index, actual in enumerate(arguments):
+            expected_type = argument_types[min(index, len(argument_types) - 1)]
+            if actual != expected_type:
+                raise PromQLValidationError(
+                    f"expected type {expected_type} in call to function {name!r}, got {actual}"
+                )
+        return return_type
+
+
+def parse_promql(query: str) -> str:
+    """
+    Parse a PromQL expression and return its value type.
+
+    Returns:
+        One of "scalar", "instant vector", "range vector" or "string"
+
+    Raises:
+        PromQLValidationError: On syntax, arity or type errors
+    """
+    if not isinstance(query, str) or not query.strip():
+        raise PromQLValidationError("query must be a non-empty string")
+    return _Parser(query).parse()
+
+
+def validate_payload(payload: Dict[str, Any], max_points: Optional[int] = MAX_POINTS_PER_SERIES) -> Dict[str, float]:
+    """
+    Validate the PromQL query and time range of a generated range-query payload.
+
+    Args:
+        payload: Generated payload with prometheusQuery, start, end and step
+        max_points: Maximum number of points per series allowed for the range, or None
+                    to skip the check (when the step is chosen later by the query planner)
+
+    Returns:
+        Dict with the parsed start, end and step (seconds)
+
+    Raises:
+        PromQLValidationError: Describing every problem found
+    """
+    errors = []
+    try:
+        value_type = parse_promql(payload.get("prometheusQuery"))
+        if value_type not in (SCALAR, VECTOR):
+            errors.append(
+                f"prometheusQuery: invalid expression type {value_type!r} for range query, must be scalar or instant vector"
+            )
+    except PromQLValidationError as e:
+        errors.append(f"prometheusQuery: {e}")
+
+    parsed = {}
+    for field, parser in (("start", parse_timestamp), ("end", parse_timestamp), ("step", parse_step)):
+        try:
+            parsed[field] = parser(payload.get(field))
+        except PromQLValidationError as e:
+            errors.append(f"{field}: {e}")
+
+    if "start" in parsed and "end" in parsed:
+        if parsed["end"] <= parsed["start"]:
+            errors.append("end must be greater than start")
+        elif "step" in parsed and max_points is not None:
+            points = int((parsed["end"] - parsed["start"]) // parsed["step"]) + 1
+            if points > max_points:
+                errors.append(
+                    f"range of {parsed['end'] - parsed['start']:.0f}s at step {parsed['step']:g}s gives {points} points "
+                    f"per series, more than the limit of {max_points}; increase step"
+                )
+
+    if errors:
+        raise PromQLValidationError("; ".join(errors))
+    return parsed
@@ -0,0 +1,163 @@
+"""
+Dependency readiness tracking and startup timing.
+
+DependencyMonitor runs one async check per dependency (OpenAI, Prometheus
+connector, MongoDB) concurrently in the background. The checks also warm the
+lazily created clients, so startup never waits on a dependency, and a
+dependency that is down is re-checked more often until it recovers.
+"""
+import asyncio
+import logging
+import time
+from datetime import datetime
+from typing import Optional, Dict, Any, Callable, Awaitable, Iterable
+
+logger = logging.getLogger(__name__)
+
+
+class DependencyMonitor:
+    """
+    Periodically checks dependencies and reports per-dependency readiness.
+
+    The process is ready once the first round of checks has finished and
+    every required dependency passed its last check. Dependencies that are
+    not required are reported but do not fail readiness, so cached and
+    fast-path requests keep being served while they recover.
+    """
+
+    def __init__(self,
+                 interval_seconds: float,
+                 recovery_interval_seconds: float,
+                 timeout_seconds: float,
+                 required: Iterable[str] = ()):
+        self.interval_seconds = interval_seconds
+        self.recovery_interval_seconds = recovery_interval_seconds
+        self.timeout_seconds = timeout_seconds
+        self.required = set(required)
+        self._checks: Dict[str, Callable[[], Awaitable[bool]]] = {}
+        self._status: Dict[str, Dict[str, Any]] = {}
+        self._task = None
+        self.warmed_up = False
+
+    def register(self, name: str, check: Callable[[], Awaitable[bool]]):
+        """Register a check returning True when the dependency is usable"""
+        self._checks[name] = check
+        self._status[name] = {
+            "ready": False,
+            "required": name in self.required,
+            "lastCheck": None,
+            "lastSuccess": None,
+            "lastError": None,
+            "latencyMs": None,
+            "consecutiveFailures": 0,
+        }
+
+    async def _run_check(self, name: str, check: Callable[[], Awaitable[bool]]):
+        start_time = time.perf_counter()
+        error = None
+        try:
+            ready = bool(await asyncio.wait_for(check(), self.timeout_seconds))
+            if not ready:
+                error = "check failed"
+        except asyncio.TimeoutError:
+            ready, error = False, f"timed out after {self.timeout_seconds}s"
+        except Exception as e:
+            ready, error = False, str(e) or type(e).__name__
+
+        status = self._status[name]
+        now = datetime.now().isoformat()
+        if ready != status["ready"] and status["lastCheck"] is not None:
+            if ready:
+                logger.info("Dependency %s is ready", name)
+            else:
+                logger.warning("Dependency %s is not ready: %s", name, error)
+        status.update(
+            ready=ready,
+            lastCheck=now,
+            lastError=error,
+            latencyMs=round((time.perf_counter() - start_time) * 1000, 1),
+            consecutiveFailures=0 if ready else status["consecutiveFailures"] + 1
+        )
+        if ready:
+            status["lastSuccess"] = now
+
+    async def check_all(self):
+        """Run every check concurrently"""
+        await asyncio.gather(*[self._run_check(name, check) for name, check in self._checks.items()])
+        self.warmed_up = True
+
+    async def _check_loop(self):
+        while True:
+            await self.check_all()
+            all_ready = all(status["ready"] for status in self._status.values())
+            await asyncio.sleep(self.interval_seconds if all_ready else self.recovery_interval_seconds)
+
+    def start(self):
+        """Start checking in the background (no-op when already running)"""
+        if self._task and not self._task.done():
+            return
+        self._task = asyncio.create_task(self._check_loop())
+
+    async def stop(self):
+        """Stop the background checks"""
+        if self._task is None:
+            return
+        self._task.cancel()
+        try:
+            await self._task
+        except asyncio.CancelledError:
+            pass
+        self._task = None
+
+    def is_ready(self, name: str) -> bool:
+        """Whether a dependency passed its last check"""
+        status = self._status.get(name)
+        return bool(status and status["ready"])
+
+    @property
+    def ready(self) -> bool:
+        """Whether the first round finished and every required dependency is ready"""
+        return self.warmed_up and all(self.is_ready(name) for name in self.required)
+
+    def status(self) -> Dict[str, Any]:
+        """Return overall readiness and the last check of each dependency"""
+        return {
+            "ready": self.ready,
+            "warmedUp": self.warmed_up,
+            "dependencies": {name: dict(status) for name, status in self._status.items()},
+        }
+
+
+class StartupTimer:
+    """Time from the start of the app import to it being imported, warmed up and serving its first response"""
+
+    def __init__(self, started_at: Optional[float] = None):
+        self.started_at = time.perf_counter() if started_at is None else started_at
+        self.import_seconds = None
+        self.warm_up_seconds = None
+        self.first_response_seconds = None
+
+    def _elapsed(self) -> float:
+        return time.perf_counter() - self.started_at
+
+    def mark_imported(self):
+        self.import_seconds = self._elapsed()
+        logger.info("App imported in %.3fs", self.import_seconds)
+
+    def mark_warmed_up(self):
+        if self.warm_up_seconds is None:
+            self.warm_up_seconds = self._elapsed()
+            logger.info("Dependencies checked %.3fs after import started", self.warm_up_seconds)
+
+    def mark_first_response(self):
+        if self.first_response_seconds is None:
+            self.first_response_seconds = self._elapsed()
+            logger.info("First response sent %.3fs after import started", self.first_response_seconds)
+
+    def stats(self) -> Dict[str, Any]:
+        """Return the startup timings in seconds (None until reached)"""
+        return {
+            "importSeconds": self.import_seconds,
+            "warmUpSeconds": self.warm_up_seconds,
+            "firstResponseSeconds": self.first_response_seconds,
+        }
@@ -0,0 +1,71 @@
+"""
+Fast JSON encoding of responses carrying query results.
+
+Returning a pydantic model from an endpoint costs three passes over a
+multi-MB prometheus_data blob: validation when the model is built, the
+response_model serialization, and the stdlib JSON encoder. The fields of
+these responses are built by this service, so json_response() encodes them
+directly instead, with orjson when it is installed and the stdlib encoder
+otherwise. The response model stays on the route and still documents the
+endpoint; FAST_JSON_RESPONSES_ENABLED=false restores the model path.
+"""
+import json
+from typing import Any, Dict, Type
+
+from fastapi.responses import Response
+from pydantic import BaseModel
+
+from config import Config
+from utils.metrics import stage
+
+try:
+    import orjson
+except ImportError:  # Optional: the stdlib encoder is used without it
+    orjson = None
+
+_ORJSON_OPTIONS = (orjson.OPT_NON_STR_KEYS | orjson.OPT_SERIALIZE_NUMPY) if orjson is not None else 0
+
+
+def dumps(value: Any) -> bytes:
+    """Encode a value as compact UTF-8 JSON"""
+    if orjson is not None:
+        return orjson.dumps(value, option=_ORJSON_OPTIONS)
+    return json.dumps(value, separators=(",", ":"), ensure_ascii=False).encode("utf-8")
+
+
+def loads(data: Any) -> Any:
+    """Decode JSON from bytes or str"""
+    if orjson is not None:
+        return orjson.loads(data)
+    return json.loads(data)
+
+
+class FastJSONResponse(Response):
+    """JSON response encoded with dumps()"""
+
+    media_type = "application/json"
+
+    def render(self, content: Any) -> bytes:
+        return dumps(content)
+
+
+def response_content(model_class: Type[BaseModel], **fields) -> Dict[str, Any]:
+    """Fields of a response model in declaration order, with defaults for the ones not given, without validation"""
+    return {
+        name: fields[name] if name in fields else field.get_default(call_default_factory=True)
+        for name, field in model_class.model_fields.items()
+    }
+
+
+def json_response(model_class: Type[BaseModel], **fields) -> Any:
+    """
+    Build an endpoint's response from its response model's fields.
+
+    Returns:
+        FastJSONResponse holding the encoded fields, or the validated model when
+        FAST_JSON_RESPONSES_ENABLED is off
+    """
+    if not Config.FAST_JSON_RESPONSES_ENABLED:
+        return model_class(**fields)
+    with stage("serialize"):
+        return FastJSONResponse(response_content(model_class, **fields))
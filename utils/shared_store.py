@@ -0,0 +1,403 @@
+"""
+Key/value store shared by the worker processes of one host.
+
+The in-process caches (LLM payloads, step-aligned query results) are
+private to each worker, so with N workers the same question would be sent
+to the LLM and the same range fetched from the connector up to N times.
+SharedStore keeps their entries in a SQLite file instead: WAL mode lets
+every worker read while one writes, the file is memory-mapped so reads of
+hot entries are served from the page cache, and synchronous=OFF skips the
+fsyncs a cache does not need. No external service is involved, and the
+entries survive a restart of the server.
+
+Each cache uses its own namespace with its own byte budget; once a
+namespace exceeds it, its least recently used entries are evicted. Values
+are encoded with utils.serialization, so they must be JSON-compatible.
+SQLite errors are logged and treated as misses: the store never fails a
+request.
+
+SQLite calls block (a writer waits up to 5s for the file lock), so code
+on the event loop uses get_async(), which runs the read on the store's
+own small thread pool, and set_later(), which queues the write there and
+returns at once. Writes queued beyond max_pending_writes are dropped:
+the entry stays in the worker's own cache and is simply not shared.
+
+SharedLease uses the same file to elect one worker for background work
+(metric catalog and saved panel refreshes) that should not run once per
+worker.
+"""
+import asyncio
+import logging
+import os
+import socket
+import sqlite3
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, wait
+from functools import partial
+from typing import Optional, Dict, Any
+
+from utils.serialization import dumps, loads
+
+logger = logging.getLogger(__name__)
+
+# Reads refresh an entry's access time at most this often, so hot entries do not cost a write per read
+TOUCH_INTERVAL_SECONDS = 10
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS entries (
+    namespace TEXT NOT NULL,
+    key TEXT NOT NULL,
+    value BLOB NOT NULL,
+    size INTEGER NOT NULL,
+    stored_at REAL NOT NULL,
+    accessed_at REAL NOT NULL,
+    PRIMARY KEY (namespace, key)
+);
+CREATE INDEX IF NOT EXISTS entries_by_access ON entries (namespace, accessed_at, size);
+CREATE TABLE IF NOT EXISTS leases (
+    name TEXT PRIMARY KEY,
+    owner TEXT NOT NULL,
+    expires_at REAL NOT NULL
+);
+"""
+
+
+def _connect(path: str, mmap_bytes: int = 0) -> sqlite3.Connection:
+    # isolation_level=None: statements autocommit unless wrapped in an explicit BEGIN
+    connection = sqlite3.connect(path, timeout=5, isolation_level=None, check_same_thread=False)
+    connection.execute("PRAGMA journal_mode=WAL")
+    connection.execute("PRAGMA synchronous=OFF")
+    connection.execute(f"PRAGMA mmap_size={int(mmap_bytes)}")
+    connection.executescript(_SCHEMA)
+    return connection
+
+
+class SharedStore:
+    """
+    Namespaced key/value store in a SQLite file, safe to use from several processes and threads.
+
+    Connections are opened lazily per process and thread, so a store created
+    before the server forks its workers is usable in each of them.
+    """
+
+    def __init__(self,
+                 path: str,
+                 namespace: str,
+                 max_bytes: int,
+                 ttl_seconds: Optional[float] = None,
+                 mmap_bytes: int = 0,
+                 io_threads: int = 2,
+                 max_pending_writes: int = 64):
+        self.path = path
+        self.namespace = namespace
+        self.max_bytes = max_bytes
+        self.ttl_seconds = ttl_seconds
+        self.mmap_bytes = mmap_bytes
+        self.io_threads = io_threads
+        self.max_pending_writes = max_pending_writes
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self._io_executor = None
+        self._io_pid = None
+        self._pending_writes = set()
+        self.hits = 0
+        self.misses = 0
+        self.writes = 0
+        self.evictions = 0
+        self.errors = 0
+        self.dropped_writes = 0
+
+    def _connection(self) -> sqlite3.Connection:
+        connection = getattr(self._local, "connection", None)
+        if connection is not None and self._local.pid == os.getpid():
+            return connection
+        connection = _connect(self.path, self.mmap_bytes)
+        self._local.connection = connection
+        self._local.pid = os.getpid()
+        return connection
+
+    def _executor(self) -> ThreadPoolExecutor:
+        """The store's I/O threads, created on first use in each process (threads do not survive a fork)"""
+        with self._lock:
+            if self._io_executor is None or self._io_pid != os.getpid():
+                self._io_executor = ThreadPoolExecutor(
+                    max_workers=self.io_threads, thread_name_prefix=f"shared-store-{self.namespace}"
+                )
+                self._io_pid = os.getpid()
+                self._pending_writes = set()
+            return self._io_executor
+
+    def _count(self, counter: str, amount: int = 1):
+        with self._lock:
+            setattr(self, counter, getattr(self, counter) + amount)
+
+    def _error(self, operation: str, error: Exception):
+        self._count("errors")
+        logger.warning("Shared %s store %s failed: %s", self.namespace, operation, error)
+
+    def get(self, key: str, newer_than: Optional[float] = None, now: Optional[float] = None) -> Optional[Any]:
+        """
+        Look up a value.
+
+        Args:
+            key: Entry key within this store's namespace
+            newer_than: Only return the value if it was stored after this Unix timestamp
+                (lets callers holding a copy skip decoding an unchanged entry)
+            now: Current Unix timestamp (defaults to the current time)
+
+        Returns:
+            The decoded value, or None if it is missing, expired or not newer than newer_than
+        """
+        if self.max_bytes <= 0:
+            return None
+        now = time.time() if now is None else now
+        try:
+            connection = self._connection()
+            # The value is only read when it changed since newer_than
+            row = connection.execute(
+                "SELECT CASE WHEN stored_at > ? THEN value END, stored_at, accessed_at "
+                "FROM entries WHERE namespace = ? AND key = ?",
+                (-1.0 if newer_than is None else newer_than, self.namespace, key)
+            ).fetchone()
+            if row is None:
+                self._count("misses")
+                return None
+            value, stored_at, accessed_at = row
+            if self.ttl_seconds is not None and now - stored_at > self.ttl_seconds:
+                connection.execute("DELETE FROM entries WHERE namespace = ? AND key = ?", (self.namespace, key))
+                self._count("misses")
+                return None
+            if value is None:
+                return None
+            if now - accessed_at > TOUCH_INTERVAL_SECONDS:
+                connection.execute(
+                    "UPDATE entries SET accessed_at = ? WHERE namespace = ? AND key = ?", (now, self.namespace, key)
+                )
+            self._count("hits")
+            return loads(value)
+        except sqlite3.Error as e:
+            self._error("read", e)
+            return None
+
+    async def get_async(self,
+                        key: str,
+                        newer_than: Optional[float] = None,
+                        now: Optional[float] = None) -> Optional[Any]:
+        """get() on the store's I/O threads, for callers on the event loop"""
+        if self.max_bytes <= 0:
+            return None
+        return await asyncio.get_running_loop().run_in_executor(
+            self._executor(), partial(self.get, key, newer_than, now)
+        )
+
+    def set_later(self, key: str, value: Any, now: Optional[float] = None) -> bool:
+        """
+        Queue set() on the store's I/O threads and return without waiting for it.
+
+        The value is encoded on the I/O thread, so the caller must not mutate it afterwards.
+
+        Returns:
+            bool: True if the write was queued, False if it was dropped because
+                  max_pending_writes writes are already queued
+        """
+        if self.max_bytes <= 0:
+            return False
+        executor = self._executor()
+        with self._lock:
+            if len(self._pending_writes) >= self.max_pending_writes:
+                self.dropped_writes += 1
+                return False
+            future = executor.submit(self.set, key, value, now)
+            self._pending_writes.add(future)
+        future.add_done_callback(self._write_done)
+        return True
+
+    def _write_done(self, future):
+        with self._lock:
+            self._pending_writes.discard(future)
+
+    def flush(self, timeout: Optional[float] = None):
+        """Wait for the writes queued with set_later() (up to timeout seconds)"""
+        with self._lock:
+            pending = list(self._pending_writes)
+        if pending:
+            wait(pending, timeout=timeout)
+
+    def set(self, key: str, value: Any, now: Optional[float] = None) -> bool:
+        """
+        Store a value, evicting the namespace's least recently used entries beyond max_bytes.
+
+        Args:
+            key: Entry key within this store's namespace
+            value: JSON-compatible value
+            now: Unix timestamp recorded as the entry's store time (defaults to the current time)
+
+        Returns:
+            bool: True if the value was stored, False if it is larger than the budget or the write failed
+        """
+        if self.max_bytes <= 0:
+            return False
+        data = dumps(value)
+        if len(data) > self.max_bytes:
+            return False
+        now = time.time() if now is None else now
+        try:
+            connection = self._connection()
+            connection.execute("BEGIN IMMEDIATE")
+            try:
+                connection.execute(
+                    "INSERT OR REPLACE INTO entries (namespace, key, value, size, stored_at, accessed_at) "
+                    "VALUES (?, ?, ?, ?, ?, ?)",
+                    (self.namespace, key, data, len(data), now, now)
+                )
+                evicted = self._evict(connection)
+                connection.execute("COMMIT")
+            except BaseException:
+                connection.execute("ROLLBACK")
+                raise
+        except sqlite3.Error as e:
+            self._error("write", e)
+            return False
+        self._count("writes")
+        if evicted:
+            self._count("evictions", evicted)
+        return True
+
+    def _evict(self, connection: sqlite3.Connection) -> int:
+        """Delete least recently used entries until the namespace fits its budget (inside the write transaction)"""
+        (total,) = connection.execute(
+            "SELECT COALESCE(SUM(size), 0) FROM entries WHERE namespace = ?", (self.namespace,)
+        ).fetchone()
+        if total <= self.max_bytes:
+            return 0
+        victims = []
+        for key, size in connection.execute(
+                "SELECT key, size FROM entries WHERE namespace = ? ORDER BY accessed_at", (self.namespace,)):
+            if total <= self.max_bytes:
+                break
+            victims.append((self.namespace, key))
+            total -= size
+        connection.executemany("DELETE FROM entries WHERE namespace = ? AND key = ?", victims)
+        return len(victims)
+
+    def delete(self, key: str):
+        """Remove an entry"""
+        try:
+            self._connection().execute("DELETE FROM entries WHERE namespace = ? AND key = ?", (self.namespace, key))
+        except sqlite3.Error as e:
+            self._error("delete", e)
+
+    def clear(self):
+        """Remove every entry of this namespace (counters are kept)"""
+        try:
+            self._connection().execute("DELETE FROM entries WHERE namespace = ?", (self.namespace,))
+        except sqlite3.Error as e:
+            self._error("clear", e)
+
+    def stats(self) -> Dict[str, Any]:
+        """Return this process's hit/miss/write counters and the namespace's shared occupancy"""
+        entries, size_bytes = 0, 0
+        try:
+            entries, size_bytes = self._connection().execute(
+                "SELECT COUNT(*), COALESCE(SUM(size), 0) FROM entries WHERE namespace = ?", (self.namespace,)
+            ).fetchone()
+        except sqlite3.Error as e:
+            self._error("stats", e)
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "path": self.path,
+                "hits": self.hits,
+                "misses": self.misses,
+                "hitRatio": (self.hits / lookups) if lookups else 0.0,
+                "writes": self.writes,
+                "evictions": self.evictions,
+                "errors": self.errors,
+                "pendingWrites": len(self._pending_writes),
+                "droppedWrites": self.dropped_writes,
+                "entries": entries,
+                "sizeBytes": size_bytes,
+                "maxBytes": self.max_bytes,
+            }
+
+
+class SharedLease:
+    """
+    Time-limited lease held by at most one process, kept in the shared SQLite file.
+
+    The holder renews it by calling acquire() again before ttl_seconds pass;
+    once it stops (or exits), another process acquires it after expiry, or
+    right away if the holder released it. Calls run off the event loop.
+    """
+
+    def __init__(self, path: str, name: str, ttl_seconds: float, owner: Optional[str] = None):
+        self.path = path
+        self.name = name
+        self.ttl_seconds = ttl_seconds
+        self._owner = owner
+        self._local = threading.local()
+        self.held = False
+
+    @property
+    def owner(self) -> str:
+        """Holder identity: the given owner, or this process (evaluated after the server forks its workers)"""
+        return self._owner or f"{socket.gethostname()}:{os.getpid()}"
+
+    def _connection(self) -> sqlite3.Connection:
+        connection = getattr(self._local, "connection", None)
+        if connection is not None and self._local.pid == os.getpid():
+            return connection
+        connection = _connect(self.path)
+        self._local.connection = connection
+        self._local.pid = os.getpid()
+        return connection
+
+    def _acquire(self, now: float) -> bool:
+        try:
+            connection = self._connection()
+            connection.execute("BEGIN IMMEDIATE")
+            try:
+                row = connection.execute("SELECT owner, expires_at FROM leases WHERE name = ?", (self.name,)).fetchone()
+                held = row is None or row[0] == self.owner or row[1] <= now
+                if held:
+                    connection.execute(
+                        "INSERT OR REPLACE INTO leases (name, owner, expires_at) VALUES (?, ?, ?)",
+                        (self.name, self.owner, now + self.ttl_seconds)
+                    )
+                connection.execute("COMMIT")
+            except BaseException:
+                connection.execute("ROLLBACK")
+                raise
+        except sqlite3.Error as e:
+            logger.warning("Lease %s check failed: %s", self.name, e)
+            held = False
+        return held
+
+    async def acquire(self, now: Optional[float] = None) -> bool:
+        """
+        Take or renew the lease.
+
+        Returns:
+            bool: Whether this process holds the lease until now + ttl_seconds
+                  (False as well when the file cannot be read)
+        """
+        now = time.time() if now is None else now
+        held = await asyncio.to_thread(self._acquire, now)
+        if held != self.held:
+            logger.info("Worker %d %s lease %s", os.getpid(), "took" if held else "lost", self.name)
+        self.held = held
+        return held
+
+    def _release(self):
+        try:
+            self._connection().execute("DELETE FROM leases WHERE name = ? AND owner = ?", (self.name, self.owner))
+        except sqlite3.Error as e:
+            logger.warning("Lease %s release failed: %s", self.name, e)
+
+    async def release(self):
+        """Give the lease up (if held) so another process can take it over without waiting for expiry"""
+        if self.held:
+            await asyncio.to_thread(self._release)
+            self.held = False
+            logger.info("Worker %d released lease %s", os.getpid(), self.name)
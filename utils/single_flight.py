@@ -0,0 +1,64 @@
+import asyncio
+from typing import Any, Awaitable, Callable, Dict, Hashable, Tuple
+
+
+class SingleFlight:
+    """
+    Coalesces concurrent async calls that share a key into one execution.
+
+    The first caller for a key starts the call; callers arriving while it is
+    in flight wait for the same result (or exception) instead of starting
+    their own. The call runs in its own task, so a cancelled caller does
+    not cancel it for the others. Results are shared, not copied: callers
+    that mutate the result must copy it first.
+    """
+
+    def __init__(self, enabled: bool = True):
+        self.enabled = enabled
+        self._calls: Dict[Hashable, asyncio.Task] = {}
+        self.executions = 0
+        self.coalesced = 0
+
+    async def do(self, key: Hashable, call: Callable[[], Awaitable[Any]]) -> Tuple[Any, bool]:
+        """
+        Run call() unless a call with the same key is already in flight.
+
+        Args:
+            key: Identity of the call
+            call: Coroutine function starting the upstream call
+
+        Returns:
+            (result, shared) where shared is True if the result came from another caller's call
+        """
+        if not self.enabled:
+            self.executions += 1
+            return await call(), False
+
+        task = self._calls.get(key)
+        shared = task is not None
+        if shared:
+            self.coalesced += 1
+        else:
+            self.executions += 1
+            task = asyncio.ensure_future(call())
+            self._calls[key] = task
+            task.add_done_callback(lambda done: self._finish(key, done))
+        return await asyncio.shield(task), shared
+
+    def _finish(self, key: Hashable, task: asyncio.Task):
+        if self._calls.get(key) is task:
+            del self._calls[key]
+        # Mark the exception as retrieved in case every caller was cancelled
+        if not task.cancelled():
+            task.exception()
+
+    def stats(self) -> Dict[str, Any]:
+        """Return executed vs. coalesced call counters"""
+        total = self.executions + self.coalesced
+        return {
+            "enabled": self.enabled,
+            "executions": self.executions,
+            "coalesced": self.coalesced,
+            "coalescedRatio": (self.coalesced / total) if total else 0.0,
+            "inFlight": len(self._calls),
+        }
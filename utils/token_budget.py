@@ -0,0 +1,107 @@
+"""
+Per-request token accounting for LLM calls.
+
+A request may call the LLM several times (the generation plus repairs of
+an invalid payload). TokenBudget adds up the tokens OpenAI reports for each
+call and caps the completion of the next one so the request stays within
+LLM_REQUEST_TOKEN_BUDGET; once too little is left for a useful completion,
+no further call is made. Prompt sizes are estimated with tiktoken when it
+is installed and from the character count (about 4 characters per token for
+English and PromQL) otherwise.
+"""
+import math
+from typing import Optional, Dict, Any, List
+
+try:
+    import tiktoken
+except ImportError:  # Optional: prompt sizes are estimated from their length without it
+    tiktoken = None
+
+# Fixed cost of a chat request and of each message in it (role and separators), per OpenAI's counting guide
+REQUEST_OVERHEAD_TOKENS = 3
+MESSAGE_OVERHEAD_TOKENS = 4
+# A call is not made when fewer completion tokens than this would be left
+MIN_COMPLETION_TOKENS = 64
+
+_encoding = None
+
+
+def estimate_tokens(text: str) -> int:
+    """Estimate the number of tokens of a text"""
+    global _encoding
+    if tiktoken is not None:
+        if _encoding is None:
+            _encoding = tiktoken.get_encoding("o200k_base")
+        return len(_encoding.encode(text))
+    return math.ceil(len(text) / 4)
+
+
+def estimate_prompt_tokens(messages: List[Dict[str, Any]]) -> int:
+    """Estimate the prompt tokens of a chat request"""
+    return REQUEST_OVERHEAD_TOKENS + sum(
+        MESSAGE_OVERHEAD_TOKENS + estimate_tokens(message.get("content") or "") for message in messages
+    )
+
+
+def truncate_lines(text: str, max_tokens: int) -> str:
+    """Keep the leading whole lines of a text that fit in max_tokens (estimated)"""
+    if estimate_tokens(text) <= max_tokens:
+        return text
+    kept, used = [], 0
+    for line in text.split("\n"):
+        cost = estimate_tokens(line) + 1
+        if used + cost > max_tokens:
+            break
+        kept.append(line)
+        used += cost
+    return "\n".join(kept)
+
+
+class TokenBudget:
+    """
+    Tokens spent by one request across its LLM calls, against a limit.
+
+    Args:
+        limit: Prompt plus completion tokens the request may spend (0 for no limit)
+        completion_cap: Maximum completion tokens of a single call
+    """
+
+    def __init__(self, limit: int, completion_cap: int):
+        self.limit = limit
+        self.completion_cap = completion_cap
+        self.calls = 0
+        self.prompt_tokens = 0
+        self.cached_prompt_tokens = 0
+        self.completion_tokens = 0
+
+    @property
+    def total_tokens(self) -> int:
+        return self.prompt_tokens + self.completion_tokens
+
+    def completion_limit(self, messages: List[Dict[str, Any]]) -> Optional[int]:
+        """
+        Completion cap for the next call with these messages.
+
+        Returns:
+            The cap, or None if the budget leaves less than MIN_COMPLETION_TOKENS for it
+        """
+        if self.limit <= 0:
+            return self.completion_cap
+        remaining = self.limit - self.total_tokens - estimate_prompt_tokens(messages)
+        limit = min(self.completion_cap, remaining)
+        return limit if limit >= MIN_COMPLETION_TOKENS else None
+
+    def record(self, usage):
+        """Add the usage OpenAI reported for a call"""
+        self.calls += 1
+        if usage is None:
+            return
+        self.prompt_tokens += usage.prompt_tokens or 0
+        self.completion_tokens += usage.completion_tokens or 0
+        details = getattr(usage, "prompt_tokens_details", None)
+        self.cached_prompt_tokens += getattr(details, "cached_tokens", None) or 0
+
+    def summary(self) -> str:
+        limit = f" of {self.limit}" if self.limit > 0 else ""
+        return (f"{self.total_tokens}{limit} tokens in {self.calls} calls "
+                f"(prompt {self.prompt_tokens}, cached {self.cached_prompt_tokens}, completion {self.completion_tokens})")